@@ -4,13 +4,21 @@
 to interact with Microsoft Azure's Blob Storage. """
 
 
+# General-purpose Python library imports
+import os
+import time
+import urllib
+
+
 # Third-party libraries
+import azure
 import azure.storage
 
 
 # S3Storage-specific imports
 from magik.base_storage import BaseStorage
 from magik.custom_exceptions import BadConfigurationException
+from magik.rate_limiter import RateLimiter
 
 
 class AzureStorage(BaseStorage):
@@ -18,16 +26,60 @@ class AzureStorage(BaseStorage):
   Storage. """
 
 
+  # The maximum number of blobs we ask Azure to return per listing request.
+  LIST_PAGE_SIZE = 5000
+
+
+  # Resumable uploads of files at least this large (in bytes) are done block
+  # by block, so that they can be resumed one block at a time.
+  BLOCK_UPLOAD_THRESHOLD = 64 * 1024 * 1024
+
+
+  # The size (in bytes) of each block in a block-by-block upload. Azure
+  # doesn't accept blocks larger than 4 MB.
+  BLOCK_SIZE = 4 * 1024 * 1024
+
+
+  # The size (in bytes) of each range that downloads are split into when
+  # their bandwidth is limited. The Azure SDK hands back a blob only once all
+  # of it has arrived, so we wait for the rate limiter before each range.
+  THROTTLED_RANGE_SIZE = 256 * 1024
+
+
+  # The number of seconds we wait between checks on a Copy Blob operation
+  # that Azure hasn't finished yet.
+  COPY_POLL_INTERVAL = 1
+
+
+  # The number of seconds we wait for Azure to finish a Copy Blob operation
+  # before aborting it.
+  COPY_TIMEOUT = 30 * 60
+
+
+  # The Azure SDK only tells us which error occurred in the message of the
+  # exception it raises, so these are the parts of those messages that mean
+  # a request failed for a reason that may well go away if we try again.
+  RETRYABLE_ERROR_MESSAGES = ('Internal Server Error', 'OperationTimedOut',
+    'ServerBusy', 'Service Unavailable', 'Gateway Timeout')
+
+
+  # The parts of the Azure SDK's error messages that mean we're sending
+  # requests too quickly. Azure throttles with a 503 Server Busy.
+  THROTTLING_ERROR_MESSAGES = ('ServerBusy', 'Server Busy',
+    'Service Unavailable')
+
+
   def __init__(self, parameters):
     """ Creates a new AzureStorage object, with the account name and account key
     and that the user has specified.
 
     Args:
       parameters: A dict that contains the credentials necessary to authenticate
-        with the Blob Storage.
+        with the Blob Storage, and optionally a 'timeout' (see
+        BaseStorage.get_timeout).
     Raises:
       BadConfigurationException: If the account name or account key are not
-        specified.
+        specified, or the timeout isn't a positive number.
     """
     if 'AZURE_ACCOUNT_NAME' not in parameters:
       raise BadConfigurationException("AZURE_ACCOUNT_NAME needs to be " + 
@@ -38,6 +90,7 @@ class AzureStorage(BaseStorage):
 
     self.azure_account_name = parameters['AZURE_ACCOUNT_NAME']
     self.azure_account_key = parameters['AZURE_ACCOUNT_KEY']
+    self.timeout = self.get_timeout(parameters)
     self.connection = self.create_azure_connection()
     # TODO(cgb): Consider validating the user's credentials here, and throw
     # a BadConfigurationException if they aren't valid.
@@ -47,12 +100,38 @@ class AzureStorage(BaseStorage):
     """ Uses the Azure SDK for Python to connect to Azure Blob Storage.
 
     Returns:
-      A BlobService object, which represents a connection to Azure Blob Storage.
+      A BlobService object, which represents a connection to Azure Blob Storage,
+        whose HTTP connections time out after self.timeout seconds.
     """
-    return azure.storage.BlobService(self.azure_account_name,
+    connection = azure.storage.BlobService(self.azure_account_name,
       self.azure_account_key)
 
+    # The Azure SDK opens a new HTTP connection for each request, and doesn't
+    # let us give it a timeout, so we set ours on each one as it's opened.
+    get_connection = connection._httpclient.get_connection
+    def get_connection_with_timeout(request):
+      http_connection = get_connection(request)
+      http_connection.timeout = self.timeout
+      return http_connection
+    connection._httpclient.get_connection = get_connection_with_timeout
+    return connection
+
   
+  def get_backend_id(self):
+    """ Identifies the Azure storage account that this object talks to.
+
+    Returns:
+      A str that identifies the storage platform and account.
+    """
+    return 'azure:{0}'.format(self.azure_account_name)
+
+
+  def get_credentials_id(self):
+    """ Identifies the Azure storage account and account key that this object
+    uses, as BaseStorage.get_credentials_id describes. """
+    return self.hash_credentials(self.azure_account_key)
+
+
   def does_bucket_exist(self, container_name):
     """ Queries Microsoft Azure to see if the specified container exists or not.
 
@@ -79,7 +158,8 @@ class AzureStorage(BaseStorage):
     self.connection.create_container(container_name)
 
 
-  def upload_file(self, source, container_name, key_name):
+  def upload_file(self, source, container_name, key_name,
+    content_encoding=None):
     """ Uploads a file from the local filesystem to Microsoft Azure Blob
     Storage.
 
@@ -90,12 +170,193 @@ class AzureStorage(BaseStorage):
         should be placed in.
       key_name: A str containing the name of the key that the file should be
         placed in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
     """
     file_contents = None
     with open(source, 'r') as file_handle:
       file_contents = file_handle.read()
+
+    # The Azure SDK sends the whole blob in one request, so the best we can do
+    # to stay within our bandwidth limits is to wait until the whole blob is
+    # paid for.
+    self.throttle(len(file_contents))
     self.connection.put_blob(container_name, key_name, file_contents,
-      'BlockBlob')
+      'BlockBlob', **self.get_encoding_args(content_encoding))
+
+
+  def upload_file_resumable(self, source, container_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file from the local filesystem to Microsoft Azure Blob
+    Storage, block by block if it is large, recording each block that was
+    uploaded so that the upload can be resumed.
+
+    Azure keeps uncommitted blocks for a week, so a resumed upload only needs
+    to send the blocks that are missing and then commit the block list.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded to Azure Blob Storage.
+      container_name: A str containing the name of the container that the file
+        should be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState that holds whatever progress a previous
+        attempt at this upload made, and that new progress should be recorded
+        in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
+    """
+    file_size = os.path.getsize(source)
+    if file_size < self.BLOCK_UPLOAD_THRESHOLD:
+      self.upload_file(source, container_name, key_name, content_encoding)
+      return
+
+    resuming = bool(transfer_state.get('blocks'))
+    try:
+      self.upload_blocks(source, file_size, container_name, key_name,
+        transfer_state, content_encoding)
+    except azure.WindowsAzureError:
+      # The blocks we uploaded last time may have expired, in which case all
+      # we can do is start over.
+      if not resuming:
+        raise
+      transfer_state.clear()
+      self.upload_blocks(source, file_size, container_name, key_name,
+        transfer_state, content_encoding)
+
+
+  def upload_blocks(self, source, file_size, container_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads each block of a file that hasn't been uploaded yet, and then
+    commits the list of blocks that make up the blob.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded to Azure Blob Storage.
+      file_size: An int with the size of the file, in bytes.
+      container_name: A str containing the name of the container that the file
+        should be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState with the blocks that were already
+        uploaded, if any.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    uploaded_blocks = set(transfer_state.get('blocks', []))
+    block_ids = []
+    with open(source, 'rb') as file_handle:
+      for offset in range(0, file_size, self.BLOCK_SIZE):
+        # Azure requires every block ID in a blob to be the same length.
+        block_id = '{0:010d}'.format(offset // self.BLOCK_SIZE)
+        block_ids.append(block_id)
+        if block_id in uploaded_blocks:
+          continue
+
+        file_handle.seek(offset)
+        block = file_handle.read(self.BLOCK_SIZE)
+        self.throttle(len(block))
+        self.connection.put_block(container_name, key_name, block, block_id)
+        transfer_state.add('blocks', block_id)
+
+    self.connection.put_block_list(container_name, key_name, block_ids,
+      **self.get_encoding_args(content_encoding))
+
+
+  def get_encoding_args(self, content_encoding):
+    """ Builds the keyword arguments that make the Azure SDK store a blob with
+    the given Content-Encoding.
+
+    Args:
+      content_encoding: A str with the Content-Encoding to store the blob
+        with, or None if it isn't encoded.
+    Returns:
+      A dict with the 'x_ms_blob_content_encoding' argument to pass to the
+        Azure SDK, or an empty dict if the blob isn't encoded.
+    """
+    if content_encoding is None:
+      return {}
+    return {'x_ms_blob_content_encoding' : content_encoding}
+
+
+  def get_stream_chunk_size(self, size):
+    """ Decides how large the blocks should be when a file is streamed to Azure
+    Blob Storage.
+
+    Args:
+      size: An int with the size of the file to stream, in bytes.
+    Returns:
+      BLOCK_SIZE, the largest block that Azure accepts.
+    """
+    return self.BLOCK_SIZE
+
+
+  def upload_stream(self, chunks, container_name, key_name, size,
+    content_encoding=None):
+    """ Uploads a file to Azure Blob Storage from a stream of chunks, with one
+    block per chunk if there is more than one chunk.
+
+    Args:
+      chunks: An iterator of strs, each BLOCK_SIZE bytes long (except for the
+        last one), whose concatenation is the file to upload.
+      container_name: A str containing the name of the container that the file
+        should be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    if size <= self.BLOCK_SIZE:
+      contents = ''.join(chunks)
+      self.throttle(len(contents))
+      self.connection.put_blob(container_name, key_name, contents,
+        'BlockBlob', **self.get_encoding_args(content_encoding))
+      return
+
+    block_ids = []
+    for block_num, block in enumerate(chunks):
+      block_id = '{0:010d}'.format(block_num)
+      self.throttle(len(block))
+      self.connection.put_block(container_name, key_name, block, block_id)
+      block_ids.append(block_id)
+    self.connection.put_block_list(container_name, key_name, block_ids,
+      **self.get_encoding_args(content_encoding))
+
+
+  def list_keys(self, container_name, prefix=''):
+    """ Lists the blobs in an Azure Blob Storage container that start with the
+    given prefix.
+
+    Args:
+      container_name: A str containing the name of the container to list.
+      prefix: A str that each blob name returned must start with.
+    Yields:
+      A dict for each blob found, in the format that BaseStorage.list_keys
+        describes.
+    """
+    marker = None
+    while True:
+      try:
+        results = self.connection.list_blobs(container_name,
+          prefix=prefix or None, marker=marker,
+          maxresults=self.LIST_PAGE_SIZE)
+      except azure.WindowsAzureMissingResourceError:
+        return
+
+      for blob in results.blobs:
+        yield {
+          'key' : blob.name,
+          'size' : int(blob.properties.content_length),
+          'etag' : blob.properties.etag,
+          'md5' : self.base64_md5_to_hex(blob.properties.content_md5),
+          'last_modified' : self.parse_timestamp(blob.properties.last_modified)
+        }
+
+      marker = results.next_marker
+      if not marker:
+        return
 
 
   def does_key_exist(self, container_name, key_name):
@@ -116,6 +377,36 @@ class AzureStorage(BaseStorage):
       return False
 
 
+  def get_metadata(self, container_name, key_name):
+    """ Queries Azure Blob Storage for information about the named file, via a
+    HEAD request.
+
+    Args:
+      container_name: A str containing the name of the container that the file
+        exists in.
+      key_name: A str containing the name of the key that identifies the file.
+    Returns:
+      None if the file doesn't exist, and otherwise a dict in the format that
+        BaseStorage.get_metadata describes. Azure's ETags aren't MD5s, so the
+        MD5 comes from the blob's Content-MD5 property instead.
+    """
+    try:
+      properties = self.connection.get_blob_properties(container_name,
+        key_name)
+    except azure.WindowsAzureMissingResourceError:
+      return None
+
+    return {
+      'key' : key_name,
+      'size' : int(properties['content-length']),
+      'etag' : properties['etag'],
+      'md5' : self.base64_md5_to_hex(properties.get('content-md5')),
+      'content_type' : properties.get('content-type'),
+      'content_encoding' : properties.get('content-encoding'),
+      'last_modified' : self.parse_timestamp(properties['last-modified'])
+    }
+
+
   def download_file(self, destination, container_name, key_name):
     """ Downloads a file to the local filesystem from Azure Blob Storage.
 
@@ -127,9 +418,128 @@ class AzureStorage(BaseStorage):
       key_name: A str containing the name of the key that the file should be
         downloaded from.
     """
-    blob = self.connection.get_blob(container_name, key_name)
+    if not RateLimiter.is_limited(self.get_backend_id()):
+      blob = self.connection.get_blob(container_name, key_name)
+      with open(destination, 'w') as file_handle:
+        file_handle.write(blob)
+      return
+
+    properties = self.connection.get_blob_properties(container_name, key_name)
     with open(destination, 'w') as file_handle:
-      file_handle.write(blob)
+      for contents in self.iter_throttled_ranges(container_name, key_name, 0,
+        int(properties['content-length']) - 1):
+        file_handle.write(contents)
+
+
+  def download_range(self, container_name, key_name, start, end):
+    """ Downloads part of a file from Azure Blob Storage.
+
+    Args:
+      container_name: A str containing the name of the container that the file
+        should be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+      start: An int with the offset of the first byte to download.
+      end: An int with the offset of the last byte to download (inclusive).
+    Returns:
+      A str containing the bytes in the requested range.
+    """
+    if RateLimiter.is_limited(self.get_backend_id()):
+      return ''.join(self.iter_throttled_ranges(container_name, key_name,
+        start, end))
+    return self.connection.get_blob(container_name, key_name,
+      x_ms_range='bytes={0}-{1}'.format(start, end))
+
+
+  def iter_throttled_ranges(self, container_name, key_name, start, end):
+    """ Downloads part of a file from Azure Blob Storage THROTTLED_RANGE_SIZE
+    bytes at a time, waiting for the bandwidth limits before each request.
+
+    Args:
+      container_name: A str containing the name of the container that the file
+        should be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+      start: An int with the offset of the first byte to download.
+      end: An int with the offset of the last byte to download (inclusive).
+    Yields:
+      A str with each range of the file, in order.
+    """
+    for range_start in range(start, end + 1, self.THROTTLED_RANGE_SIZE):
+      range_end = min(range_start + self.THROTTLED_RANGE_SIZE, end + 1) - 1
+      self.throttle(range_end - range_start + 1)
+      yield self.connection.get_blob(container_name, key_name,
+        x_ms_range='bytes={0}-{1}'.format(range_start, range_end))
+
+
+  def copy_key(self, source_container_name, source_key_name, container_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file to a new key within Azure Blob Storage, via a Copy Blob
+    request, so that its contents never leave Azure. Copy Blob keeps the
+    blob's properties, including its Content-Encoding.
+
+    Azure may finish the copy after answering the request, in which case we
+    wait for it to finish, for up to COPY_TIMEOUT seconds. A copy that takes
+    longer is aborted, and the empty blob that aborting leaves is deleted.
+
+    Args:
+      source_container_name: A str containing the name of the container that
+        the file should be copied from.
+      source_key_name: A str containing the name of the key that the file
+        should be copied from.
+      container_name: A str containing the name of the container that the file
+        should be copied to.
+      key_name: A str containing the name of the key that the file should be
+        copied to.
+      size: An int with the size of the file, in bytes, which is unused.
+      content_encoding: A str with the Content-Encoding the file is stored
+        with, which is unused.
+    Raises:
+      WindowsAzureError: If Azure gave up on the copy, or we did.
+    """
+    # urllib.quote can only quote bytes, so unicode key names are encoded
+    # first.
+    if isinstance(source_key_name, unicode):
+      source_key_name = source_key_name.encode('utf-8')
+    source_url = self.connection.make_blob_url(source_container_name,
+      urllib.quote(source_key_name))
+    response = self.connection.copy_blob(container_name, key_name, source_url)
+    status = response.get('x-ms-copy-status')
+    deadline = time.time() + self.COPY_TIMEOUT
+    while status == 'pending':
+      if time.time() >= deadline:
+        self.abort_copy(container_name, key_name, response.get('x-ms-copy-id'))
+        raise azure.WindowsAzureError('Copy Blob from /{0}/{1} did not ' \
+          'finish within {2} seconds'.format(source_container_name,
+          source_key_name, self.COPY_TIMEOUT))
+      time.sleep(self.COPY_POLL_INTERVAL)
+      status = self.connection.get_blob_properties(container_name,
+        key_name).get('x-ms-copy-status')
+
+    if status in ['aborted', 'failed']:
+      raise azure.WindowsAzureError('Copy Blob from /{0}/{1} was {2}'.format(
+        source_container_name, source_key_name, status))
+
+
+  def abort_copy(self, container_name, key_name, copy_id):
+    """ Aborts a Copy Blob operation that is still pending, and deletes the
+    empty blob that aborting it leaves behind.
+
+    If the copy can't be aborted (e.g., because it finished in the meantime),
+    its blob is left alone.
+
+    Args:
+      container_name: A str containing the name of the container that the file
+        was being copied to.
+      key_name: A str containing the name of the key that the file was being
+        copied to.
+      copy_id: A str with the id that Azure gave the copy.
+    """
+    try:
+      self.connection.abort_copy_blob(container_name, key_name, copy_id)
+    except azure.WindowsAzureError:
+      return
+    self.connection.delete_blob(container_name, key_name)
 
 
   def delete_file(self, container_name, key_name):
@@ -142,3 +552,33 @@ class AzureStorage(BaseStorage):
         deleted from.
     """
     self.connection.delete_blob(container_name, key_name)
+
+
+  def is_retryable_error(self, exception):
+    """ Decides if an operation that failed with the given exception is worth
+    retrying. Besides network errors, Azure server errors and throttling are
+    retried.
+
+    Args:
+      exception: The Exception that the operation raised.
+    Returns:
+      True if the operation should be retried, and False otherwise.
+    """
+    if isinstance(exception, azure.WindowsAzureError):
+      return any(message in str(exception)
+        for message in self.RETRYABLE_ERROR_MESSAGES)
+    return BaseStorage.is_retryable_error(self, exception)
+
+
+  def is_throttling_error(self, exception):
+    """ Decides if an operation failed because Azure is throttling us.
+
+    Args:
+      exception: The Exception that the operation raised.
+    Returns:
+      True if the exception means we're being throttled, and False otherwise.
+    """
+    if isinstance(exception, azure.WindowsAzureError):
+      return any(message in str(exception)
+        for message in self.THROTTLING_ERROR_MESSAGES)
+    return False
@@ -5,7 +5,35 @@ interface that details all of the operations that *Storage classes need
 to define to be magik-compatible. """
 
 
+# General-purpose Python library imports
+import base64
+import binascii
+import calendar
+import email.utils
+import hashlib
+import httplib
+import multiprocessing.pool
+import os
 import os.path
+import Queue
+import socket
+import tempfile
+import threading
+import time
+
+
+# magik-specific imports
+from magik.batch_scheduler import BatchScheduler
+from magik.checkpoint import Checkpoint
+from magik.compression_codec import CompressionCodec
+from magik.concurrency_controller import ConcurrencyController
+from magik.custom_exceptions import BadConfigurationException
+from magik.hash_cache import HashCache
+from magik.manifest_index import ManifestIndex
+from magik.metadata_cache import MetadataCache
+from magik.pack_store import PackStore
+from magik.rate_limiter import RateLimiter
+from magik.retry_policy import RetryPolicy
 
 
 class BaseStorage():
@@ -14,6 +42,89 @@ class BaseStorage():
   should look like in their new class. """
 
 
+  # The number of threads that batch operations (e.g., upload_files) use to
+  # process their items in parallel, unless the caller asks for another number.
+  DEFAULT_NUM_THREADS = 10
+
+
+  # The number of items per thread that iterator-based batch operations (e.g.,
+  # iter_upload_files) take from their input before handing results back.
+  IN_FLIGHT_PER_THREAD = 2
+
+
+  # The number of seconds that iterator-based batch operations wait for a
+  # result at a time, before checking if they've been interrupted.
+  RESULT_POLL_INTERVAL = 0.5
+
+
+  # The number of keys that delete_keys is asked to delete at once when
+  # deleting everything under a prefix. Storage platforms that can delete many
+  # keys in one request should raise this.
+  DELETE_BATCH_SIZE = 1
+
+
+  # The number of bytes we read at a time when hashing local files.
+  HASH_CHUNK_SIZE = 1024 * 1024
+
+
+  # The number of seconds a connection to the storage platform can take to
+  # open, or wait for data on a read or a write, before the operation using it
+  # fails, unless the caller picks another timeout (see get_timeout).
+  DEFAULT_TIMEOUT = 60
+
+
+  # The number of bytes we fetch per request when downloading a file in a way
+  # that can be resumed. Files smaller than this are downloaded in one go.
+  DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+  # The number of bytes we move per request when streaming a file from one
+  # storage platform to another (see get_stream_chunk_size).
+  STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+  # The number of chunks that streaming a file from one storage platform to
+  # another downloads ahead of the chunk being uploaded. Each transfer holds at
+  # most this many chunks, plus the one being uploaded, in memory.
+  STREAM_READ_AHEAD = 2
+
+
+  # The number of bytes we fetch per request when streaming every file under a
+  # prefix (see iter_download_prefix). This is smaller than STREAM_CHUNK_SIZE,
+  # since the first chunk of many files is held in memory at once.
+  PREFIX_CHUNK_SIZE = 1024 * 1024
+
+
+  # The number of files that iter_download_packed takes from its input at a
+  # time, so that files stored near each other in the same pack can be
+  # fetched with one request.
+  PACKED_DOWNLOAD_WINDOW = 1000
+
+
+  # The HashCache that remembers the MD5s of local files we've hashed. It is
+  # shared by all *Storage objects, and created the first time it's needed.
+  hash_cache = None
+
+
+  # A lock that makes sure only one HashCache gets created.
+  hash_cache_lock = threading.Lock()
+
+
+  # The ManifestIndex that remembers the last-known contents of each bucket.
+  # It is shared by all *Storage objects, and created the first time a sync
+  # needs it.
+  manifest_index = None
+
+
+  # A lock that makes sure only one ManifestIndex gets created.
+  manifest_index_lock = threading.Lock()
+
+
+  # The MetadataCache that remembers the metadata of files we've looked up
+  # recently. It is shared by all *Storage objects.
+  metadata_cache = MetadataCache()
+
+
   def __init__(self, parameters):
     """ Creates a new *Storage object.
 
@@ -28,7 +139,9 @@ class BaseStorage():
     raise NotImplementedError
 
 
-  def upload_files(self, source_to_dest_list):
+  def upload_files(self, source_to_dest_list, num_threads=None,
+    skip_unchanged=False, resumable=False, retry_policy=None, adaptive=False,
+    schedule_by_size=False, compression=None):
     """ Uploads one or more files to the storage platform.
 
     Args:
@@ -36,40 +149,214 @@ class BaseStorage():
         'source' that points to the file on the local filesystem to upload,
         and a key named 'destination' that points to where it should be
         uploaded on the remote storage service.
+      num_threads: An int that indicates how many files should be uploaded at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      skip_unchanged: A bool that indicates if files whose MD5 matches the MD5
+        of the copy already in the storage platform should not be uploaded
+        again.
+      resumable: A bool that indicates if the progress of this batch should be
+        checkpointed, so that running the same batch again after a failure
+        skips the files that were already uploaded and resumes large uploads
+        that were cut short.
+      retry_policy: The RetryPolicy that decides which failed uploads are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files uploaded at the
+        same time to each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+      schedule_by_size: A bool that indicates if the files should be uploaded
+        in the order that BatchScheduler picks from their sizes and buckets,
+        instead of the order they were given in. The results are returned in
+        the order they were given in either way.
+      compression: A str with the encoding (from CompressionCodec.ENCODINGS)
+        to compress files with before uploading them, or None to upload them
+        as they are. Files that are already compressed are never compressed
+        again.
     Returns:
       A copy of the same list of dicts that was passed in as an argument,
         with an extra field in each dict named 'success', that indicates if
         the upload was successful, and in case of failures, a field called
         'failure_reason' that explains why the file could not be uploaded.
+        If skip_unchanged is set, each dict also has a field named 'skipped',
+        that indicates if the upload was skipped because the file was
+        unchanged. Files that were compressed have a 'content_encoding' field
+        with the encoding they were compressed with.
+    Raises:
+      BadConfigurationException: If compression names an encoding that isn't
+        available.
     """
-    # TODO(cgb): Parallelize the upload process.
+    if compression is not None:
+      CompressionCodec.check_encoding(compression)
     upload_result = source_to_dest_list[:]
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_batch(len(upload_result))
 
+    # Make sure each bucket we upload to actually exists, and create it if it
+    # doesn't. We do this once per bucket, before any uploads start, so that
+    # our upload threads don't race each other to create the same bucket.
+    bucket_names = set()
     for item_to_upload in upload_result:
-      # First, make sure the file to upload actually exists.
-      source = item_to_upload['source']
-      if not os.path.exists(source):
-        item_to_upload['success'] = False
-        item_to_upload['failure_reason'] = 'file not found'
-        continue
+      if os.path.exists(item_to_upload['source']):
+        bucket_names.add(self.parse_path(item_to_upload['destination'])[0])
+    bucket_errors = self.check_buckets(bucket_names, retry_policy,
+      create_missing=True)
 
-      # Next, make sure the user specified a bucket in the destination.
-      destination = item_to_upload['destination']
-      bucket_name = destination.split('/')[1]
-      key_name = "/".join(destination.split('/')[2:])
+    order = None
+    if schedule_by_size:
+      order = BatchScheduler.order_by_size(
+        [self.get_local_size(item['source']) for item in upload_result],
+        [self.parse_path(item['destination'])[0] for item in upload_result])
 
-      # Make sure the bucket actually exists, and create it if it doesn't.
-      if not self.does_bucket_exist(bucket_name):
-        self.create_bucket(bucket_name)
+    checkpoint = None
+    if resumable:
+      checkpoint = Checkpoint.for_job('upload_files', self.get_backend_id(),
+        upload_result)
 
-      # Finally, upload the file.
-      self.upload_file(source, bucket_name, key_name)
-      item_to_upload['success'] = True
+    try:
+      self.run_in_parallel(
+        lambda item, transfer_state=None: self.upload_one_file(item,
+          bucket_errors, skip_unchanged, transfer_state, compression),
+        upload_result, num_threads, checkpoint, retry_policy,
+        self.get_bucket_function('destination', adaptive), order)
+    finally:
+      if checkpoint is not None:
+        checkpoint.close()
 
+    if skip_unchanged:
+      self.get_hash_cache().flush()
+    self.flush_manifest_index()
     return upload_result
 
 
-  def download_files(self, source_to_dest_list):
+  def upload_one_file(self, item_to_upload, bucket_errors,
+    skip_unchanged=False, transfer_state=None, compression=None):
+    """ Uploads a single file to the storage platform, as part of a call to
+    upload_files.
+
+    Args:
+      item_to_upload: A dict with the 'source' and 'destination' of the file to
+        upload. It is updated in place with the 'success' of the upload, and a
+        'failure_reason' if the upload failed.
+      bucket_errors: A dict that maps the name of each bucket we're uploading
+        to to None if it's ready, or to the reason why it isn't.
+      skip_unchanged: A bool that indicates if the upload should be skipped if
+        the remote copy of the file has the same MD5 as the local file.
+      transfer_state: A TransferState to record the progress of the upload in,
+        or None if the upload doesn't need to be resumable.
+      compression: A str with the encoding to compress the file with before
+        uploading it, or None to upload it as it is.
+    """
+    # First, make sure the file to upload actually exists.
+    source = item_to_upload['source']
+    if not os.path.exists(source):
+      item_to_upload['success'] = False
+      item_to_upload['failure_reason'] = 'file not found'
+      return
+
+    # Next, make sure we were able to create the bucket.
+    bucket_name, key_name = self.parse_path(item_to_upload['destination'])
+    if bucket_errors.get(bucket_name):
+      item_to_upload['success'] = False
+      item_to_upload['failure_reason'] = bucket_errors[bucket_name]
+      return
+
+    # Files that are already compressed aren't worth compressing again.
+    content_encoding = None
+    if compression and CompressionCodec.should_compress(source) and \
+      CompressionCodec.should_compress(key_name):
+      content_encoding = compression
+      item_to_upload['content_encoding'] = content_encoding
+
+    # Then, see if we even need to upload the file.
+    if skip_unchanged:
+      item_to_upload['skipped'] = self.is_remote_copy_identical(source,
+        bucket_name, key_name, content_encoding)
+      if item_to_upload['skipped']:
+        item_to_upload['success'] = True
+        return
+
+    # Finally, upload the file (or a compressed copy of it).
+    upload_source = source
+    if content_encoding is not None:
+      upload_source = self.compress_to_temporary_file(source, key_name,
+        content_encoding)
+    try:
+      if transfer_state is None:
+        self.upload_file(upload_source, bucket_name, key_name, content_encoding)
+      else:
+        # Any progress we recorded for this file is useless if the file has
+        # changed since then. Compression always gives the same bytes for the
+        # same file, so a compressed upload can be resumed too.
+        file_stat = os.stat(source)
+        fingerprint = [file_stat.st_size, file_stat.st_mtime]
+        if transfer_state.get('source') != fingerprint:
+          transfer_state.clear()
+          transfer_state.set('source', fingerprint)
+        self.upload_file_resumable(upload_source, bucket_name, key_name,
+          transfer_state, content_encoding)
+      self.record_upload_in_manifest(source, bucket_name, key_name,
+        content_encoding)
+    finally:
+      if upload_source != source:
+        os.remove(upload_source)
+    item_to_upload['success'] = True
+
+
+  def compress_to_temporary_file(self, source, key_name, encoding):
+    """ Compresses a local file into a temporary file, ready to be uploaded.
+
+    Args:
+      source: A str naming the file on the local filesystem to compress.
+      key_name: A str containing the name of the key the file will be uploaded
+        to. The temporary file gets the same extension, so that libraries that
+        guess content types from file names guess the same type for it.
+      encoding: A str with the encoding to compress with.
+    Returns:
+      A str naming the temporary file, which the caller should remove.
+    """
+    file_handle, temporary_file = tempfile.mkstemp(prefix='magik-compress-',
+      suffix=os.path.splitext(key_name)[1])
+    os.close(file_handle)
+    try:
+      CompressionCodec.compress_file(source, temporary_file, encoding)
+    except Exception:
+      os.remove(temporary_file)
+      raise
+    return temporary_file
+
+
+  def is_remote_copy_identical(self, source, bucket_name, key_name,
+    content_encoding=None):
+    """ Checks if a local file has the same contents as a file stored in the
+    storage platform, by comparing their MD5s.
+
+    Args:
+      source: A str naming the file on the local filesystem.
+      bucket_name: A str containing the name of the bucket that the remote file
+        is in.
+      key_name: A str containing the name of the key for the remote file.
+      content_encoding: A str with the encoding that the local file would be
+        compressed with before it is uploaded, or None if it wouldn't be.
+    Returns:
+      True if the remote file exists, is compressed the same way, and has the
+        same MD5 as the (compressed) local file, and False otherwise (including
+        when the storage platform doesn't know the MD5 of the remote file).
+    """
+    metadata = self.get_metadata(bucket_name, key_name)
+    if not metadata or not metadata['md5']:
+      return False
+    if metadata.get('content_encoding') != content_encoding:
+      return False
+
+    # Don't bother hashing the local file if the sizes already differ.
+    if content_encoding is None and \
+      os.path.getsize(source) != metadata['size']:
+      return False
+
+    return self.get_local_md5(source, content_encoding) == metadata['md5']
+
+
+  def download_files(self, source_to_dest_list, num_threads=None,
+    resumable=False, retry_policy=None, adaptive=False, decompress=False):
     """ Downloads one or more files from the storage platform.
 
     Args:
@@ -77,41 +364,123 @@ class BaseStorage():
         'source' that points to the file on the storage platform to download,
         and a key named 'destination' that points to where it should be
         downloaded on the local filesystem.
+      num_threads: An int that indicates how many files should be downloaded
+        at the same time. Defaults to DEFAULT_NUM_THREADS.
+      resumable: A bool that indicates if the progress of this batch should be
+        checkpointed, so that running the same batch again after a failure
+        skips the files that were already downloaded and resumes large
+        downloads that were cut short.
+      retry_policy: The RetryPolicy that decides which failed downloads are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files downloaded at the
+        same time from each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+      decompress: A bool that indicates if files that were stored compressed
+        (i.e., whose Content-Encoding is one of CompressionCodec.ENCODINGS)
+        should be decompressed once they are downloaded.
     Returns:
       A copy of the same list of dicts that was passed in as an argument,
         with an extra field in each dict named 'success', that indicates if
         the download was successful, and in case of failures, a field called
         'failure_reason' that explains why the file could not be downloaded.
+        Files that were decompressed have a 'content_encoding' field with the
+        encoding they were stored with.
     """
-    # TODO(cgb): Parallelize the download process.
     download_result = source_to_dest_list[:]
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_batch(len(download_result))
+    bucket_errors = self.check_buckets(set(self.parse_path(item['source'])[0]
+      for item in download_result), retry_policy)
 
-    for item_to_download in download_result:
-      # First, make sure the item to download actually exists.
-      source = item_to_download['source']
-      bucket_name = source.split('/')[1]
-      key_name = "/".join(source.split('/')[2:])
+    checkpoint = None
+    if resumable:
+      checkpoint = Checkpoint.for_job('download_files', self.get_backend_id(),
+        download_result)
 
-      # It definitely doesn't exist if the bucket doesn't exist.
-      if not self.does_bucket_exist(bucket_name):
-        item_to_download['success'] = False
-        item_to_download['failure_reason'] = 'bucket not found'
-        continue
+    try:
+      self.run_in_parallel(
+        lambda item, transfer_state=None: self.download_one_file(item,
+          bucket_errors, transfer_state, decompress),
+        download_result, num_threads, checkpoint, retry_policy,
+        self.get_bucket_function('source', adaptive))
+    finally:
+      if checkpoint is not None:
+        checkpoint.close()
+    self.flush_manifest_index()
+    return download_result
 
-      if not self.does_key_exist(bucket_name, key_name):
-        item_to_download['success'] = False
-        item_to_download['failure_reason'] = 'source not found'
-        continue
 
-      # Finally, download the file.
-      destination = item_to_download['destination']
-      self.download_file(destination, bucket_name, key_name)
-      item_to_download['success'] = True
+  def download_one_file(self, item_to_download, bucket_errors,
+    transfer_state=None, decompress=False):
+    """ Downloads a single file from the storage platform, as part of a call to
+    download_files.
 
-    return download_result
+    Args:
+      item_to_download: A dict with the 'source' and 'destination' of the file
+        to download. It is updated in place with the 'success' of the download,
+        and a 'failure_reason' if the download failed.
+      bucket_errors: A dict that maps the name of each bucket we're downloading
+        from to None if it exists, or to the reason why we can't use it.
+      transfer_state: A TransferState to record the progress of the download
+        in, or None if the download doesn't need to be resumable.
+      decompress: A bool that indicates if the file should be decompressed
+        once it is downloaded, if it was stored compressed.
+    """
+    # First, make sure the item to download actually exists.
+    bucket_name, key_name = self.parse_path(item_to_download['source'])
+
+    # It definitely doesn't exist if the bucket doesn't exist.
+    if bucket_errors.get(bucket_name):
+      item_to_download['success'] = False
+      item_to_download['failure_reason'] = bucket_errors[bucket_name]
+      return
+
+    # Only look up the file's metadata if we need its Content-Encoding.
+    content_encoding = None
+    if decompress:
+      metadata = self.get_metadata(bucket_name, key_name)
+      exists = metadata is not None
+      if exists and metadata.get('content_encoding') in \
+        CompressionCodec.ENCODINGS:
+        content_encoding = metadata['content_encoding']
+    else:
+      exists = self.does_key_exist(bucket_name, key_name)
+
+    if not exists:
+      item_to_download['success'] = False
+      item_to_download['failure_reason'] = 'source not found'
+      self.record_delete_in_manifest(bucket_name, key_name)
+      return
 
+    # Finally, download the file. Compressed files are downloaded next to
+    # their destination first, at a path that stays the same between attempts
+    # so that resumable downloads can pick up where they left off.
+    destination = item_to_download['destination']
+    download_destination = destination
+    if content_encoding is not None:
+      download_destination = '{0}.magik-{1}'.format(destination,
+        content_encoding)
+    if transfer_state is None:
+      self.download_file(download_destination, bucket_name, key_name)
+    elif not self.download_file_resumable(download_destination, bucket_name,
+      key_name, transfer_state):
+      item_to_download['success'] = False
+      item_to_download['failure_reason'] = 'source not found'
+      self.record_delete_in_manifest(bucket_name, key_name)
+      return
 
-  def delete_files(self, files_to_delete):
+    if content_encoding is not None:
+      try:
+        CompressionCodec.decompress_file(download_destination, destination,
+          content_encoding)
+      finally:
+        os.remove(download_destination)
+      item_to_download['content_encoding'] = content_encoding
+    item_to_download['success'] = True
+
+
+  def delete_files(self, files_to_delete, num_threads=None, retry_policy=None,
+    adaptive=False):
     """ Deletes one or more files from the storage platform.
 
     Args:
@@ -120,97 +489,2323 @@ class BaseStorage():
         Note that we intentionally use a dict here, even though it only has
         one key/value pair at the time, in case we need to expand it in the
         future to include other information (e.g., what region the file is in).
+      num_threads: An int that indicates how many files should be deleted at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed deletions are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files deleted at the
+        same time from each bucket should adapt to how the storage platform
+        responds, up to num_threads.
     Returns:
       A copy of the same list of dicts that was passed in as an argument,
         with an extra field in each dict named 'success', that indicates if
         the deletion was successful, and in case of failures, a field called
         'failure_reason' that explains why the file could not be deleted.
     """
-    # TODO(cgb): Parallelize the deletion process.
     delete_result = files_to_delete[:]
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_batch(len(delete_result))
+    bucket_errors = self.check_buckets(set(self.parse_path(item['source'])[0]
+      for item in delete_result), retry_policy)
+    self.run_in_parallel(
+      lambda item: self.delete_one_file(item, bucket_errors),
+      delete_result, num_threads, retry_policy=retry_policy,
+      bucket_function=self.get_bucket_function('source', adaptive))
+    self.flush_manifest_index()
+    return delete_result
 
-    for item_to_delete in files_to_delete:
-      # First, make sure the item to delete actually exists.
-      source = item_to_delete['source']
-      bucket_name = source.split('/')[1]
-      key_name = "/".join(source.split('/')[2:])
 
-      # It definitely doesn't exist if the bucket doesn't exist.
-      if not self.does_bucket_exist(bucket_name):
-        item_to_delete['success'] = False
-        item_to_delete['failure_reason'] = 'bucket not found'
-        continue
+  def delete_one_file(self, item_to_delete, bucket_errors):
+    """ Deletes a single file from the storage platform, as part of a call to
+    delete_files.
 
-      if not self.does_key_exist(bucket_name, key_name):
-        item_to_delete['success'] = False
-        item_to_delete['failure_reason'] = 'source not found'
-        continue
+    Args:
+      item_to_delete: A dict with the 'source' of the file to delete. It is
+        updated in place with the 'success' of the deletion, and a
+        'failure_reason' if the deletion failed.
+      bucket_errors: A dict that maps the name of each bucket we're deleting
+        from to None if it exists, or to the reason why we can't use it.
+    """
+    # First, make sure the item to delete actually exists.
+    bucket_name, key_name = self.parse_path(item_to_delete['source'])
 
-      # Finally, download the file.
-      self.delete_file(bucket_name, key_name)
-      item_to_delete['success'] = True
+    # It definitely doesn't exist if the bucket doesn't exist.
+    if bucket_errors.get(bucket_name):
+      item_to_delete['success'] = False
+      item_to_delete['failure_reason'] = bucket_errors[bucket_name]
+      return
 
-    return delete_result
+    if not self.does_key_exist(bucket_name, key_name):
+      item_to_delete['success'] = False
+      item_to_delete['failure_reason'] = 'source not found'
+      self.record_delete_in_manifest(bucket_name, key_name)
+      return
 
+    # Finally, delete the file.
+    self.delete_file(bucket_name, key_name)
+    self.record_delete_in_manifest(bucket_name, key_name)
+    item_to_delete['success'] = True
 
-  def does_bucket_exist(self, bucket_name):
-    """ Queries the underlying storage platform to see if the named bucket
-    exists.
+
+  def copy_files(self, source_to_dest_list, num_threads=None,
+    retry_policy=None, adaptive=False):
+    """ Copies one or more files to new keys or buckets, within the storage
+    platform.
+
+    Wherever the storage platform supports it, files are copied by the storage
+    platform itself, so that their contents never pass through this machine.
 
     Args:
-      bucket_name: A str that represents the name of the bucket to check for
-        existence.
+      source_to_dest_list: A list of dicts, where each dict has a key named
+        'source' that points to the file on the storage platform to copy, and
+        a key named 'destination' that points to where on the storage platform
+        it should be copied to.
+      num_threads: An int that indicates how many files should be copied at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed copies are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files copied at the
+        same time to each bucket should adapt to how the storage platform
+        responds, up to num_threads.
     Returns:
-      True if the named bucket exists, and False otherwise.
+      A copy of the same list of dicts that was passed in as an argument,
+        with an extra field in each dict named 'success', that indicates if
+        the copy was successful, and in case of failures, a field called
+        'failure_reason' that explains why the file could not be copied.
     """
-    raise NotImplementedError
+    return self.copy_or_move_files(source_to_dest_list, False, num_threads,
+      retry_policy, adaptive)
 
 
-  def create_bucket(self, bucket_name):
-    """ Creates a new bucket in the underlying storage platform.
+  def move_files(self, source_to_dest_list, num_threads=None,
+    retry_policy=None, adaptive=False):
+    """ Moves one or more files to new keys or buckets, within the storage
+    platform, by copying them like copy_files does and then deleting the
+    originals.
 
     Args:
-      bucket_name: A str that represents the name of the bucket to create.
+      source_to_dest_list: A list of dicts in the format that copy_files
+        takes.
+      num_threads: An int that indicates how many files should be moved at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed moves are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files moved at the
+        same time to each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+    Returns:
+      A copy of the same list of dicts that was passed in as an argument,
+        with the fields that copy_files describes. The original of a file is
+        only deleted once it has been copied successfully.
     """
-    raise NotImplementedError
+    return self.copy_or_move_files(source_to_dest_list, True, num_threads,
+      retry_policy, adaptive)
 
 
-  def does_key_exist(self, bucket_name, key_name):
-    """ Queries the underlying storage platform to see if the named file exists.
+  def copy_or_move_files(self, source_to_dest_list, move, num_threads=None,
+    retry_policy=None, adaptive=False):
+    """ Copies or moves one or more files within the storage platform, as
+    copy_files and move_files describe.
 
     Args:
-      bucket_name: A str containing the name of the bucket that the file exists
+      source_to_dest_list: A list of dicts in the format that copy_files
+        takes.
+      move: A bool that indicates if the originals should be deleted once
+        they have been copied.
+      num_threads: An int that indicates how many files should be copied at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed copies are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files copied at the
+        same time to each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+    Returns:
+      A copy of the same list of dicts that was passed in as an argument,
+        with the fields that copy_files describes.
+    """
+    copy_result = source_to_dest_list[:]
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_batch(len(copy_result))
+
+    # Only the buckets we're copying to get created if they're missing.
+    bucket_errors = self.check_buckets(set(self.parse_path(item['source'])[0]
+      for item in copy_result), retry_policy)
+    bucket_errors.update(self.check_buckets(set(
+      self.parse_path(item['destination'])[0] for item in copy_result) -
+      set(bucket_errors), retry_policy, create_missing=True))
+
+    self.run_in_parallel(
+      lambda item: self.copy_one_file(item, bucket_errors, move),
+      copy_result, num_threads, retry_policy=retry_policy,
+      bucket_function=self.get_bucket_function('destination', adaptive))
+    self.flush_manifest_index()
+    return copy_result
+
+
+  def copy_one_file(self, item_to_copy, bucket_errors, move=False):
+    """ Copies (or moves) a single file within the storage platform, as part
+    of a call to copy_files or move_files.
+
+    Args:
+      item_to_copy: A dict with the 'source' and 'destination' of the file to
+        copy. It is updated in place with the 'success' of the copy, and a
+        'failure_reason' if the copy failed.
+      bucket_errors: A dict that maps the name of each bucket we're copying
+        from or to to None if it's ready, or to the reason why it isn't.
+      move: A bool that indicates if the original file should be deleted once
+        it has been copied.
+    """
+    source_bucket_name, source_key_name = self.parse_path(
+      item_to_copy['source'])
+    bucket_name, key_name = self.parse_path(item_to_copy['destination'])
+
+    # First, make sure both buckets are usable.
+    for name in [source_bucket_name, bucket_name]:
+      if bucket_errors.get(name):
+        item_to_copy['success'] = False
+        item_to_copy['failure_reason'] = bucket_errors[name]
+        return
+
+    # Copying a file onto itself is a no-op, and moving a file onto itself
+    # must not delete it.
+    if (source_bucket_name, source_key_name) == (bucket_name, key_name):
+      item_to_copy['skipped'] = True
+      item_to_copy['success'] = True
+      return
+
+    # Next, make sure the file to copy actually exists.
+    metadata = self.get_metadata(source_bucket_name, source_key_name)
+    if metadata is None:
+      item_to_copy['success'] = False
+      item_to_copy['failure_reason'] = 'source not found'
+      self.record_delete_in_manifest(source_bucket_name, source_key_name)
+      return
+
+    # Finally, copy the file, and get rid of the original if we're moving it.
+    self.copy_key(source_bucket_name, source_key_name, bucket_name, key_name,
+      metadata['size'], metadata.get('content_encoding'))
+    self.record_copy_in_manifest(metadata, bucket_name, key_name)
+    if move:
+      self.delete_file(source_bucket_name, source_key_name)
+      self.record_delete_in_manifest(source_bucket_name, source_key_name)
+    item_to_copy['success'] = True
+
+
+  def transfer_files(self, destination_storage, source_to_dest_list,
+    num_threads=None, retry_policy=None, adaptive=False):
+    """ Copies one or more files from this storage platform to another one
+    (e.g., from Amazon S3 to Azure Blob Storage).
+
+    Each file is streamed straight from its ranged downloads into an upload to
+    the other storage platform, a few chunks at a time, so that it never
+    touches the local disk and only a bounded part of it is ever in memory.
+
+    Args:
+      destination_storage: The *Storage object for the storage platform that
+        the files should be copied to.
+      source_to_dest_list: A list of dicts, where each dict has a key named
+        'source' that points to the file on this storage platform to copy,
+        and a key named 'destination' that points to where on the other
+        storage platform it should be copied to.
+      num_threads: An int that indicates how many files should be copied at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed copies are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      adaptive: A bool that indicates if the number of files copied at the
+        same time to each bucket should adapt to how the other storage
+        platform responds, up to num_threads.
+    Returns:
+      A copy of the same list of dicts that was passed in as an argument,
+        with the fields that copy_files describes.
+    """
+    transfer_result = source_to_dest_list[:]
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_batch(len(transfer_result))
+
+    source_bucket_errors = self.check_buckets(set(
+      self.parse_path(item['source'])[0] for item in transfer_result),
+      retry_policy)
+    bucket_errors = destination_storage.check_buckets(set(
+      self.parse_path(item['destination'])[0] for item in transfer_result),
+      retry_policy, create_missing=True)
+
+    # Uploads are where we're most likely to be throttled, so the other
+    # storage platform decides which errors are retried and how many copies
+    # run against each of its buckets.
+    destination_storage.run_in_parallel(
+      lambda item: self.transfer_one_file(item, destination_storage,
+        source_bucket_errors, bucket_errors),
+      transfer_result, num_threads, retry_policy=retry_policy,
+      bucket_function=destination_storage.get_bucket_function('destination',
+        adaptive))
+    destination_storage.flush_manifest_index()
+    return transfer_result
+
+
+  def transfer_one_file(self, item_to_transfer, destination_storage,
+    source_bucket_errors, bucket_errors):
+    """ Copies a single file from this storage platform to another one, as
+    part of a call to transfer_files.
+
+    Args:
+      item_to_transfer: A dict with the 'source' and 'destination' of the file
+        to copy. It is updated in place with the 'success' of the copy, and a
+        'failure_reason' if the copy failed.
+      destination_storage: The *Storage object for the storage platform that
+        the file should be copied to.
+      source_bucket_errors: A dict that maps the name of each bucket we're
+        copying from to None if it exists, or to the reason why we can't use
+        it.
+      bucket_errors: A dict that maps the name of each bucket we're copying to
+        to None if it's ready, or to the reason why it isn't.
+    """
+    source_bucket_name, source_key_name = self.parse_path(
+      item_to_transfer['source'])
+    bucket_name, key_name = self.parse_path(item_to_transfer['destination'])
+
+    # First, make sure both buckets are usable.
+    for name, errors in [(source_bucket_name, source_bucket_errors),
+      (bucket_name, bucket_errors)]:
+      if errors.get(name):
+        item_to_transfer['success'] = False
+        item_to_transfer['failure_reason'] = errors[name]
+        return
+
+    # Next, make sure the file to copy actually exists.
+    metadata = self.get_metadata(source_bucket_name, source_key_name)
+    if metadata is None:
+      item_to_transfer['success'] = False
+      item_to_transfer['failure_reason'] = 'source not found'
+      return
+
+    # Finally, stream the file across, in the chunk size that the other
+    # storage platform uploads in, still encoded the way it was stored.
+    chunk_size = destination_storage.get_stream_chunk_size(metadata['size'])
+    destination_storage.upload_stream(self.iter_key_chunks(source_bucket_name,
+      source_key_name, metadata['size'], chunk_size), bucket_name, key_name,
+      metadata['size'], metadata.get('content_encoding'))
+    destination_storage.record_copy_in_manifest(metadata, bucket_name,
+      key_name)
+    item_to_transfer['success'] = True
+
+
+  def iter_upload_files(self, source_to_dest_iterable, num_threads=None,
+    skip_unchanged=False, retry_policy=None, adaptive=False,
+    max_in_flight=None, compression=None):
+    """ Uploads files to the storage platform like upload_files does, but takes
+    them from an iterable that is only read as there is room for more uploads,
+    and hands back each result as soon as its upload finishes.
+
+    This keeps memory use flat no matter how many files there are, so it suits
+    very large batches. Unlike upload_files, these uploads can't be resumed.
+
+    Args:
+      source_to_dest_iterable: An iterable of dicts in the format that
+        upload_files takes.
+      num_threads: An int that indicates how many files should be uploaded at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      skip_unchanged: A bool that indicates if files whose MD5 matches the MD5
+        of the copy already in the storage platform should not be uploaded
+        again.
+      retry_policy: The RetryPolicy that decides which failed uploads are
+        retried. Defaults to a RetryPolicy whose budget grows with each file.
+      adaptive: A bool that indicates if the number of files uploaded at the
+        same time to each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+      max_in_flight: An int with the most files that can be taken from the
+        iterable but not handed back yet. Defaults to IN_FLIGHT_PER_THREAD
+        times num_threads.
+      compression: A str with the encoding to compress files with before
+        uploading them, or None to upload them as they are.
+    Yields:
+      Each dict from the iterable, once its upload has finished, with the
+        fields that upload_files describes. They are yielded in the order
+        their uploads finished in.
+    Raises:
+      BadConfigurationException: If compression names an encoding that isn't
+        available.
+    """
+    if compression is not None:
+      CompressionCodec.check_encoding(compression)
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+
+    # Buckets are checked (and created) as they first show up, from the thread
+    # reading the iterable, so that uploads don't race to create them.
+    bucket_errors = {}
+    def check_bucket(item):
+      bucket_name = self.parse_path(item['destination'])[0]
+      if bucket_name not in bucket_errors and os.path.exists(item['source']):
+        bucket_errors.update(self.check_buckets(set([bucket_name]),
+          retry_policy, create_missing=True))
+
+    try:
+      for item in self.iter_in_parallel(
+        lambda item: self.upload_one_file(item, bucket_errors, skip_unchanged,
+          compression=compression),
+        source_to_dest_iterable, num_threads, retry_policy,
+        self.get_bucket_function('destination', adaptive), max_in_flight,
+        check_bucket):
+        yield item
+    finally:
+      if skip_unchanged:
+        self.get_hash_cache().flush()
+      self.flush_manifest_index()
+
+
+  def iter_download_files(self, source_to_dest_iterable, num_threads=None,
+    retry_policy=None, adaptive=False, max_in_flight=None, decompress=False):
+    """ Downloads files from the storage platform like download_files does, but
+    takes them from an iterable that is only read as there is room for more
+    downloads, and hands back each result as soon as its download finishes.
+
+    Args:
+      source_to_dest_iterable: An iterable of dicts in the format that
+        download_files takes.
+      num_threads: An int that indicates how many files should be downloaded
+        at the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed downloads are
+        retried. Defaults to a RetryPolicy whose budget grows with each file.
+      adaptive: A bool that indicates if the number of files downloaded at the
+        same time from each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+      max_in_flight: An int with the most files that can be taken from the
+        iterable but not handed back yet. Defaults to IN_FLIGHT_PER_THREAD
+        times num_threads.
+      decompress: A bool that indicates if files that were stored compressed
+        should be decompressed once they are downloaded.
+    Yields:
+      Each dict from the iterable, once its download has finished, with the
+        fields that download_files describes.
+    """
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+
+    bucket_errors = {}
+    def check_bucket(item):
+      bucket_name = self.parse_path(item['source'])[0]
+      if bucket_name not in bucket_errors:
+        bucket_errors.update(self.check_buckets(set([bucket_name]),
+          retry_policy))
+
+    try:
+      for item in self.iter_in_parallel(
+        lambda item: self.download_one_file(item, bucket_errors,
+          decompress=decompress),
+        source_to_dest_iterable, num_threads, retry_policy,
+        self.get_bucket_function('source', adaptive), max_in_flight,
+        check_bucket):
+        yield item
+    finally:
+      self.flush_manifest_index()
+
+
+  def iter_delete_files(self, files_to_delete, num_threads=None,
+    retry_policy=None, adaptive=False, max_in_flight=None):
+    """ Deletes files from the storage platform like delete_files does, but
+    takes them from an iterable that is only read as there is room for more
+    deletions, and hands back each result as soon as its deletion finishes.
+
+    Args:
+      files_to_delete: An iterable of dicts in the format that delete_files
+        takes.
+      num_threads: An int that indicates how many files should be deleted at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed deletions are
+        retried. Defaults to a RetryPolicy whose budget grows with each file.
+      adaptive: A bool that indicates if the number of files deleted at the
+        same time from each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+      max_in_flight: An int with the most files that can be taken from the
+        iterable but not handed back yet. Defaults to IN_FLIGHT_PER_THREAD
+        times num_threads.
+    Yields:
+      Each dict from the iterable, once its deletion has finished, with the
+        fields that delete_files describes.
+    """
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+
+    bucket_errors = {}
+    def check_bucket(item):
+      bucket_name = self.parse_path(item['source'])[0]
+      if bucket_name not in bucket_errors:
+        bucket_errors.update(self.check_buckets(set([bucket_name]),
+          retry_policy))
+
+    try:
+      for item in self.iter_in_parallel(
+        lambda item: self.delete_one_file(item, bucket_errors),
+        files_to_delete, num_threads, retry_policy,
+        self.get_bucket_function('source', adaptive), max_in_flight,
+        check_bucket):
+        yield item
+    finally:
+      self.flush_manifest_index()
+
+
+  def iter_delete_prefix(self, source, num_threads=None, retry_policy=None,
+    adaptive=False):
+    """ Deletes every key in a bucket that starts with the given prefix.
+
+    The bucket is listed as we go, and its keys are deleted DELETE_BATCH_SIZE
+    at a time (via delete_keys), with several batches deleted in parallel.
+
+    Args:
+      source: A str naming the bucket and key prefix to delete, e.g.,
+        '/mybucket/logs/2014-'. The prefix is matched as-is, so '/mybucket/a'
+        matches both 'a/b.txt' and 'ab.txt'.
+      num_threads: An int that indicates how many batches of keys should be
+        deleted at the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed deletions are
+        retried. Defaults to a RetryPolicy whose budget grows with each batch.
+      adaptive: A bool that indicates if the number of batches deleted at the
+        same time should adapt to how the storage platform responds, up to
+        num_threads.
+    Yields:
+      A dict for each key that was found, with the key's path as its 'source',
+        and the fields that delete_files describes.
+    """
+    bucket_name, prefix = self.parse_path(source)
+
+    def batches():
+      key_names = []
+      for key_info in self.list_keys(bucket_name, prefix):
+        key_names.append(key_info['key'])
+        if len(key_names) >= self.DELETE_BATCH_SIZE:
+          yield {'source' : source, 'keys' : key_names}
+          key_names = []
+      if key_names:
+        yield {'source' : source, 'keys' : key_names}
+
+    def delete_batch(batch):
+      batch['failures'] = self.delete_keys(bucket_name, batch['keys'])
+      for key_name in batch['keys']:
+        if key_name not in batch['failures']:
+          self.record_delete_in_manifest(bucket_name, key_name)
+      batch['success'] = True
+
+    try:
+      for batch in self.iter_in_parallel(delete_batch, batches(), num_threads,
+        retry_policy, self.get_bucket_function('source', adaptive)):
+        for key_name in batch['keys']:
+          result = {'source' : self.build_path(bucket_name, key_name)}
+          failure_reason = batch.get('failure_reason') or \
+            batch.get('failures', {}).get(key_name)
+          result['success'] = failure_reason is None
+          if failure_reason is not None:
+            result['failure_reason'] = failure_reason
+          yield result
+    finally:
+      self.flush_manifest_index()
+
+
+  def iter_run_operations(self, operations, num_threads=None,
+    retry_policy=None, adaptive=False, max_in_flight=None):
+    """ Runs a stream of uploads, downloads and deletions of small files whose
+    contents are held in memory, in parallel, handing back each result as soon
+    as its operation finishes.
+
+    This lets a caller that has many small files to move (e.g., the REST
+    server's batch endpoint) send them all through one *Storage object and
+    one pool of threads, without writing them to the local filesystem.
+
+    Args:
+      operations: An iterable of dicts, each with an 'op' of 'upload',
+        'download' or 'delete'. Uploads have a 'destination' to upload to and
+        the 'contents' (a str) to upload there (and, optionally, the
+        'content_encoding' the contents are compressed with), and downloads
+        and deletions have the 'source' to download or delete.
+      num_threads: An int that indicates how many operations should run at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed operations are
+        retried. Defaults to a RetryPolicy whose budget grows with each
+        operation.
+      adaptive: A bool that indicates if the number of operations run at the
+        same time against each bucket should adapt to how the storage platform
+        responds, up to num_threads.
+      max_in_flight: An int with the most operations that can be taken from
+        the iterable but not handed back yet. Defaults to IN_FLIGHT_PER_THREAD
+        times num_threads.
+    Yields:
+      Each dict from the iterable, once its operation has finished, with a
+        'success' field (and a 'failure_reason' if it failed). Downloads get
+        the downloaded file as their 'contents', decompressed if it was stored
+        compressed, in which case they also get a 'content_encoding' field
+        with the encoding it was stored with.
+    """
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+
+    # Only buckets that we upload to get created if they're missing, so we
+    # keep track of the buckets we read from separately.
+    bucket_errors = {'upload' : {}, 'download' : {}, 'delete' : {}}
+    bucket_errors['delete'] = bucket_errors['download']
+    def check_bucket(item):
+      bucket_name = self.get_operation_bucket(item)
+      if bucket_name is None:
+        return
+      errors = bucket_errors[item['op']]
+      if bucket_name not in errors:
+        errors.update(self.check_buckets(set([bucket_name]), retry_policy,
+          create_missing=item['op'] == 'upload'))
+
+    def run_operation(item):
+      if self.get_operation_bucket(item) is None:
+        item['success'] = False
+        item['failure_reason'] = 'invalid operation'
+      elif item['op'] == 'upload':
+        self.upload_one_string(item, bucket_errors['upload'])
+      elif item['op'] == 'download':
+        self.download_one_string(item, bucket_errors['download'])
+      else:
+        self.delete_one_file(item, bucket_errors['delete'])
+
+    bucket_function = None
+    if adaptive:
+      bucket_function = self.get_operation_bucket
+
+    try:
+      for item in self.iter_in_parallel(run_operation, operations, num_threads,
+        retry_policy, bucket_function, max_in_flight, check_bucket):
+        yield item
+    finally:
+      self.flush_manifest_index()
+
+
+  def get_operation_bucket(self, item):
+    """ Finds the bucket that an operation given to iter_run_operations uses.
+
+    Args:
+      item: A dict with the operation, in the format that iter_run_operations
+        takes.
+    Returns:
+      A str with the name of the bucket, or None if the operation is invalid.
+    """
+    if item.get('op') == 'upload':
+      if not item.get('destination') or not isinstance(item.get('contents'),
+        str):
+        return None
+      return self.parse_path(item['destination'])[0]
+    elif item.get('op') in ['download', 'delete'] and item.get('source'):
+      return self.parse_path(item['source'])[0]
+    return None
+
+
+  def upload_one_string(self, item_to_upload, bucket_errors):
+    """ Uploads a single file whose contents are held in memory, as part of a
+    call to iter_run_operations.
+
+    Args:
+      item_to_upload: A dict with the 'destination' and 'contents' of the file
+        to upload, and optionally the 'content_encoding' that the contents are
+        already compressed with. It is updated in place with the 'success' of
+        the upload, and a 'failure_reason' if the upload failed.
+      bucket_errors: A dict that maps the name of each bucket we're uploading
+        to to None if it's ready, or to the reason why it isn't.
+    """
+    bucket_name, key_name = self.parse_path(item_to_upload['destination'])
+    if bucket_errors.get(bucket_name):
+      item_to_upload['success'] = False
+      item_to_upload['failure_reason'] = bucket_errors[bucket_name]
+      return
+
+    contents = item_to_upload['contents']
+    self.upload_stream(iter([contents]), bucket_name, key_name, len(contents),
+      item_to_upload.get('content_encoding'))
+    self.record_contents_in_manifest(bucket_name, key_name, len(contents),
+      hashlib.md5(contents).hexdigest())
+    item_to_upload['success'] = True
+
+
+  def download_one_string(self, item_to_download, bucket_errors):
+    """ Downloads a single file into memory, as part of a call to
+    iter_run_operations.
+
+    Args:
+      item_to_download: A dict with the 'source' of the file to download. It is
+        updated in place with the 'success' of the download, the file's
+        'contents' (and 'content_encoding', if it was stored compressed) if it
+        succeeded, and a 'failure_reason' if it failed.
+      bucket_errors: A dict that maps the name of each bucket we're downloading
+        from to None if it exists, or to the reason why we can't use it.
+    """
+    bucket_name, key_name = self.parse_path(item_to_download['source'])
+    if bucket_errors.get(bucket_name):
+      item_to_download['success'] = False
+      item_to_download['failure_reason'] = bucket_errors[bucket_name]
+      return
+
+    # Listings don't say how files are encoded, so we always look it up.
+    metadata = self.get_metadata(bucket_name, key_name)
+    if metadata is None:
+      item_to_download['success'] = False
+      item_to_download['failure_reason'] = 'source not found'
+      self.record_delete_in_manifest(bucket_name, key_name)
+      return
+
+    # An empty file has no bytes to ask for a range of.
+    contents = ''
+    if metadata['size'] > 0:
+      contents = self.download_range(bucket_name, key_name, 0,
+        metadata['size'] - 1)
+
+    content_encoding = metadata.get('content_encoding')
+    if content_encoding in CompressionCodec.ENCODINGS:
+      contents = ''.join(CompressionCodec.decompress_chunks([contents],
+        content_encoding))
+      item_to_download['content_encoding'] = content_encoding
+    item_to_download['contents'] = contents
+    item_to_download['success'] = True
+
+
+  def iter_download_prefix(self, source, num_threads=None, retry_policy=None,
+    adaptive=False, max_in_flight=None):
+    """ Downloads every key in a bucket that starts with the given prefix as a
+    stream of chunks, starting the downloads in parallel, and hands back each
+    file as soon as its first chunk has arrived.
+
+    The bucket is listed as we go, and files are handed back as they are
+    stored (i.e., still compressed, if they were stored compressed), so that
+    their sizes are known before they are read. Each file's first
+    PREFIX_CHUNK_SIZE bytes are fetched in parallel, and the rest of it is
+    only fetched (with iter_key_chunks) as the caller reads its 'chunks', so
+    at most max_in_flight first chunks, plus the chunks of the file being
+    read, are held in memory at once. Callers that pass each chunk on as it
+    arrives (e.g., the REST server's archive downloads) can start sending
+    before the last file has been downloaded.
+
+    Args:
+      source: A str naming the bucket and key prefix to download, e.g.,
+        '/mybucket/logs/2014-'. The prefix is matched as-is, like
+        iter_delete_prefix does.
+      num_threads: An int that indicates how many files should be started at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed downloads are
+        retried. Defaults to a RetryPolicy whose budget grows with each file.
+      adaptive: A bool that indicates if the number of files started at the
+        same time should adapt to how the storage platform responds, up to
+        num_threads.
+      max_in_flight: An int with the most files that can be started but not
+        handed back yet. Defaults to IN_FLIGHT_PER_THREAD times num_threads.
+    Yields:
+      A dict for each key that was found, with the key's path as its 'source',
+        its 'last_modified' time from the listing, and a 'success' field. Files
+        that were found also have their stored 'size', their
+        'content_encoding' (or None if they aren't compressed), and an
+        iterator of strs with their 'chunks', which raises an exception if
+        the rest of the file can't be downloaded. Files that weren't have a
+        'failure_reason'.
+    """
+    bucket_name, prefix = self.parse_path(source)
+
+    def downloads():
+      for key_info in self.list_keys(bucket_name, prefix):
+        yield {
+          'source' : self.build_path(bucket_name, key_info['key']),
+          'key' : key_info['key'],
+          'last_modified' : key_info['last_modified']
+        }
+
+    def start_download(item):
+      # Listings don't say how files are encoded, so we always look it up.
+      metadata = self.get_metadata(bucket_name, item['key'])
+      if metadata is None:
+        item['success'] = False
+        item['failure_reason'] = 'source not found'
+        return
+
+      # An empty file has no bytes to ask for a range of.
+      size = metadata['size']
+      first_chunk = ''
+      if size > 0:
+        first_chunk = self.download_range(bucket_name, item['key'], 0,
+          min(size, self.PREFIX_CHUNK_SIZE) - 1)
+      item['size'] = size
+      item['content_encoding'] = metadata.get('content_encoding')
+      item['chunks'] = self.iter_rest_of_key(bucket_name, item['key'], size,
+        first_chunk)
+      item['success'] = True
+
+    bucket_function = None
+    if adaptive:
+      bucket_function = lambda item: bucket_name
+
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+    for item in self.iter_in_parallel(start_download, downloads(),
+      num_threads, retry_policy, bucket_function, max_in_flight):
+      del item['key']
+      yield item
+
+
+  def iter_rest_of_key(self, bucket_name, key_name, size, first_chunk):
+    """ Hands back a chunk of a file that was already downloaded, followed by
+    the rest of the file, downloaded PREFIX_CHUNK_SIZE bytes at a time.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file is
         in.
-      key_name: A str containing the name of the key that identifies the file.
+      key_name: A str containing the name of the key that the file is in.
+      size: An int with the size of the file, in bytes.
+      first_chunk: A str with the start of the file.
+    Yields:
+      A str with each chunk of the file, in order.
+    """
+    yield first_chunk
+    if len(first_chunk) < size:
+      for chunk in self.iter_key_chunks(bucket_name, key_name, size,
+        self.PREFIX_CHUNK_SIZE, len(first_chunk)):
+        yield chunk
+
+
+  def get_pack_store(self, bucket_name):
+    """ Finds the PackStore that keeps packed files in a bucket.
+
+    Args:
+      bucket_name: A str with the name of the bucket.
     Returns:
-      True if a file does exist in the named bucket with the provided key name,
-        and False otherwise.
+      The PackStore for the bucket, which is shared with every other *Storage
+        object with the same credentials.
     """
-    raise NotImplementedError
+    return PackStore.for_bucket(self, bucket_name)
 
 
-  def download_file(self, destination, bucket_name, key_name):
-    """ Downloads a file to the local filesystem from the underlying storage
-    platform.
+  def iter_upload_packed(self, source_to_dest_iterable, num_threads=None,
+    retry_policy=None, pack_size=None):
+    """ Uploads small files into packs (see PackStore) instead of storing each
+    one in its own object, handing back each file's result once the pack it
+    went into has been written.
+
+    Files are read in the order they're given in, and each bucket's files are
+    gathered into a pack until it holds pack_size bytes, at which point the
+    pack is uploaded while the next one is filled. Only the packs being
+    uploaded (and those being filled) are held in memory.
 
     Args:
-      destination: A str containing the name of the file on the local filesystem
-        that we should download our file to.
-      bucket_name: A str containing the name of the bucket that the file should
-        be downloaded from.
-      key_name: A str containing the name of the key that the file should be
-        downloaded from.
+      source_to_dest_iterable: An iterable of dicts, each with the
+        'destination' to upload a file to, and either the 'source' of the file
+        on the local filesystem or the 'contents' (a str) to upload.
+      num_threads: An int that indicates how many packs should be uploaded at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed pack uploads are
+        retried. Defaults to a RetryPolicy whose budget grows with each pack.
+      pack_size: An int with the number of bytes of files to put in each pack.
+        Defaults to PackStore.PACK_SIZE.
+    Yields:
+      Each dict from the iterable (without its 'contents'), with a 'success'
+        field, and a 'failure_reason' if the file couldn't be uploaded.
     """
-    raise NotImplementedError
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+    if pack_size is None:
+      pack_size = PackStore.PACK_SIZE
 
+    def packs():
+      filling = {}
+      for item in source_to_dest_iterable:
+        bucket_name, key_name = self.parse_path(item['destination'])
+        if 'contents' in item:
+          contents = item.pop('contents')
+        elif os.path.exists(item['source']):
+          with open(item['source'], 'rb') as file_handle:
+            contents = file_handle.read()
+        else:
+          yield {'bucket' : bucket_name, 'items' : [item], 'files' : [],
+            'failure_reason' : 'file not found'}
+          continue
 
-  def delete_file(self, bucket_name, key_name):
-    """ Deletes a file stored in the underlying storage platform.
+        pack = filling.setdefault(bucket_name, {'bucket' : bucket_name,
+          'items' : [], 'files' : [], 'size' : 0})
+        pack['items'].append(item)
+        pack['files'].append({'key' : key_name, 'contents' : contents})
+        pack['size'] += len(contents)
+        if pack['size'] >= pack_size:
+          yield filling.pop(bucket_name)
+      for bucket_name in sorted(filling):
+        yield filling[bucket_name]
+
+    bucket_errors = {}
+    def check_bucket(pack):
+      if pack['files'] and pack['bucket'] not in bucket_errors:
+        bucket_errors.update(self.check_buckets(set([pack['bucket']]),
+          retry_policy, create_missing=True))
+
+    def upload_pack(pack):
+      if 'failure_reason' in pack:
+        pack['success'] = False
+      elif bucket_errors.get(pack['bucket']):
+        pack['success'] = False
+        pack['failure_reason'] = bucket_errors[pack['bucket']]
+      else:
+        self.get_pack_store(pack['bucket']).write_pack(pack['files'])
+        pack['success'] = True
+
+    for pack in self.iter_in_parallel(upload_pack, packs(), num_threads,
+      retry_policy, max_in_flight=num_threads, before_submit=check_bucket):
+      for item in pack['items']:
+        item['success'] = pack['success']
+        if not pack['success']:
+          item['failure_reason'] = pack['failure_reason']
+        yield item
+
+
+  def iter_download_packed(self, source_to_dest_iterable, num_threads=None,
+    retry_policy=None):
+    """ Downloads files that were uploaded with iter_upload_packed to the local
+    filesystem, handing back each result as soon as it has been written.
+
+    Files are looked up PACKED_DOWNLOAD_WINDOW at a time, and files in the same
+    window that are stored near each other in the same pack are fetched with
+    a single ranged GET.
 
     Args:
-      bucket_name: A str containing the name of the bucket that the file should
-        be downloaded from.
-      key_name: A str containing the name of the key that the file should be
-        downloaded from.
+      source_to_dest_iterable: An iterable of dicts, each with the 'source' of
+        a packed file, and the 'destination' on the local filesystem to write
+        it to.
+      num_threads: An int that indicates how many ranged GETs should be made at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed GETs are retried.
+        Defaults to a RetryPolicy whose budget grows with each GET.
+    Yields:
+      Each dict from the iterable, with a 'success' field, and a
+        'failure_reason' if the file couldn't be downloaded.
     """
-    raise NotImplementedError
+    def spans():
+      window = []
+      for item in source_to_dest_iterable:
+        window.append(item)
+        if len(window) >= self.PACKED_DOWNLOAD_WINDOW:
+          for span in self.plan_packed_reads(window):
+            yield span
+          window = []
+      for span in self.plan_packed_reads(window):
+        yield span
+
+    def download_span(span):
+      if 'failure_reason' in span:
+        span['success'] = False
+        return
+      pack_store = self.get_pack_store(span['bucket'])
+      for item, contents in pack_store.read_span(span):
+        with open(item['destination'], 'wb') as file_handle:
+          file_handle.write(contents)
+      span['success'] = True
+
+    for span in self.iter_in_parallel(download_span, spans(), num_threads,
+      retry_policy):
+      for entry, item in span['parts']:
+        item['success'] = span['success']
+        if not span['success']:
+          item['failure_reason'] = span['failure_reason']
+        yield item
+
+
+  def plan_packed_reads(self, items):
+    """ Looks up where each of a group of packed files is stored, and groups
+    them into the spans that iter_download_packed fetches.
+
+    Args:
+      items: A list of dicts, in the format that iter_download_packed takes.
+    Returns:
+      A list of dicts, one for each span to fetch (in the format that
+        PackStore.plan_reads returns, with the 'bucket' it's in), plus one with
+        a 'failure_reason' for each file that couldn't be found. The value of
+        each part is the file's dict.
+    """
+    spans = []
+    parts = {}
+    for item in items:
+      bucket_name, key_name = self.parse_path(item['source'])
+      try:
+        entry = self.get_pack_store(bucket_name).get_entry(key_name)
+      except Exception as exception:
+        spans.append({'bucket' : bucket_name, 'parts' : [(None, item)],
+          'failure_reason' : self.describe_error(exception)})
+        continue
+      if entry is None:
+        spans.append({'bucket' : bucket_name, 'parts' : [(None, item)],
+          'failure_reason' : 'source not found'})
+        continue
+      parts.setdefault(bucket_name, []).append((entry, item))
+
+    for bucket_name in sorted(parts):
+      for span in self.get_pack_store(bucket_name).plan_reads(
+        parts[bucket_name]):
+        span['bucket'] = bucket_name
+        spans.append(span)
+    return spans
+
+
+  def delete_files_packed(self, files_to_delete):
+    """ Deletes files that were uploaded with iter_upload_packed. Their space
+    is only given back once their packs are compacted (see
+    PackStore.compact).
+
+    Args:
+      files_to_delete: A list of dicts, each with the 'source' of a packed
+        file to delete.
+    Returns:
+      A copy of the same list of dicts, with a 'success' field in each, and a
+        'failure_reason' for files that couldn't be deleted.
+    """
+    delete_result = files_to_delete[:]
+    key_names = {}
+    for item in delete_result:
+      bucket_name, key_name = self.parse_path(item['source'])
+      key_names.setdefault(bucket_name, []).append(key_name)
+
+    deleted = {}
+    failures = {}
+    for bucket_name in key_names:
+      try:
+        deleted[bucket_name] = set(self.get_pack_store(
+          bucket_name).write_deletions(key_names[bucket_name]))
+      except Exception as exception:
+        failures[bucket_name] = self.describe_error(exception)
+
+    for item in delete_result:
+      bucket_name, key_name = self.parse_path(item['source'])
+      if bucket_name in failures:
+        item['success'] = False
+        item['failure_reason'] = failures[bucket_name]
+      elif key_name in deleted[bucket_name]:
+        item['success'] = True
+      else:
+        item['success'] = False
+        item['failure_reason'] = 'source not found'
+    return delete_result
+
+
+  def sync_upload(self, source, destination, num_threads=None, refresh=False,
+    adaptive=False, schedule_by_size=False):
+    """ Uploads every file in a local directory tree that is missing or out of
+    date in the storage platform.
+
+    A file is considered out of date if its size differs from the remote copy,
+    or if it has been modified since the remote copy was written and its MD5
+    doesn't match the remote one.
+
+    Args:
+      source: A str naming the directory on the local filesystem to upload.
+      destination: A str naming the bucket and (optional) key prefix to upload
+        to, e.g., '/mybucket/builds/42'.
+      num_threads: An int that indicates how many files should be uploaded at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+      adaptive: A bool that indicates if the number of files uploaded at the
+        same time should adapt to how the storage platform responds.
+      schedule_by_size: A bool that indicates if the files should be uploaded
+        in the order that BatchScheduler picks from their sizes.
+    Returns:
+      The list of dicts returned by upload_files, one per file that had to be
+        uploaded.
+    """
+    return self.upload_files(list(self.find_files_to_upload(source,
+      destination, refresh)), num_threads, adaptive=adaptive,
+      schedule_by_size=schedule_by_size)
+
+
+  def iter_sync_upload(self, source, destination, num_threads=None,
+    refresh=False, adaptive=False):
+    """ Uploads every file in a local directory tree that is missing or out of
+    date in the storage platform, like sync_upload does, but hands back each
+    result as soon as its upload finishes (see iter_upload_files).
+
+    Args:
+      source: A str naming the directory on the local filesystem to upload.
+      destination: A str naming the bucket and (optional) key prefix to upload
+        to, e.g., '/mybucket/builds/42'.
+      num_threads: An int that indicates how many files should be uploaded at
+        the same time. Defaults to DEFAULT_NUM_THREADS.
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+      adaptive: A bool that indicates if the number of files uploaded at the
+        same time should adapt to how the storage platform responds.
+    Yields:
+      A dict for each file that had to be uploaded, as iter_upload_files
+        describes.
+    """
+    return self.iter_upload_files(self.find_files_to_upload(source,
+      destination, refresh), num_threads, adaptive=adaptive)
+
+
+  def find_files_to_upload(self, source, destination, refresh=False):
+    """ Walks a local directory tree, looking for files that are missing or
+    out of date under a bucket prefix.
+
+    Args:
+      source: A str naming the directory on the local filesystem to upload.
+      destination: A str naming the bucket and (optional) key prefix to upload
+        to.
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+    Yields:
+      A dict in the format that upload_files takes, for each file that needs
+        to be uploaded.
+    """
+    bucket_name, prefix = self.parse_path(destination)
+    remote_keys = self.list_keys_by_name(bucket_name, prefix, refresh)
+
+    for local_path, relative_path in self.walk_local_directory(source):
+      key_name = self.join_key(prefix, relative_path)
+      if self.is_out_of_date(remote_keys.get(key_name), local_path,
+        newer_side='local'):
+        yield {
+          'source' : local_path,
+          'destination' : self.build_path(bucket_name, key_name)
+        }
+
+
+  def sync_download(self, source, destination, num_threads=None,
+    refresh=False, adaptive=False):
+    """ Downloads every file under a bucket prefix that is missing or out of
+    date in a local directory tree.
+
+    A file is considered out of date if its size differs from the remote copy,
+    or if the remote copy has been modified since the local copy was written
+    and their MD5s don't match.
+
+    Args:
+      source: A str naming the bucket and (optional) key prefix to download
+        from, e.g., '/mybucket/builds/42'.
+      destination: A str naming the directory on the local filesystem to
+        download to.
+      num_threads: An int that indicates how many files should be downloaded
+        at the same time. Defaults to DEFAULT_NUM_THREADS.
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+      adaptive: A bool that indicates if the number of files downloaded at the
+        same time should adapt to how the storage platform responds.
+    Returns:
+      The list of dicts returned by download_files, one per file that had to be
+        downloaded.
+    """
+    last_modified_times = {}
+    download_result = self.download_files(list(self.find_files_to_download(
+      source, destination, last_modified_times, refresh)), num_threads,
+      adaptive=adaptive)
+
+    for item in download_result:
+      self.set_local_mtime(item, last_modified_times)
+    return download_result
+
+
+  def iter_sync_download(self, source, destination, num_threads=None,
+    refresh=False, adaptive=False):
+    """ Downloads every file under a bucket prefix that is missing or out of
+    date in a local directory tree, like sync_download does, but hands back
+    each result as soon as its download finishes (see iter_download_files).
+
+    Args:
+      source: A str naming the bucket and (optional) key prefix to download
+        from, e.g., '/mybucket/builds/42'.
+      destination: A str naming the directory on the local filesystem to
+        download to.
+      num_threads: An int that indicates how many files should be downloaded
+        at the same time. Defaults to DEFAULT_NUM_THREADS.
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+      adaptive: A bool that indicates if the number of files downloaded at the
+        same time should adapt to how the storage platform responds.
+    Yields:
+      A dict for each file that had to be downloaded, as iter_download_files
+        describes.
+    """
+    last_modified_times = {}
+    for item in self.iter_download_files(self.find_files_to_download(source,
+      destination, last_modified_times, refresh), num_threads,
+      adaptive=adaptive):
+      self.set_local_mtime(item, last_modified_times)
+      yield item
+
+
+  def find_files_to_download(self, source, destination, last_modified_times,
+    refresh=False):
+    """ Looks for keys under a bucket prefix that are missing or out of date in
+    a local directory tree, creating the local directories they go in.
+
+    Args:
+      source: A str naming the bucket and (optional) key prefix to download
+        from.
+      destination: A str naming the directory on the local filesystem to
+        download to.
+      last_modified_times: A dict that the modification time of each key that
+        needs to be downloaded is stored in, keyed by the local path it will be
+        downloaded to.
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+    Yields:
+      A dict in the format that download_files takes, for each file that needs
+        to be downloaded.
+    """
+    bucket_name, prefix = self.parse_path(source)
+    remote_keys = self.list_keys_by_name(bucket_name, prefix, refresh)
+
+    for key_name, key_info in sorted(remote_keys.items()):
+      # Work with the key as UTF-8, like the prefix and local paths are.
+      source = self.build_path(bucket_name, key_name)
+      relative_path = self.parse_path(source)[1][len(prefix):].lstrip('/')
+      if not relative_path or relative_path.endswith('/'):
+        continue
+
+      local_path = os.path.join(destination, *relative_path.split('/'))
+      if self.is_out_of_date(key_info, local_path, newer_side='remote'):
+        local_dir = os.path.dirname(local_path)
+        if not os.path.isdir(local_dir):
+          os.makedirs(local_dir)
+        last_modified_times[local_path] = key_info['last_modified']
+        yield {
+          'source' : source,
+          'destination' : local_path
+        }
+
+
+  def set_local_mtime(self, item, last_modified_times):
+    """ Gives a file that a sync downloaded the same modification time as the
+    remote copy, so that the next sync sees them as being in sync.
+
+    Args:
+      item: A dict for a file that a sync tried to download, as returned by
+        download_files.
+      last_modified_times: A dict that maps the local path of each file to the
+        modification time of its remote copy.
+    """
+    if item['success']:
+      last_modified = last_modified_times.pop(item['destination'])
+      os.utime(item['destination'], (last_modified, last_modified))
+
+
+  def list_keys_by_name(self, bucket_name, prefix, refresh=False):
+    """ Lists the keys in a bucket that live under the given prefix, treating
+    the prefix as a directory name.
+
+    If the manifest index already holds a full listing of the prefix, it is
+    used instead of listing the bucket. Otherwise the bucket is listed, and the
+    listing is saved in the manifest index for next time.
+
+    Args:
+      bucket_name: A str containing the name of the bucket to list.
+      prefix: A str containing the key prefix to list. If non-empty, only keys
+        in this 'directory' are listed (so 'logs' matches 'logs/a' but not
+        'logsbackup/a').
+      refresh: A bool that indicates if the bucket should be listed even if the
+        manifest index already knows what is in it.
+    Returns:
+      A dict mapping each key name to the dict that list_keys returned for it.
+    """
+    if prefix and not prefix.endswith('/'):
+      prefix += '/'
+
+    manifest_index = self.get_manifest_index()
+    backend_id = self.get_backend_id()
+    if not refresh and manifest_index.has_listing(backend_id, bucket_name,
+      prefix):
+      return manifest_index.get_keys(backend_id, bucket_name, prefix)
+
+    remote_keys = {}
+    if self.does_bucket_exist(bucket_name):
+      for key_info in self.list_keys(bucket_name, prefix):
+        remote_keys[key_info['key']] = key_info
+
+    manifest_index.replace_listing(backend_id, bucket_name, prefix,
+      remote_keys.values())
+    return remote_keys
+
+
+  def is_out_of_date(self, key_info, local_path, newer_side):
+    """ Decides if a local file and the remote copy of it differ.
+
+    Args:
+      key_info: A dict returned by list_keys for the remote copy of the file,
+        or None if there is no remote copy.
+      local_path: A str naming the local copy of the file.
+      newer_side: 'local' if we're checking if the remote copy needs to be
+        updated, or 'remote' if we're checking if the local copy does.
+    Returns:
+      True if the copy on the side opposite to newer_side needs to be
+        transferred again, and False otherwise.
+    """
+    if key_info is None or not os.path.isfile(local_path):
+      return True
+
+    local_stat = os.stat(local_path)
+    if local_stat.st_size != key_info['size']:
+      return True
+
+    if newer_side == 'local':
+      modified_since_transfer = local_stat.st_mtime > key_info['last_modified']
+    else:
+      modified_since_transfer = key_info['last_modified'] > local_stat.st_mtime
+    if not modified_since_transfer:
+      return False
+
+    # The file was touched since it was last transferred, but its contents may
+    # be the same. Only transfer it again if the checksums say so.
+    if key_info.get('md5'):
+      return self.get_local_md5(local_path) != key_info['md5']
+    return True
+
+
+  def walk_local_directory(self, directory):
+    """ Finds every file in a local directory tree.
+
+    Args:
+      directory: A str naming the directory to walk.
+    Yields:
+      A tuple for each file found, containing the full path of the file and its
+        path relative to directory, with '/' as the separator.
+    """
+    for root, _, file_names in os.walk(directory):
+      for file_name in sorted(file_names):
+        local_path = os.path.join(root, file_name)
+        relative_path = os.path.relpath(local_path, directory)
+        yield local_path, relative_path.replace(os.sep, '/')
+
+
+  def check_buckets(self, bucket_names, retry_policy, create_missing=False):
+    """ Checks that each of the buckets a batch uses exists, querying the
+    storage platform once per bucket.
+
+    Args:
+      bucket_names: A set containing the names of the buckets to check.
+      retry_policy: The RetryPolicy that decides which failed queries are
+        retried.
+      create_missing: A bool that indicates if buckets that don't exist should
+        be created.
+    Returns:
+      A dict that maps each bucket name to None if the bucket exists (or was
+        created), or to a str explaining why it can't be used.
+    """
+    bucket_errors = {}
+    for bucket_name in bucket_names:
+      try:
+        if retry_policy.call(lambda: self.does_bucket_exist(bucket_name),
+          self.is_retryable_error):
+          bucket_errors[bucket_name] = None
+        elif create_missing:
+          retry_policy.call(lambda: self.create_bucket(bucket_name),
+            self.is_retryable_error)
+          bucket_errors[bucket_name] = None
+        else:
+          bucket_errors[bucket_name] = 'bucket not found'
+      except Exception as exception:
+        bucket_errors[bucket_name] = self.describe_error(exception)
+    return bucket_errors
+
+
+  def run_in_parallel(self, function, items, num_threads=None,
+    checkpoint=None, retry_policy=None, bucket_function=None, order=None):
+    """ Calls a function once for each of the given items, using a pool of
+    threads to make the calls in parallel.
+
+    Calls that fail with an error worth retrying are retried according to the
+    retry policy. If a call still fails, its item is marked as failed (with the
+    error as its 'failure_reason') and the rest of the batch carries on.
+
+    Args:
+      function: A function that takes a single item as its argument. If a
+        checkpoint is given, it also takes the item's TransferState as a second
+        argument.
+      items: A list of dicts to call the function on. The function should set
+        the 'success' field of each one.
+      num_threads: An int that indicates how many calls should be made at the
+        same time. Defaults to DEFAULT_NUM_THREADS.
+      checkpoint: A Checkpoint that records which items finished, or None if
+        this batch shouldn't be resumable. Items that the checkpoint says have
+        finished are marked as successful without calling the function, and
+        the checkpoint is removed once every item has succeeded.
+      retry_policy: The RetryPolicy that decides which failed calls are
+        retried. Defaults to a RetryPolicy with a budget sized for this batch.
+      bucket_function: A function that takes an item and returns the name of
+        the bucket it uses, or None to always make num_threads calls at the
+        same time. If given, the number of calls made at the same time against
+        each bucket is adapted by that bucket's ConcurrencyController, up to
+        num_threads (which defaults to ConcurrencyController.MAX_LIMIT).
+      order: A list with the index of each item, in the order the calls should
+        be started. Defaults to the order the items are given in.
+    """
+    if not items:
+      return
+
+    if num_threads is None:
+      if bucket_function is None:
+        num_threads = self.DEFAULT_NUM_THREADS
+      else:
+        num_threads = ConcurrencyController.MAX_LIMIT
+
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_batch(len(items))
+
+    def run_one_item(index_and_item):
+      index, item = index_and_item
+      if checkpoint is None:
+        call = lambda: function(item)
+      elif checkpoint.is_item_done(index):
+        item['success'] = True
+        return
+      else:
+        call = lambda: function(item, checkpoint.get_transfer_state(index))
+
+      if self.call_for_item(call, item, retry_policy, bucket_function) and \
+        checkpoint is not None and item.get('success'):
+        checkpoint.mark_item_done(index)
+
+    pool = multiprocessing.pool.ThreadPool(max(1, min(num_threads,
+      len(items))))
+    try:
+      # Hand out one item at a time, so that the order we start items in is
+      # the order we were asked for, and a thread stuck on a large item
+      # doesn't hold back a queue of items behind it.
+      if order is None:
+        order = range(len(items))
+      pool.map(run_one_item, [(index, items[index]) for index in order],
+        chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+    if checkpoint is not None and all(item.get('success') for item in items):
+      checkpoint.remove()
+
+
+  def iter_in_parallel(self, function, items, num_threads=None,
+    retry_policy=None, bucket_function=None, max_in_flight=None,
+    before_submit=None):
+    """ Calls a function once for each item from an iterable, using a pool of
+    threads to make the calls in parallel, and hands back each item as soon as
+    its call finishes.
+
+    Items are only taken from the iterable while fewer than max_in_flight of
+    them are waiting to be handed back, so a lazy iterable is never read much
+    further than the calls that are running. Calls are retried and failures
+    recorded as in run_in_parallel.
+
+    Args:
+      function: A function that takes a single item as its argument.
+      items: An iterable of dicts to call the function on. The function should
+        set the 'success' field of each one.
+      num_threads: An int that indicates how many calls should be made at the
+        same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed calls are
+        retried. Defaults to a RetryPolicy whose budget grows with each item.
+      bucket_function: A function that takes an item and returns the name of
+        the bucket it uses, or None to always make num_threads calls at the
+        same time (see run_in_parallel).
+      max_in_flight: An int with the most items that can be taken from the
+        iterable but not handed back yet. Defaults to IN_FLIGHT_PER_THREAD
+        times num_threads.
+      before_submit: A function that is called with each item, from the thread
+        reading the iterable, before its call is handed to the pool.
+    Yields:
+      Each item, once its call has finished, in the order they finished in.
+    """
+    if num_threads is None:
+      if bucket_function is None:
+        num_threads = self.DEFAULT_NUM_THREADS
+      else:
+        num_threads = ConcurrencyController.MAX_LIMIT
+
+    if max_in_flight is None:
+      max_in_flight = num_threads * self.IN_FLIGHT_PER_THREAD
+
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+
+    finished_items = Queue.Queue()
+    def run_one_item(item):
+      try:
+        self.call_for_item(lambda: function(item), item, retry_policy,
+          bucket_function)
+      finally:
+        finished_items.put(item)
+
+    def wait_for_item():
+      # Block with a timeout, since a Queue.get without one can't be
+      # interrupted with Ctrl-C.
+      while True:
+        try:
+          return finished_items.get(True, self.RESULT_POLL_INTERVAL)
+        except Queue.Empty:
+          continue
+
+    pool = multiprocessing.pool.ThreadPool(max(1, num_threads))
+    num_in_flight = 0
+    try:
+      for item in items:
+        if before_submit is not None:
+          before_submit(item)
+        retry_policy.add_items(1)
+        pool.apply_async(run_one_item, (item,))
+        num_in_flight += 1
+
+        # Hand back whatever has finished, and wait for more to finish if we
+        # can't take any more items yet.
+        while num_in_flight >= max_in_flight or not finished_items.empty():
+          yield wait_for_item()
+          num_in_flight -= 1
+
+      while num_in_flight > 0:
+        yield wait_for_item()
+        num_in_flight -= 1
+    finally:
+      pool.close()
+      pool.join()
+
+
+  def call_for_item(self, call, item, retry_policy, bucket_function=None):
+    """ Makes the call that processes one item in a batch, retrying it if it
+    fails with an error worth retrying, and marking the item as failed if it
+    still fails.
+
+    Args:
+      call: A function that takes no arguments and processes the item.
+      item: The dict for the item, which gets a 'success' field of False and a
+        'failure_reason' if the call fails.
+      retry_policy: The RetryPolicy that decides if the call is retried.
+      bucket_function: A function that takes the item and returns the name of
+        the bucket it uses, if the call should be gated by that bucket's
+        ConcurrencyController, or None otherwise.
+    Returns:
+      True if the call returned, and False if it raised an exception.
+    """
+    if bucket_function is not None:
+      controller = ConcurrencyController.for_bucket(self.get_backend_id(),
+        bucket_function(item))
+      controlled_call = call
+      call = lambda: controller.run(controlled_call, self.is_throttling_error)
+
+    try:
+      retry_policy.call(call, self.is_retryable_error)
+      return True
+    except Exception as exception:
+      item['success'] = False
+      item['failure_reason'] = self.describe_error(exception)
+      return False
+
+
+  def is_retryable_error(self, exception):
+    """ Decides if an operation that failed with the given exception is worth
+    retrying.
+
+    Implementers should override this to recognize their storage platform's
+    transient errors (e.g., throttling), and fall back to this method for
+    anything else. By default, only dropped connections and other network
+    errors are retried.
+
+    Args:
+      exception: The Exception that the operation raised.
+    Returns:
+      True if the operation should be retried, and False otherwise.
+    """
+    return isinstance(exception, (socket.error, httplib.HTTPException))
+
+
+  def is_throttling_error(self, exception):
+    """ Decides if an operation failed because the storage platform is
+    throttling us, which tells ConcurrencyControllers to back off.
+
+    Implementers should override this to recognize their storage platform's
+    throttling errors. By default, no errors are treated as throttling.
+
+    Args:
+      exception: The Exception that the operation raised.
+    Returns:
+      True if the exception means we're being throttled, and False otherwise.
+    """
+    return False
+
+
+  def get_bucket_function(self, field, adaptive):
+    """ Builds the function that run_in_parallel uses to find the bucket that
+    each item in a batch uses.
+
+    Args:
+      field: A str naming the field in each item that holds its remote path
+        (e.g., 'destination' for uploads).
+      adaptive: A bool that indicates if the batch adapts its concurrency.
+    Returns:
+      A function that takes an item and returns the name of its bucket, or None
+        if the batch doesn't adapt its concurrency.
+    """
+    if not adaptive:
+      return None
+    return lambda item: self.parse_path(item[field])[0]
+
+
+  def throttle(self, num_bytes):
+    """ Waits until the bandwidth limits for this storage platform (if any)
+    let some bytes through. Implementers should call this as they send or
+    receive each chunk of a file.
+
+    Args:
+      num_bytes: An int with the number of bytes about to be (or just) sent.
+    """
+    RateLimiter.throttle(self.get_backend_id(), num_bytes)
+
+
+  def describe_error(self, exception):
+    """ Turns an exception into a 'failure_reason' for a batch item.
+
+    Args:
+      exception: The Exception that made the item fail.
+    Returns:
+      A str describing the exception.
+    """
+    return '{0}: {1}'.format(exception.__class__.__name__, exception)
+
+
+  def parse_path(self, path):
+    """ Splits a path of the form '/bucket/key/name' into its bucket and key.
+
+    Args:
+      path: A str whose first component names a bucket, and whose remaining
+        components name a key in that bucket.
+    Returns:
+      A tuple containing the name of the bucket and the name of the key (which
+        may be empty).
+    """
+    bucket_name = path.split('/')[1]
+    key_name = "/".join(path.split('/')[2:])
+    return bucket_name, key_name
+
+
+  def build_path(self, bucket_name, key_name):
+    """ Joins a bucket and a key into a path of the form '/bucket/key/name',
+    as parse_path splits them.
+
+    Listings (and the manifest index) hand back key names as unicode, so they
+    are encoded as UTF-8, giving the same strs that paths on the command line
+    are.
+
+    Args:
+      bucket_name: A str (or unicode) with the name of the bucket.
+      key_name: A str (or unicode) with the name of the key.
+    Returns:
+      A str containing the path.
+    """
+    return '/' + '/'.join(name.encode('utf-8') if isinstance(name, unicode)
+      else name for name in [bucket_name, key_name])
+
+
+  def join_key(self, prefix, relative_path):
+    """ Appends a relative path to a key prefix.
+
+    Args:
+      prefix: A str containing a key prefix, which may be empty.
+      relative_path: A str containing a '/'-separated relative path.
+    Returns:
+      A str containing the resulting key name.
+    """
+    if not prefix:
+      return relative_path
+    return prefix.rstrip('/') + '/' + relative_path
+
+
+  def get_local_size(self, path):
+    """ Finds the size of a file on the local filesystem.
+
+    Args:
+      path: A str naming the file.
+    Returns:
+      An int with the size of the file in bytes, or 0 if it doesn't exist.
+    """
+    try:
+      return os.path.getsize(path)
+    except OSError:
+      return 0
+
+
+  def get_local_md5(self, path, content_encoding=None):
+    """ Finds the MD5 checksum of a local file, only reading the file if it has
+    changed since we last hashed it.
+
+    Args:
+      path: A str naming the file to hash.
+      content_encoding: A str with the encoding to hash the file as if it were
+        compressed with, or None to hash the file as it is.
+    Returns:
+      A str containing the hex-encoded MD5 of the file's (compressed) contents.
+    """
+    path = os.path.abspath(path)
+    file_stat = os.stat(path)
+    hash_cache = self.get_hash_cache()
+
+    # The MD5 of the compressed file is cached alongside the file's own MD5.
+    cache_key = path
+    if content_encoding is not None:
+      cache_key = '{0}#{1}'.format(path, content_encoding)
+
+    md5 = hash_cache.get(cache_key, file_stat.st_size, file_stat.st_mtime)
+    if md5 is None:
+      if content_encoding is None:
+        md5 = self.compute_md5(path)
+      else:
+        md5 = CompressionCodec.compute_md5(path, content_encoding)
+      hash_cache.put(cache_key, file_stat.st_size, file_stat.st_mtime, md5)
+    return md5
+
+
+  def get_manifest_index(self, create=True):
+    """ Returns the ManifestIndex shared by all *Storage objects.
+
+    Args:
+      create: A bool that indicates if the index should be created if it
+        doesn't exist yet. If False, the index is only opened if a previous
+        sync already created it, so that users who never sync don't pay for
+        keeping it up to date.
+    Returns:
+      A ManifestIndex, or None if create is False and there is no index.
+    """
+    with BaseStorage.manifest_index_lock:
+      if BaseStorage.manifest_index is None and (create or
+        os.path.exists(ManifestIndex.DEFAULT_LOCATION)):
+        BaseStorage.manifest_index = ManifestIndex()
+    return BaseStorage.manifest_index
+
+
+  def record_upload_in_manifest(self, source, bucket_name, key_name,
+    content_encoding=None):
+    """ Tells the manifest index (if there is one) about a file we uploaded,
+    and forgets any cached metadata for it.
+
+    The file's metadata is looked up once it has been uploaded, so that the
+    index holds the storage platform's own modification time (which later
+    listings are compared against, and which our clock may not agree with)
+    and the MD5 that the platform computed for the bytes it received.
+
+    Args:
+      source: A str naming the local file that was uploaded.
+      bucket_name: A str containing the name of the bucket it was uploaded to.
+      key_name: A str containing the name of the key it was uploaded to.
+      content_encoding: A str with the encoding the file was compressed with
+        before it was uploaded, or None if it wasn't.
+    """
+    self.metadata_cache.invalidate(self.get_credentials_id(), bucket_name,
+      key_name)
+    manifest_index = self.get_manifest_index(create=False)
+    if manifest_index is None:
+      return
+
+    metadata = self.get_metadata(bucket_name, key_name)
+    if metadata is None:
+      manifest_index.remove(self.get_backend_id(), bucket_name, key_name)
+      return
+
+    # Some uploads (e.g., multipart uploads to S3) leave the platform without
+    # an MD5 of the file, so we fall back to hashing the bytes we sent.
+    md5 = metadata['md5'] or self.get_local_md5(source, content_encoding)
+    manifest_index.put(self.get_backend_id(), bucket_name, {
+      'key' : key_name,
+      'size' : metadata['size'],
+      'etag' : metadata['etag'],
+      'md5' : md5,
+      'last_modified' : metadata['last_modified']
+    })
+
+
+  def record_copy_in_manifest(self, metadata, bucket_name, key_name):
+    """ Tells the manifest index (if there is one) about a file we copied,
+    and forgets any cached metadata for the copy.
+
+    Args:
+      metadata: A dict with the metadata of the file that was copied, in the
+        format that get_metadata returns.
+      bucket_name: A str containing the name of the bucket it was copied to.
+      key_name: A str containing the name of the key it was copied to.
+    """
+    self.record_contents_in_manifest(bucket_name, key_name, metadata['size'],
+      metadata['md5'])
+
+
+  def record_contents_in_manifest(self, bucket_name, key_name, size, md5):
+    """ Tells the manifest index (if there is one) about a file we wrote
+    without uploading it from the local filesystem, and forgets any cached
+    metadata for it.
+
+    Args:
+      bucket_name: A str containing the name of the bucket the file was
+        written to.
+      key_name: A str containing the name of the key the file was written to.
+      size: An int with the size of the file, in bytes.
+      md5: A str with the hex-encoded MD5 of the file, or None if it isn't
+        known.
+    """
+    self.metadata_cache.invalidate(self.get_credentials_id(), bucket_name,
+      key_name)
+    manifest_index = self.get_manifest_index(create=False)
+    if manifest_index is None:
+      return
+
+    # The file's ETag depends on how it was written (e.g., if it was copied in
+    # parts), so we leave it out.
+    manifest_index.put(self.get_backend_id(), bucket_name, {
+      'key' : key_name,
+      'size' : size,
+      'etag' : None,
+      'md5' : md5,
+      'last_modified' : time.time()
+    })
+
+
+  def record_delete_in_manifest(self, bucket_name, key_name):
+    """ Tells the manifest index (if there is one) that a file no longer
+    exists, and forgets any cached metadata for it.
+
+    Args:
+      bucket_name: A str containing the name of the bucket the file was in.
+      key_name: A str containing the name of the key for the file.
+    """
+    self.metadata_cache.invalidate(self.get_credentials_id(), bucket_name,
+      key_name)
+    manifest_index = self.get_manifest_index(create=False)
+    if manifest_index is not None:
+      manifest_index.remove(self.get_backend_id(), bucket_name, key_name)
+
+
+  def flush_manifest_index(self):
+    """ Writes any changes made to the manifest index (if there is one) to
+    disk. """
+    manifest_index = self.get_manifest_index(create=False)
+    if manifest_index is not None:
+      manifest_index.flush()
+
+
+  def get_hash_cache(self):
+    """ Returns the HashCache shared by all *Storage objects, creating it if
+    this is the first time it is needed.
+
+    Returns:
+      A HashCache.
+    """
+    with BaseStorage.hash_cache_lock:
+      if BaseStorage.hash_cache is None:
+        BaseStorage.hash_cache = HashCache()
+    return BaseStorage.hash_cache
+
+
+  def compute_md5(self, path):
+    """ Computes the MD5 checksum of a local file, reading it in chunks so
+    that large files don't have to fit in memory.
+
+    Args:
+      path: A str naming the file to hash.
+    Returns:
+      A str containing the hex-encoded MD5 of the file's contents.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file_handle:
+      while True:
+        chunk = file_handle.read(self.HASH_CHUNK_SIZE)
+        if not chunk:
+          break
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+  def parse_timestamp(self, timestamp):
+    """ Converts a timestamp returned by a storage platform to seconds since
+    the epoch.
+
+    Args:
+      timestamp: A str containing either an ISO 8601 timestamp (e.g.,
+        '2013-03-18T22:43:05.000Z') or an RFC 1123 timestamp (e.g.,
+        'Mon, 18 Mar 2013 22:43:05 GMT'), in UTC.
+    Returns:
+      A float with the number of seconds since the epoch.
+    """
+    if 'T' in timestamp and ',' not in timestamp:
+      return float(calendar.timegm(time.strptime(timestamp[:19],
+        '%Y-%m-%dT%H:%M:%S')))
+    return float(calendar.timegm(email.utils.parsedate(timestamp)))
+
+
+  def base64_md5_to_hex(self, base64_md5):
+    """ Converts a base64-encoded MD5 (as found in Content-MD5 headers) to the
+    hex encoding that compute_md5 uses.
+
+    Args:
+      base64_md5: A str containing a base64-encoded MD5, or None.
+    Returns:
+      A str containing the hex-encoded MD5, or None if none was given.
+    """
+    if not base64_md5:
+      return None
+    return binascii.hexlify(base64.b64decode(base64_md5))
+
+
+  def get_timeout(self, parameters):
+    """ Reads how long connections to the storage platform can wait before
+    giving up, so that one stalled request fails (and can be retried) instead
+    of stalling its whole batch.
+
+    Implementers should call this before connecting, and apply the timeout to
+    every connection their storage platform's SDK opens.
+
+    Args:
+      parameters: A dict in the format that StorageFactory.get_storage takes,
+        whose 'timeout' (if any) is a number of seconds, or a str holding one.
+    Returns:
+      A float with the number of seconds, which defaults to DEFAULT_TIMEOUT.
+    Raises:
+      BadConfigurationException: If the timeout isn't a positive number.
+    """
+    timeout = parameters.get('timeout')
+    if timeout is None or timeout == '':
+      return float(self.DEFAULT_TIMEOUT)
+    try:
+      seconds = float(timeout)
+    except ValueError:
+      seconds = 0
+    if seconds <= 0:
+      raise BadConfigurationException('The timeout must be a positive ' \
+        'number of seconds, not {0}'.format(timeout))
+    return seconds
+
+
+  def get_backend_id(self):
+    """ Identifies the storage platform and account that this object talks to,
+    so that state kept on the local filesystem (e.g., the manifest index) for
+    one account isn't confused with that of another.
+
+    Returns:
+      A str that identifies the storage platform and account.
+    """
+    raise NotImplementedError
+
+
+  def get_credentials_id(self):
+    """ Identifies the storage platform and account that this object talks to,
+    along with the credentials it uses, so that state shared between callers
+    in one process (e.g., cached metadata in the REST server) is never shared
+    with a caller who couldn't have read it from the storage platform.
+
+    Implementers should return hash_credentials of their secret credentials.
+
+    Returns:
+      A str that identifies the storage platform, account and credentials,
+        without revealing the credentials.
+    """
+    raise NotImplementedError
+
+
+  def hash_credentials(self, *secrets):
+    """ Builds an id for get_credentials_id from this object's backend id and
+    its secret credentials.
+
+    Args:
+      secrets: The strs (or Nones) that this object authenticates with.
+    Returns:
+      A str with the backend id and a SHA-1 digest of it and the secrets.
+    """
+    digest = hashlib.sha1()
+    for part in (self.get_backend_id(),) + secrets:
+      if isinstance(part, unicode):
+        part = part.encode('utf-8')
+      digest.update('{0}\0'.format(part))
+    return '{0}:{1}'.format(self.get_backend_id(), digest.hexdigest())
+
+
+  def does_bucket_exist(self, bucket_name):
+    """ Queries the underlying storage platform to see if the named bucket
+    exists.
+
+    Args:
+      bucket_name: A str that represents the name of the bucket to check for
+        existence.
+    Returns:
+      True if the named bucket exists, and False otherwise.
+    """
+    raise NotImplementedError
+
+
+  def create_bucket(self, bucket_name):
+    """ Creates a new bucket in the underlying storage platform.
+
+    Args:
+      bucket_name: A str that represents the name of the bucket to create.
+    """
+    raise NotImplementedError
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists the keys in a bucket that start with the given prefix.
+
+    Implementations should page through the listing lazily, so that callers can
+    iterate over very large buckets without holding the whole listing in
+    memory.
+
+    Args:
+      bucket_name: A str containing the name of the bucket to list.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A dict for each key found, with the key's name ('key'), size in bytes
+        ('size'), ETag ('etag'), hex-encoded MD5 if known ('md5', or None),
+        and last modification time in seconds since the epoch
+        ('last_modified').
+    """
+    raise NotImplementedError
+
+
+  def does_key_exist(self, bucket_name, key_name):
+    """ Queries the underlying storage platform to see if the named file exists.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file exists
+        in.
+      key_name: A str containing the name of the key that identifies the file.
+    Returns:
+      True if a file does exist in the named bucket with the provided key name,
+        and False otherwise.
+    """
+    raise NotImplementedError
+
+
+  def get_metadata(self, bucket_name, key_name):
+    """ Queries the underlying storage platform for information about a file,
+    without downloading it (e.g., via a HEAD request).
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file exists
+        in.
+      key_name: A str containing the name of the key that identifies the file.
+    Returns:
+      None if the file doesn't exist, and otherwise a dict with the key's name
+        ('key'), size in bytes ('size'), ETag ('etag'), hex-encoded MD5 if
+        known ('md5', or None), content type ('content_type'), content
+        encoding ('content_encoding', or None), and last modification time in
+        seconds since the epoch ('last_modified').
+    """
+    raise NotImplementedError
+
+
+  def get_cached_metadata(self, bucket_name, key_name):
+    """ Looks up information about a file like get_metadata does, but answers
+    from the shared MetadataCache if the file was looked up recently with the
+    same credentials.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file exists
+        in.
+      key_name: A str containing the name of the key that identifies the file.
+    Returns:
+      None if the file doesn't exist, and otherwise a dict in the format that
+        get_metadata describes.
+    """
+    credentials_id = self.get_credentials_id()
+    found, metadata = self.metadata_cache.get(credentials_id, bucket_name,
+      key_name)
+    if not found:
+      metadata = self.get_metadata(bucket_name, key_name)
+      self.metadata_cache.put(credentials_id, bucket_name, key_name, metadata)
+    return metadata
+
+
+  def download_file(self, destination, bucket_name, key_name):
+    """ Downloads a file to the local filesystem from the underlying storage
+    platform.
+
+    Args:
+      destination: A str containing the name of the file on the local filesystem
+        that we should download our file to.
+      bucket_name: A str containing the name of the bucket that the file should
+        be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+    """
+    raise NotImplementedError
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Downloads part of a file from the underlying storage platform.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file should
+        be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+      start: An int with the offset of the first byte to download.
+      end: An int with the offset of the last byte to download (inclusive, as
+        in HTTP Range headers).
+    Returns:
+      A str containing the bytes in the requested range.
+    """
+    raise NotImplementedError
+
+
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
+    """ Uploads a file from the local filesystem to the underlying storage
+    platform.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
+    """
+    raise NotImplementedError
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file from the local filesystem to the underlying storage
+    platform, recording its progress so that an upload that is cut short can
+    be resumed.
+
+    Implementers should override this if their storage platform lets large
+    files be uploaded in pieces. By default, files are uploaded in one go.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState that holds whatever progress a previous
+        attempt at this upload made, and that new progress should be recorded
+        in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    self.upload_file(source, bucket_name, key_name, content_encoding)
+
+
+  def download_file_resumable(self, destination, bucket_name, key_name,
+    transfer_state):
+    """ Downloads a file to the local filesystem from the underlying storage
+    platform, recording its progress so that a download that is cut short can
+    be resumed.
+
+    Large files are downloaded DOWNLOAD_CHUNK_SIZE bytes at a time into a
+    partial file next to the destination, recording how many bytes have been
+    written after each chunk. The partial file replaces the destination once
+    it is complete.
+
+    Args:
+      destination: A str containing the name of the file on the local filesystem
+        that we should download our file to.
+      bucket_name: A str containing the name of the bucket that the file should
+        be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+      transfer_state: A TransferState that holds whatever progress a previous
+        attempt at this download made, and that new progress should be recorded
+        in.
+    Returns:
+      True if the file was downloaded, and False if it doesn't exist.
+    """
+    metadata = self.get_metadata(bucket_name, key_name)
+    if metadata is None:
+      return False
+    if metadata['size'] <= self.DOWNLOAD_CHUNK_SIZE:
+      self.download_file(destination, bucket_name, key_name)
+      return True
+
+    # If the remote file has changed since we started, the bytes we already
+    # have are useless.
+    partial_file = destination + '.magik-partial'
+    if transfer_state.get('etag') != metadata['etag'] or \
+      not os.path.exists(partial_file):
+      transfer_state.clear()
+      transfer_state.set('etag', metadata['etag'])
+      open(partial_file, 'wb').close()
+
+    # Only trust the bytes that actually made it to disk.
+    offset = min(transfer_state.get('offset', 0),
+      os.path.getsize(partial_file))
+    with open(partial_file, 'ab') as file_handle:
+      file_handle.truncate(offset)
+      while offset < metadata['size']:
+        end = min(offset + self.DOWNLOAD_CHUNK_SIZE, metadata['size']) - 1
+        file_handle.write(self.download_range(bucket_name, key_name, offset,
+          end))
+        file_handle.flush()
+        offset = end + 1
+        transfer_state.set('offset', offset)
+
+    os.rename(partial_file, destination)
+    return True
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file to a new key within the underlying storage platform.
+
+    Implementers whose storage platform can copy files itself should override
+    this. By default, the file is streamed from its old key to its new one,
+    with iter_key_chunks and upload_stream, which may stage it in a temporary
+    local file (see upload_stream) unless the platform overrides
+    upload_stream to take the chunks as they come.
+
+    Args:
+      source_bucket_name: A str containing the name of the bucket that the
+        file should be copied from.
+      source_key_name: A str containing the name of the key that the file
+        should be copied from.
+      bucket_name: A str containing the name of the bucket that the file should
+        be copied to.
+      key_name: A str containing the name of the key that the file should be
+        copied to.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding the file is stored
+        with, which the copy must keep, or None if it isn't encoded.
+    """
+    chunk_size = self.get_stream_chunk_size(size)
+    self.upload_stream(self.iter_key_chunks(source_bucket_name,
+      source_key_name, size, chunk_size), bucket_name, key_name, size,
+      content_encoding)
+
+
+  def iter_key_chunks(self, bucket_name, key_name, size, chunk_size, start=0):
+    """ Downloads a file from the underlying storage platform one range at a
+    time, keeping up to STREAM_READ_AHEAD ranges downloaded ahead of the one
+    the caller is working on.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file should
+        be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+      size: An int with the size of the file, in bytes.
+      chunk_size: An int with the number of bytes to download at a time.
+      start: An int with the offset to start downloading from, for callers
+        that already have the start of the file.
+    Yields:
+      A str with each chunk of the file, in order.
+    Raises:
+      Exception: Whatever exception downloading a chunk raised.
+    """
+    chunks = Queue.Queue(self.STREAM_READ_AHEAD)
+    stopped = threading.Event()
+
+    def put(entry):
+      # Give up if the caller stopped reading, rather than blocking forever.
+      while not stopped.is_set():
+        try:
+          chunks.put(entry, True, self.RESULT_POLL_INTERVAL)
+          return True
+        except Queue.Full:
+          continue
+      return False
+
+    def download_chunks():
+      try:
+        for offset in range(start, size, chunk_size):
+          end = min(offset + chunk_size, size) - 1
+          if not put((self.download_range(bucket_name, key_name, offset, end),
+            None)):
+            return
+        put((None, None))
+      except Exception as exception:
+        put((None, exception))
+
+    downloader = threading.Thread(target=download_chunks)
+    downloader.daemon = True
+    downloader.start()
+    try:
+      while True:
+        chunk, exception = chunks.get()
+        if exception is not None:
+          raise exception
+        if chunk is None:
+          return
+        yield chunk
+    finally:
+      stopped.set()
+
+
+  def get_stream_chunk_size(self, size):
+    """ Decides how large the chunks should be when a file is streamed to the
+    underlying storage platform.
+
+    Implementers whose storage platform needs the pieces of an upload to be a
+    particular size should override this. By default, chunks are
+    STREAM_CHUNK_SIZE bytes long.
+
+    Args:
+      size: An int with the size of the file to stream, in bytes.
+    Returns:
+      An int with the number of bytes each chunk should have.
+    """
+    return self.STREAM_CHUNK_SIZE
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Uploads a file to the underlying storage platform from a stream of
+    chunks, rather than from the local filesystem.
+
+    Implementers whose storage platform can take a file in pieces should
+    override this. By default, the chunks are written to a temporary file,
+    which is then uploaded in one go.
+
+    Args:
+      chunks: An iterator of strs, each as long as get_stream_chunk_size says
+        (except for the last one), whose concatenation is the file to upload.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    file_handle, temporary_file = tempfile.mkstemp(prefix='magik-stream-')
+    try:
+      with os.fdopen(file_handle, 'wb') as temporary_handle:
+        for chunk in chunks:
+          temporary_handle.write(chunk)
+      self.upload_file(temporary_file, bucket_name, key_name,
+        content_encoding)
+    finally:
+      os.remove(temporary_file)
+
+
+  def delete_file(self, bucket_name, key_name):
+    """ Deletes a file stored in the underlying storage platform.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file should
+        be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+    """
+    raise NotImplementedError
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes several files stored in the underlying storage platform.
+
+    Implementers whose storage platform can delete many keys in one request
+    should override this (and DELETE_BATCH_SIZE). By default, each key is
+    deleted with its own call to delete_file.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the files
+        should be deleted from.
+      key_names: A list of strs containing the names of the keys to delete.
+    Returns:
+      A dict that maps the name of each key that couldn't be deleted to a str
+        explaining why.
+    Raises:
+      Exception: If deleting a key failed with an error worth retrying, so
+        that the caller's RetryPolicy retries it and its
+        ConcurrencyController sees any throttling. The keys before it may
+        have been deleted already, which is why DELETE_BATCH_SIZE stays at 1
+        for platforms that delete keys this way.
+    """
+    failures = {}
+    for key_name in key_names:
+      try:
+        self.delete_file(bucket_name, key_name)
+      except Exception as exception:
+        if self.is_retryable_error(exception):
+          raise
+        failures[key_name] = self.describe_error(exception)
+    return failures
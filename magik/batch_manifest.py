@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+""" batch_manifest.py provides a single class, BatchManifest, that reads the
+list of files a batch should work on from a file, so that one magik process can
+work through many files. """
+
+
+# General-purpose Python library imports
+import csv
+import json
+
+
+# magik-specific imports
+from magik.custom_exceptions import BadConfigurationException
+
+
+class BatchManifest():
+  """ BatchManifest reads a manifest one line at a time, so that a manifest
+  with millions of files can be streamed into the batch engine.
+
+  Each line of a manifest is either a JSON object with a 'source' and (except
+  for deletes) a 'destination', or a CSV row with the source followed by the
+  destination. The two formats can be mixed, blank lines are ignored, and a
+  first CSV row of 'source,destination' is treated as a header.
+  """
+
+
+  # The names of the fields that each item in a manifest has.
+  FIELDS = ['source', 'destination']
+
+
+  @classmethod
+  def read(cls, file_handle, fields=None):
+    """ Reads the items in a manifest.
+
+    Args:
+      file_handle: A file-like object to read the manifest from.
+      fields: A list of the names of the fields each item must have. Defaults
+        to FIELDS.
+    Yields:
+      A dict for each item in the manifest, with a str for each field.
+    Raises:
+      BadConfigurationException: If a line in the manifest can't be parsed, or
+        is missing a field.
+    """
+    fields = fields or cls.FIELDS
+    for line_number, line in enumerate(file_handle, 1):
+      line = line.strip()
+      if not line:
+        continue
+
+      if line.startswith('{'):
+        try:
+          item = json.loads(line)
+        except ValueError as exception:
+          raise BadConfigurationException('Line {0} of the manifest is not ' \
+            'valid JSON: {1}'.format(line_number, exception))
+      else:
+        row = next(csv.reader([line]))
+        if line_number == 1 and [column.strip().lower() for column in row] == \
+          cls.FIELDS[:len(row)]:
+          continue
+        item = dict(zip(cls.FIELDS, row))
+
+      missing_fields = [field for field in fields if not item.get(field)]
+      if missing_fields:
+        raise BadConfigurationException('Line {0} of the manifest has no ' \
+          '{1}'.format(line_number, ' or '.join(missing_fields)))
+
+      yield dict((field, item[field]) for field in cls.FIELDS if field in item)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" batch_scheduler.py provides a single class, BatchScheduler, that decides
+which order the items in a batch should be started in, so that the batch
+finishes as soon as possible. """
+
+
+class BatchScheduler():
+  """ BatchScheduler orders a batch of transfers by size.
+
+  Large transfers are started longest-first, since a large transfer that is
+  started last keeps the batch running long after everything else is done.
+  The small transfers are spread out between the large ones, so that threads
+  keep finishing small files while the large ones stream, instead of every
+  thread being stuck on a large file at once. Small transfers to the same
+  bucket are kept together, so that they can reuse the same connections.
+  """
+
+
+  # Transfers at least this large (in bytes) are scheduled longest-first.
+  LARGE_OBJECT_SIZE = 8 * 1024 * 1024
+
+
+  @classmethod
+  def order_by_size(cls, sizes, bucket_names):
+    """ Decides the order in which the items in a batch should be started.
+
+    Args:
+      sizes: A list with the size (in bytes) of each item in the batch.
+      bucket_names: A list with the name of the bucket each item in the batch
+        uses.
+    Returns:
+      A list with the index of each item in the batch, in the order they should
+        be started.
+    """
+    indices = range(len(sizes))
+    large = sorted([index for index in indices
+      if sizes[index] >= cls.LARGE_OBJECT_SIZE],
+      key=lambda index: (-sizes[index], index))
+    small = sorted([index for index in indices
+      if sizes[index] < cls.LARGE_OBJECT_SIZE],
+      key=lambda index: (bucket_names[index], index))
+    if not large:
+      return small
+
+    order = []
+    small_per_large = len(small) / float(len(large))
+    num_small_taken = 0
+    for position, index in enumerate(large):
+      order.append(index)
+      next_num_small_taken = int(round((position + 1) * small_per_large))
+      order.extend(small[num_small_taken:next_num_small_taken])
+      num_small_taken = next_num_small_taken
+    order.extend(small[num_small_taken:])
+    return order
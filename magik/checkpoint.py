@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+""" checkpoint.py defines two classes, Checkpoint and TransferState, that record
+the progress of a batch of transfers on the local filesystem, so that a batch
+that dies halfway can pick up where it left off when it is run again. """
+
+
+# General-purpose Python library imports
+import glob
+import hashlib
+import json
+import os
+import threading
+
+
+class Checkpoint():
+  """ Checkpoint keeps a journal of the progress of one batch of transfers.
+
+  The journal is a file with one JSON object per line, each recording that an
+  item in the batch finished, or that some piece of state for an item's
+  transfer (e.g., the ID of a multipart upload) changed. Appending a line is
+  cheap no matter how large the batch is, and a line that was only partially
+  written when magik died is simply ignored when the journal is read back.
+  """
+
+
+  # The directory on the local filesystem where checkpoints are kept by
+  # default.
+  DEFAULT_DIRECTORY = os.path.expanduser('~/.magik/checkpoints')
+
+
+  def __init__(self, location):
+    """ Opens the checkpoint stored at the given location, creating it if it
+    doesn't exist yet.
+
+    Args:
+      location: A str naming the journal file for this checkpoint.
+    """
+    self.location = location
+    self.lock = threading.Lock()
+    self.completed_items = set()
+    self.transfers = {}
+
+    if os.path.exists(location):
+      with open(location, 'r') as file_handle:
+        for line in file_handle:
+          try:
+            self.apply(json.loads(line))
+          except ValueError:
+            continue
+    else:
+      checkpoint_dir = os.path.dirname(location)
+      if checkpoint_dir and not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    self.file_handle = open(location, 'a')
+
+
+  @classmethod
+  def for_job(cls, directive, backend_id, items, directory=None):
+    """ Opens the checkpoint for a batch of transfers, which is named after
+    the batch's contents so that running the same batch again finds it.
+
+    Args:
+      directive: A str naming the batch operation (e.g., 'upload_files').
+      backend_id: A str identifying the storage platform and account.
+      items: A list of dicts, each with the 'source' and 'destination' of one
+        item in the batch.
+      directory: A str naming the directory that checkpoints are kept in.
+        Defaults to DEFAULT_DIRECTORY.
+    Returns:
+      A Checkpoint.
+    """
+    job = hashlib.sha1()
+    job.update(json.dumps([directive, backend_id]))
+    for item in items:
+      job.update(json.dumps([item['source'], item['destination']]))
+
+    directory = directory or cls.DEFAULT_DIRECTORY
+    return cls(os.path.join(directory, job.hexdigest() + '.journal'))
+
+
+  def apply(self, entry):
+    """ Updates our in-memory view of the batch with one journal entry.
+
+    Args:
+      entry: A dict that was read from (or is about to be written to) the
+        journal.
+    """
+    index = entry['item']
+    if entry.get('done'):
+      self.completed_items.add(index)
+    elif entry.get('clear'):
+      self.transfers.pop(index, None)
+    elif 'set' in entry:
+      self.transfers.setdefault(index, {})[entry['set']] = entry['value']
+    elif 'add' in entry:
+      self.transfers.setdefault(index, {}).setdefault(entry['add'],
+        []).append(entry['value'])
+
+
+  def record(self, entry):
+    """ Appends an entry to the journal, and applies it to our in-memory view
+    of the batch.
+
+    Args:
+      entry: A dict that can be serialized as JSON.
+    """
+    with self.lock:
+      self.apply(entry)
+      self.file_handle.write(json.dumps(entry) + '\n')
+      self.file_handle.flush()
+
+
+  def is_item_done(self, index):
+    """ Checks if an item in the batch already finished successfully.
+
+    Args:
+      index: An int with the position of the item in the batch.
+    Returns:
+      True if the item finished, and False otherwise.
+    """
+    with self.lock:
+      return index in self.completed_items
+
+
+  def mark_item_done(self, index):
+    """ Records that an item in the batch finished successfully.
+
+    Args:
+      index: An int with the position of the item in the batch.
+    """
+    self.record({'item' : index, 'done' : True})
+
+
+  def get_transfer_state(self, index):
+    """ Returns the object that *Storage classes use to record the progress of
+    a single item's transfer.
+
+    Args:
+      index: An int with the position of the item in the batch.
+    Returns:
+      A TransferState.
+    """
+    return TransferState(self, index)
+
+
+  def close(self):
+    """ Closes the journal, once the batch is done with it, whether or not
+    every item finished. """
+    with self.lock:
+      self.file_handle.close()
+
+
+  def remove(self):
+    """ Deletes the checkpoint and any tracker files that belong to it, once
+    the batch has finished. """
+    with self.lock:
+      self.file_handle.close()
+      for path in [self.location] + glob.glob(self.location + '.*'):
+        os.remove(path)
+
+
+class TransferState():
+  """ TransferState gives a *Storage class a place to remember how far it got
+  while transferring a single file, such as the ID of a multipart upload and
+  the parts that were uploaded, or the number of bytes downloaded so far. """
+
+
+  def __init__(self, checkpoint, index):
+    """ Creates a new TransferState.
+
+    Args:
+      checkpoint: The Checkpoint for the batch that this transfer is part of.
+      index: An int with the position of the item in the batch.
+    """
+    self.checkpoint = checkpoint
+    self.index = index
+
+
+  def get(self, name, default=None):
+    """ Looks up a piece of state for this transfer.
+
+    Args:
+      name: A str naming the piece of state.
+      default: The value to return if the state was never set.
+    Returns:
+      The last value set (or the list of values added) for name, or default.
+    """
+    with self.checkpoint.lock:
+      return self.checkpoint.transfers.get(self.index, {}).get(name, default)
+
+
+  def set(self, name, value):
+    """ Records a piece of state for this transfer.
+
+    Args:
+      name: A str naming the piece of state.
+      value: A value that can be serialized as JSON.
+    """
+    self.checkpoint.record({'item' : self.index, 'set' : name,
+      'value' : value})
+
+
+  def add(self, name, value):
+    """ Adds a value to a list of values for this transfer (e.g., the number of
+    a part that was just uploaded).
+
+    Args:
+      name: A str naming the list.
+      value: A value that can be serialized as JSON.
+    """
+    self.checkpoint.record({'item' : self.index, 'add' : name,
+      'value' : value})
+
+
+  def clear(self):
+    """ Forgets all state for this transfer (including its tracker files), so
+    that it starts over. """
+    self.checkpoint.record({'item' : self.index, 'clear' : True})
+    for path in glob.glob(self.get_tracker_file('*')):
+      os.remove(path)
+
+
+  def get_tracker_file(self, name):
+    """ Returns the name of a file that a third-party library can use to keep
+    its own progress for this transfer. The file is removed along with the
+    checkpoint.
+
+    Args:
+      name: A str that distinguishes this tracker file from any others for the
+        same transfer.
+    Returns:
+      A str naming the tracker file.
+    """
+    return '{0}.{1}.{2}'.format(self.checkpoint.location, self.index, name)
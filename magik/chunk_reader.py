@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+""" chunk_reader.py provides a single class, ChunkReader, that lets code that
+reads from files read from a stream of chunks instead. """
+
+
+class ChunkReader():
+  """ ChunkReader wraps an iterator of strs in a read-only, non-seekable
+  file-like object, so that data being streamed from one storage platform can
+  be handed to libraries that upload from files, without staging it on disk.
+
+  Only one chunk (plus whatever part of the next one a read needs) is held in
+  memory at a time.
+  """
+
+
+  def __init__(self, chunks):
+    """ Creates a new ChunkReader.
+
+    Args:
+      chunks: An iterator of strs, whose concatenation is the data to read.
+    """
+    self.chunks = iter(chunks)
+    self.chunk = ''
+    self.offset = 0
+
+
+  def read(self, size=-1):
+    """ Reads data from the stream.
+
+    Args:
+      size: An int with the most bytes to read, or a negative number to read
+        everything that is left.
+    Returns:
+      A str with the data that was read, which is only empty once the stream
+        has been read in full.
+    """
+    pieces = []
+    num_bytes = 0
+    while size < 0 or num_bytes < size:
+      if self.offset >= len(self.chunk):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+          break
+        self.chunk = chunk
+        self.offset = 0
+        continue
+
+      # Slice out only what this read needs, rather than copying what's left
+      # of the chunk on every read.
+      if size < 0:
+        end = len(self.chunk)
+      else:
+        end = self.offset + size - num_bytes
+      piece = self.chunk[self.offset:end]
+      self.offset += len(piece)
+      num_bytes += len(piece)
+      pieces.append(piece)
+    return ''.join(pieces)
+
+
+  def tell(self):
+    """ Refuses to report a position in the stream, since it can't be seeked
+    back to, so that callers don't try to rewind it to retry a request.
+
+    Raises:
+      IOError: Always.
+    """
+    raise IOError('ChunkReader streams are not seekable')
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+""" compression_codec.py provides a single class, CompressionCodec, that
+compresses files on their way to cloud storage and decompresses them on their
+way back. """
+
+
+# General-purpose Python library imports
+import hashlib
+import mimetypes
+import zlib
+
+
+# Third-party library imports
+try:
+  import zstandard
+except ImportError:
+  # zstd is optional, so only gzip is available without it.
+  zstandard = None
+
+
+# Magik library imports
+from magik.custom_exceptions import BadConfigurationException
+
+
+class CompressionCodec():
+  """ CompressionCodec stream-compresses and decompresses data with gzip or
+  zstd, a chunk at a time, so that files of any size can be compressed
+  without holding them in memory.
+
+  Files are stored compressed with their Content-Encoding set to the codec
+  that compressed them, which is how downloads (and HTTP clients) know to
+  decompress them. Files whose type says they are already compressed (e.g.,
+  images or zip files) are left alone, since compressing them again would
+  cost time without saving any space.
+  """
+
+
+  # The encodings that files can be compressed with, named as they are in
+  # Content-Encoding headers.
+  ENCODINGS = ('gzip', 'zstd')
+
+
+  # The number of bytes read from a file at a time when compressing or
+  # decompressing it.
+  CHUNK_SIZE = 1024 * 1024
+
+
+  # The content types (besides audio/*, image/* and video/*) that are already
+  # compressed.
+  COMPRESSED_TYPES = ('application/gzip', 'application/pdf',
+    'application/x-7z-compressed', 'application/x-bzip2', 'application/x-gzip',
+    'application/x-rar-compressed', 'application/x-xz', 'application/zip',
+    'application/zstd', 'font/woff', 'font/woff2')
+
+
+  # The media types whose content types are all already compressed, except
+  # for the few listed in UNCOMPRESSED_TYPES.
+  COMPRESSED_MEDIA = ('audio/', 'image/', 'video/')
+
+
+  # The content types under COMPRESSED_MEDIA that still compress well.
+  UNCOMPRESSED_TYPES = ('image/bmp', 'image/svg+xml', 'image/x-ms-bmp')
+
+
+  @classmethod
+  def check_encoding(cls, encoding):
+    """ Makes sure that files can be compressed with the given encoding.
+
+    Args:
+      encoding: A str with the name of the encoding.
+    Raises:
+      BadConfigurationException: If the encoding isn't one of ENCODINGS, or
+        needs a library that isn't installed.
+    """
+    if encoding not in cls.ENCODINGS:
+      raise BadConfigurationException('{0} is not a supported compression ' \
+        'encoding'.format(encoding))
+    if encoding == 'zstd' and zstandard is None:
+      raise BadConfigurationException('zstd compression needs the zstandard ' \
+        'library to be installed')
+
+
+  @classmethod
+  def should_compress(cls, path):
+    """ Decides if a file is worth compressing, from the content type that its
+    name implies.
+
+    Args:
+      path: A str with the name of the file (or of the key it is stored in).
+    Returns:
+      False if the file looks like it is already compressed, and True
+        otherwise.
+    """
+    content_type, encoding = mimetypes.guess_type(path)
+    if encoding is not None:
+      return False
+    if content_type is None or content_type in cls.UNCOMPRESSED_TYPES:
+      return True
+    if content_type in cls.COMPRESSED_TYPES:
+      return False
+    return not content_type.startswith(cls.COMPRESSED_MEDIA)
+
+
+  @classmethod
+  def compress_chunks(cls, chunks, encoding):
+    """ Compresses a stream of data.
+
+    Args:
+      chunks: An iterable of strs, whose concatenation is the data to compress.
+      encoding: A str with the encoding to compress with, from ENCODINGS.
+    Yields:
+      Strs whose concatenation is the compressed data.
+    """
+    cls.check_encoding(encoding)
+    if encoding == 'zstd':
+      compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+      # A gzip header with no name or modification time in it, so that the
+      # same data always compresses to the same bytes (and MD5).
+      compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+      data = compressor.compress(chunk)
+      if data:
+        yield data
+    yield compressor.flush()
+
+
+  @classmethod
+  def decompress_chunks(cls, chunks, encoding):
+    """ Decompresses a stream of data.
+
+    Args:
+      chunks: An iterable of strs, whose concatenation is the data to
+        decompress.
+      encoding: A str with the encoding the data was compressed with, from
+        ENCODINGS.
+    Yields:
+      Strs whose concatenation is the decompressed data.
+    """
+    cls.check_encoding(encoding)
+    if encoding == 'zstd':
+      decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+      decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+      data = decompressor.decompress(chunk)
+      if data:
+        yield data
+    if encoding == 'gzip':
+      yield decompressor.flush()
+
+
+  @classmethod
+  def compress_file(cls, source, destination, encoding):
+    """ Compresses a file on the local filesystem.
+
+    Args:
+      source: A str with the name of the file to compress.
+      destination: A str with the name of the file to write the compressed
+        data to.
+      encoding: A str with the encoding to compress with, from ENCODINGS.
+    """
+    with open(source, 'rb') as source_handle:
+      with open(destination, 'wb') as destination_handle:
+        for data in cls.compress_chunks(cls.read_chunks(source_handle),
+          encoding):
+          destination_handle.write(data)
+
+
+  @classmethod
+  def decompress_file(cls, source, destination, encoding):
+    """ Decompresses a file on the local filesystem.
+
+    Args:
+      source: A str with the name of the compressed file.
+      destination: A str with the name of the file to write the decompressed
+        data to.
+      encoding: A str with the encoding the file was compressed with, from
+        ENCODINGS.
+    """
+    with open(source, 'rb') as source_handle:
+      with open(destination, 'wb') as destination_handle:
+        for data in cls.decompress_chunks(cls.read_chunks(source_handle),
+          encoding):
+          destination_handle.write(data)
+
+
+  @classmethod
+  def compute_md5(cls, path, encoding):
+    """ Finds the MD5 that a file would have once compressed, without writing
+    the compressed file anywhere.
+
+    Args:
+      path: A str with the name of the file.
+      encoding: A str with the encoding to compress with, from ENCODINGS.
+    Returns:
+      A str with the hex-encoded MD5 of the compressed file.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file_handle:
+      for data in cls.compress_chunks(cls.read_chunks(file_handle), encoding):
+        md5.update(data)
+    return md5.hexdigest()
+
+
+  @classmethod
+  def read_chunks(cls, file_handle):
+    """ Reads a file CHUNK_SIZE bytes at a time.
+
+    Args:
+      file_handle: The file to read.
+    Yields:
+      A str with each chunk of the file.
+    """
+    for chunk in iter(lambda: file_handle.read(cls.CHUNK_SIZE), ''):
+      yield chunk
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+""" concurrency_controller.py provides a single class, ConcurrencyController,
+that adapts how many operations magik runs at once against a bucket to what
+the storage platform can handle. """
+
+
+# General-purpose Python library imports
+import threading
+import time
+
+
+# Magik library imports
+from magik.instrumentation import Instrumentation
+
+
+class ConcurrencyController():
+  """ ConcurrencyController limits how many operations can be in flight at
+  once, and adjusts that limit with additive-increase/multiplicative-decrease
+  (AIMD), the way TCP adjusts its congestion window.
+
+  Operations are measured in windows, each roughly as many operations as the
+  current limit. At the end of a window, the limit grows by one if throughput
+  didn't drop and latency stayed close to the lowest latency seen so far. Each
+  throttling error halves the limit right away, but only once per window, since
+  a burst of throttling errors usually comes from the same overload.
+
+  Controllers are kept per storage backend and bucket (see for_bucket), so
+  that every batch against the same bucket shares what was learned about it.
+  """
+
+
+  # The limit that a new controller starts with.
+  INITIAL_LIMIT = 4
+
+
+  # The limit never goes below this...
+  MIN_LIMIT = 1
+
+
+  # ...or above this.
+  MAX_LIMIT = 64
+
+
+  # How much the limit is multiplied by when we get throttled.
+  DECREASE_FACTOR = 0.5
+
+
+  # How much the average latency of a window can exceed the lowest one seen
+  # before we stop growing the limit.
+  LATENCY_TOLERANCE = 2.0
+
+
+  # How much throughput can drop from one window to the next before we stop
+  # growing the limit.
+  THROUGHPUT_TOLERANCE = 0.95
+
+
+  # The controllers for each (backend, bucket) pair.
+  controllers = {}
+
+
+  # A lock that protects the dict of controllers.
+  controllers_lock = threading.Lock()
+
+
+  def __init__(self, backend_id=None, bucket_name=None, initial_limit=None,
+    min_limit=None, max_limit=None):
+    """ Creates a new ConcurrencyController.
+
+    Args:
+      backend_id: A str identifying the storage backend and account, which is
+        only used when reporting events.
+      bucket_name: A str naming the bucket, which is only used when reporting
+        events.
+      initial_limit: An int with the number of operations allowed in flight to
+        start with. Defaults to INITIAL_LIMIT.
+      min_limit: An int with the lowest the limit can go. Defaults to
+        MIN_LIMIT.
+      max_limit: An int with the highest the limit can go. Defaults to
+        MAX_LIMIT.
+    """
+    self.backend_id = backend_id
+    self.bucket_name = bucket_name
+    self.min_limit = min_limit or self.MIN_LIMIT
+    self.max_limit = max_limit or self.MAX_LIMIT
+    self.limit = float(min(self.max_limit, max(self.min_limit,
+      initial_limit or self.INITIAL_LIMIT)))
+    self.in_flight = 0
+    self.condition = threading.Condition()
+
+    # Measurements for the current window.
+    self.window_start = time.time()
+    self.window_operations = 0
+    self.window_latency = 0.0
+    self.window_throttled = False
+
+    # What we learned from earlier windows.
+    self.last_throughput = None
+    self.min_latency = None
+    self.throughput = 0.0
+
+
+  @classmethod
+  def for_bucket(cls, backend_id, bucket_name):
+    """ Returns the controller for a bucket, creating it if needed.
+
+    Args:
+      backend_id: A str identifying the storage backend and account.
+      bucket_name: A str naming the bucket.
+    Returns:
+      A ConcurrencyController.
+    """
+    with cls.controllers_lock:
+      key = (backend_id, bucket_name)
+      if key not in cls.controllers:
+        cls.controllers[key] = cls(backend_id, bucket_name)
+      return cls.controllers[key]
+
+
+  def run(self, function, is_throttling_error):
+    """ Calls a function once there is room for another operation in flight,
+    and learns from how long it took and whether it was throttled.
+
+    Args:
+      function: A function that takes no arguments.
+      is_throttling_error: A function that takes an Exception and returns True
+        if it means the storage platform is throttling us.
+    Returns:
+      Whatever the function returns.
+    Raises:
+      Exception: Whatever the function raises.
+    """
+    self.acquire()
+    start = time.time()
+    try:
+      result = function()
+    except Exception as exception:
+      self.release(time.time() - start, is_throttling_error(exception))
+      raise
+    self.release(time.time() - start, False)
+    return result
+
+
+  def acquire(self):
+    """ Waits until there is room for another operation in flight, and
+    reserves it. """
+    with self.condition:
+      while self.in_flight >= int(self.limit):
+        self.condition.wait()
+      self.in_flight += 1
+
+
+  def release(self, latency, throttled):
+    """ Records that an operation finished, and adjusts the limit.
+
+    Args:
+      latency: A float with the number of seconds the operation took.
+      throttled: A bool that indicates if the storage platform throttled the
+        operation.
+    """
+    with self.condition:
+      self.in_flight -= 1
+      if throttled:
+        self.record_throttle()
+      else:
+        self.window_operations += 1
+        self.window_latency += latency
+
+      if self.window_operations >= int(self.limit):
+        self.end_window()
+      self.condition.notify_all()
+
+
+  def record_throttle(self):
+    """ Shrinks the limit after a throttling error, unless we already did so
+    during this window. Callers must hold the condition. """
+    if self.window_throttled:
+      return
+    self.window_throttled = True
+    self.limit = max(self.min_limit, self.limit * self.DECREASE_FACTOR)
+    self.report()
+
+
+  def end_window(self):
+    """ Grows the limit if the window that just ended went well, and starts a
+    new window. Callers must hold the condition. """
+    now = time.time()
+    elapsed = max(now - self.window_start, 1e-6)
+    throughput = self.window_operations / elapsed
+    latency = self.window_latency / self.window_operations
+
+    if self.min_latency is None or latency < self.min_latency:
+      self.min_latency = latency
+
+    latency_stable = latency <= self.min_latency * self.LATENCY_TOLERANCE
+    throughput_rising = self.last_throughput is None or \
+      throughput >= self.last_throughput * self.THROUGHPUT_TOLERANCE
+    if not self.window_throttled and latency_stable and throughput_rising:
+      self.limit = min(self.max_limit, self.limit + 1)
+
+    self.throughput = throughput
+    self.last_throughput = throughput
+    self.window_start = now
+    self.window_operations = 0
+    self.window_latency = 0.0
+    self.window_throttled = False
+    self.report()
+
+
+  def report(self):
+    """ Tells the instrumentation hooks about our current state. Callers must
+    hold the condition. """
+    Instrumentation.emit('concurrency', {
+      'backend' : self.backend_id,
+      'bucket' : self.bucket_name,
+      'limit' : int(self.limit),
+      'in_flight' : self.in_flight,
+      'throughput' : self.throughput
+    })
@@ -6,9 +6,12 @@ interact with Google Cloud Storage (GCS). """
 
 # Third-party libraries
 import boto.gs.connection
+import boto.gs.resumable_upload_handler
 
 
 # GCStorage-specific imports
+from magik.base_storage import BaseStorage
+from magik.chunk_reader import ChunkReader
 from magik.s3_storage import S3Storage
 from magik.custom_exceptions import BadConfigurationException
 
@@ -17,16 +20,21 @@ class GCStorage(S3Storage):
   """ GCStorage provides callers with an interface to Google Cloud Storage. """
 
 
+  # Google Cloud Storage doesn't support S3's multi-object delete, so we
+  # delete keys one at a time (in parallel) instead.
+  DELETE_BATCH_SIZE = 1
+
+
   def __init__(self, parameters):
     """ Creates a new GCStorage object, with the GCS_ACCESS_KEY and
     GCS_SECRET_KEY that the user has specified.
 
     Args:
       parameters: A dict that contains the credentials necessary to authenticate
-        with GCS.
+        with GCS, and optionally a 'timeout' (see BaseStorage.get_timeout).
     Raises:
       BadConfigurationException: If GCS_ACCESS_KEY or GCS_SECRET_KEY is not
-        specified.
+        specified, or the timeout isn't a positive number.
     """
     if 'GCS_ACCESS_KEY' not in parameters:
       raise BadConfigurationException("GCS_ACCESS_KEY needs to be specified")
@@ -36,6 +44,7 @@ class GCStorage(S3Storage):
 
     self.gcs_access_key = parameters['GCS_ACCESS_KEY']
     self.gcs_secret_key = parameters['GCS_SECRET_KEY']
+    self.timeout = self.get_timeout(parameters)
     self.connection = self.create_gcs_connection()
     # TODO(cgb): Consider validating the user's credentials here, and throw
     # a BadConfigurationException if they aren't valid.
@@ -46,7 +55,101 @@ class GCStorage(S3Storage):
 
     Returns:
       A boto.gs.connection.GSConnection, which represents a connection to Google
-        Cloud Storage.
+        Cloud Storage, whose HTTP connections time out after self.timeout
+        seconds.
     """
-    return boto.gs.connection.GSConnection(gs_access_key_id=self.gcs_access_key,
+    connection = boto.gs.connection.GSConnection(
+      gs_access_key_id=self.gcs_access_key,
       gs_secret_access_key=self.gcs_secret_key)
+    connection.http_connection_kwargs['timeout'] = self.timeout
+    return connection
+
+
+  def get_backend_id(self):
+    """ Identifies the Google Cloud Storage account that this object talks to.
+
+    Returns:
+      A str that identifies the storage platform and account.
+    """
+    return 'gcs:{0}'.format(self.gcs_access_key)
+
+
+  def get_credentials_id(self):
+    """ Identifies the Google Cloud Storage account and secret key that this
+    object uses, as BaseStorage.get_credentials_id describes. """
+    return self.hash_credentials(self.gcs_secret_key)
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file from the local filesystem to Google Cloud Storage via a
+    GCS resumable upload, which boto keeps track of in a tracker file.
+
+    GCS doesn't support S3-style multipart uploads through boto, so we can't
+    use the S3Storage implementation of this method.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded to Google Cloud Storage.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState that holds whatever progress a previous
+        attempt at this upload made, and that new progress should be recorded
+        in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
+    """
+    bucket = self.connection.lookup(bucket_name)
+    key = bucket.new_key(key_name)
+    upload_handler = boto.gs.resumable_upload_handler.ResumableUploadHandler(
+      tracker_file_name=transfer_state.get_tracker_file('upload'))
+    key.set_contents_from_filename(source, res_upload_handler=upload_handler,
+      **self.get_upload_args(content_encoding))
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file to a new key within Google Cloud Storage, via a single
+    PUT-Copy request, which keeps the file's headers.
+
+    GCS copies files of any size in one request, and doesn't support S3-style
+    multipart copies, so we never copy in parts like S3Storage does.
+
+    Args:
+      source_bucket_name: A str containing the name of the bucket that the
+        file should be copied from.
+      source_key_name: A str containing the name of the key that the file
+        should be copied from.
+      bucket_name: A str containing the name of the bucket that the file should
+        be copied to.
+      key_name: A str containing the name of the key that the file should be
+        copied to.
+      size: An int with the size of the file, in bytes, which is unused.
+      content_encoding: A str with the Content-Encoding the file is stored
+        with, which is unused.
+    """
+    bucket = self.connection.get_bucket(bucket_name, validate=False)
+    bucket.copy_key(key_name, source_bucket_name, source_key_name)
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Uploads a file to Google Cloud Storage from a stream of chunks, in a
+    single request that uses chunked transfer encoding.
+
+    Args:
+      chunks: An iterator of strs whose concatenation is the file to upload.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      size: An int with the size of the file, in bytes, which is unused.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    bucket = self.connection.get_bucket(bucket_name, validate=False)
+    key = bucket.new_key(key_name)
+    key.set_contents_from_stream(ChunkReader(chunks),
+      **self.get_upload_args(content_encoding))
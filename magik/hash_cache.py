@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+""" hash_cache.py provides a single class, HashCache, that remembers the MD5s of
+local files, so that magik doesn't have to re-read files that haven't changed
+to find out if they need to be uploaded again. """
+
+
+# General-purpose Python library imports
+import os
+import sqlite3
+import threading
+
+
+class HashCache():
+  """ HashCache stores the MD5 of each file it is told about in a SQLite
+  database, keyed by the file's path, size and modification time. A file whose
+  size or modification time has changed is treated as a cache miss. """
+
+
+  # The location on the local filesystem where the cache is kept by default.
+  DEFAULT_LOCATION = os.path.expanduser('~/.magik/hash_cache.db')
+
+
+  def __init__(self, location=None):
+    """ Opens (and creates, if needed) the hash cache.
+
+    Args:
+      location: A str naming the file that the cache should be stored in.
+        Defaults to DEFAULT_LOCATION. The special name ':memory:' keeps the
+        cache in memory only.
+    """
+    self.location = location or self.DEFAULT_LOCATION
+    if self.location != ':memory:':
+      cache_dir = os.path.dirname(self.location)
+      if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # The cache is shared by the threads that upload files in parallel, so
+    # serialize access to the connection ourselves.
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(self.location, check_same_thread=False)
+    self.connection.execute('CREATE TABLE IF NOT EXISTS hashes (' +
+      'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, md5 TEXT)')
+
+
+  def get(self, path, size, mtime):
+    """ Looks up the MD5 of a file.
+
+    Args:
+      path: A str naming the file on the local filesystem.
+      size: An int with the current size of the file, in bytes.
+      mtime: A float with the current modification time of the file.
+    Returns:
+      A str with the hex-encoded MD5 of the file, or None if the file isn't in
+        the cache or has changed since it was hashed.
+    """
+    with self.lock:
+      row = self.connection.execute('SELECT size, mtime, md5 FROM hashes ' +
+        'WHERE path = ?', (path,)).fetchone()
+
+    if row and row[0] == size and row[1] == mtime:
+      return str(row[2])
+    return None
+
+
+  def put(self, path, size, mtime, md5):
+    """ Remembers the MD5 of a file.
+
+    Args:
+      path: A str naming the file on the local filesystem.
+      size: An int with the size of the file when it was hashed, in bytes.
+      mtime: A float with the modification time of the file when it was hashed.
+      md5: A str with the hex-encoded MD5 of the file.
+    """
+    with self.lock:
+      self.connection.execute('INSERT OR REPLACE INTO hashes ' +
+        '(path, size, mtime, md5) VALUES (?, ?, ?, ?)',
+        (path, size, mtime, md5))
+
+
+  def flush(self):
+    """ Writes any entries added since the last flush to disk. """
+    with self.lock:
+      self.connection.commit()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+""" hash_ring.py provides a single class, HashRing, that assigns keys to nodes
+by consistent hashing. """
+
+
+# General-purpose Python library imports
+import bisect
+import hashlib
+
+
+class HashRing():
+  """ HashRing places each node at many points (virtual nodes) on a ring of
+  hash values, and assigns each key to the first node at or after the key's
+  own hash.
+
+  Adding a node only moves the keys that land on its points, which is about
+  1/N of them, instead of reshuffling almost every key the way taking the
+  hash modulo the number of nodes would.
+  """
+
+
+  # The number of points each node is placed at on the ring. More points
+  # spread keys more evenly between nodes.
+  VIRTUAL_NODES = 100
+
+
+  def __init__(self, nodes, virtual_nodes=None):
+    """ Creates a new HashRing.
+
+    Args:
+      nodes: A list of strs naming each node. Names should stay the same when
+        nodes are added or removed, since they decide where each node sits.
+      virtual_nodes: The number of points each node is placed at. Defaults to
+        VIRTUAL_NODES.
+    """
+    virtual_nodes = virtual_nodes or self.VIRTUAL_NODES
+    self.nodes = list(nodes)
+    # Use % rather than str.format, which can't take unicode node names.
+    self.points = sorted((self.hash('%s#%d' % (node, index)), node)
+      for node in self.nodes for index in range(virtual_nodes))
+    self.hashes = [point for point, _ in self.points]
+
+
+  @classmethod
+  def hash(cls, value):
+    """ Hashes a str to a position on the ring.
+
+    Args:
+      value: The str to hash. unicode strs are hashed as UTF-8, so that a
+        name hashes the same whichever way it's given.
+    Returns:
+      An int with the position, which has 64 bits.
+    """
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+
+  def get_node(self, key):
+    """ Finds the node that a key belongs to.
+
+    Args:
+      key: A str naming the key.
+    Returns:
+      A str naming the node.
+    """
+    return self.get_nodes(key, 1)[0]
+
+
+  def get_nodes(self, key, count=None):
+    """ Finds the nodes that a key belongs to, in the order they come after the
+    key on the ring. The first is the key's owner, and the rest are where it
+    would go if the nodes before them were removed.
+
+    Args:
+      key: A str naming the key.
+      count: The most nodes to return. Defaults to all of them.
+    Returns:
+      A list of distinct strs naming nodes.
+    """
+    if count is None:
+      count = len(self.nodes)
+    nodes = []
+    start = bisect.bisect_left(self.hashes, self.hash(key))
+    for offset in range(len(self.points)):
+      node = self.points[(start + offset) % len(self.points)][1]
+      if node not in nodes:
+        nodes.append(node)
+        if len(nodes) >= count:
+          break
+    return nodes
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+""" hedged_storage.py provides a single class, HedgedStorage, that sends
+duplicates of slow reads to another *Storage object, so that one slow request
+doesn't hold up the batch it's in. """
+
+
+# Magik library imports
+from magik.custom_exceptions import BadConfigurationException
+from magik.hedger import Hedger
+from magik.wrapping_storage import WrappingStorage
+
+
+class HedgedStorage(WrappingStorage):
+  """ HedgedStorage wraps another *Storage object, and runs its idempotent
+  reads (looking up, checking for and downloading files) through a Hedger:
+  a read that takes longer than 95% of recent reads of the same kind is sent
+  again, up to num_duplicates more times, and whichever copy answers first
+  wins. Storage platforms spread requests across many servers, so a
+  duplicate usually lands on a faster one, which cuts the slowest reads of a
+  large batch down to close to the typical one.
+
+  Everything else (writes, deletes and listings) goes straight to the wrapped
+  *Storage object, since sending it twice either isn't safe or doesn't help.
+  """
+
+
+  # The number of duplicates of a slow read we send, unless the caller asks
+  # for another number.
+  DEFAULT_NUM_DUPLICATES = 1
+
+
+  def __init__(self, storage, num_duplicates=None):
+    """ Creates a new HedgedStorage.
+
+    Args:
+      storage: The *Storage object that reads are sent to.
+      num_duplicates: An int (or a str holding one) with the most duplicates
+        of a slow read to send. Defaults to DEFAULT_NUM_DUPLICATES.
+    Raises:
+      BadConfigurationException: If the number of duplicates isn't a positive
+        int.
+    """
+    WrappingStorage.__init__(self, [storage])
+    self.storage = storage
+    if num_duplicates is None or num_duplicates == '':
+      num_duplicates = self.DEFAULT_NUM_DUPLICATES
+    try:
+      self.num_duplicates = int(num_duplicates)
+    except ValueError:
+      self.num_duplicates = 0
+    if self.num_duplicates < 1:
+      raise BadConfigurationException('The number of duplicate reads must ' \
+        'be a positive integer, not {0}'.format(num_duplicates))
+
+
+  def get_hedger(self, operation):
+    """ Returns the Hedger that learns how long one kind of read usually takes
+    against the wrapped *Storage object.
+
+    Args:
+      operation: A str naming the read (e.g., 'get_metadata').
+    Returns:
+      A Hedger.
+    """
+    return Hedger.for_operation(self.storage.get_backend_id(), operation)
+
+
+  def get_backend_id(self):
+    """ Identifies the wrapped *Storage object's platform and account, since
+    hedging doesn't change what is stored where. """
+    return self.storage.get_backend_id()
+
+
+  def does_bucket_exist(self, bucket_name):
+    """ Asks the wrapped *Storage object if a bucket exists. """
+    return self.storage.does_bucket_exist(bucket_name)
+
+
+  def create_bucket(self, bucket_name):
+    """ Asks the wrapped *Storage object to create a bucket. """
+    self.storage.create_bucket(bucket_name)
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists keys with the wrapped *Storage object, as BaseStorage.list_keys
+    describes. """
+    return self.storage.list_keys(bucket_name, prefix)
+
+
+  def does_key_exist(self, bucket_name, key_name):
+    """ Checks if a file exists, hedging slow checks, as
+    BaseStorage.does_key_exist describes. """
+    return self.get_hedger('does_key_exist').call([lambda:
+      self.storage.does_key_exist(bucket_name, key_name)] *
+      (self.num_duplicates + 1))
+
+
+  def get_metadata(self, bucket_name, key_name):
+    """ Looks up a file, hedging slow lookups, as BaseStorage.get_metadata
+    describes. """
+    return self.get_hedger('get_metadata').call([lambda:
+      self.storage.get_metadata(bucket_name, key_name)] *
+      (self.num_duplicates + 1))
+
+
+  def download_file(self, destination, bucket_name, key_name):
+    """ Downloads a file, hedging slow downloads, as BaseStorage.download_file
+    and Hedger.download describe. """
+    self.get_hedger('download_file').download(destination, [lambda path:
+      self.storage.download_file(path, bucket_name, key_name)] *
+      (self.num_duplicates + 1))
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Downloads part of a file, hedging slow downloads, as
+    BaseStorage.download_range describes. """
+    return self.get_hedger('download_range').call([lambda:
+      self.storage.download_range(bucket_name, key_name, start, end)] *
+      (self.num_duplicates + 1))
+
+
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
+    """ Uploads a file with the wrapped *Storage object, as
+    BaseStorage.upload_file describes. """
+    self.storage.upload_file(source, bucket_name, key_name, content_encoding)
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file with the wrapped *Storage object, as
+    BaseStorage.upload_file_resumable describes. """
+    self.storage.upload_file_resumable(source, bucket_name, key_name,
+      transfer_state, content_encoding)
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file with the wrapped *Storage object, as BaseStorage.copy_key
+    describes. """
+    self.storage.copy_key(source_bucket_name, source_key_name, bucket_name,
+      key_name, size, content_encoding)
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Streams a file with the wrapped *Storage object, as
+    BaseStorage.upload_stream describes. """
+    self.storage.upload_stream(chunks, bucket_name, key_name, size,
+      content_encoding)
+
+
+  def delete_file(self, bucket_name, key_name):
+    """ Deletes a file with the wrapped *Storage object, as
+    BaseStorage.delete_file describes. """
+    self.storage.delete_file(bucket_name, key_name)
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes files with the wrapped *Storage object, as
+    BaseStorage.delete_keys describes. """
+    return self.storage.delete_keys(bucket_name, key_names)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+""" hedger.py provides a single class, Hedger, that cuts the tail latency of
+reads by sending them again (to another replica, or to the same backend) when
+they take longer than usual. """
+
+
+# General-purpose Python library imports
+import collections
+import os
+import Queue
+import threading
+import time
+import uuid
+
+
+# Magik library imports
+from magik.instrumentation import Instrumentation
+
+
+class Hedger():
+  """ Hedger runs a read as a list of interchangeable attempts. It starts the
+  first one, and if it hasn't answered by the time PERCENTILE of recent reads
+  had (e.g., their 95th percentile latency), starts the next one too, and so on
+  until one of them answers. Whichever answers first wins, and the others are
+  left to finish on their own, so only reads that are already slow pay for
+  the extra requests.
+
+  An attempt that fails doesn't wait for the deadline: the next one starts
+  right away, so hedged reads also fail over between replicas.
+
+  Hedgers are kept per storage backend and operation (see for_operation), so
+  that each deadline is learned from reads of the same kind.
+  """
+
+
+  # The fraction of recent reads that should answer before we hedge.
+  PERCENTILE = 0.95
+
+
+  # How many recent latencies the deadline is computed from.
+  WINDOW = 200
+
+
+  # How many latencies we need before we trust the percentile over
+  # INITIAL_DELAY.
+  MIN_SAMPLES = 20
+
+
+  # How many seconds to wait before hedging, until we have MIN_SAMPLES.
+  INITIAL_DELAY = 0.1
+
+
+  # The hedgers for each (backend, operation) pair.
+  hedgers = {}
+
+
+  # A lock that protects the dict of hedgers.
+  hedgers_lock = threading.Lock()
+
+
+  def __init__(self, backend_id=None, operation=None, initial_delay=None):
+    """ Creates a new Hedger.
+
+    Args:
+      backend_id: A str identifying the storage backend and account, which is
+        only used when reporting events.
+      operation: A str naming the operation (e.g., 'get_metadata'), which is
+        only used when reporting events.
+      initial_delay: A float with the number of seconds to wait before hedging
+        until enough latencies are known. Defaults to INITIAL_DELAY.
+    """
+    self.backend_id = backend_id
+    self.operation = operation
+    self.initial_delay = initial_delay or self.INITIAL_DELAY
+    self.latencies = collections.deque(maxlen=self.WINDOW)
+    self.lock = threading.Lock()
+
+
+  @classmethod
+  def for_operation(cls, backend_id, operation):
+    """ Returns the hedger for an operation, creating it if needed.
+
+    Args:
+      backend_id: A str identifying the storage backend and account.
+      operation: A str naming the operation.
+    Returns:
+      A Hedger.
+    """
+    with cls.hedgers_lock:
+      key = (backend_id, operation)
+      if key not in cls.hedgers:
+        cls.hedgers[key] = cls(backend_id, operation)
+      return cls.hedgers[key]
+
+
+  def record(self, latency):
+    """ Learns from how long a successful attempt took.
+
+    Args:
+      latency: A float with the number of seconds the attempt took.
+    """
+    with self.lock:
+      self.latencies.append(latency)
+
+
+  def get_delay(self):
+    """ Decides how long to wait for an attempt before starting another.
+
+    Returns:
+      A float with the number of seconds to wait.
+    """
+    with self.lock:
+      if len(self.latencies) < self.MIN_SAMPLES:
+        return self.initial_delay
+      latencies = sorted(self.latencies)
+    return latencies[int(self.PERCENTILE * (len(latencies) - 1))]
+
+
+  def call(self, attempts, discard=None, accept=None):
+    """ Runs attempts at a read, hedging as described above, and returns the
+    first answer.
+
+    Args:
+      attempts: A list of functions that take no arguments, each of which
+        reads the same thing (e.g., from a different replica).
+      discard: A function that is called with the answer of each attempt that
+        succeeded after another one had already won (e.g., to remove a file
+        it downloaded), or None if answers need no cleaning up.
+      accept: A function that takes an answer and returns False if it should
+        be treated like a failure (e.g., a replica that doesn't have a file
+        yet), or None to accept every answer. Rejected answers aren't passed
+        to discard, so this is meant for answers that need no cleaning up.
+    Returns:
+      Whatever the first attempt to answer (with an accepted answer) returned,
+        or the last rejected answer if every attempt failed or was rejected
+        and at least one was rejected.
+    Raises:
+      Exception: Whatever the last attempt to fail raised, if every attempt
+        failed.
+    """
+    if len(attempts) == 1 and accept is None:
+      start = time.time()
+      result = attempts[0]()
+      self.record(time.time() - start)
+      return result
+
+    answers = Queue.Queue()
+    state = {'done' : False}
+    state_lock = threading.Lock()
+
+    def run(index):
+      start = time.time()
+      try:
+        result = attempts[index]()
+      except Exception as exception:
+        answers.put((index, None, exception))
+        return
+      self.record(time.time() - start)
+      with state_lock:
+        if not state['done']:
+          answers.put((index, result, None))
+          return
+      if discard is not None:
+        discard(result)
+
+    def start(index):
+      thread = threading.Thread(target=run, args=(index,))
+      thread.daemon = True
+      thread.start()
+
+    start(0)
+    started = 1
+    finished = 0
+    rejected = []
+    last_exception = None
+    while True:
+      try:
+        if started < len(attempts):
+          delay = self.get_delay()
+          _, result, exception = answers.get(True, delay)
+        else:
+          _, result, exception = answers.get()
+      except Queue.Empty:
+        Instrumentation.emit('hedge', {
+          'backend_id' : self.backend_id,
+          'operation' : self.operation,
+          'attempt' : started,
+          'delay' : delay
+        })
+        start(started)
+        started += 1
+        continue
+
+      finished += 1
+      if exception is None and (accept is None or accept(result)):
+        break
+      if exception is None:
+        rejected.append(result)
+      else:
+        last_exception = exception
+      if finished == len(attempts):
+        if rejected:
+          return rejected[-1]
+        raise last_exception
+      if started < len(attempts):
+        start(started)
+        started += 1
+
+    # Attempts that answered while we were picking this one won't be used.
+    with state_lock:
+      state['done'] = True
+    while discard is not None and not answers.empty():
+      _, late_result, late_exception = answers.get()
+      if late_exception is None:
+        discard(late_result)
+    return result
+
+
+  def download(self, destination, attempts):
+    """ Runs attempts at downloading a file, hedging as call describes.
+
+    Each attempt downloads to its own file next to the destination, and the
+    first to finish is renamed over it, so that attempts never write to the
+    same file.
+
+    Args:
+      destination: A str with the name of the file to download to.
+      attempts: A list of functions, each of which takes the name of a file
+        and downloads the same file (e.g., from a different replica) to it.
+    Raises:
+      Exception: Whatever the last attempt to fail raised, if every attempt
+        failed.
+    """
+    def download_to_own_file(attempt):
+      path = '{0}.magik-{1}'.format(destination, uuid.uuid4().hex[:12])
+      try:
+        attempt(path)
+      except Exception:
+        if os.path.exists(path):
+          os.remove(path)
+        raise
+      return path
+
+    path = self.call([lambda attempt=attempt: download_to_own_file(attempt)
+      for attempt in attempts], discard=os.remove)
+    os.rename(path, destination)
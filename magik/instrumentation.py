@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+""" instrumentation.py provides a single class, Instrumentation, that lets
+callers observe what magik is doing (e.g., how many transfers it is running at
+once, and how fast they are going) without magik having to know how they want
+to record it. """
+
+
+# General-purpose Python library imports
+import threading
+
+
+class Instrumentation():
+  """ Instrumentation keeps a list of hooks, and calls each of them whenever
+  magik reports an event.
+
+  A hook is a function that takes two arguments: a str naming the event (e.g.,
+  'concurrency'), and a dict with the data for that event. Hooks are called
+  from whichever thread reported the event, so they should be quick and
+  thread-safe.
+  """
+
+
+  # The functions that are called for each event.
+  hooks = []
+
+
+  # A lock that protects the list of hooks.
+  lock = threading.Lock()
+
+
+  @classmethod
+  def add_hook(cls, hook):
+    """ Starts calling a function for each event.
+
+    Args:
+      hook: A function that takes an event name and a dict of event data.
+    """
+    with cls.lock:
+      cls.hooks = cls.hooks + [hook]
+
+
+  @classmethod
+  def remove_hook(cls, hook):
+    """ Stops calling a function that was added with add_hook.
+
+    Args:
+      hook: The function to stop calling.
+    """
+    with cls.lock:
+      cls.hooks = [existing for existing in cls.hooks if existing is not hook]
+
+
+  @classmethod
+  def emit(cls, event, data):
+    """ Reports an event to every hook.
+
+    Args:
+      event: A str naming the event.
+      data: A dict with the data for the event.
+    """
+    for hook in cls.hooks:
+      hook(event, data)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+""" manifest_index.py provides a single class, ManifestIndex, that remembers
+what magik last saw (or wrote) in each bucket, so that syncs don't have to list
+the whole bucket every time they run. """
+
+
+# General-purpose Python library imports
+import os
+import sqlite3
+import threading
+import time
+
+
+class ManifestIndex():
+  """ ManifestIndex keeps a SQLite database with the last-known size, ETag, MD5
+  and modification time of each remote key, per storage backend and bucket.
+
+  It also records which prefixes have been listed in full. Only keys under
+  those prefixes can be trusted to be complete: magik updates the index on
+  each upload and delete it performs, but can't know about changes made by
+  other tools, so callers should re-list a prefix if they suspect that.
+
+  Names are kept as unicode, decoding strs given to it as UTF-8, since SQLite
+  only takes text that way and ranges of keys have to be compared by
+  character.
+  """
+
+
+  # The location on the local filesystem where the index is kept by default.
+  DEFAULT_LOCATION = os.path.expanduser('~/.magik/manifest.db')
+
+
+  def __init__(self, location=None):
+    """ Opens (and creates, if needed) the manifest index.
+
+    Args:
+      location: A str naming the file that the index should be stored in.
+        Defaults to DEFAULT_LOCATION. The special name ':memory:' keeps the
+        index in memory only.
+    """
+    self.location = location or self.DEFAULT_LOCATION
+    if self.location != ':memory:':
+      index_dir = os.path.dirname(self.location)
+      if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    # The index is shared by the threads that transfer files in parallel, so
+    # serialize access to the connection ourselves.
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(self.location, check_same_thread=False)
+    self.connection.execute('CREATE TABLE IF NOT EXISTS objects (' +
+      'backend TEXT, bucket TEXT, key TEXT, size INTEGER, etag TEXT, ' +
+      'md5 TEXT, last_modified REAL, PRIMARY KEY (backend, bucket, key))')
+    self.connection.execute('CREATE TABLE IF NOT EXISTS listings (' +
+      'backend TEXT, bucket TEXT, prefix TEXT, listed_at REAL, ' +
+      'PRIMARY KEY (backend, bucket, prefix))')
+
+
+  def has_listing(self, backend, bucket, prefix, max_age=None):
+    """ Checks if the index knows every key under a prefix, because that prefix
+    (or a shorter one that contains it) was listed in full.
+
+    Args:
+      backend: A str identifying the storage backend and account.
+      bucket: A str containing the name of the bucket.
+      prefix: A str containing the key prefix.
+      max_age: The number of seconds after which a listing is considered too
+        old to be trusted, or None if listings never expire.
+    Returns:
+      True if the index can answer for the given prefix, and False otherwise.
+    """
+    prefix = self.decode(prefix)
+    with self.lock:
+      rows = self.connection.execute('SELECT prefix, listed_at FROM listings ' +
+        'WHERE backend = ? AND bucket = ?', (self.decode(backend),
+        self.decode(bucket))).fetchall()
+
+    now = time.time()
+    for listed_prefix, listed_at in rows:
+      if not prefix.startswith(listed_prefix):
+        continue
+      if max_age is None or now - listed_at <= max_age:
+        return True
+    return False
+
+
+  def get_keys(self, backend, bucket, prefix):
+    """ Looks up every key the index knows of under a prefix.
+
+    Args:
+      backend: A str identifying the storage backend and account.
+      bucket: A str containing the name of the bucket.
+      prefix: A str containing the key prefix.
+    Returns:
+      A dict mapping each key name (as unicode) to a dict in the format that
+        BaseStorage.list_keys describes.
+    """
+    query = 'SELECT key, size, etag, md5, last_modified FROM objects ' + \
+      'WHERE backend = ? AND bucket = ?'
+    params = [self.decode(backend), self.decode(bucket)]
+
+    # Use a range instead of LIKE, so that SQLite can use the primary key.
+    if prefix:
+      query += ' AND key >= ? AND key < ?'
+      params.extend([self.decode(prefix), self.get_prefix_end(prefix)])
+
+    with self.lock:
+      rows = self.connection.execute(query, params).fetchall()
+
+    keys = {}
+    for key, size, etag, md5, last_modified in rows:
+      keys[key] = {
+        'key' : key,
+        'size' : size,
+        'etag' : etag,
+        'md5' : md5,
+        'last_modified' : last_modified
+      }
+    return keys
+
+
+  def replace_listing(self, backend, bucket, prefix, key_infos):
+    """ Replaces everything the index knows about a prefix with the results of
+    a fresh listing of it.
+
+    Args:
+      backend: A str identifying the storage backend and account.
+      bucket: A str containing the name of the bucket.
+      prefix: A str containing the key prefix that was listed.
+      key_infos: An iterable of dicts, in the format that BaseStorage.list_keys
+        describes, with one entry per key under the prefix.
+    """
+    backend = self.decode(backend)
+    bucket = self.decode(bucket)
+    prefix = self.decode(prefix)
+    rows = ((backend, bucket, self.decode(key_info['key']), key_info['size'],
+      key_info['etag'], key_info['md5'], key_info['last_modified'])
+      for key_info in key_infos)
+
+    with self.lock:
+      if prefix:
+        self.connection.execute('DELETE FROM objects WHERE backend = ? AND ' +
+          'bucket = ? AND key >= ? AND key < ?', (backend, bucket, prefix,
+          self.get_prefix_end(prefix)))
+      else:
+        self.connection.execute('DELETE FROM objects WHERE backend = ? AND ' +
+          'bucket = ?', (backend, bucket))
+      self.connection.executemany('INSERT OR REPLACE INTO objects ' +
+        '(backend, bucket, key, size, etag, md5, last_modified) VALUES ' +
+        '(?, ?, ?, ?, ?, ?, ?)', rows)
+      self.connection.execute('INSERT OR REPLACE INTO listings ' +
+        '(backend, bucket, prefix, listed_at) VALUES (?, ?, ?, ?)',
+        (backend, bucket, prefix, time.time()))
+      self.connection.commit()
+
+
+  def put(self, backend, bucket, key_info):
+    """ Records that a key was written.
+
+    Args:
+      backend: A str identifying the storage backend and account.
+      bucket: A str containing the name of the bucket.
+      key_info: A dict, in the format that BaseStorage.list_keys describes,
+        for the key that was written.
+    """
+    with self.lock:
+      self.connection.execute('INSERT OR REPLACE INTO objects ' +
+        '(backend, bucket, key, size, etag, md5, last_modified) VALUES ' +
+        '(?, ?, ?, ?, ?, ?, ?)', (self.decode(backend), self.decode(bucket),
+        self.decode(key_info['key']), key_info['size'], key_info['etag'],
+        key_info['md5'], key_info['last_modified']))
+
+
+  def remove(self, backend, bucket, key):
+    """ Records that a key no longer exists.
+
+    Args:
+      backend: A str identifying the storage backend and account.
+      bucket: A str containing the name of the bucket.
+      key: A str containing the name of the key that was deleted.
+    """
+    with self.lock:
+      self.connection.execute('DELETE FROM objects WHERE backend = ? AND ' +
+        'bucket = ? AND key = ?', (self.decode(backend), self.decode(bucket),
+        self.decode(key)))
+
+
+  def get_prefix_end(self, prefix):
+    """ Finds the smallest str that is greater than every str starting with the
+    given prefix, so that prefix matches can be done as range queries.
+
+    Args:
+      prefix: A non-empty str, which is decoded as UTF-8 if it isn't unicode.
+    Returns:
+      A unicode str that sorts just after every str starting with prefix.
+    """
+    prefix = self.decode(prefix)
+    return prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+
+  def decode(self, name):
+    """ Turns a name into the unicode that the index keeps names as.
+
+    Args:
+      name: A str holding UTF-8, or a unicode str.
+    Returns:
+      A unicode str with the same characters as name.
+    """
+    if isinstance(name, str):
+      return name.decode('utf-8')
+    return name
+
+
+  def flush(self):
+    """ Writes any changes made since the last flush to disk. """
+    with self.lock:
+      self.connection.commit()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+""" metadata_cache.py provides a single class, MetadataCache, that remembers
+the metadata of files in cloud storage for a short while, so that repeated
+lookups (e.g., health checks) don't each cost a request. """
+
+
+# General-purpose Python library imports
+import collections
+import threading
+import time
+
+
+class MetadataCache():
+  """ MetadataCache holds the results of get_metadata calls in memory, each for
+  up to DEFAULT_TTL seconds.
+
+  Uploads, copies and deletions made through magik invalidate the entries for
+  the files they change, so the TTL only bounds how stale an entry can get
+  when something else changes the file.
+
+  Entries are kept per set of credentials (not just per account), since the
+  cache answers before any request is made: a caller with the right account
+  name but the wrong secret key must miss, and fail at the storage platform.
+  """
+
+
+  # The number of seconds an entry is trusted for.
+  DEFAULT_TTL = 10
+
+
+  # The most entries the cache holds. Once it is full, the oldest entries are
+  # dropped first.
+  MAX_ENTRIES = 10000
+
+
+  def __init__(self, ttl=None, max_entries=None):
+    """ Creates a new, empty MetadataCache.
+
+    Args:
+      ttl: The number of seconds an entry is trusted for. Defaults to
+        DEFAULT_TTL.
+      max_entries: The most entries the cache holds. Defaults to MAX_ENTRIES.
+    """
+    self.ttl = ttl or self.DEFAULT_TTL
+    self.max_entries = max_entries or self.MAX_ENTRIES
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+
+  def get(self, credentials, bucket, key):
+    """ Looks up the cached metadata of a file.
+
+    Args:
+      credentials: A str that identifies the storage platform, account and
+        credentials (see BaseStorage.get_credentials_id).
+      bucket: A str with the name of the bucket the file is in.
+      key: A str with the name of the file's key.
+    Returns:
+      A tuple whose first item is True if the cache has a current entry for
+        the file, and whose second item is the cached metadata (which is None
+        if the file was found not to exist).
+    """
+    with self.lock:
+      entry = self.entries.get((credentials, bucket, key))
+      if entry is None:
+        return False, None
+      expires, metadata = entry
+      if expires <= time.time():
+        del self.entries[(credentials, bucket, key)]
+        return False, None
+      return True, metadata
+
+
+  def put(self, credentials, bucket, key, metadata):
+    """ Caches the metadata of a file.
+
+    Args:
+      credentials: A str that identifies the storage platform, account and
+        credentials (see BaseStorage.get_credentials_id).
+      bucket: A str with the name of the bucket the file is in.
+      key: A str with the name of the file's key.
+      metadata: A dict in the format that get_metadata returns, or None if the
+        file doesn't exist.
+    """
+    with self.lock:
+      self.entries.pop((credentials, bucket, key), None)
+      self.entries[(credentials, bucket, key)] = (time.time() + self.ttl, metadata)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+
+  def invalidate(self, credentials, bucket, key):
+    """ Forgets the cached metadata of a file, because it has changed.
+
+    Args:
+      credentials: A str that identifies the storage platform, account and
+        credentials (see BaseStorage.get_credentials_id).
+      bucket: A str with the name of the bucket the file is in.
+      key: A str with the name of the file's key.
+    """
+    with self.lock:
+      self.entries.pop((credentials, bucket, key), None)
@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+""" pack_store.py provides a single class, PackStore, that bundles many small
+files into a few large pack objects in a bucket, and reads them back out with
+ranged GETs. """
+
+
+# General-purpose Python library imports
+import hashlib
+import json
+import os.path
+import threading
+import time
+import uuid
+
+
+class PackStore():
+  """ PackStore keeps small files in pack objects instead of one object per
+  file, since storing and fetching millions of tiny objects one request at a
+  time costs far more (in requests and in per-object overhead) than storing
+  the same bytes in a few large objects.
+
+  Each pack is written along with an index object that maps the logical key of
+  every file in the pack to its (offset, length) in the pack. Packs and their
+  indexes are never changed once written: newer indexes override older ones
+  (they are named so that they sort in the order they were written in), and
+  deleting a file writes an index that only records the deletion. compact
+  rewrites the files that are still live into new packs and deletes the old
+  ones, which is the only time space is given back.
+
+  Compaction must not run while other processes are writing packs to the same
+  bucket, since packs that have no index yet look abandoned to it.
+
+  Logical keys are kept as unicode (see normalize_key), since that is what
+  indexes hold once they have been read back, so callers can look keys up
+  either as unicode or as UTF-8 strs.
+  """
+
+
+  # The prefix that pack and index objects are stored under in their bucket.
+  PACK_DIRECTORY = '.magik-packs/'
+
+
+  # The number of bytes of files we put in a pack before starting a new one.
+  PACK_SIZE = 8 * 1024 * 1024
+
+
+  # The number of seconds the indexes we've read are trusted for before we
+  # look for indexes that other processes have written.
+  INDEX_TTL = 10
+
+
+  # The largest gap, in bytes, between two files in the same pack that we'll
+  # read (and throw away) to fetch both files with one ranged GET.
+  SPAN_GAP = 64 * 1024
+
+
+  # The most bytes that a single ranged GET asks for when fetching several
+  # files from the same pack.
+  MAX_SPAN_SIZE = 8 * 1024 * 1024
+
+
+  # The fraction of the bytes in packs that must belong to deleted or
+  # overwritten files before compact bothers rewriting anything.
+  MIN_WASTE = 0.5
+
+
+  # The PackStore for each bucket, keyed by (credentials id, bucket name), so
+  # that every caller with the same credentials shares the same cached
+  # indexes. Keying on the account alone would let a caller with the wrong
+  # secret read (and write) packs through another caller's *Storage object.
+  stores = {}
+
+
+  # A lock that makes sure only one PackStore gets created per bucket.
+  stores_lock = threading.Lock()
+
+
+  def __init__(self, storage, bucket_name):
+    """ Creates a new PackStore, without reading any indexes yet.
+
+    Args:
+      storage: The *Storage object that pack and index objects are read and
+        written through.
+      bucket_name: A str with the name of the bucket the packs are kept in.
+    """
+    self.storage = storage
+    self.bucket_name = bucket_name
+    self.indexes = {}
+    self.entries = None
+    self.loaded_at = 0
+    self.lock = threading.Lock()
+
+
+  @classmethod
+  def for_bucket(cls, storage, bucket_name):
+    """ Returns the PackStore for a bucket, creating it if needed.
+
+    Args:
+      storage: The *Storage object to use if the PackStore is created. Only
+        *Storage objects with the same credentials (see
+        BaseStorage.get_credentials_id) share a PackStore.
+      bucket_name: A str with the name of the bucket.
+    Returns:
+      A PackStore.
+    """
+    with cls.stores_lock:
+      key = (storage.get_credentials_id(), bucket_name)
+      if key not in cls.stores:
+        cls.stores[key] = cls(storage, bucket_name)
+      return cls.stores[key]
+
+
+  def refresh(self, force=False):
+    """ Reads any indexes that we haven't seen yet, and forgets those that have
+    been deleted, if our view of the bucket is more than INDEX_TTL seconds old.
+
+    Since indexes never change once written, only new ones are downloaded.
+
+    Args:
+      force: A bool that indicates if the bucket should be listed even if our
+        view of it is still fresh.
+    """
+    with self.lock:
+      if not force and self.entries is not None and \
+        time.time() - self.loaded_at < self.INDEX_TTL:
+        return
+
+      listed = {}
+      for key_info in self.storage.list_keys(self.bucket_name,
+        self.PACK_DIRECTORY):
+        if key_info['key'].endswith('.index'):
+          name = key_info['key'][len(self.PACK_DIRECTORY):-len('.index')]
+          listed[name] = key_info
+
+      for name in self.indexes.keys():
+        if name not in listed:
+          del self.indexes[name]
+      for name, key_info in listed.items():
+        if name not in self.indexes:
+          self.indexes[name] = json.loads(self.storage.download_range(
+            self.bucket_name, key_info['key'], 0, key_info['size'] - 1))
+
+      self.resolve()
+      self.loaded_at = time.time()
+
+
+  def resolve(self):
+    """ Works out which entry is current for each file, by applying the
+    indexes in the order they were written in. Must be called with the lock
+    held.
+    """
+    self.entries = {}
+    for name in sorted(self.indexes):
+      self.apply_index(self.indexes[name])
+
+
+  def apply_index(self, index):
+    """ Applies one index on top of the current entries. Must be called with
+    the lock held.
+
+    Args:
+      index: A dict with an index, in the format that write_index takes.
+    """
+    for key_name in index['deleted']:
+      self.entries.pop(key_name, None)
+    for key_name, entry in index['entries'].items():
+      entry = dict(entry)
+      entry['pack'] = index['pack']
+      self.entries[key_name] = entry
+
+
+  def add_index(self, name, index):
+    """ Remembers an index that we've just written, without listing the bucket
+    again. Must not be called with the lock held.
+
+    Args:
+      name: A str with the index's name.
+      index: A dict with the index, in the format that write_index takes.
+    """
+    with self.lock:
+      newest = name > max(self.indexes or [''])
+      self.indexes[name] = index
+      if self.entries is None:
+        return
+      # An index that sorts after all the others can simply be applied on top
+      # of them, which saves redoing every index for each pack written.
+      if newest:
+        self.apply_index(index)
+      else:
+        self.resolve()
+
+
+  def get_entry(self, key_name):
+    """ Looks up where a file is stored.
+
+    Args:
+      key_name: A str with the logical key of the file.
+    Returns:
+      A dict with the 'pack' key the file is in, its 'offset' and 'length' in
+        the pack, its hex-encoded 'md5' and its 'last_modified' time, or None
+        if there is no such file.
+    """
+    self.refresh()
+    with self.lock:
+      return self.entries.get(self.normalize_key(key_name))
+
+
+  def list_entries(self, prefix=''):
+    """ Lists the files in the packs whose logical keys start with a prefix.
+
+    Args:
+      prefix: A str that each key name returned must start with.
+    Returns:
+      A list of dicts, sorted by key, each with the file's 'key' (as unicode),
+        'size', 'md5' and 'last_modified' time, like list_keys returns for
+        ordinary files.
+    """
+    prefix = self.normalize_key(prefix)
+    self.refresh()
+    with self.lock:
+      entries = [(key_name, entry) for key_name, entry in
+        self.entries.items() if key_name.startswith(prefix)]
+    return [{
+      'key' : key_name,
+      'size' : entry['length'],
+      'md5' : entry['md5'],
+      'last_modified' : entry['last_modified']
+    } for key_name, entry in sorted(entries)]
+
+
+  def normalize_key(self, key_name):
+    """ Converts a logical key to the form that indexes keep it in.
+
+    Indexes are stored as JSON, which reads every key back as unicode, so keys
+    given as UTF-8 strs are decoded to match.
+
+    Args:
+      key_name: A str (or unicode) with the logical key of a file.
+    Returns:
+      A unicode with the same key.
+    """
+    if isinstance(key_name, str):
+      return key_name.decode('utf-8')
+    return key_name
+
+
+  def new_name(self):
+    """ Makes up a name for a new pack and its index, that sorts after the
+    names of the packs written before it.
+
+    Returns:
+      A str with the name.
+    """
+    return '{0:020d}-{1}'.format(int(time.time() * 1000000),
+      uuid.uuid4().hex[:12])
+
+
+  def write_pack(self, files, name=None):
+    """ Writes a new pack holding the given files, followed by its index.
+
+    The pack is only visible to readers once its index has been written, so a
+    pack whose upload fails part-way doesn't hide the files' older copies.
+
+    Args:
+      files: A list of dicts, each with the logical 'key' and the 'contents'
+        (a str) of a file, and optionally its 'last_modified' time (which
+        defaults to now).
+      name: A str with the name of the pack, which defaults to a new one from
+        new_name.
+    Returns:
+      A str with the name of the pack.
+    """
+    name = name or self.new_name()
+    now = time.time()
+    index = {
+      'pack' : self.PACK_DIRECTORY + name + '.pack',
+      'entries' : {},
+      'deleted' : []
+    }
+    offset = 0
+    for item in files:
+      index['entries'][self.normalize_key(item['key'])] = {
+        'offset' : offset,
+        'length' : len(item['contents']),
+        'md5' : hashlib.md5(item['contents']).hexdigest(),
+        'last_modified' : item.get('last_modified') or now
+      }
+      offset += len(item['contents'])
+
+    self.upload_string(''.join([item['contents'] for item in files]),
+      index['pack'])
+    self.write_index(name, index)
+    return name
+
+
+  def write_deletions(self, key_names):
+    """ Deletes files from the packs, by writing an index that records their
+    deletion. The space they take up is only given back by compact.
+
+    Args:
+      key_names: A list of strs with the logical keys of the files to delete.
+    Returns:
+      A list with the keys of the files that were deleted, as they were given,
+        leaving out those that didn't exist.
+    """
+    self.refresh()
+    with self.lock:
+      deleted = [key_name for key_name in key_names
+        if self.normalize_key(key_name) in self.entries]
+    if deleted:
+      self.write_index(self.new_name(), {
+        'pack' : None,
+        'entries' : {},
+        'deleted' : [self.normalize_key(key_name) for key_name in deleted]
+      })
+    return deleted
+
+
+  def write_index(self, name, index):
+    """ Uploads an index and starts using it.
+
+    Args:
+      name: A str with the name of the index.
+      index: A dict with the name of the 'pack' the index describes (or None
+        if it only records deletions), the 'entries' of the files in the pack,
+        keyed by their logical keys, and the keys that were 'deleted'.
+    """
+    self.upload_string(json.dumps(index), self.PACK_DIRECTORY + name +
+      '.index')
+    self.add_index(name, index)
+
+
+  def upload_string(self, contents, key_name):
+    """ Uploads an object whose contents are held in memory, in the chunks that
+    the storage platform wants.
+
+    Args:
+      contents: A str with the contents of the object.
+      key_name: A str with the name of the key to upload the object to.
+    """
+    chunk_size = self.storage.get_stream_chunk_size(len(contents))
+    chunks = [contents[start:start + chunk_size]
+      for start in range(0, len(contents), chunk_size)] or ['']
+    self.storage.upload_stream(iter(chunks), self.bucket_name, key_name,
+      len(contents))
+
+
+  def delete_objects(self, names):
+    """ Deletes pack and index objects, DELETE_BATCH_SIZE of them at a time.
+
+    Args:
+      names: A list of strs with the names of the objects, relative to
+        PACK_DIRECTORY.
+    """
+    batch_size = self.storage.DELETE_BATCH_SIZE
+    for start in range(0, len(names), batch_size):
+      self.storage.delete_keys(self.bucket_name, [self.PACK_DIRECTORY + name
+        for name in names[start:start + batch_size]])
+
+
+  def plan_reads(self, parts):
+    """ Groups the files to read into spans, each of which can be fetched with
+    a single ranged GET, by merging files that are near each other in the
+    same pack.
+
+    Args:
+      parts: A list of (entry, value) tuples, where each entry is in the format
+        that get_entry returns, and each value is anything the caller wants
+        to find the file by once it has been read.
+    Returns:
+      A list of dicts, each with the 'pack' to read from, the 'start' and
+        'end' of the bytes to read (inclusive), and the (entry, value)
+        'parts' that fall inside that range.
+    """
+    spans = []
+    for entry, value in sorted(parts, key=lambda part: (part[0]['pack'],
+      part[0]['offset'])):
+      end = entry['offset'] + entry['length'] - 1
+      if spans:
+        span = spans[-1]
+        if span['pack'] == entry['pack'] and \
+          entry['offset'] - span['end'] - 1 <= self.SPAN_GAP and \
+          end - span['start'] < self.MAX_SPAN_SIZE:
+          span['end'] = max(span['end'], end)
+          span['parts'].append((entry, value))
+          continue
+      spans.append({
+        'pack' : entry['pack'],
+        'start' : entry['offset'],
+        'end' : end,
+        'parts' : [(entry, value)]
+      })
+    return spans
+
+
+  def read_span(self, span):
+    """ Fetches the files in a span with a single ranged GET.
+
+    Args:
+      span: A dict in the format that plan_reads returns.
+    Returns:
+      A list of (value, contents) tuples, one for each part of the span.
+    """
+    # A span of only empty files has no bytes to ask for a range of.
+    data = ''
+    if span['end'] >= span['start']:
+      data = self.storage.download_range(self.bucket_name, span['pack'],
+        span['start'], span['end'])
+    return [(value, data[entry['offset'] - span['start']:entry['offset'] -
+      span['start'] + entry['length']]) for entry, value in span['parts']]
+
+
+  def read(self, key_name):
+    """ Reads a single file out of its pack.
+
+    Args:
+      key_name: A str with the logical key of the file.
+    Returns:
+      A str with the contents of the file, or None if there is no such file.
+    """
+    entry = self.get_entry(key_name)
+    if entry is None:
+      return None
+    return self.read_span(self.plan_reads([(entry, key_name)])[0])[0][1]
+
+
+  def compact(self, min_waste=None):
+    """ Gives back the space taken up by deleted and overwritten files, by
+    copying the files that are still live into new packs and deleting all of
+    the old packs and indexes (and any packs left behind without an index).
+
+    The new indexes are named after the newest index they replace, so that
+    they still sort before indexes written after compaction started.
+
+    Args:
+      min_waste: A float with the fraction of bytes in packs that must be
+        wasted before anything is rewritten. Defaults to MIN_WASTE.
+    Returns:
+      A dict with the number of 'packs' and 'live_bytes' and 'dead_bytes' in
+        them before compaction, whether they were 'compacted', and the number
+        of 'packs_written'.
+    """
+    if min_waste is None:
+      min_waste = self.MIN_WASTE
+
+    self.refresh(force=True)
+    with self.lock:
+      indexes = dict(self.indexes)
+      entries = dict(self.entries)
+
+    # Packs that an index we've read points to are replaced, as are packs with
+    # no index at all (left behind by uploads that failed part-way). Packs
+    # whose index was written after we read the indexes are left alone.
+    pack_sizes = {}
+    index_names = set()
+    for key_info in self.storage.list_keys(self.bucket_name,
+      self.PACK_DIRECTORY):
+      name, extension = os.path.splitext(
+        key_info['key'][len(self.PACK_DIRECTORY):])
+      if extension == '.pack':
+        pack_sizes[name] = key_info['size']
+      elif extension == '.index':
+        index_names.add(name)
+    old_packs = [name for name in pack_sizes if name in indexes or
+      name not in index_names]
+    total_bytes = sum([pack_sizes[name] for name in old_packs])
+    live_bytes = sum([entry['length'] for entry in entries.values()])
+
+    stats = {
+      'packs' : len(old_packs),
+      'live_bytes' : live_bytes,
+      'dead_bytes' : total_bytes - live_bytes,
+      'compacted' : False,
+      'packs_written' : 0
+    }
+    if not total_bytes or stats['dead_bytes'] < min_waste * total_bytes:
+      return stats
+
+    newest = max(indexes or [''])
+    files = []
+    size = 0
+    for span in self.plan_reads([(entry, key_name) for key_name, entry in
+      entries.items()]):
+      for key_name, contents in self.read_span(span):
+        files.append({
+          'key' : key_name,
+          'contents' : contents,
+          'last_modified' : entries[key_name]['last_modified']
+        })
+        size += len(contents)
+      if size >= self.PACK_SIZE:
+        self.write_pack(files, '{0}-compacted-{1:04d}'.format(newest,
+          stats['packs_written']))
+        stats['packs_written'] += 1
+        files = []
+        size = 0
+    if files:
+      self.write_pack(files, '{0}-compacted-{1:04d}'.format(newest,
+        stats['packs_written']))
+      stats['packs_written'] += 1
+
+    # The live files are safe in their new packs now, so the old indexes can
+    # go, followed by the packs they pointed to.
+    self.delete_objects([name + '.index' for name in sorted(indexes)])
+    self.delete_objects([name + '.pack' for name in sorted(old_packs)])
+
+    self.refresh(force=True)
+    stats['compacted'] = True
+    return stats
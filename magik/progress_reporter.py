@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" progress_reporter.py provides a single class, ProgressReporter, that shows
+how far along a batch of transfers is. """
+
+
+# General-purpose Python library imports
+import sys
+import time
+
+
+class ProgressReporter():
+  """ ProgressReporter counts the results of a batch as they come in, and
+  writes a one-line summary (with the throughput so far) to a stream every so
+  often, overwriting the previous one. """
+
+
+  # The least number of seconds between two summaries.
+  REPORT_INTERVAL = 0.5
+
+
+  def __init__(self, stream=None, verb='transferred'):
+    """ Creates a new ProgressReporter.
+
+    Args:
+      stream: A file-like object to write summaries to. Defaults to
+        sys.stderr.
+      verb: A str describing what happens to each item (e.g., 'deleted').
+    """
+    self.stream = stream or sys.stderr
+    self.verb = verb
+    self.start_time = time.time()
+    self.last_report_time = None
+    self.succeeded = 0
+    self.skipped = 0
+    self.failed = 0
+
+
+  def update(self, result):
+    """ Counts the result of one item, and writes a summary if it's been long
+    enough since the last one.
+
+    Args:
+      result: A dict with the result of one item, as returned by the batch
+        operations in BaseStorage.
+    """
+    if result.get('skipped'):
+      self.skipped += 1
+    elif result.get('success'):
+      self.succeeded += 1
+    else:
+      self.failed += 1
+
+    now = time.time()
+    if self.last_report_time is None or \
+      now - self.last_report_time >= self.REPORT_INTERVAL:
+      self.report(now)
+
+
+  def finish(self):
+    """ Writes the final summary, and ends its line. """
+    self.report(time.time())
+    self.stream.write('\n')
+    self.stream.flush()
+
+
+  def report(self, now):
+    """ Writes a summary of the results so far over the previous summary.
+
+    Args:
+      now: A float with the current time.
+    """
+    self.last_report_time = now
+    elapsed = max(now - self.start_time, 1e-6)
+    done = self.succeeded + self.skipped + self.failed
+    self.stream.write('\r{0} {1}, {2} skipped, {3} failed ({4:.1f} files/s)'
+      .format(self.succeeded, self.verb, self.skipped, self.failed,
+      done / elapsed))
+    self.stream.flush()
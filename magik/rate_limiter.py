@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+""" rate_limiter.py provides a single class, RateLimiter, that caps how much
+bandwidth magik's transfers use, so that they don't starve other traffic on
+the same host. """
+
+
+# General-purpose Python library imports
+import threading
+import time
+
+
+class RateLimiter():
+  """ RateLimiter is a token bucket that lets bytes through at a fixed average
+  rate, with bursts of up to a fixed size after the link has been idle.
+
+  Transfers ask for permission to move their bytes a chunk at a time, and each
+  chunk is given the next free slot on the link. A transfer can only hold one
+  slot at a time, so concurrent transfers take turns, and each one gets an
+  equal share of the bandwidth: a huge object being uploaded can't hold up the
+  small ones being uploaded next to it.
+
+  Limits can be set for all transfers in this process, and for the transfers
+  to each storage backend (see set_limit). A transfer has to get through both.
+  """
+
+
+  # The largest number of bytes a transfer can reserve at once. Larger
+  # requests are split up, so that other transfers get a turn in between.
+  CHUNK_SIZE = 64 * 1024
+
+
+  # The number of seconds' worth of bytes that can be sent in a burst after
+  # the link has been idle.
+  BURST_SECONDS = 1.0
+
+
+  # The suffixes that parse_rate accepts, and what each one multiplies by.
+  RATE_SUFFIXES = {'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3}
+
+
+  # The RateLimiter for each storage backend that has a limit, keyed by its
+  # backend ID, with the limit for all backends under None.
+  limiters = {}
+
+
+  # A lock that protects the dict of limiters.
+  limiters_lock = threading.Lock()
+
+
+  def __init__(self, rate, burst=None):
+    """ Creates a new RateLimiter.
+
+    Args:
+      rate: A number with how many bytes per second to let through.
+      burst: A number with how many bytes can go through at once after the
+        link has been idle. Defaults to BURST_SECONDS worth of bytes.
+    """
+    self.rate = float(rate)
+    if burst is None:
+      burst = self.rate * self.BURST_SECONDS
+    self.burst = float(burst)
+    self.lock = threading.Lock()
+    self.next_free = 0.0
+
+
+  @classmethod
+  def set_limit(cls, rate, backend_id=None):
+    """ Caps the bandwidth used by magik's transfers.
+
+    Args:
+      rate: A number with how many bytes per second to let through, or None to
+        remove the limit.
+      backend_id: A str identifying the storage backend and account to limit
+        transfers to, or None to limit all transfers in this process.
+    """
+    with cls.limiters_lock:
+      if rate:
+        cls.limiters[backend_id] = cls(rate)
+      else:
+        cls.limiters.pop(backend_id, None)
+
+
+  @classmethod
+  def get_limiters(cls, backend_id):
+    """ Finds the limits that apply to transfers to a storage backend.
+
+    Args:
+      backend_id: A str identifying the storage backend and account.
+    Returns:
+      A list of RateLimiters, which is empty if transfers aren't limited.
+    """
+    with cls.limiters_lock:
+      return [cls.limiters[key] for key in (None, backend_id)
+        if key in cls.limiters]
+
+
+  @classmethod
+  def is_limited(cls, backend_id):
+    """ Checks if transfers to a storage backend are limited.
+
+    Args:
+      backend_id: A str identifying the storage backend and account.
+    Returns:
+      True if there is a limit, and False otherwise.
+    """
+    return bool(cls.get_limiters(backend_id))
+
+
+  @classmethod
+  def throttle(cls, backend_id, num_bytes):
+    """ Waits until the limits for a storage backend let some bytes through.
+
+    Args:
+      backend_id: A str identifying the storage backend and account.
+      num_bytes: An int with the number of bytes about to be (or just) sent.
+    """
+    limiters = cls.get_limiters(backend_id)
+    while limiters and num_bytes > 0:
+      chunk = min(num_bytes, cls.CHUNK_SIZE)
+      delay = max(limiter.reserve(chunk) for limiter in limiters)
+      if delay > 0:
+        time.sleep(delay)
+      num_bytes -= chunk
+
+
+  @classmethod
+  def parse_rate(cls, rate):
+    """ Parses a rate given on the command line, such as '512K' or '10M'.
+
+    Args:
+      rate: A str with a number of bytes per second, optionally followed by
+        K, M or G.
+    Returns:
+      An int with the number of bytes per second.
+    Raises:
+      ValueError: If rate isn't in a format we understand.
+    """
+    rate = rate.strip().upper()
+    multiplier = 1
+    if rate and rate[-1] in cls.RATE_SUFFIXES:
+      multiplier = cls.RATE_SUFFIXES[rate[-1]]
+      rate = rate[:-1]
+    return int(float(rate) * multiplier)
+
+
+  @classmethod
+  def parse_backend_rate(cls, backend_rate):
+    """ Parses a limit for one storage backend given on the command line, such
+    as 's3:ACCESS_KEY=10M'.
+
+    Args:
+      backend_rate: A str with a backend ID (e.g., 's3:ACCESS_KEY' or
+        'azure:ACCOUNT_NAME'), an '=', and a rate in the format that
+        parse_rate accepts.
+    Returns:
+      A tuple with the backend ID, as a str, and an int with the number of
+        bytes per second.
+    Raises:
+      ValueError: If backend_rate isn't in a format we understand.
+    """
+    backend_id, separator, rate = backend_rate.rpartition('=')
+    if not separator or not backend_id:
+      raise ValueError('expected BACKEND_ID=RATE, got ' + backend_rate)
+    return backend_id, cls.parse_rate(rate)
+
+
+  def reserve(self, num_bytes):
+    """ Reserves the next free slot on the link for some bytes.
+
+    Args:
+      num_bytes: An int with the number of bytes to reserve a slot for.
+    Returns:
+      A float with the number of seconds the caller has to wait before its
+        bytes are paid for.
+    """
+    with self.lock:
+      now = time.time()
+      start = max(self.next_free, now - self.burst / self.rate)
+      self.next_free = start + num_bytes / self.rate
+      return self.next_free - now
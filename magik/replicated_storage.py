@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+""" replicated_storage.py provides a single class, ReplicatedStorage, that
+keeps a copy of every file in several *Storage objects (e.g., S3 and Azure),
+and reads each file from whichever copy answers first. """
+
+
+# General-purpose Python library imports
+import heapq
+import threading
+
+
+# Magik library imports
+from magik.custom_exceptions import BadConfigurationException
+from magik.hedger import Hedger
+from magik.wrapping_storage import WrappingStorage
+
+
+class ReplicatedStorage(WrappingStorage):
+  """ ReplicatedStorage writes each file to every one of its replicas (each a
+  *Storage object, for a different account or platform) in parallel. A write
+  of a new file succeeds if at least write_quorum replicas took it, so that
+  one replica being down doesn't stop writes.
+
+  There are no versions to tell an old copy of a file from a new one, so
+  overwrites and deletes must reach every replica that may have a copy of the
+  file (including any that can't be asked), or that copy could be read (or
+  listed) again later. Since every file is written to at least write_quorum
+  replicas, a file that more than len(replicas) - write_quorum replicas don't
+  have is new. So with a write_quorum of at least 2, one replica being down
+  only stops overwrites and deletes.
+
+  Reads are hedged (see Hedger): they go to the first replica listed (e.g.,
+  the nearest), and if it hasn't answered within the 95th percentile latency
+  of recent reads, to the next one too, and the first answer wins. A replica
+  that fails or doesn't have the file (e.g., because it missed a write) is
+  skipped right away.
+
+  Uploads of streams and resumable transfers go through BaseStorage, which
+  builds them from upload_file and download_range, so they are replicated and
+  hedged too.
+  """
+
+
+  def __init__(self, storages, write_quorum=None):
+    """ Creates a new ReplicatedStorage.
+
+    Args:
+      storages: A list of *Storage objects to keep copies of each file in,
+        each for a different account (i.e., with a different backend id), in
+        the order reads should prefer them.
+      write_quorum: An int (or a str holding one) with the number of replicas
+        that must take a write of a new file for it to succeed. Defaults to
+        all of them.
+    Raises:
+      BadConfigurationException: If no replicas were given, two of them are
+        for the same account, or the write quorum isn't between 1 and the
+        number of replicas.
+    """
+    if not storages:
+      raise BadConfigurationException('Need at least one storage to ' \
+        'replicate files to.')
+    backend_ids = [storage.get_backend_id() for storage in storages]
+    if len(set(backend_ids)) != len(backend_ids):
+      raise BadConfigurationException('A storage is configured more than ' \
+        'once in {0}'.format(backend_ids))
+    WrappingStorage.__init__(self, storages)
+    self.replicas = list(storages)
+    self.backend_ids = backend_ids
+
+    if write_quorum is None or write_quorum == '':
+      write_quorum = len(storages)
+    try:
+      self.write_quorum = int(write_quorum)
+    except ValueError:
+      self.write_quorum = 0
+    if not 1 <= self.write_quorum <= len(storages):
+      raise BadConfigurationException('The write quorum must be between 1 ' \
+        'and {0}, not {1}'.format(len(storages), write_quorum))
+
+
+  def get_backend_id(self):
+    """ Identifies the replicas and the write quorum.
+
+    Returns:
+      A str that identifies every replica, in order, and the write quorum.
+    """
+    return 'replicated-{0}:{1}'.format(self.write_quorum,
+      ','.join(self.backend_ids))
+
+
+  def run_on_replicas(self, function):
+    """ Calls a function with each replica, in parallel, and waits for all of
+    them to finish.
+
+    Args:
+      function: A function that takes a *Storage object.
+    Returns:
+      A tuple with a list of what the function returned for each replica (or
+        None where it raised), and a list of the Exception it raised for each
+        replica (or None where it didn't).
+    """
+    results = [None] * len(self.replicas)
+    errors = [None] * len(self.replicas)
+
+    def run(index):
+      try:
+        results[index] = function(self.replicas[index])
+      except Exception as exception:
+        errors[index] = exception
+
+    threads = [threading.Thread(target=run, args=(index,))
+      for index in range(1, len(self.replicas))]
+    for thread in threads:
+      thread.start()
+    run(0)
+    for thread in threads:
+      thread.join()
+    return results, errors
+
+
+  def find_copies(self, bucket_name, key_name):
+    """ Asks every replica, in parallel, if it has a file.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A list with True for each replica that has the file, False for each
+        one that doesn't, and None for each one that couldn't be asked.
+    """
+    results, errors = self.run_on_replicas(lambda storage:
+      storage.get_metadata(bucket_name, key_name))
+    return [None if error is not None else result is not None
+      for result, error in zip(results, errors)]
+
+
+  def may_have_copy(self, storage, bucket_name, key_name):
+    """ Checks if a replica that failed to overwrite or delete a file may
+    still have a copy of it.
+
+    Args:
+      storage: The *Storage object for the replica.
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      False if the replica doesn't have the file, and True if it does or
+        couldn't be asked.
+    """
+    try:
+      return storage.get_metadata(bucket_name, key_name) is not None
+    except Exception:
+      return True
+
+
+  def write(self, function, bucket_name, key_name):
+    """ Calls a function that writes a file to a replica with each replica,
+    in parallel, and checks that enough of them succeeded.
+
+    Unless every replica has to take the write anyway, the replicas are first
+    asked if they have the file, since those that may have a copy of it must
+    all take the write.
+
+    Args:
+      function: A function that takes a *Storage object.
+      bucket_name: A str with the name of the bucket the file is written to.
+      key_name: A str with the name of the key the file is written to.
+    Raises:
+      Exception: The first error a replica raised, if fewer than write_quorum
+        replicas succeeded, or a replica that may have a copy of the file
+        failed.
+    """
+    num_replicas = len(self.replicas)
+    holders = [False] * num_replicas
+    if self.write_quorum < num_replicas:
+      # Replicas that may have an old copy must take the write, unless so
+      # many replicas lack the file that it must be new (see above).
+      copies = self.find_copies(bucket_name, key_name)
+      if True in copies or \
+        copies.count(False) <= num_replicas - self.write_quorum:
+        holders = [copy is not False for copy in copies]
+
+    _, errors = self.run_on_replicas(function)
+    failures = [error for error in errors if error is not None]
+    if num_replicas - len(failures) < self.write_quorum:
+      raise failures[0]
+    for error, holder in zip(errors, holders):
+      if error is not None and holder:
+        raise error
+
+
+  def read(self, operation, function, accept=None):
+    """ Calls a function that reads from a replica with the replicas in order,
+    hedging as Hedger.call describes.
+
+    Args:
+      operation: A str naming the read, so that its deadline is only learned
+        from reads of the same kind.
+      function: A function that takes a *Storage object.
+      accept: A function that decides which answers count, as Hedger.call
+        describes, or None.
+    Returns:
+      The first answer, as Hedger.call describes.
+    """
+    hedger = Hedger.for_operation(self.get_backend_id(), operation)
+    return hedger.call([lambda replica=replica: function(replica)
+      for replica in self.replicas], accept=accept)
+
+
+  def does_bucket_exist(self, bucket_name):
+    """ Checks that a bucket exists in every replica.
+
+    Args:
+      bucket_name: A str with the name of the bucket.
+    Returns:
+      True if every replica has the bucket, and False otherwise.
+    """
+    return all(storage.does_bucket_exist(bucket_name)
+      for storage in self.replicas)
+
+
+  def create_bucket(self, bucket_name):
+    """ Creates a bucket in every replica that doesn't have it yet.
+
+    Args:
+      bucket_name: A str with the name of the bucket.
+    """
+    for storage in self.replicas:
+      if not storage.does_bucket_exist(bucket_name):
+        storage.create_bucket(bucket_name)
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists the keys in a bucket that start with the given prefix, by
+    listing every replica and merging their listings, so that files a replica
+    missed are still listed.
+
+    Args:
+      bucket_name: A str with the name of the bucket to list.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A dict for each key found, in the format that BaseStorage.list_keys
+        describes, from the first replica (in order) that has the key.
+    """
+    def list_replica(index):
+      for key_info in self.replicas[index].list_keys(bucket_name, prefix):
+        yield key_info['key'], index, key_info
+
+    last_key_name = None
+    for key_name, _, key_info in heapq.merge(*[list_replica(index)
+      for index in range(len(self.replicas))]):
+      if key_name != last_key_name:
+        yield key_info
+      last_key_name = key_name
+
+
+  def does_key_exist(self, bucket_name, key_name):
+    """ Checks if any replica has a file (see get_metadata). """
+    return self.get_metadata(bucket_name, key_name) is not None
+
+
+  def get_metadata(self, bucket_name, key_name):
+    """ Looks up a file in whichever replica answers first, as
+    BaseStorage.get_metadata describes. A replica that doesn't have the file
+    only gets the last word if none of the others do. """
+    return self.read('get_metadata', lambda storage: storage.get_metadata(
+      bucket_name, key_name), accept=lambda metadata: metadata is not None)
+
+
+  def download_file(self, destination, bucket_name, key_name):
+    """ Downloads a file from whichever replica finishes first, as
+    BaseStorage.download_file and Hedger.download describe. """
+    hedger = Hedger.for_operation(self.get_backend_id(), 'download_file')
+    hedger.download(destination, [lambda path, replica=replica:
+      replica.download_file(path, bucket_name, key_name)
+      for replica in self.replicas])
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Downloads part of a file from whichever replica answers first, as
+    BaseStorage.download_range describes. """
+    return self.read('download_range', lambda storage: storage.download_range(
+      bucket_name, key_name, start, end))
+
+
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
+    """ Uploads a file to every replica, as BaseStorage.upload_file
+    describes. """
+    self.write(lambda storage: storage.upload_file(source, bucket_name,
+      key_name, content_encoding), bucket_name, key_name)
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file within every replica, as BaseStorage.copy_key
+    describes. """
+    self.write(lambda storage: storage.copy_key(source_bucket_name,
+      source_key_name, bucket_name, key_name, size, content_encoding),
+      bucket_name, key_name)
+
+
+  def delete_file(self, bucket_name, key_name):
+    """ Deletes a file from every replica, as BaseStorage.delete_file
+    describes.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Raises:
+      Exception: The first error a replica raised, if a replica that failed
+        may still have a copy of the file, or every replica failed.
+    """
+    _, errors = self.run_on_replicas(lambda storage: storage.delete_file(
+      bucket_name, key_name))
+    for storage, error in zip(self.replicas, errors):
+      if error is not None and self.may_have_copy(storage, bucket_name,
+        key_name):
+        raise error
+    # If no replica deleted the file, it wasn't there to delete.
+    if None not in errors:
+      raise errors[0]
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes several files from every replica, in parallel.
+
+    Args:
+      bucket_name: A str with the name of the bucket the files are in.
+      key_names: A list of strs with the names of the keys to delete.
+    Returns:
+      A dict that maps the name of each key that a replica failed to delete
+        while it may still have a copy of the file (or that no replica
+        deleted) to a str explaining why.
+    """
+    results, errors = self.run_on_replicas(lambda storage: storage.delete_keys(
+      bucket_name, key_names))
+    failures = {}
+    for key_name in key_names:
+      reasons = []
+      for storage, result, error in zip(self.replicas, results, errors):
+        if error is not None:
+          reason = self.describe_error(error)
+        else:
+          reason = result.get(key_name)
+        if reason is None:
+          continue
+        if self.may_have_copy(storage, bucket_name, key_name):
+          failures[key_name] = reason
+          break
+        reasons.append(reason)
+      if len(reasons) == len(self.replicas):
+        failures[key_name] = reasons[0]
+    return failures
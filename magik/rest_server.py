@@ -9,9 +9,15 @@ See bin/magik-server for how this server is started and controlled. """
 
 
 # General-purpose Python library imports
+import base64
+import calendar
+import email.utils
 import json
-import mimetypes
 import os
+import re
+import tarfile
+import urllib
+import urlparse
 import uuid
 
 
@@ -21,17 +27,83 @@ import webapp2
 
 
 # Magik library imports
+from magik.compression_codec import CompressionCodec
+from magik.custom_exceptions import BadConfigurationException
+from magik.static_file_cache import StaticFileCache
 from magik.storage_factory import StorageFactory
+from magik.tar_stream import TarStream
 
 
-class RESTServer(webapp2.RequestHandler):
+class ConditionalRequestHandler(webapp2.RequestHandler):
+  """ ConditionalRequestHandler is the base class for handlers that let
+  clients revalidate their cached copies of what they serve, via the
+  If-None-Match and If-Modified-Since headers, and that send compressed
+  content to clients that accept it.
+  """
+
+
+  # A regex that matches the parameters of an Accept-Encoding entry that
+  # refuses the encoding (i.e., gives it a quality of zero).
+  REFUSED_ENCODING = re.compile(r'^\s*q\s*=\s*0(\.0*)?\s*$')
+
+
+  def is_not_modified(self, etag, mtime):
+    """ Checks if the client already has the current version of a file, via
+    the If-None-Match and If-Modified-Since headers it sent.
+
+    Args:
+      etag: A str with the file's quoted ETag.
+      mtime: An int with the file's modification time, in seconds since the
+        epoch.
+    Returns:
+      True if the client's copy is current, and False otherwise.
+    """
+    if_none_match = self.request.headers.get('If-None-Match')
+    if if_none_match:
+      # If-None-Match takes precedence over If-Modified-Since when both are
+      # given.
+      return any(tag.strip() in [etag, 'W/' + etag, '*']
+        for tag in if_none_match.split(','))
+
+    if_modified_since = self.request.headers.get('If-Modified-Since')
+    if if_modified_since:
+      since = email.utils.parsedate(if_modified_since)
+      return since is not None and mtime <= calendar.timegm(since)
+    return False
+
+
+  def accepts_encoding(self, encoding):
+    """ Checks if the client accepts content compressed with the given
+    encoding, via the Accept-Encoding header it sent.
+
+    Args:
+      encoding: A str with the name of the encoding (e.g., 'gzip').
+    Returns:
+      True if the client accepts the encoding, and False otherwise.
+    """
+    for entry in self.request.headers.get('Accept-Encoding', '').split(','):
+      name, _, parameters = entry.partition(';')
+      if name.strip().lower() in [encoding, '*'] and \
+        not self.REFUSED_ENCODING.match(parameters):
+        return True
+    return False
+
+
+class RESTServer(ConditionalRequestHandler):
   """ RESTServer defines a web server with routes to upload, download, and
   delete data from cloud storage platforms, which map to Magik methods.
 
   These routes are provided in a RESTful fashion: a GET /bucket/filename
   results in downloading the file 'filename' from the bucket 'bucket', and
   in the same fashion, a PUT /bucket/filename uploads data to the file
-  'filename' in the bucket 'bucket'.
+  'filename' in the bucket 'bucket'. Files are copied or moved within a cloud
+  storage platform with the WebDAV COPY and MOVE verbs, whose Destination
+  header names where the file should end up, and many small files can be
+  uploaded, downloaded or deleted in one request with a POST to BATCH_PATH.
+  Every file under a prefix can be downloaded at once as a tar archive, via a
+  GET with an 'archive' parameter. Small files can be kept in pack objects
+  (see PackStore) instead, by passing a 'packed' parameter to GET, DELETE and
+  batch uploads.
   """
 
 
@@ -44,7 +116,29 @@ class RESTServer(webapp2.RequestHandler):
   # operation finished unsuccessfully.
   FAILURE = 'failure'
 
- 
+
+  # The path that batches of operations are posted to.
+  BATCH_PATH = '/_batch'
+
+
+  # The content types of request bodies that are read as tar archives (which
+  # may be compressed) of files to upload.
+  TAR_TYPES = ('application/x-tar', 'application/x-gtar', 'application/gzip')
+
+
+  # A dict that maps each type of archive that prefixes can be downloaded as
+  # to the content type it is served with.
+  ARCHIVE_TYPES = {
+    'tar' : 'application/x-tar',
+    'tar.gz' : 'application/gzip'
+  }
+
+
+  # The name of the file added to the end of an archive to list the files
+  # that couldn't be downloaded into it, if there were any.
+  ARCHIVE_ERRORS_FILE = 'magik-errors.json'
+
+
   def get(self, path):
     """ Downloads a file from a cloud storage platform.
 
@@ -55,6 +149,22 @@ class RESTServer(webapp2.RequestHandler):
       credentials: Any AWS, GCS, Walrus, or Azure credential, that should be
         used to authenticate this user.
 
+    The file's ETag, Last-Modified, Content-Type and Content-Length are sent
+    as headers. Clients can ask for a single byte range of the file with a
+    Range header (optionally guarded by If-Range), which is fetched from the
+    cloud storage platform on its own, and can revalidate a copy they already
+    have with If-None-Match or If-Modified-Since.
+
+    Files that were stored compressed are sent as they are stored, with a
+    Content-Encoding header, to clients that accept their encoding, and are
+    decompressed first for clients that don't (in which case Range headers
+    are ignored, since the byte offsets would refer to the compressed file).
+
+    If an 'archive' parameter (one of ARCHIVE_TYPES) is given, the path is
+    treated as a prefix instead, and every file under it is sent in a single
+    archive, as get_archive describes. If a 'packed' parameter is given, the
+    file is read out of the bucket's packs, as get_packed describes.
+
     Args:
       path: A str that represents the name of the file to download in the cloud
         storage platform. The name of the bucket should be the first item, so
@@ -62,13 +172,49 @@ class RESTServer(webapp2.RequestHandler):
         'file/name.txt' should be downloaded from the bucket 'mybucket'.
     """
     args = self.get_args_from_request_params(self.request)
-    if args['name'] == '':
+    if not (args['name'] or args['stripes'] or args['replicas']):
       self.response.write(json.dumps([{
         'success' : False,
         'failure_reason' : 'no storage specified'
       }]))
       return
-    storage = StorageFactory.get_storage(args)
+    storage = StorageFactory.get_pooled_storage(args)
+
+    archive_type = self.request.get('archive')
+    if archive_type:
+      self.get_archive(storage, path, archive_type)
+      return
+    elif self.request.get('packed'):
+      self.get_packed(storage, path)
+      return
+
+    bucket_name, key_name = storage.parse_path(path)
+    metadata = self.write_metadata_headers(storage, path)
+    if metadata is None:
+      return
+
+    # A Range guarded by an If-Range that doesn't match means the client's
+    # partial copy is stale, so it gets the whole file instead.
+    byte_range = None
+    decompress = self.must_decompress(metadata)
+    if_range = self.request.headers.get('If-Range')
+    if not decompress and (not if_range or
+      if_range == self.response.headers['ETag']):
+      byte_range = self.get_byte_range(metadata['size'])
+
+    if byte_range is False:
+      self.response.set_status(416)
+      self.response.headers['Content-Range'] = 'bytes */{0}'.format(
+        metadata['size'])
+      return
+    elif byte_range is not None:
+      start, end = byte_range
+      self.response.set_status(206)
+      self.response.headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+        start, end, metadata['size'])
+      self.response.write(storage.download_range(bucket_name, key_name, start,
+        end))
+      return
 
     random_suffix = str(uuid.uuid4()).replace('-', '')[:10]
     destination = '/tmp/magik-temp-{0}'.format(random_suffix)
@@ -76,7 +222,10 @@ class RESTServer(webapp2.RequestHandler):
       'source' : path,
       'destination' : destination
     }]
-    result = storage.download_files(source_to_dest_list)
+    if decompress:
+      result = storage.download_files(source_to_dest_list, decompress=True)
+    else:
+      result = storage.download_files(source_to_dest_list)
     if result[0]['success'] == True:
       with open(destination, 'r') as file_handle:
         self.response.write(file_handle.read())
@@ -87,6 +236,257 @@ class RESTServer(webapp2.RequestHandler):
     return
 
 
+  def get_archive(self, storage, path, archive_type):
+    """ Sends every file under a prefix in a cloud storage platform as a
+    single tar archive, whose paths start with the bucket's name (so that it
+    can be posted back to BATCH_PATH as is).
+
+    Files are started in parallel and streamed into the archive a chunk at a
+    time as they arrive, so the archive starts going out before the last file
+    has been downloaded, and no file is ever held in memory whole. Files are
+    archived as they are stored, so files that were stored compressed carry
+    their Content-Encoding in a TarStream.CONTENT_ENCODING_HEADER, which
+    uploads to BATCH_PATH honour. Files that couldn't be downloaded (or that
+    failed part of the way through, and so are padded with NUL bytes) are
+    listed in ARCHIVE_ERRORS_FILE at the end of the archive, since the
+    response has already started by then.
+
+    Args:
+      storage: The *Storage object for the cloud storage platform to use.
+      path: A str with the bucket and key prefix to download, e.g.,
+        '/mybucket/logs/2014-'.
+      archive_type: A str with the type of archive to send, which should be
+        one of ARCHIVE_TYPES.
+    """
+    if archive_type not in self.ARCHIVE_TYPES:
+      self.response.set_status(400)
+      self.response.write(json.dumps([{
+        'success' : False,
+        'failure_reason' : 'unsupported archive type'
+      }]))
+      return
+
+    bucket_name, prefix = storage.parse_path(path)
+    if not storage.does_bucket_exist(bucket_name):
+      self.response.set_status(404)
+      self.response.write(json.dumps([{
+        'source' : path,
+        'success' : False,
+        'failure_reason' : 'bucket not found'
+      }]))
+      return
+
+    file_name = prefix.rstrip('/').split('/')[-1] or bucket_name
+    self.response.content_type = self.ARCHIVE_TYPES[archive_type]
+    self.response.headers['Content-Disposition'] = \
+      'attachment; filename="{0}.{1}"'.format(file_name, archive_type)
+    self.response.app_iter = self.write_archive(
+      storage.iter_download_prefix(path), compress=archive_type == 'tar.gz')
+
+
+  def get_packed(self, storage, path):
+    """ Sends a file that was uploaded into a pack, with a single ranged GET
+    of the pack it's in.
+
+    The file's ETag (its MD5) and Last-Modified time come from the pack's
+    index, so clients can revalidate their copies without the pack being
+    read at all.
+
+    Args:
+      storage: The *Storage object for the cloud storage platform to use.
+      path: A str with the bucket and logical key of the file.
+    """
+    bucket_name, key_name = storage.parse_path(path)
+    pack_store = storage.get_pack_store(bucket_name)
+    entry = pack_store.get_entry(key_name)
+    contents = None
+    if entry is not None:
+      etag = '"{0}"'.format(entry['md5'])
+      self.response.headers['ETag'] = etag
+      self.response.headers['Last-Modified'] = email.utils.formatdate(
+        entry['last_modified'], usegmt=True)
+      if self.is_not_modified(etag, int(entry['last_modified'])):
+        self.response.set_status(304)
+        return
+      contents = pack_store.read(key_name)
+
+    if contents is None:
+      self.response.set_status(404)
+      self.response.write(json.dumps([{
+        'source' : path,
+        'success' : False,
+        'failure_reason' : 'source not found'
+      }]))
+      return
+    self.response.write(contents)
+
+
+  def write_archive(self, results, compress):
+    """ Builds a tar archive from downloaded files, as get_archive describes.
+
+    Args:
+      results: An iterable of dicts, one per file, in the format that
+        BaseStorage.iter_download_prefix yields.
+      compress: A bool that indicates if the archive should be gzipped.
+    Yields:
+      A str with each part of the archive, as soon as it is ready.
+    """
+    tar_stream = TarStream(compress)
+    failures = []
+    for result in results:
+      if result['success']:
+        try:
+          for data in tar_stream.add_stream(result['source'].lstrip('/'),
+            result['size'], result['chunks'], result['last_modified'],
+            result['content_encoding']):
+            if data:
+              yield data
+          continue
+        except Exception as exception:
+          result['failure_reason'] = str(exception)
+
+      failures.append({
+        'source' : result['source'],
+        'failure_reason' : result['failure_reason']
+      })
+
+    data = ''
+    if failures:
+      data = tar_stream.add(self.ARCHIVE_ERRORS_FILE, ''.join(
+        json.dumps(failure) + '\n' for failure in failures))
+    yield data + tar_stream.close()
+
+
+  def head(self, path):
+    """ Looks up a file in a cloud storage platform without downloading it,
+    answering with the headers that a GET of the file would have.
+
+    This method expects the same parameters that the get method expects.
+    Lookups are answered from the shared MetadataCache when the file was
+    looked up recently with the same credentials, so frequent checks (e.g.,
+    health checks) don't each cost a request to the cloud storage platform.
+
+    Args:
+      path: A str that represents the name of the file to look up in the cloud
+        storage platform, in the format that the get method describes.
+    """
+    args = self.get_args_from_request_params(self.request)
+    if not (args['name'] or args['stripes'] or args['replicas']):
+      self.response.set_status(400)
+      return
+    storage = StorageFactory.get_pooled_storage(args)
+
+    # The size of a file that we would decompress isn't known until it has
+    # been decompressed.
+    metadata = self.write_metadata_headers(storage, path)
+    if metadata is not None and not self.must_decompress(metadata):
+      self.response.headers['Content-Length'] = str(metadata['size'])
+
+
+  def write_metadata_headers(self, storage, path):
+    """ Looks up a file's metadata, and writes the headers that describe it
+    (ETag, Last-Modified, Content-Type, Accept-Ranges and, for files that were
+    stored compressed, Content-Encoding and Vary) to the response.
+
+    If the file doesn't exist, the response becomes a 404, and if the client's
+    copy of the file is still current, it becomes a 304.
+
+    Args:
+      storage: The *Storage object for the cloud storage platform to use.
+      path: A str that represents the name of the file in the cloud storage
+        platform.
+    Returns:
+      A dict with the file's metadata, in the format that
+        BaseStorage.get_metadata describes, or None if the response is already
+        complete.
+    """
+    bucket_name, key_name = storage.parse_path(path)
+    metadata = storage.get_cached_metadata(bucket_name, key_name)
+    if metadata is None:
+      self.response.set_status(404)
+      self.response.write(json.dumps([{
+        'source' : path,
+        'success' : False,
+        'failure_reason' : 'source not found'
+      }]))
+      return None
+
+    etag = '"{0}"'.format(metadata['etag'])
+    accept_ranges = 'bytes'
+    if metadata.get('content_encoding') in CompressionCodec.ENCODINGS:
+      self.response.headers['Vary'] = 'Accept-Encoding'
+      if self.must_decompress(metadata):
+        # The decompressed file isn't byte-for-byte what the ETag describes.
+        etag = 'W/' + etag
+        accept_ranges = 'none'
+      else:
+        self.response.headers['Content-Encoding'] = \
+          metadata['content_encoding']
+
+    self.response.headers['ETag'] = etag
+    self.response.headers['Last-Modified'] = email.utils.formatdate(
+      metadata['last_modified'], usegmt=True)
+    self.response.headers['Accept-Ranges'] = accept_ranges
+    if metadata['content_type']:
+      self.response.headers['Content-Type'] = metadata['content_type']
+    if self.is_not_modified(etag, metadata['last_modified']):
+      self.response.set_status(304)
+      return None
+    return metadata
+
+
+  def must_decompress(self, metadata):
+    """ Decides if a file has to be decompressed before it is sent, because it
+    was stored compressed with an encoding that the client doesn't accept.
+
+    Args:
+      metadata: A dict with the file's metadata, in the format that
+        BaseStorage.get_metadata describes.
+    Returns:
+      True if the file must be decompressed, and False otherwise.
+    """
+    content_encoding = metadata.get('content_encoding')
+    return content_encoding in CompressionCodec.ENCODINGS and \
+      not self.accepts_encoding(content_encoding)
+
+
+  def get_byte_range(self, size):
+    """ Works out which bytes of a file the client asked for in its Range
+    header.
+
+    Only a single range is supported. Requests for several ranges at once get
+    the whole file, which HTTP allows.
+
+    Args:
+      size: An int with the size of the file, in bytes.
+    Returns:
+      None if the whole file should be sent, False if the range can't be
+        satisfied, and otherwise a tuple with the offsets of the first and last
+        (inclusive) bytes to send.
+    """
+    range_header = self.request.headers.get('Range', '').strip()
+    if not range_header.startswith('bytes=') or ',' in range_header:
+      return None
+
+    first, _, last = range_header[len('bytes='):].partition('-')
+    try:
+      if first.strip():
+        start = int(first)
+        end = int(last) if last.strip() else size - 1
+      else:
+        # A suffix range (e.g., bytes=-500) asks for the last bytes of the file.
+        start = max(size - int(last), 0)
+        end = size - 1
+    except ValueError:
+      return None
+
+    if start > end and first.strip() and last.strip():
+      return None
+    if start >= size or end < start:
+      return False
+    return start, min(end, size - 1)
+
+
   def put(self, path):
     """ Uploads a file to a cloud storage platform.
 
@@ -97,6 +497,8 @@ class RESTServer(webapp2.RequestHandler):
         's3').
       credentials: Any AWS, GCS, Walrus, or Azure credential, that should be
         used to authenticate this user.
+      compress: Optionally, the encoding (from CompressionCodec.ENCODINGS) to
+        store the file compressed with.
 
     Args:
       path: A str that represents the name of the file to upload in the cloud
@@ -113,15 +515,28 @@ class RESTServer(webapp2.RequestHandler):
       return
 
     args = self.get_args_from_request_params(self.request)
-    storage = StorageFactory.get_storage(args)
+    storage = StorageFactory.get_pooled_storage(args)
 
     source = self.write_temporary_file(file_contents)
     source_to_dest_list = [{
       'source' : source,
       'destination' : path
     }]
-    self.response.write(storage.upload_files(source_to_dest_list))
-    os.remove(source)
+    compression = self.request.get('compress')
+    try:
+      if compression:
+        self.response.write(storage.upload_files(source_to_dest_list,
+          compression=compression))
+      else:
+        self.response.write(storage.upload_files(source_to_dest_list))
+    except BadConfigurationException as exception:
+      self.response.set_status(400)
+      self.response.write(json.dumps([{
+        'success' : False,
+        'failure_reason' : str(exception)
+      }]))
+    finally:
+      os.remove(source)
     return
 
 
@@ -135,6 +550,9 @@ class RESTServer(webapp2.RequestHandler):
       credentials: Any AWS, GCS, Walrus, or Azure credential, that should be
         used to authenticate this user.
 
+    If a 'packed' parameter is given, the file is deleted from the bucket's
+    packs instead (see BaseStorage.delete_files_packed).
+
     Args:
       path: A str that represents the name of the file to delete from the cloud
         storage platform. The name of the bucket should be the first item, so
@@ -142,11 +560,272 @@ class RESTServer(webapp2.RequestHandler):
         'file/name.txt' should be uploaded to the bucket 'mybucket'.
     """
     args = self.get_args_from_request_params(self.request)
-    storage = StorageFactory.get_storage(args)
+    storage = StorageFactory.get_pooled_storage(args)
     files_to_delete = [{
       'source' : path
     }]
-    self.response.write(storage.delete_files(files_to_delete))
+    if self.request.get('packed'):
+      self.response.write(storage.delete_files_packed(files_to_delete))
+    else:
+      self.response.write(storage.delete_files(files_to_delete))
+
+
+  def copy(self, path):
+    """ Copies a file to a new key or bucket within a cloud storage platform,
+    without its contents passing through this server (where the platform
+    allows it).
+
+    In addition to the arguments below, this method also expects the request
+    to have a Destination header naming where the file should be copied to
+    (e.g., '/otherbucket/file/name.txt'), and the same parameters that the get
+    method expects.
+
+    Args:
+      path: A str that represents the name of the file to copy in the cloud
+        storage platform, in the format that the get method describes.
+    """
+    self.copy_or_move(path, move=False)
+
+
+  def move(self, path):
+    """ Moves a file to a new key or bucket within a cloud storage platform,
+    by copying it like the copy method does and then deleting the original.
+
+    Args:
+      path: A str that represents the name of the file to move in the cloud
+        storage platform, in the format that the get method describes.
+    """
+    self.copy_or_move(path, move=True)
+
+
+  def copy_or_move(self, path, move):
+    """ Copies or moves a file within a cloud storage platform, as the copy and
+    move methods describe.
+
+    Args:
+      path: A str that represents the name of the file to copy in the cloud
+        storage platform.
+      move: A bool that indicates if the original file should be deleted once
+        it has been copied.
+    """
+    # WebDAV clients send the whole URL, so only keep its path.
+    destination = urllib.unquote(urlparse.urlparse(
+      self.request.headers.get('Destination', '')).path)
+    if destination == '':
+      self.response.write(json.dumps([{
+        'success' : False,
+        'failure_reason' : 'no destination specified'
+      }]))
+      return
+
+    args = self.get_args_from_request_params(self.request)
+    storage = StorageFactory.get_pooled_storage(args)
+    source_to_dest_list = [{
+      'source' : path,
+      'destination' : destination
+    }]
+    if move:
+      self.response.write(storage.move_files(source_to_dest_list))
+    else:
+      self.response.write(storage.copy_files(source_to_dest_list))
+
+
+  def post(self, path):
+    """ Runs a batch of uploads, downloads and deletions of small files at
+    once, through one pooled connection to a cloud storage platform, and
+    streams back the result of each as soon as it finishes.
+
+    The request body holds the operations to run, in one of three formats,
+    picked by its Content-Type:
+      application/x-tar (or a compressed tar): each file in the archive is
+        uploaded, to the path it has in the archive (whose first directory is
+        the bucket).
+      multipart/form-data: each file in the form is uploaded, to the path
+        named by its field's name.
+      Anything else: one JSON object per line, each with an 'op' of 'upload',
+        'download' or 'delete'. Uploads have a 'destination' and the base64
+        encoded 'body' to upload there, and downloads and deletions have the
+        'source' to download or delete.
+
+    The response has one JSON object per line, one per operation, in the
+    order they finish. Each is the operation that was asked for, with its
+    'success' (and 'failure_reason', if it failed), and downloads have the
+    base64 encoded 'body' of the file that was downloaded.
+
+    If a 'packed' parameter is given, the uploads are written into packs (see
+    BaseStorage.iter_upload_packed) instead of one object per file, and any
+    other operations fail, since only uploads can be packed.
+
+    This method also expects the same parameters that the get method expects.
+
+    Args:
+      path: A str with the path that was posted to, which must be BATCH_PATH.
+    """
+    if path != self.BATCH_PATH:
+      self.response.set_status(405)
+      self.response.headers['Allow'] = 'GET, HEAD, PUT, DELETE, COPY, MOVE'
+      return
+
+    args = self.get_args_from_request_params(self.request)
+    if not (args['name'] or args['stripes'] or args['replicas']):
+      self.response.set_status(400)
+      self.response.write(json.dumps([{
+        'success' : False,
+        'failure_reason' : 'no storage specified'
+      }]))
+      return
+    storage = StorageFactory.get_pooled_storage(args)
+
+    content_type = self.request.content_type
+    if content_type in self.TAR_TYPES:
+      operations = self.read_tar_operations(self.request.body_file)
+    elif content_type == 'multipart/form-data':
+      operations = self.read_multipart_operations(self.request)
+    else:
+      operations = self.read_json_operations(self.request.body_file)
+
+    # Hand the results to the web server as they come in, rather than holding
+    # the whole batch in memory.
+    self.response.content_type = 'application/x-ndjson'
+    if self.request.get('packed'):
+      results = self.run_packed_uploads(storage, operations)
+    else:
+      results = storage.iter_run_operations(operations)
+    self.response.app_iter = self.write_batch_results(results)
+
+
+  def run_packed_uploads(self, storage, operations):
+    """ Uploads the files in a batch into packs, and fails the batch's other
+    operations.
+
+    Args:
+      storage: The *Storage object for the cloud storage platform to use.
+      operations: An iterable of dicts, in the format that
+        BaseStorage.iter_run_operations takes.
+    Yields:
+      Each dict from the iterable, once it has been run, in the format that
+        BaseStorage.iter_run_operations yields.
+    """
+    others = []
+    def uploads():
+      for item in operations:
+        if item.get('op') == 'upload' and \
+          storage.get_operation_bucket(item) is not None:
+          yield item
+        else:
+          others.append(item)
+
+    for result in storage.iter_upload_packed(uploads()):
+      yield result
+    for item in others:
+      item['success'] = False
+      item['failure_reason'] = 'only uploads can be packed'
+      yield item
+
+
+  def read_json_operations(self, body_file):
+    """ Reads the operations in a batch that was posted as one JSON object per
+    line.
+
+    Args:
+      body_file: A file-like object with the request body.
+    Yields:
+      A dict for each operation, in the format that
+        BaseStorage.iter_run_operations takes. Lines that aren't valid
+        operations are yielded with just their 'line' number, so that they
+        fail when they are run.
+    """
+    line_number = 0
+    for line in iter(body_file.readline, ''):
+      line_number += 1
+      if not line.strip():
+        continue
+
+      try:
+        item = json.loads(line)
+      except ValueError:
+        item = None
+      if not isinstance(item, dict):
+        yield {'line' : line_number}
+        continue
+
+      # Only bodies that decode become contents to upload.
+      item.pop('contents', None)
+      if item.get('op') == 'upload' and 'body' in item:
+        try:
+          item['contents'] = base64.b64decode(item.pop('body'))
+        except (TypeError, ValueError):
+          pass
+      yield item
+
+
+  def read_tar_operations(self, body_file):
+    """ Reads the files in a batch that was posted as a tar archive, as
+    uploads.
+
+    The archive is read as a stream, so each file only needs to be held in
+    memory until it has been uploaded. Files with a
+    TarStream.CONTENT_ENCODING_HEADER (e.g., from an archive that get_archive
+    sent) are uploaded with that Content-Encoding.
+
+    Args:
+      body_file: A file-like object with the request body.
+    Yields:
+      A dict for each file in the archive, in the format that
+        BaseStorage.iter_run_operations takes.
+    """
+    archive = tarfile.open(fileobj=body_file, mode='r|*')
+    try:
+      for member in archive:
+        if not member.isfile():
+          continue
+        yield {
+          'op' : 'upload',
+          'destination' : '/' + member.name.lstrip('/'),
+          'contents' : archive.extractfile(member).read(),
+          'content_encoding' : member.pax_headers.get(
+            TarStream.CONTENT_ENCODING_HEADER)
+        }
+    finally:
+      archive.close()
+
+
+  def read_multipart_operations(self, request):
+    """ Reads the files in a batch that was posted as a multipart form, as
+    uploads.
+
+    Args:
+      request: The web request whose form holds the files to upload, each in
+        a field named after the path it should be uploaded to.
+    Yields:
+      A dict for each file in the form, in the format that
+        BaseStorage.iter_run_operations takes.
+    """
+    for name, value in request.POST.items():
+      # Fields that aren't files hold the credentials instead.
+      if getattr(value, 'filename', None) is None:
+        continue
+      yield {
+        'op' : 'upload',
+        'destination' : name,
+        'contents' : value.file.read()
+      }
+
+
+  def write_batch_results(self, results):
+    """ Formats the results of a batch as one JSON object per line.
+
+    Args:
+      results: An iterable of dicts, one per operation in the batch, in the
+        format that BaseStorage.iter_run_operations yields.
+    Yields:
+      A str with the line of JSON for each result.
+    """
+    for result in results:
+      contents = result.pop('contents', None)
+      if result.get('op') == 'download' and result.get('success'):
+        result['body'] = base64.b64encode(contents)
+      yield json.dumps(result) + '\n'
 
 
   def get_args_from_request_params(self, request):
@@ -159,12 +838,17 @@ class RESTServer(webapp2.RequestHandler):
         credential has a value of an empty string.
     Returns:
       A dict that maps each credential to the value that should be used for it,
-        and an additional key for the name of the cloud storage to use.
+        and additional keys for the name of the cloud storage to use, how
+        its keys are sharded, the storages its files are striped or
+        replicated across, and how its requests time out and are hedged (see
+        StorageFactory.get_storage).
     """
     args = {}
 
     for item in ['name', 'AWS_ACCESS_KEY', 'AWS_SECRET_KEY', 'GCS_ACCESS_KEY',
-      'GCS_SECRET_KEY', 'S3_URL', 'AZURE_ACCOUNT_NAME', 'AZURE_ACCOUNT_KEY']:
+      'GCS_SECRET_KEY', 'S3_URL', 'AZURE_ACCOUNT_NAME', 'AZURE_ACCOUNT_KEY',
+      'shard_prefixes', 'shard_buckets', 'shard_bucket_suffix', 'stripes',
+      'replicas', 'write_quorum', 'timeout', 'hedge_reads']:
       args[item] = request.get(item)
 
     return args
@@ -259,34 +943,58 @@ class MagikUI(webapp2.RequestHandler):
     self.response.out.write(request.text)
 
 
-class StaticFileHandler(webapp2.RequestHandler):
+class StaticFileHandler(ConditionalRequestHandler):
   """ As webapp2 doesn't have any built-in capabilities to handle static files,
   we implement our own here.
 
-  StaticFileHandler reads the local filesystem to read files specified in the
-  URL and serve them accordingly.
-
-  TODO(cgb): Make sure that callers can't read files outside of magik's
-  directory.
+  StaticFileHandler serves the files in magik's static directory from a
+  StaticFileCache, gzipped if the client accepts it, and with the caching
+  headers that let browsers skip downloading files they already have. Paths
+  that resolve to somewhere outside of the static directory are refused.
   """
 
 
+  # The directory that static files are served from.
+  STATIC_DIRECTORY = os.path.realpath(os.path.join(os.path.dirname(__file__),
+    '..', 'static'))
+
+
+  # The number of seconds that browsers may use a static file for without
+  # checking if it has changed.
+  MAX_AGE = 3600
+
+
   def get(self, path):
-    """ Interprets path as a file to read in magik's homedir, reads it, and
-    serves it.
+    """ Interprets path as a file to read in magik's static directory, and
+    serves it (or a 304, if the client's copy is still current).
 
     Args:
-      path: A str representing the file to serve.
+      path: A str representing the file to serve, relative to the static
+        directory.
     """
-    abs_path = os.path.dirname(__file__) + "/../static/" + path
-    if os.path.isdir(abs_path): #or abs_path.find(os.getcwd()) != 0:
+    abs_path = os.path.realpath(os.path.join(self.STATIC_DIRECTORY, path))
+    if not abs_path.startswith(self.STATIC_DIRECTORY + os.sep) or \
+      os.path.isdir(abs_path):
       self.response.set_status(403)
       return
 
-    try:
-      with open(abs_path, 'r') as file_handle:
-        self.response.headers['Content-Type'] = mimetypes.guess_type(
-          abs_path)[0]
-        self.response.out.write(file_handle.read())
-    except:
+    entry = StaticFileCache.get(abs_path)
+    if entry is None:
       self.response.set_status(404)
+      return
+
+    self.response.headers['Content-Type'] = entry['content_type']
+    self.response.headers['ETag'] = entry['etag']
+    self.response.headers['Last-Modified'] = entry['last_modified']
+    self.response.headers['Cache-Control'] = 'public, max-age={0}'.format(
+      self.MAX_AGE)
+    self.response.headers['Vary'] = 'Accept-Encoding'
+    if self.is_not_modified(entry['etag'], entry['mtime']):
+      self.response.set_status(304)
+      return
+
+    if entry['gzipped'] is not None and self.accepts_encoding('gzip'):
+      self.response.headers['Content-Encoding'] = 'gzip'
+      self.response.out.write(entry['gzipped'])
+    else:
+      self.response.out.write(entry['contents'])
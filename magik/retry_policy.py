@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+""" retry_policy.py provides a single class, RetryPolicy, that decides if and
+when an operation that failed against a storage platform should be tried
+again. """
+
+
+# General-purpose Python library imports
+import random
+import threading
+import time
+
+
+class RetryPolicy():
+  """ RetryPolicy retries operations that fail with errors that are worth
+  retrying (e.g., throttling or a dropped connection), waiting a capped,
+  exponentially growing amount of time with full jitter between attempts.
+
+  Each RetryPolicy also has a retry budget: the total number of retries it
+  allows across every operation it is used for. A batch uses one RetryPolicy
+  for all of its items, so that a storage platform that is down makes the
+  batch fail quickly instead of retrying every item over and over.
+  """
+
+
+  # The number of times an operation is attempted (including the first
+  # attempt) before we give up on it.
+  DEFAULT_MAX_ATTEMPTS = 5
+
+
+  # The number of seconds we wait (on average) before the first retry.
+  DEFAULT_BASE_DELAY = 0.2
+
+
+  # The maximum number of seconds we wait between two attempts.
+  DEFAULT_MAX_DELAY = 20.0
+
+
+  # The smallest retry budget that a batch gets, no matter how few items it
+  # has.
+  MIN_RETRY_BUDGET = 20
+
+
+  # The number of retries a batch gets per item, on top of MIN_RETRY_BUDGET.
+  RETRY_BUDGET_PER_ITEM = 0.1
+
+
+  def __init__(self, max_attempts=None, base_delay=None, max_delay=None,
+    retry_budget=None, budget_per_item=0):
+    """ Creates a new RetryPolicy.
+
+    Args:
+      max_attempts: An int with the number of times an operation is attempted
+        before we give up on it. Defaults to DEFAULT_MAX_ATTEMPTS.
+      base_delay: A float with the number of seconds to wait before the first
+        retry. Defaults to DEFAULT_BASE_DELAY.
+      max_delay: A float with the maximum number of seconds to wait between
+        attempts. Defaults to DEFAULT_MAX_DELAY.
+      retry_budget: An int with the total number of retries this policy allows,
+        or None for no limit.
+      budget_per_item: A float with the number of retries that add_items adds
+        to the budget for each item.
+    """
+    if max_attempts is None:
+      max_attempts = self.DEFAULT_MAX_ATTEMPTS
+    if base_delay is None:
+      base_delay = self.DEFAULT_BASE_DELAY
+    if max_delay is None:
+      max_delay = self.DEFAULT_MAX_DELAY
+
+    self.max_attempts = max_attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.retries_left = retry_budget
+    self.budget_per_item = budget_per_item
+    self.lock = threading.Lock()
+
+
+  @classmethod
+  def for_batch(cls, num_items):
+    """ Creates a RetryPolicy with the default settings and a retry budget that
+    grows with the size of a batch.
+
+    Args:
+      num_items: An int with the number of items in the batch.
+    Returns:
+      A RetryPolicy.
+    """
+    return cls(retry_budget=cls.MIN_RETRY_BUDGET +
+      int(num_items * cls.RETRY_BUDGET_PER_ITEM))
+
+
+  @classmethod
+  def for_stream(cls):
+    """ Creates a RetryPolicy with the default settings for a batch whose size
+    isn't known up front, whose retry budget grows as items are added to it.
+
+    Returns:
+      A RetryPolicy.
+    """
+    return cls(retry_budget=cls.MIN_RETRY_BUDGET,
+      budget_per_item=cls.RETRY_BUDGET_PER_ITEM)
+
+
+  def add_items(self, num_items):
+    """ Grows the retry budget for items that were added to a batch after it
+    started. Policies without a per-item budget are left alone.
+
+    Args:
+      num_items: An int with the number of items that were added.
+    """
+    with self.lock:
+      if self.retries_left is not None:
+        self.retries_left += self.budget_per_item * num_items
+
+
+  def call(self, function, is_retryable):
+    """ Calls a function, retrying it if it fails with an error worth retrying.
+
+    Args:
+      function: A function that takes no arguments.
+      is_retryable: A function that takes an Exception and returns True if the
+        operation that raised it is worth retrying.
+    Returns:
+      Whatever the function returns.
+    Raises:
+      Exception: The last exception the function raised, if it failed with an
+        error that isn't worth retrying, ran out of attempts, or the retry
+        budget ran out.
+    """
+    attempt = 1
+    while True:
+      try:
+        return function()
+      except Exception as exception:
+        if attempt >= self.max_attempts or not is_retryable(exception) or \
+          not self.take_retry():
+          raise
+      time.sleep(self.get_delay(attempt))
+      attempt += 1
+
+
+  def take_retry(self):
+    """ Takes one retry out of the retry budget.
+
+    Returns:
+      True if there was a retry left in the budget, and False otherwise.
+    """
+    with self.lock:
+      if self.retries_left is None:
+        return True
+      if self.retries_left <= 0:
+        return False
+      self.retries_left -= 1
+      return True
+
+
+  def get_delay(self, attempt):
+    """ Picks how long to wait before retrying an operation, using exponential
+    backoff with full jitter, so that many threads that fail at once don't all
+    retry at once.
+
+    Args:
+      attempt: An int with the number of attempts made so far.
+    Returns:
+      A float with the number of seconds to wait.
+    """
+    return random.uniform(0, min(self.max_delay,
+      self.base_delay * (2 ** (attempt - 1))))
@@ -4,32 +4,80 @@
 interact with Amazon's Simple Storage Service (S3). """
 
 
+# General-purpose Python library imports
+import math
+import os
+import StringIO
+
+
 # Third-party libraries
+import boto.exception
 import boto.s3.connection
 import boto.s3.key
+import boto.s3.multipart
 
 
 # S3Storage-specific imports
 from magik.base_storage import BaseStorage
 from magik.custom_exceptions import BadConfigurationException
+from magik.rate_limiter import RateLimiter
 
 
 class S3Storage(BaseStorage):
   """ S3Storage provides callers with an interface to Amazon S3. """
 
 
+  # Resumable uploads of files at least this large (in bytes) are done as
+  # multipart uploads, so that they can be resumed part by part.
+  MULTIPART_THRESHOLD = 64 * 1024 * 1024
+
+
+  # The size (in bytes) of each part in a multipart upload.
+  MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+  # Files at least this large (in bytes) are copied in parts, since S3 can
+  # only copy up to 5 GB in a single request.
+  MULTIPART_COPY_THRESHOLD = 5 * 1024 * 1024 * 1024
+
+
+  # The size (in bytes) of each part in a multipart copy. Since S3 allows up to
+  # MAX_PARTS parts, this lets us copy files of up to 5 TB.
+  MULTIPART_COPY_CHUNK_SIZE = 512 * 1024 * 1024
+
+
+  # The most parts that S3 allows a multipart upload to have.
+  MAX_PARTS = 10000
+
+
+  # The number of keys we delete per request when deleting everything under a
+  # prefix. S3's multi-object delete takes up to 1000 keys.
+  DELETE_BATCH_SIZE = 1000
+
+
+  # The error codes that S3 returns when a request failed for a reason that
+  # may well go away if we try again (e.g., we're being throttled).
+  RETRYABLE_ERROR_CODES = ('InternalError', 'RequestTimeout',
+    'ServiceUnavailable', 'SlowDown', 'Throttling')
+
+
+  # The error codes that S3 returns when we're sending requests too quickly.
+  THROTTLING_ERROR_CODES = ('SlowDown', 'Throttling')
+
+
   def __init__(self, parameters):
     """ Creates a new S3Storage object, with the AWS_ACCESS_KEY and
     AWS_SECRET_KEY that the user has specified.
 
     Args:
       parameters: A dict that contains the credentials necessary to authenticate
-        with S3.
+        with S3, and optionally a 'timeout' (see BaseStorage.get_timeout).
     Raises:
       BadConfigurationException: If AWS_ACCESS_KEY or AWS_SECRET_KEY is not
-        specified.
+        specified, or the timeout isn't a positive number.
     """
     self.setup_s3_credentials(parameters)
+    self.timeout = self.get_timeout(parameters)
     self.connection = self.create_s3_connection()
     # TODO(cgb): Consider validating the user's credentials here, and throw
     # a BadConfigurationException if they aren't valid.
@@ -39,11 +87,14 @@ class S3Storage(BaseStorage):
     """ Uses boto to connect to Amazon S3.
 
     Returns:
-      A boto.s3.Connection, which represents a connection to Amazon S3.
+      A boto.s3.Connection, which represents a connection to Amazon S3, whose
+        HTTP connections time out after self.timeout seconds.
     """
-    return boto.s3.connection.S3Connection(
+    connection = boto.s3.connection.S3Connection(
       aws_access_key_id=self.aws_access_key,
       aws_secret_access_key=self.aws_secret_key)
+    connection.http_connection_kwargs['timeout'] = self.timeout
+    return connection
 
 
   def setup_s3_credentials(self, parameters):
@@ -67,6 +118,21 @@ class S3Storage(BaseStorage):
     self.aws_secret_key = parameters['AWS_SECRET_KEY']
 
 
+  def get_backend_id(self):
+    """ Identifies the Amazon S3 account that this object talks to.
+
+    Returns:
+      A str that identifies the storage platform and account.
+    """
+    return 's3:{0}'.format(self.aws_access_key)
+
+
+  def get_credentials_id(self):
+    """ Identifies the Amazon S3 account and secret key that this object uses,
+    as BaseStorage.get_credentials_id describes. """
+    return self.hash_credentials(self.aws_secret_key)
+
+
   def does_bucket_exist(self, bucket_name):
     """ Queries Amazon S3 to see if the specified bucket exists or not.
 
@@ -92,7 +158,7 @@ class S3Storage(BaseStorage):
     self.connection.create_bucket(bucket_name)
 
 
-  def upload_file(self, source, bucket_name, key_name):
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
     """ Uploads a file from the local filesystem to Amazon S3.
 
     Args:
@@ -102,11 +168,191 @@ class S3Storage(BaseStorage):
         be placed in.
       key_name: A str containing the name of the key that the file should be
         placed in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
     """
     bucket = self.connection.lookup(bucket_name)
     key = boto.s3.key.Key(bucket)
     key.key = key_name
-    key.set_contents_from_filename(source)
+    key.set_contents_from_filename(source,
+      **self.get_upload_args(content_encoding))
+
+
+  def get_stream_chunk_size(self, size):
+    """ Decides how large the parts of a multipart upload should be when a
+    file is streamed to Amazon S3.
+
+    Args:
+      size: An int with the size of the file to stream, in bytes.
+    Returns:
+      An int with the number of bytes each part should have: STREAM_CHUNK_SIZE,
+        unless the file is too large for that many parts to fit in S3's limit
+        of MAX_PARTS.
+    """
+    return max(self.STREAM_CHUNK_SIZE,
+      int(math.ceil(float(size) / self.MAX_PARTS)))
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Uploads a file to Amazon S3 from a stream of chunks, as a multipart
+    upload with one part per chunk if there is more than one chunk.
+
+    Args:
+      chunks: An iterator of strs, each as long as get_stream_chunk_size says
+        (except for the last one), whose concatenation is the file to upload.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    bucket = self.connection.get_bucket(bucket_name, validate=False)
+    if size <= self.get_stream_chunk_size(size):
+      key = boto.s3.key.Key(bucket)
+      key.key = key_name
+      key.set_contents_from_string(''.join(chunks),
+        **self.get_upload_args(content_encoding))
+      return
+
+    multipart_upload = bucket.initiate_multipart_upload(key_name,
+      **self.get_encoding_args(content_encoding))
+    try:
+      for part_num, chunk in enumerate(chunks, 1):
+        multipart_upload.upload_part_from_file(StringIO.StringIO(chunk),
+          part_num, size=len(chunk), **self.get_throttle_args())
+      multipart_upload.complete_upload()
+    except Exception:
+      multipart_upload.cancel_upload()
+      raise
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists the keys in an Amazon S3 bucket that start with the given prefix.
+
+    boto pages through the listing for us (1000 keys at a time), so this only
+    holds one page of the listing in memory at once.
+
+    Args:
+      bucket_name: A str containing the name of the bucket to list.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A dict for each key found, in the format that BaseStorage.list_keys
+        describes.
+    """
+    bucket = self.connection.lookup(bucket_name)
+    if not bucket:
+      return
+
+    for key in bucket.list(prefix=prefix):
+      etag = key.etag.strip('"')
+      yield {
+        'key' : key.name,
+        'size' : key.size,
+        'etag' : etag,
+        'md5' : self.etag_to_md5(etag),
+        'last_modified' : self.parse_timestamp(key.last_modified)
+      }
+
+
+  def etag_to_md5(self, etag):
+    """ Finds the MD5 of an object from its ETag.
+
+    Args:
+      etag: A str containing the ETag of an object, without quotes.
+    Returns:
+      A str containing the hex-encoded MD5 of the object, or None if the ETag
+        isn't an MD5. This is the case for objects uploaded in multiple parts,
+        whose ETags end with a '-' followed by the number of parts.
+    """
+    if '-' in etag:
+      return None
+    return etag
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file from the local filesystem to Amazon S3, as a multipart
+    upload if it is large, recording the ID of the upload and each part that
+    was uploaded so that the upload can be resumed.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded to Amazon S3.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState that holds whatever progress a previous
+        attempt at this upload made, and that new progress should be recorded
+        in.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
+    """
+    file_size = os.path.getsize(source)
+    if file_size < self.MULTIPART_THRESHOLD:
+      self.upload_file(source, bucket_name, key_name, content_encoding)
+      return
+
+    bucket = self.connection.lookup(bucket_name)
+    resuming = transfer_state.get('upload_id') is not None
+    try:
+      self.upload_parts(source, file_size, bucket, key_name, transfer_state,
+        content_encoding)
+    except boto.exception.S3ResponseError as exception:
+      # The upload we were resuming may have been aborted or expired, in which
+      # case all we can do is start over.
+      if not resuming or exception.error_code != 'NoSuchUpload':
+        raise
+      transfer_state.clear()
+      self.upload_parts(source, file_size, bucket, key_name, transfer_state,
+        content_encoding)
+
+
+  def upload_parts(self, source, file_size, bucket, key_name, transfer_state,
+    content_encoding=None):
+    """ Uploads each part of a file that hasn't been uploaded yet as part of a
+    multipart upload, and then completes the upload.
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded to Amazon S3.
+      file_size: An int with the size of the file, in bytes.
+      bucket: The boto.s3.bucket.Bucket that the file should be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState with the ID of the multipart upload and
+        the parts that were already uploaded, if any.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    upload_id = transfer_state.get('upload_id')
+    if upload_id:
+      multipart_upload = boto.s3.multipart.MultiPartUpload(bucket)
+      multipart_upload.key_name = key_name
+      multipart_upload.id = upload_id
+    else:
+      multipart_upload = bucket.initiate_multipart_upload(key_name,
+        **self.get_encoding_args(content_encoding))
+      transfer_state.set('upload_id', multipart_upload.id)
+
+    uploaded_parts = set(transfer_state.get('parts', []))
+    num_parts = int(math.ceil(float(file_size) / self.MULTIPART_CHUNK_SIZE))
+    with open(source, 'rb') as file_handle:
+      for part_num in range(1, num_parts + 1):
+        if part_num in uploaded_parts:
+          continue
+
+        offset = (part_num - 1) * self.MULTIPART_CHUNK_SIZE
+        file_handle.seek(offset)
+        multipart_upload.upload_part_from_file(file_handle, part_num,
+          size=min(self.MULTIPART_CHUNK_SIZE, file_size - offset),
+          **self.get_throttle_args())
+        transfer_state.add('parts', part_num)
+
+    multipart_upload.complete_upload()
 
 
   def does_key_exist(self, bucket_name, key_name):
@@ -126,6 +372,43 @@ class S3Storage(BaseStorage):
     return key.exists()
 
 
+  def get_metadata(self, bucket_name, key_name):
+    """ Queries Amazon S3 for information about the named file, via a HEAD
+    request.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file exists
+        in.
+      key_name: A str containing the name of the key that identifies the file.
+    Returns:
+      None if the file doesn't exist, and otherwise a dict in the format that
+        BaseStorage.get_metadata describes.
+    """
+    # Skip validating the bucket, since it costs an extra request and the HEAD
+    # on the key fails anyway if the bucket doesn't exist.
+    bucket = self.connection.get_bucket(bucket_name, validate=False)
+    try:
+      key = bucket.get_key(key_name)
+    except boto.exception.S3ResponseError as exception:
+      if exception.status == 404:
+        return None
+      raise
+
+    if not key:
+      return None
+
+    etag = key.etag.strip('"')
+    return {
+      'key' : key_name,
+      'size' : int(key.size),
+      'etag' : etag,
+      'md5' : self.etag_to_md5(etag),
+      'content_type' : key.content_type,
+      'content_encoding' : key.content_encoding,
+      'last_modified' : self.parse_timestamp(key.last_modified)
+    }
+
+
   def download_file(self, destination, bucket_name, key_name):
     """ Downloads a file to the local filesystem from Amazon S3.
 
@@ -140,7 +423,89 @@ class S3Storage(BaseStorage):
     bucket = self.connection.lookup(bucket_name)
     key = boto.s3.key.Key(bucket)
     key.key = key_name
-    key.get_contents_to_filename(destination)
+    key.get_contents_to_filename(destination, **self.get_throttle_args())
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Downloads part of a file from Amazon S3.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the file should
+        be downloaded from.
+      key_name: A str containing the name of the key that the file should be
+        downloaded from.
+      start: An int with the offset of the first byte to download.
+      end: An int with the offset of the last byte to download (inclusive).
+    Returns:
+      A str containing the bytes in the requested range.
+    """
+    bucket = self.connection.lookup(bucket_name)
+    key = boto.s3.key.Key(bucket)
+    key.key = key_name
+    return key.get_contents_as_string(headers={
+      'Range' : 'bytes={0}-{1}'.format(start, end)
+    }, **self.get_throttle_args())
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file to a new key within Amazon S3, via a PUT-Copy request (or
+    a multipart copy, if the file is large), so that its contents never leave
+    S3. A PUT-Copy keeps the file's headers, and a multipart copy is started
+    with its Content-Encoding.
+
+    Args:
+      source_bucket_name: A str containing the name of the bucket that the
+        file should be copied from.
+      source_key_name: A str containing the name of the key that the file
+        should be copied from.
+      bucket_name: A str containing the name of the bucket that the file should
+        be copied to.
+      key_name: A str containing the name of the key that the file should be
+        copied to.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding the file is stored
+        with, or None if it isn't encoded.
+    """
+    bucket = self.connection.get_bucket(bucket_name, validate=False)
+    if size < self.MULTIPART_COPY_THRESHOLD:
+      bucket.copy_key(key_name, source_bucket_name, source_key_name)
+    else:
+      self.copy_parts(source_bucket_name, source_key_name, bucket, key_name,
+        size, content_encoding)
+
+
+  def copy_parts(self, source_bucket_name, source_key_name, bucket, key_name,
+    size, content_encoding=None):
+    """ Copies a file to a new key within Amazon S3 one part at a time, as a
+    multipart upload whose parts are copied from the original file.
+
+    Args:
+      source_bucket_name: A str containing the name of the bucket that the
+        file should be copied from.
+      source_key_name: A str containing the name of the key that the file
+        should be copied from.
+      bucket: The boto.s3.bucket.Bucket that the file should be copied to.
+      key_name: A str containing the name of the key that the file should be
+        copied to.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    multipart_upload = bucket.initiate_multipart_upload(key_name,
+      **self.get_encoding_args(content_encoding))
+    try:
+      num_parts = int(math.ceil(float(size) / self.MULTIPART_COPY_CHUNK_SIZE))
+      for part_num in range(1, num_parts + 1):
+        start = (part_num - 1) * self.MULTIPART_COPY_CHUNK_SIZE
+        end = min(start + self.MULTIPART_COPY_CHUNK_SIZE, size) - 1
+        multipart_upload.copy_part_from_key(source_bucket_name,
+          source_key_name, part_num, start, end)
+      multipart_upload.complete_upload()
+    except Exception:
+      # Don't leave the parts we already copied lying around (and billed for).
+      multipart_upload.cancel_upload()
+      raise
 
 
   def delete_file(self, bucket_name, key_name):
@@ -156,3 +521,119 @@ class S3Storage(BaseStorage):
     key = boto.s3.key.Key(bucket)
     key.key = key_name
     key.delete()
+
+
+  def get_throttle_args(self):
+    """ Builds the keyword arguments that make a boto transfer stay within the
+    bandwidth limits for this storage platform.
+
+    boto calls the callback we give it after each chunk (8 KB) it sends or
+    receives, which is where we wait for the rate limiter.
+
+    Returns:
+      A dict with the 'cb' and 'num_cb' arguments to pass to boto, or an empty
+        dict if transfers aren't limited.
+    """
+    if not RateLimiter.is_limited(self.get_backend_id()):
+      return {}
+
+    transferred = [0]
+    def callback(bytes_so_far, total_bytes):
+      # boto starts counting from zero again if it retries the transfer.
+      if bytes_so_far < transferred[0]:
+        transferred[0] = 0
+      self.throttle(bytes_so_far - transferred[0])
+      transferred[0] = bytes_so_far
+
+    return {'cb' : callback, 'num_cb' : -1}
+
+
+  def get_encoding_args(self, content_encoding):
+    """ Builds the keyword arguments that make boto store a file with the
+    given Content-Encoding.
+
+    Args:
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    Returns:
+      A dict with the 'headers' argument to pass to boto, or an empty dict if
+        the file isn't encoded.
+    """
+    if content_encoding is None:
+      return {}
+    return {'headers' : {'Content-Encoding' : content_encoding}}
+
+
+  def get_upload_args(self, content_encoding=None):
+    """ Builds the keyword arguments for a boto upload, combining those that
+    get_throttle_args and get_encoding_args build.
+
+    Args:
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    Returns:
+      A dict with the arguments to pass to boto.
+    """
+    upload_args = self.get_throttle_args()
+    upload_args.update(self.get_encoding_args(content_encoding))
+    return upload_args
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes several files stored in Amazon S3 with a single multi-object
+    delete request.
+
+    S3-compatible platforms that don't support multi-object delete (e.g.,
+    Google Cloud Storage and Walrus) set DELETE_BATCH_SIZE to 1, and get
+    BaseStorage's one request per key instead.
+
+    Args:
+      bucket_name: A str containing the name of the bucket that the files
+        should be deleted from.
+      key_names: A list of up to DELETE_BATCH_SIZE strs containing the names of
+        the keys to delete.
+    Returns:
+      A dict that maps the name of each key that couldn't be deleted to a str
+        explaining why.
+    Raises:
+      Exception: If a key couldn't be deleted with an error worth retrying,
+        when deleting one request per key (see BaseStorage.delete_keys).
+    """
+    if self.DELETE_BATCH_SIZE == 1:
+      return BaseStorage.delete_keys(self, bucket_name, key_names)
+
+    bucket = self.connection.lookup(bucket_name)
+    result = bucket.delete_keys(key_names, quiet=True)
+    return dict((error.key, '{0}: {1}'.format(error.code, error.message))
+      for error in result.errors)
+
+
+  def is_retryable_error(self, exception):
+    """ Decides if an operation that failed with the given exception is worth
+    retrying. Besides network errors, S3 server errors (5xx), throttling, and
+    request timeouts are retried.
+
+    Args:
+      exception: The Exception that the operation raised.
+    Returns:
+      True if the operation should be retried, and False otherwise.
+    """
+    if isinstance(exception, boto.exception.BotoServerError):
+      return exception.status >= 500 or exception.status == 429 or \
+        exception.error_code in self.RETRYABLE_ERROR_CODES
+    return BaseStorage.is_retryable_error(self, exception)
+
+
+  def is_throttling_error(self, exception):
+    """ Decides if an operation failed because S3 is throttling us, which it
+    signals with a 503 Slow Down (or a 429 Too Many Requests).
+
+    Args:
+      exception: The Exception that the operation raised.
+    Returns:
+      True if the exception means we're being throttled, and False otherwise.
+    """
+    if isinstance(exception, boto.exception.BotoServerError):
+      return exception.status in (429, 503) or \
+        exception.error_code in self.THROTTLING_ERROR_CODES
+    return False
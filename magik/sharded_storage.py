@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+""" sharded_storage.py provides a single class, ShardedStorage, that spreads
+the keys of a bucket across hashed key prefixes (and optionally across several
+buckets) of another *Storage object. """
+
+
+# General-purpose Python library imports
+import heapq
+
+
+# Magik library imports
+from magik.custom_exceptions import BadConfigurationException
+from magik.hash_ring import HashRing
+from magik.wrapping_storage import WrappingStorage
+
+
+class ShardedStorage(WrappingStorage):
+  """ ShardedStorage wraps another *Storage object, and stores each key under
+  a prefix picked by hashing the key's name, so that sequentially named keys
+  (e.g., timestamps or counters) are spread across many prefixes instead of
+  all landing on the one the storage platform partitions them into. Storage
+  platforms like S3 scale the request rate they allow per prefix, so this
+  lets sustained request rates grow with the number of shards.
+
+  Keys can also be spread across several buckets: shard 0 is the bucket
+  itself, and the others are named '<bucket><suffix><n>' (e.g.,
+  'mybucket-shard-1'). Each of those is marked with an OWNER_KEY object
+  naming the bucket it belongs to when it's created, and a bucket whose
+  shard buckets aren't marked as its own (e.g., because a bucket with that
+  name already existed) is refused, rather than mixing our keys into it.
+  Callers only ever see the bucket and key names they asked for, since every
+  key is mapped to its shard on the way in and back again on the way out
+  (e.g., in listings).
+  """
+
+
+  # The number of hashed prefixes each bucket's keys are spread across, unless
+  # the caller asks for another number.
+  DEFAULT_NUM_PREFIXES = 16
+
+
+  # The str between a bucket's name and the number of each of its other shard
+  # buckets, unless the caller asks for another one.
+  DEFAULT_BUCKET_SUFFIX = '-shard-'
+
+
+  # The key that marks a shard bucket with the name of the bucket it belongs
+  # to. It's kept out of listings, and is reserved in buckets whose keys
+  # aren't prefixed.
+  OWNER_KEY = '.magik-shard-owner'
+
+
+  def __init__(self, storage, num_prefixes=None, num_buckets=None,
+    bucket_suffix=None):
+    """ Creates a new ShardedStorage.
+
+    Args:
+      storage: The *Storage object that keys are stored in.
+      num_prefixes: An int (or a str holding one) with the number of hashed
+        prefixes to spread each bucket's keys across, or 1 to leave key names
+        as they are. Defaults to DEFAULT_NUM_PREFIXES.
+      num_buckets: An int (or a str holding one) with the number of buckets to
+        spread each bucket's keys across. Defaults to 1.
+      bucket_suffix: A str that goes between a bucket's name and the number of
+        each of its other shard buckets. Defaults to DEFAULT_BUCKET_SUFFIX.
+    Raises:
+      BadConfigurationException: If either number isn't a positive int.
+    """
+    WrappingStorage.__init__(self, [storage])
+    self.storage = storage
+    self.num_prefixes = self.parse_shard_count(num_prefixes,
+      self.DEFAULT_NUM_PREFIXES)
+    self.num_buckets = self.parse_shard_count(num_buckets, 1)
+    self.bucket_suffix = bucket_suffix or self.DEFAULT_BUCKET_SUFFIX
+    self.prefix_width = len('{0:x}'.format(self.num_prefixes - 1))
+
+    # The buckets whose shard buckets we've found marked as their own.
+    self.owned_buckets = set()
+
+
+  def parse_shard_count(self, value, default):
+    """ Reads a number of shards.
+
+    Args:
+      value: An int or str with the number of shards, or None (or an empty
+        str) to use the default.
+      default: The int to use if no value was given.
+    Returns:
+      An int with the number of shards.
+    Raises:
+      BadConfigurationException: If the value isn't a positive int.
+    """
+    if value is None or value == '':
+      return default
+    try:
+      count = int(value)
+    except ValueError:
+      count = 0
+    if count < 1:
+      raise BadConfigurationException('The number of shards must be a ' \
+        'positive integer, not {0}'.format(value))
+    return count
+
+
+  def get_shard(self, bucket_name, key_name):
+    """ Finds where a key is stored.
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+      key_name: A str with the name of the key the caller sees.
+    Returns:
+      A tuple with the name of the bucket and the name of the key that the
+        file is actually stored in.
+    """
+    # The high 32 bits of the key's hash pick its prefix, and the low 32 bits
+    # pick its bucket. The key name may be unicode, which str.format can't
+    # take, so the prefix is added with % instead.
+    position = HashRing.hash(key_name)
+    if self.num_prefixes > 1:
+      key_name = '%0*x/%s' % (self.prefix_width, (position >> 32) %
+        self.num_prefixes, key_name)
+    return self.get_shard_buckets(bucket_name)[(position & 0xffffffff) %
+      self.num_buckets], key_name
+
+
+  def get_shard_buckets(self, bucket_name):
+    """ Lists the buckets that a bucket's keys are spread across.
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+    Returns:
+      A list of strs with the names of the buckets the keys are stored in.
+    """
+    return [bucket_name] + ['{0}{1}{2}'.format(bucket_name,
+      self.bucket_suffix, index) for index in range(1, self.num_buckets)]
+
+
+  def check_owner(self, bucket_name):
+    """ Makes sure that each of a bucket's other shard buckets is marked as
+    belonging to it (see OWNER_KEY).
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+    Raises:
+      BadConfigurationException: If a shard bucket isn't marked as belonging
+        to the bucket.
+    """
+    if bucket_name in self.owned_buckets:
+      return
+    for shard_bucket_name in self.get_shard_buckets(bucket_name)[1:]:
+      metadata = self.storage.get_metadata(shard_bucket_name, self.OWNER_KEY)
+      owner = None
+      if metadata is not None and metadata['size'] > 0:
+        owner = self.storage.download_range(shard_bucket_name, self.OWNER_KEY,
+          0, metadata['size'] - 1)
+      if owner != bucket_name:
+        raise BadConfigurationException('The bucket {0} already exists, ' \
+          'but not as a shard of {1}, so its keys can\'t be sharded into ' \
+          'it. Pick another shard bucket suffix.'.format(shard_bucket_name,
+          bucket_name))
+    self.owned_buckets.add(bucket_name)
+
+
+  def get_shard_prefixes(self):
+    """ Lists the prefixes that keys are stored under in each bucket.
+
+    Returns:
+      A list of strs with each prefix (including its trailing '/'), or a list
+        holding only the empty str if keys aren't prefixed.
+    """
+    if self.num_prefixes == 1:
+      return ['']
+    return ['{0:0{1}x}/'.format(index, self.prefix_width)
+      for index in range(self.num_prefixes)]
+
+
+  def get_backend_id(self):
+    """ Identifies the storage platform and account, along with the layout of
+    the shards, so that state kept for the keys callers see isn't confused
+    with state kept for the keys they're stored in.
+
+    Returns:
+      A str that identifies the storage platform, account and layout.
+    """
+    layout = '{0}-{1}'.format(self.num_prefixes, self.num_buckets)
+    if self.num_buckets > 1 and \
+      self.bucket_suffix != self.DEFAULT_BUCKET_SUFFIX:
+      layout += self.bucket_suffix
+    return 'sharded-{0}:{1}'.format(layout, self.storage.get_backend_id())
+
+
+  def does_bucket_exist(self, bucket_name):
+    """ Checks that every bucket a bucket's keys are spread across exists, and
+    that the other shard buckets belong to it.
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+    Returns:
+      True if all of the bucket's shards exist, and False otherwise.
+    Raises:
+      BadConfigurationException: If the shard buckets exist, but aren't all
+        marked as belonging to the bucket.
+    """
+    if not all(self.storage.does_bucket_exist(shard_bucket_name)
+      for shard_bucket_name in self.get_shard_buckets(bucket_name)):
+      return False
+    self.check_owner(bucket_name)
+    return True
+
+
+  def create_bucket(self, bucket_name):
+    """ Creates the buckets that a bucket's keys are spread across, skipping
+    those that already exist, and marks the ones we create as belonging to
+    the bucket.
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+    Raises:
+      BadConfigurationException: If a shard bucket already existed, but
+        doesn't belong to the bucket.
+    """
+    for index, shard_bucket_name in enumerate(self.get_shard_buckets(
+      bucket_name)):
+      if self.storage.does_bucket_exist(shard_bucket_name):
+        continue
+      self.storage.create_bucket(shard_bucket_name)
+      if index > 0:
+        self.storage.upload_stream(iter([bucket_name]), shard_bucket_name,
+          self.OWNER_KEY, len(bucket_name))
+    self.check_owner(bucket_name)
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists the keys in a bucket that start with the given prefix, by
+    listing every shard and merging their listings back into order.
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A dict for each key found, in the format that BaseStorage.list_keys
+        describes, with the key's name as the caller sees it.
+    """
+    listings = [self.list_shard(shard_bucket_name, shard_prefix, bucket_name,
+      prefix) for shard_bucket_name in self.get_shard_buckets(bucket_name)
+      for shard_prefix in self.get_shard_prefixes()]
+    for _, key_info in heapq.merge(*listings):
+      yield key_info
+
+
+  def list_shard(self, shard_bucket_name, shard_prefix, bucket_name, prefix):
+    """ Lists the keys in one shard that start with the given prefix.
+
+    Args:
+      shard_bucket_name: A str with the name of the bucket to list.
+      shard_prefix: A str with the prefix the shard's keys are stored under.
+      bucket_name: A str with the name of the bucket the caller sees.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A tuple with the name of each key as the caller sees it, and a dict for
+        the key in the format that list_keys yields. Keys that don't belong
+        in the shard (e.g., that were written around this class) are skipped.
+    """
+    for key_info in self.storage.list_keys(shard_bucket_name,
+      shard_prefix + prefix):
+      if key_info['key'] == self.OWNER_KEY:
+        continue
+      key_name = key_info['key'][len(shard_prefix):]
+      if self.get_shard(bucket_name, key_name) != (shard_bucket_name,
+        key_info['key']):
+        continue
+      key_info = dict(key_info)
+      key_info['key'] = key_name
+      yield key_name, key_info
+
+
+  def does_key_exist(self, bucket_name, key_name):
+    """ Checks if a file exists in its shard, as BaseStorage.does_key_exist
+    describes. """
+    return self.storage.does_key_exist(*self.get_shard(bucket_name, key_name))
+
+
+  def get_metadata(self, bucket_name, key_name):
+    """ Looks up a file in its shard, as BaseStorage.get_metadata describes,
+    with the key's name as the caller sees it. """
+    metadata = self.storage.get_metadata(*self.get_shard(bucket_name,
+      key_name))
+    if metadata is not None:
+      metadata = dict(metadata)
+      metadata['key'] = key_name
+    return metadata
+
+
+  def download_file(self, destination, bucket_name, key_name):
+    """ Downloads a file from its shard, as BaseStorage.download_file
+    describes. """
+    self.storage.download_file(destination, *self.get_shard(bucket_name,
+      key_name))
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Downloads part of a file from its shard, as BaseStorage.download_range
+    describes. """
+    shard_bucket_name, shard_key_name = self.get_shard(bucket_name, key_name)
+    return self.storage.download_range(shard_bucket_name, shard_key_name,
+      start, end)
+
+
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
+    """ Uploads a file to its shard, as BaseStorage.upload_file describes. """
+    shard_bucket_name, shard_key_name = self.get_shard(bucket_name, key_name)
+    self.storage.upload_file(source, shard_bucket_name, shard_key_name,
+      content_encoding)
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file to its shard, as BaseStorage.upload_file_resumable
+    describes. """
+    shard_bucket_name, shard_key_name = self.get_shard(bucket_name, key_name)
+    self.storage.upload_file_resumable(source, shard_bucket_name,
+      shard_key_name, transfer_state, content_encoding)
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file from its shard to the shard of the key it's copied to,
+    as BaseStorage.copy_key describes. """
+    shard_source_bucket_name, shard_source_key_name = self.get_shard(
+      source_bucket_name, source_key_name)
+    shard_bucket_name, shard_key_name = self.get_shard(bucket_name, key_name)
+    self.storage.copy_key(shard_source_bucket_name, shard_source_key_name,
+      shard_bucket_name, shard_key_name, size, content_encoding)
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Streams a file to its shard, as BaseStorage.upload_stream describes.
+    """
+    shard_bucket_name, shard_key_name = self.get_shard(bucket_name, key_name)
+    self.storage.upload_stream(chunks, shard_bucket_name, shard_key_name, size,
+      content_encoding)
+
+
+  def delete_file(self, bucket_name, key_name):
+    """ Deletes a file from its shard, as BaseStorage.delete_file describes.
+    """
+    self.storage.delete_file(*self.get_shard(bucket_name, key_name))
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes several files, with one call to the wrapped *Storage object's
+    delete_keys per bucket that they're spread across.
+
+    Args:
+      bucket_name: A str with the name of the bucket the caller sees.
+      key_names: A list of strs with the names of the keys to delete, as the
+        caller sees them.
+    Returns:
+      A dict that maps the name of each key that couldn't be deleted to a str
+        explaining why.
+    """
+    shards = {}
+    for key_name in key_names:
+      shard_bucket_name, shard_key_name = self.get_shard(bucket_name, key_name)
+      shards.setdefault(shard_bucket_name, {})[shard_key_name] = key_name
+
+    failures = {}
+    for shard_bucket_name, shard_keys in shards.items():
+      for shard_key_name, reason in self.storage.delete_keys(
+        shard_bucket_name, sorted(shard_keys)).items():
+        failures[shard_keys[shard_key_name]] = reason
+    return failures
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+""" static_file_cache.py provides a single class, StaticFileCache, that keeps
+the static files that the web UI serves in memory, along with everything needed
+to serve them efficiently. """
+
+
+# General-purpose Python library imports
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import StringIO
+import threading
+
+
+class StaticFileCache():
+  """ StaticFileCache reads each static file from disk once, and keeps its
+  contents, a gzipped copy of them (for types worth compressing), and the
+  ETag and Last-Modified values that clients revalidate their copies with.
+
+  Files are checked with a stat on each lookup, so edits to them are picked up
+  without restarting the server.
+  """
+
+
+  # The content types (besides text/*) that we gzip, since they compress well.
+  # Images and fonts are already compressed, so gzipping them is wasted work.
+  COMPRESSIBLE_TYPES = ('application/javascript', 'application/json',
+    'application/x-javascript', 'application/xml', 'image/svg+xml')
+
+
+  # A dict that maps the absolute path of each file we've read to the entry
+  # that get returns for it.
+  files = {}
+
+
+  # A lock that makes sure only one thread reads a file into the cache at once.
+  lock = threading.Lock()
+
+
+  @classmethod
+  def get(cls, path):
+    """ Looks up a static file, reading it into the cache if it isn't there
+    yet or has changed since it was read.
+
+    Args:
+      path: A str with the absolute path of the file.
+    Returns:
+      None if the file doesn't exist, and otherwise a dict with the file's
+        contents ('contents'), its gzipped contents ('gzipped', or None if it
+        isn't worth compressing), content type ('content_type'), quoted ETag
+        ('etag'), modification time in seconds since the epoch ('mtime') and
+        that time as an HTTP date ('last_modified').
+    """
+    try:
+      file_stat = os.stat(path)
+    except OSError:
+      return None
+
+    fingerprint = (file_stat.st_size, file_stat.st_mtime)
+    entry = cls.files.get(path)
+    if entry is not None and entry['fingerprint'] == fingerprint:
+      return entry
+
+    with cls.lock:
+      entry = cls.files.get(path)
+      if entry is None or entry['fingerprint'] != fingerprint:
+        entry = cls.read(path, fingerprint)
+        cls.files[path] = entry
+    return entry
+
+
+  @classmethod
+  def read(cls, path, fingerprint):
+    """ Reads a static file from disk, and works out how it should be served.
+
+    Args:
+      path: A str with the absolute path of the file.
+      fingerprint: A tuple with the size and modification time of the file.
+    Returns:
+      A dict in the format that get describes.
+    """
+    with open(path, 'rb') as file_handle:
+      contents = file_handle.read()
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    gzipped = None
+    if content_type.startswith('text/') or \
+      content_type in cls.COMPRESSIBLE_TYPES:
+      gzipped = cls.compress(contents)
+      if len(gzipped) >= len(contents):
+        gzipped = None
+
+    mtime = int(fingerprint[1])
+    return {
+      'fingerprint' : fingerprint,
+      'contents' : contents,
+      'gzipped' : gzipped,
+      'content_type' : content_type,
+      'etag' : '"{0}"'.format(hashlib.md5(contents).hexdigest()),
+      'mtime' : mtime,
+      'last_modified' : email.utils.formatdate(mtime, usegmt=True)
+    }
+
+
+  @classmethod
+  def compress(cls, contents):
+    """ Gzips the contents of a file.
+
+    Args:
+      contents: A str with the data to compress.
+    Returns:
+      A str with the gzipped data.
+    """
+    buffer = StringIO.StringIO()
+    # Leave the modification time out, so the same file always gzips the same.
+    gzip_file = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+      mtime=0)
+    gzip_file.write(contents)
+    gzip_file.close()
+    return buffer.getvalue()
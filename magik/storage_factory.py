@@ -4,11 +4,22 @@
 to create connections to each type of cloud storage that magik supports. """
 
 
+# General-purpose Python library imports
+import collections
+import json
+import threading
+
+
 # magik-specific imports
 from magik.custom_exceptions import BadConfigurationException
 from magik.azure_storage import AzureStorage
 from magik.gc_storage import GCStorage
+from magik.hedged_storage import HedgedStorage
+from magik.replicated_storage import ReplicatedStorage
 from magik.s3_storage import S3Storage
+from magik.sharded_storage import ShardedStorage
+from magik.striped_storage import StripedStorage
+from magik.tiered_storage import TieredStorage
 from magik.walrus_storage import WalrusStorage
 
 
@@ -21,8 +32,75 @@ class StorageFactory():
   SUPPORTED_STORAGE_PLATFORMS = ('azure', 'gcs', 's3', 'walrus')
 
 
+  # The most *Storage objects that get_pooled_storage keeps around. Once the
+  # pool is full, the least recently used ones are dropped.
+  MAX_POOLED_STORAGES = 100
+
+
+  # An OrderedDict that maps the parameters of each pooled *Storage object
+  # to the object, from least to most recently used.
+  pool = collections.OrderedDict()
+
+
+  # A lock that makes sure only one *Storage object is created per set of
+  # parameters.
+  pool_lock = threading.Lock()
+
+
+  # The directory that every *Storage object keeps a local tier in (see
+  # TieredStorage), unless its parameters name one, or None for no tier.
+  tier_directory = None
+
+
+  # The most bytes of flushed files each local tier keeps, or None for
+  # TieredStorage's default.
+  tier_size = None
+
+
+  @classmethod
+  def set_tier(cls, directory, size=None):
+    """ Puts a local tier in front of every *Storage object made from now on,
+    for callers (e.g., the REST server) whose parameters come from someone who
+    shouldn't pick a directory on this machine.
+
+    Args:
+      directory: A str naming the directory to keep the tiers in, or None to
+        stop adding tiers.
+      size: An int with the most bytes of flushed files each tier keeps, or
+        None for TieredStorage's default.
+    """
+    cls.tier_directory = directory
+    cls.tier_size = size
+
+
   @classmethod
   def get_storage(cls, parameters):
+    """ Instantiates a new *Storage object as get_cloud_storage does, behind
+    a tier of local disk if one is configured.
+
+    Args:
+      parameters: A dict in the format that get_cloud_storage takes. If it has
+        a 'tier_directory' (or set_tier was given one), uploads are written
+        there and flushed to cloud storage in the background (see
+        TieredStorage), and a 'tier_size' says how many bytes of flushed files
+        to keep there.
+    Returns:
+      A *Storage object.
+    Raises:
+      BadConfigurationException: If get_cloud_storage does, or the tier size
+        isn't positive.
+      NotImplementedError: If get_cloud_storage does.
+    """
+    storage = cls.get_cloud_storage(parameters)
+    tier_directory = parameters.get('tier_directory') or cls.tier_directory
+    if tier_directory:
+      storage = TieredStorage.for_storage(storage, tier_directory,
+        parameters.get('tier_size') or cls.tier_size)
+    return storage
+
+
+  @classmethod
+  def get_cloud_storage(cls, parameters):
     """ Instantiates a new *Storage object, based on the name of the cloud
     storage platform the user wants to connect to, and with the given
     credentials.
@@ -30,25 +108,126 @@ class StorageFactory():
     Args:
       parameters: A dict that contains information about which cloud storage
         we should interact with, and the storage-specific credentials needed
-        to use this storage service.
+        to use this storage service. If it has a 'shard_prefixes' or
+        'shard_buckets' count, keys are spread across that many hashed
+        prefixes or buckets (see ShardedStorage), and a
+        'shard_bucket_suffix' says how shard buckets are named. If it has
+        'stripes' (a list of dicts like this one, or a JSON str holding such a
+        list), files are striped across each of the storages they describe
+        instead (see StripedStorage), each named on the HashRing by its
+        'stripe_name' if it has one. If it has 'replicas' in the same format,
+        each file is copied to every storage they describe instead (see
+        ReplicatedStorage), and a 'write_quorum' says how many of them must
+        take each write. A 'timeout' sets how many seconds connections can
+        wait (see BaseStorage.get_timeout), and a 'hedge_reads' count says
+        how many duplicates of slow reads to send (see HedgedStorage). Shard
+        counts, timeouts and hedging apply to each stripe or replica.
     Raises:
       BadConfigurationException: If the caller fails to specify a cloud storage
-        platform to instantiate.
+        platform to instantiate, gives a shard count that isn't a positive
+        int, gives stripes or replicas that aren't a list of dicts, gives
+        both stripes and replicas, gives a write quorum that can't be met, or
+        gives a timeout or hedge_reads count that isn't positive.
       NotImplementedError: If the cloud storage platform named is not one that
         magik supports.
     """
+    if parameters.get('stripes') and parameters.get('replicas'):
+      raise BadConfigurationException('Files can be striped or replicated, ' \
+        'but not both (stripes can have replicas of their own).')
+    inherited_parameters = dict((name, parameters[name]) for name in
+      ['shard_prefixes', 'shard_buckets', 'shard_bucket_suffix', 'timeout',
+      'hedge_reads'] if parameters.get(name))
+    if parameters.get('stripes'):
+      stripes = cls.parse_storages('stripes', parameters['stripes'])
+      return StripedStorage([cls.get_cloud_storage(dict(inherited_parameters,
+        **stripe)) for stripe in stripes], [stripe.get('stripe_name')
+        for stripe in stripes])
+    if parameters.get('replicas'):
+      return ReplicatedStorage([cls.get_cloud_storage(dict(inherited_parameters,
+        **replica)) for replica in cls.parse_storages('replicas',
+        parameters['replicas'])], parameters.get('write_quorum'))
+
     if 'name' not in parameters:
       raise BadConfigurationException('Need to specify a cloud storage name.')
 
     storage_name = parameters['name']
     if storage_name == 'azure':
-      return AzureStorage(parameters)
+      storage = AzureStorage(parameters)
     elif storage_name == 'gcs':
-      return GCStorage(parameters)
+      storage = GCStorage(parameters)
     elif storage_name == 's3':
-      return S3Storage(parameters)
+      storage = S3Storage(parameters)
     elif storage_name == 'walrus':
-      return WalrusStorage(parameters)
+      storage = WalrusStorage(parameters)
     else:
       raise NotImplementedError('{0} is not a supported cloud storage' \
         .format(storage_name))
+
+    if parameters.get('shard_prefixes') or parameters.get('shard_buckets'):
+      storage = ShardedStorage(storage, parameters.get('shard_prefixes'),
+        parameters.get('shard_buckets'),
+        parameters.get('shard_bucket_suffix'))
+    if parameters.get('hedge_reads'):
+      storage = HedgedStorage(storage, parameters['hedge_reads'])
+    return storage
+
+
+  @classmethod
+  def parse_storages(cls, name, storages):
+    """ Reads the parameters for each storage that a composite storage (e.g.,
+    a StripedStorage) is made of.
+
+    Args:
+      name: A str naming the parameter the storages were given in (e.g.,
+        'stripes'), for error messages.
+      storages: A list of dicts, each in the format that get_storage takes, or
+        a JSON str holding such a list (e.g., from a REST request).
+    Returns:
+      A list of dicts with the parameters for each storage.
+    Raises:
+      BadConfigurationException: If the storages aren't valid JSON, or aren't
+        a non-empty list of dicts.
+    """
+    if isinstance(storages, basestring):
+      try:
+        storages = json.loads(storages)
+      except ValueError:
+        raise BadConfigurationException('{0} must be given as JSON, not ' \
+          '{1}'.format(name, storages))
+    if not isinstance(storages, list) or not storages or \
+      not all(isinstance(storage, dict) for storage in storages):
+      raise BadConfigurationException('{0} must be a list of storage ' \
+        'parameters, not {1}'.format(name, storages))
+    return storages
+
+
+  @classmethod
+  def get_pooled_storage(cls, parameters):
+    """ Returns a *Storage object for the given parameters like get_storage
+    does, but reuses the one made for the same parameters last time, so that
+    callers that make many short-lived requests (e.g., the REST server) don't
+    set up a new connection for each one.
+
+    *Storage objects are shared between threads already (see
+    BaseStorage.run_in_parallel), so a pooled one can serve several requests
+    at once.
+
+    Args:
+      parameters: A dict in the format that get_storage takes.
+    Returns:
+      A *Storage object.
+    Raises:
+      BadConfigurationException: If get_storage does.
+      NotImplementedError: If get_storage does.
+    """
+    # Credentials that weren't given don't change which storage we connect to.
+    pool_key = tuple(sorted((name, value) for name, value in
+      parameters.items() if value))
+    with cls.pool_lock:
+      storage = cls.pool.pop(pool_key, None)
+      if storage is None:
+        storage = cls.get_storage(parameters)
+      cls.pool[pool_key] = storage
+      while len(cls.pool) > cls.MAX_POOLED_STORAGES:
+        cls.pool.popitem(last=False)
+    return storage
@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+""" striped_storage.py provides a single class, StripedStorage, that stripes
+files across several *Storage objects (e.g., several accounts), so that their
+request rates and bandwidth add up. """
+
+
+# General-purpose Python library imports
+import collections
+import heapq
+import threading
+
+
+# Magik library imports
+from magik.chunk_reader import ChunkReader
+from magik.custom_exceptions import BadConfigurationException
+from magik.hash_ring import HashRing
+from magik.retry_policy import RetryPolicy
+from magik.wrapping_storage import WrappingStorage
+
+
+class StripedStorage(WrappingStorage):
+  """ StripedStorage stores each file in exactly one of several backends (each
+  a *Storage object, for a different account or platform), picked by a
+  HashRing of the backends' names, and routes every operation on the file to
+  that backend. Buckets exist in every backend, each holding its share of the
+  bucket's files.
+
+  Adding a backend moves ownership of about 1/N of the files to it, and
+  iter_rebalance moves those files over. Until it has, a file that isn't
+  found in its owner is looked for in the other backends (in ring order), and
+  deletes keep looking for copies of the file until no backend has one, so
+  nothing is lost or resurrected in the meantime.
+
+  A backend is named by its backend id unless it's given a name. Backend ids
+  include access keys, so backends whose keys may be rotated should be given
+  names, or rotating a key would hand the backend's files to the others.
+  """
+
+
+  # The most files whose location outside their owner we remember, so that
+  # reads of files that haven't been rebalanced yet don't search for them
+  # every time.
+  MAX_RELOCATED = 10000
+
+
+  def __init__(self, storages, names=None):
+    """ Creates a new StripedStorage.
+
+    Args:
+      storages: A list of *Storage objects to stripe files across, each for a
+        different account (i.e., with a different backend id).
+      names: A list with the name of each backend on the HashRing (or None to
+        name it by its backend id), in the same order as storages, or None to
+        name every backend by its backend id.
+    Raises:
+      BadConfigurationException: If no backends were given, two of them are
+        for the same account or have the same name, or the number of names
+        doesn't match the number of backends.
+    """
+    if not storages:
+      raise BadConfigurationException('Need at least one storage to stripe ' \
+        'files across.')
+    names = names or [None] * len(storages)
+    if len(names) != len(storages):
+      raise BadConfigurationException('Got {0} names for {1} stripes' \
+        .format(len(names), len(storages)))
+    WrappingStorage.__init__(self, storages)
+    self.storages = {}
+    backend_ids = set()
+    for storage, name in zip(storages, names):
+      backend_id = storage.get_backend_id()
+      name = name or backend_id
+      if backend_id in backend_ids or name in self.storages:
+        raise BadConfigurationException('{0} is configured more than once' \
+          .format(name))
+      backend_ids.add(backend_id)
+      self.storages[name] = storage
+
+    self.ring = HashRing(sorted(self.storages))
+    self.relocated = collections.OrderedDict()
+    self.relocated_lock = threading.Lock()
+
+
+  def get_owner_ids(self, bucket_name, key_name):
+    """ Finds the backends that a file belongs to, in ring order.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A list with the name of every backend, starting with the file's owner.
+    """
+    # Key names may be unicode, which str.format can't take.
+    return self.ring.get_nodes('/%s/%s' % (bucket_name, key_name))
+
+
+  def get_owner_id(self, bucket_name, key_name):
+    """ Finds the backend that a file is written to.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A str with the name of the backend that owns the file.
+    """
+    return self.ring.get_node('/%s/%s' % (bucket_name, key_name))
+
+
+  def get_owner(self, bucket_name, key_name):
+    """ Finds the *Storage object for the backend that a file is written to.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      The *Storage object that owns the file.
+    """
+    return self.storages[self.get_owner_id(bucket_name, key_name)]
+
+
+  def locate(self, bucket_name, key_name):
+    """ Finds the backend that a file should be read from: the one it was last
+    found in outside its owner, if any, and its owner otherwise.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A *Storage object.
+    """
+    return self.storages[self.get_location_id(bucket_name, key_name)]
+
+
+  def get_location_id(self, bucket_name, key_name):
+    """ Finds the name of the backend that locate picks for a file.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A str with the name of the backend.
+    """
+    with self.relocated_lock:
+      backend_id = self.relocated.get((bucket_name, key_name))
+    return backend_id or self.get_owner_id(bucket_name, key_name)
+
+
+  def find(self, bucket_name, key_name):
+    """ Looks a file up in its owner, and then in the other backends if it
+    hasn't been moved to its owner yet.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      None if no backend has the file, and otherwise a dict in the format that
+        BaseStorage.get_metadata describes.
+    """
+    return self.find_location(bucket_name, key_name)[1]
+
+
+  def find_location(self, bucket_name, key_name):
+    """ Looks a file up as find does, and says which backend it was found in.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A tuple with the name of the backend that has the file and its metadata
+        (in the format that BaseStorage.get_metadata describes), or with None
+        and None if no backend has it.
+    """
+    for backend_id in self.get_owner_ids(bucket_name, key_name):
+      metadata = self.storages[backend_id].get_metadata(bucket_name, key_name)
+      if metadata is not None:
+        self.remember_location(bucket_name, key_name, backend_id)
+        return backend_id, metadata
+    self.remember_location(bucket_name, key_name, None)
+    return None, None
+
+
+  def remember_location(self, bucket_name, key_name, backend_id):
+    """ Records which backend a file was found in, if it isn't its owner.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+      backend_id: A str with the name of the backend holding the file, or
+        None if it is (or will be) in its owner.
+    """
+    with self.relocated_lock:
+      self.relocated.pop((bucket_name, key_name), None)
+      if backend_id is None or \
+        backend_id == self.get_owner_id(bucket_name, key_name):
+        return
+      self.relocated[(bucket_name, key_name)] = backend_id
+      while len(self.relocated) > self.MAX_RELOCATED:
+        self.relocated.popitem(last=False)
+
+
+  def get_backend_id(self):
+    """ Identifies the set of backends that files are striped across.
+
+    Returns:
+      A str that identifies every backend.
+    """
+    return 'striped:' + ','.join(sorted(storage.get_backend_id()
+      for storage in self.storages.values()))
+
+
+  def does_bucket_exist(self, bucket_name):
+    """ Checks that a bucket exists in every backend.
+
+    Args:
+      bucket_name: A str with the name of the bucket.
+    Returns:
+      True if every backend has the bucket, and False otherwise.
+    """
+    return all(storage.does_bucket_exist(bucket_name)
+      for storage in self.storages.values())
+
+
+  def create_bucket(self, bucket_name):
+    """ Creates a bucket in every backend that doesn't have it yet.
+
+    Args:
+      bucket_name: A str with the name of the bucket.
+    """
+    for storage in self.storages.values():
+      if not storage.does_bucket_exist(bucket_name):
+        storage.create_bucket(bucket_name)
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists the keys in a bucket that start with the given prefix, by
+    listing every backend and merging their listings back into order.
+
+    Args:
+      bucket_name: A str with the name of the bucket to list.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A dict for each key found, in the format that BaseStorage.list_keys
+        describes. A key found in more than one backend (because it hasn't
+        been rebalanced yet) is only listed once, from its owner if the
+        owner has it.
+    """
+    listings = [self.list_backend(backend_id, bucket_name, prefix)
+      for backend_id in sorted(self.storages)]
+    last_key_name = None
+    for key_name, _, key_info in heapq.merge(*listings):
+      if key_name != last_key_name:
+        yield key_info
+      last_key_name = key_name
+
+
+  def list_backend(self, backend_id, bucket_name, prefix):
+    """ Lists the keys in one backend's share of a bucket.
+
+    Args:
+      backend_id: A str with the id of the backend to list.
+      bucket_name: A str with the name of the bucket to list.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A tuple for each key, with its name, 0 if the backend owns it (or 1 if
+        it doesn't), and a dict in the format that list_keys yields.
+    """
+    for key_info in self.storages[backend_id].list_keys(bucket_name, prefix):
+      owner_id = self.get_owner_id(bucket_name, key_info['key'])
+      yield key_info['key'], int(owner_id != backend_id), key_info
+
+
+  def does_key_exist(self, bucket_name, key_name):
+    """ Checks if any backend has a file (see find). """
+    return self.find(bucket_name, key_name) is not None
+
+
+  def get_metadata(self, bucket_name, key_name):
+    """ Looks up a file in whichever backend has it (see find). """
+    return self.find(bucket_name, key_name)
+
+
+  def download_file(self, destination, bucket_name, key_name):
+    """ Downloads a file from the backend it's in, as
+    BaseStorage.download_file describes. """
+    self.locate(bucket_name, key_name).download_file(destination, bucket_name,
+      key_name)
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Downloads part of a file from the backend it's in, as
+    BaseStorage.download_range describes. """
+    return self.locate(bucket_name, key_name).download_range(bucket_name,
+      key_name, start, end)
+
+
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
+    """ Uploads a file to its owner, as BaseStorage.upload_file describes. """
+    self.get_owner(bucket_name, key_name).upload_file(source, bucket_name,
+      key_name, content_encoding)
+    self.remember_location(bucket_name, key_name, None)
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file to its owner, as BaseStorage.upload_file_resumable
+    describes. """
+    self.get_owner(bucket_name, key_name).upload_file_resumable(source,
+      bucket_name, key_name, transfer_state, content_encoding)
+    self.remember_location(bucket_name, key_name, None)
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Streams a file to its owner, as BaseStorage.upload_stream describes.
+
+    The chunks are cut to the size that the owner wants, since the caller
+    couldn't know which backend the file would go to when it cut them.
+    """
+    owner = self.get_owner(bucket_name, key_name)
+    reader = ChunkReader(chunks)
+    chunk_size = owner.get_stream_chunk_size(size)
+    owner.upload_stream(iter(lambda: reader.read(chunk_size), ''),
+      bucket_name, key_name, size, content_encoding)
+    self.remember_location(bucket_name, key_name, None)
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file to the owner of the key it's copied to, within a backend
+    if it already holds the file, and by streaming it between backends
+    otherwise. """
+    source = self.locate(source_bucket_name, source_key_name)
+    owner = self.get_owner(bucket_name, key_name)
+    if source is owner:
+      owner.copy_key(source_bucket_name, source_key_name, bucket_name,
+        key_name, size, content_encoding)
+    else:
+      owner.upload_stream(source.iter_key_chunks(source_bucket_name,
+        source_key_name, size, owner.get_stream_chunk_size(size)),
+        bucket_name, key_name, size, content_encoding)
+    self.remember_location(bucket_name, key_name, None)
+
+
+  def delete_file(self, bucket_name, key_name):
+    """ Deletes a file from the backend it's in, and then from any other
+    backend that find still finds it in (because it hadn't been rebalanced
+    yet), so that no older copy is read once it's gone.
+
+    A backend failing to delete the file is ignored if it doesn't have the
+    file, which is usual for backends that find wasn't asked about.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Raises:
+      Exception: If a backend that has the file couldn't delete it, or the
+        first backend's error if none of them had the file.
+    """
+    backend_id = self.get_location_id(bucket_name, key_name)
+    tried = set()
+    deleted = False
+    first_error = None
+    while backend_id is not None and backend_id not in tried:
+      tried.add(backend_id)
+      try:
+        self.storages[backend_id].delete_file(bucket_name, key_name)
+        deleted = True
+      except Exception as exception:
+        if self.has_file(backend_id, bucket_name, key_name):
+          raise exception
+        first_error = first_error or exception
+      backend_id = self.find_location(bucket_name, key_name)[0]
+
+    self.remember_location(bucket_name, key_name, None)
+    if not deleted and first_error is not None:
+      raise first_error
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes several files from the backends they're in, and then from any
+    other backends that find still finds them in, as delete_file does.
+
+    Files are deleted in one batch per backend each time round, so files that
+    have no copies outside the backend they're in take one batch, plus the
+    lookups that make sure of that.
+
+    Args:
+      bucket_name: A str with the name of the bucket the files are in.
+      key_names: A list of strs with the names of the keys to delete.
+    Returns:
+      A dict that maps the name of each key that couldn't be deleted to a str
+        explaining why: a backend that has the file failed to delete it, or no
+        backend had it (with the first backend's reason).
+    """
+    locations = dict((key_name, self.get_location_id(bucket_name, key_name))
+      for key_name in key_names)
+    tried = dict((key_name, set()) for key_name in key_names)
+    deleted = set()
+    failures = {}
+    first_failures = {}
+    while locations:
+      batches = {}
+      for key_name, backend_id in locations.items():
+        tried[key_name].add(backend_id)
+        batches.setdefault(backend_id, []).append(key_name)
+
+      for backend_id, batch in sorted(batches.items()):
+        backend_failures = self.storages[backend_id].delete_keys(bucket_name,
+          batch)
+        for key_name in batch:
+          if key_name not in backend_failures:
+            deleted.add(key_name)
+          elif self.has_file(backend_id, bucket_name, key_name):
+            failures[key_name] = backend_failures[key_name]
+          else:
+            first_failures.setdefault(key_name, backend_failures[key_name])
+
+      # Only files we just deleted can have copies left elsewhere.
+      found = {}
+      for key_name in locations:
+        if key_name in failures:
+          continue
+        backend_id = self.find_location(bucket_name, key_name)[0]
+        if backend_id is not None and backend_id not in tried[key_name]:
+          found[key_name] = backend_id
+      locations = found
+
+    for key_name in key_names:
+      self.remember_location(bucket_name, key_name, None)
+      if key_name not in deleted and key_name not in failures and \
+        key_name in first_failures:
+        failures[key_name] = first_failures[key_name]
+    return failures
+
+
+  def has_file(self, backend_id, bucket_name, key_name):
+    """ Checks if a backend has a file, after it failed to delete it.
+
+    Args:
+      backend_id: A str with the name of the backend.
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      False if the backend doesn't have the file, and True if it does or if
+        that couldn't be checked.
+    """
+    try:
+      return self.storages[backend_id].get_metadata(bucket_name,
+        key_name) is not None
+    except Exception:
+      return True
+
+
+  def iter_rebalance(self, bucket_name, num_threads=None, retry_policy=None):
+    """ Moves each file in a bucket that isn't in its owner (e.g., because a
+    backend was added) to its owner, in parallel.
+
+    Files are streamed between backends with upload_stream, so they only touch
+    the local disk if the owner stages streamed uploads there. A file whose
+    owner already has a copy (because it was written again since the backend
+    was added) is only deleted from the old backend, since the owner's copy
+    is newer.
+
+    Args:
+      bucket_name: A str with the name of the bucket to rebalance.
+      num_threads: An int that indicates how many files should be moved at the
+        same time. Defaults to DEFAULT_NUM_THREADS.
+      retry_policy: The RetryPolicy that decides which failed moves are
+        retried. Defaults to a RetryPolicy whose budget grows with each file.
+    Yields:
+      A dict for each file that had to be moved, with its 'source' path, its
+        'key' name as the listing gave it, the names of the backends it was
+        moved 'from' and 'to', and the fields that BaseStorage.move_files
+        describes.
+    """
+    if retry_policy is None:
+      retry_policy = RetryPolicy.for_stream()
+    self.check_buckets(set([bucket_name]), retry_policy, create_missing=True)
+
+    def misplaced():
+      for backend_id in sorted(self.storages):
+        for key_info in self.storages[backend_id].list_keys(bucket_name):
+          owner_id = self.get_owner_id(bucket_name, key_info['key'])
+          if owner_id != backend_id:
+            yield {
+              'source' : self.build_path(bucket_name, key_info['key']),
+              'key' : key_info['key'],
+              'from' : backend_id,
+              'to' : owner_id,
+              'size' : key_info['size']
+            }
+
+    def move(item):
+      key_name = item['key']
+      source = self.storages[item['from']]
+      owner = self.storages[item['to']]
+      if owner.get_metadata(bucket_name, key_name) is None:
+        # Listings don't say how files are encoded, so ask the old backend.
+        metadata = source.get_metadata(bucket_name, key_name)
+        if metadata is None:
+          item['success'] = False
+          item['failure_reason'] = 'source not found'
+          return
+        owner.upload_stream(source.iter_key_chunks(bucket_name, key_name,
+          metadata['size'], owner.get_stream_chunk_size(metadata['size'])),
+          bucket_name, key_name, metadata['size'],
+          metadata.get('content_encoding'))
+      source.delete_file(bucket_name, key_name)
+      self.remember_location(bucket_name, key_name, None)
+      item['success'] = True
+
+    for item in self.iter_in_parallel(move, misplaced(), num_threads,
+      retry_policy):
+      yield item
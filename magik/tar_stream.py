@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+""" tar_stream.py provides a single class, TarStream, that builds a tar archive
+one file at a time, so that it can be sent while it is still being built. """
+
+
+# General-purpose Python library imports
+import StringIO
+import tarfile
+import time
+
+
+class TarStream():
+  """ TarStream writes files into a tar archive (optionally gzipped), and hands
+  back the bytes of the archive that each file produces as soon as it has been
+  added, instead of writing the archive to disk.
+
+  Only the file being added (and whatever the tar and gzip formats buffer
+  between files) is held in memory at a time, and files added with add_stream
+  are only held a chunk at a time.
+  """
+
+
+  # The PAX header that records the Content-Encoding of a file that was added
+  # as it is stored (i.e., still compressed).
+  CONTENT_ENCODING_HEADER = 'MAGIK.content_encoding'
+
+
+  def __init__(self, compress=False):
+    """ Creates a new, empty TarStream.
+
+    Args:
+      compress: A bool that indicates if the archive should be gzipped.
+    """
+    self.pieces = []
+    mode = 'w|'
+    if compress:
+      mode = 'w|gz'
+    # PAX headers hold names as UTF-8 whatever their length, so names with
+    # non-ASCII characters (given as unicode or as UTF-8) come out intact.
+    self.archive = tarfile.open(fileobj=self, mode=mode,
+      format=tarfile.PAX_FORMAT, encoding='utf-8')
+
+
+  def add(self, name, contents, mtime=None):
+    """ Adds a file to the archive.
+
+    Args:
+      name: A str (or unicode) with the path the file should have in the
+        archive.
+      contents: A str with the contents of the file.
+      mtime: The modification time of the file, in seconds since the epoch.
+        Defaults to the current time.
+    Returns:
+      A str with the bytes of the archive that are ready to be sent, which may
+        be empty.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(contents)
+    info.mode = 0o644
+    info.mtime = int(mtime or time.time())
+    self.archive.addfile(info, StringIO.StringIO(contents))
+    return self.flush()
+
+
+  def add_stream(self, name, size, chunks, mtime=None, content_encoding=None):
+    """ Adds a file to the archive from a stream of chunks, handing back the
+    bytes of the archive as each chunk is added.
+
+    The file's header goes out first, so its size has to be known up front. If
+    the chunks stop early (or raise an exception), the rest of the file is
+    filled with NUL bytes so that the archive can still be read, and the
+    caller is told by an exception once the padding has been handed back.
+
+    Args:
+      name: A str (or unicode) with the path the file should have in the
+        archive.
+      size: An int with the size of the file, in bytes.
+      chunks: An iterable of strs whose concatenation is the file.
+      mtime: The modification time of the file, in seconds since the epoch.
+        Defaults to the current time.
+      content_encoding: A str with the Content-Encoding that the chunks are
+        compressed with, which is recorded in the CONTENT_ENCODING_HEADER, or
+        None if they aren't.
+    Yields:
+      A str with the bytes of the archive that are ready to be sent, which may
+        be empty.
+    Raises:
+      IOError: If the chunks held fewer than size bytes.
+      Exception: Whatever exception reading the chunks raised.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = int(mtime or time.time())
+    if content_encoding:
+      info.pax_headers[unicode(self.CONTENT_ENCODING_HEADER)] = \
+        unicode(content_encoding)
+
+    # This writes what TarFile.addfile would, without needing the whole file
+    # to be readable from a single file object.
+    header = info.tobuf(self.archive.format, self.archive.encoding,
+      self.archive.errors)
+    self.archive.fileobj.write(header)
+    self.archive.offset += len(header)
+    yield self.flush()
+
+    written = 0
+    error = None
+    try:
+      for chunk in chunks:
+        chunk = chunk[:size - written]
+        self.archive.fileobj.write(chunk)
+        written += len(chunk)
+        yield self.flush()
+    except Exception as exception:
+      error = exception
+
+    blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+    if remainder > 0:
+      blocks += 1
+    self.archive.fileobj.write(tarfile.NUL * (blocks * tarfile.BLOCKSIZE -
+      written))
+    self.archive.offset += blocks * tarfile.BLOCKSIZE
+    self.archive.members.append(info)
+    yield self.flush()
+
+    if error is not None:
+      raise error
+    elif written < size:
+      raise IOError('file ended after {0} of {1} bytes'.format(written, size))
+
+
+  def close(self):
+    """ Finishes the archive.
+
+    Returns:
+      A str with the rest of the bytes of the archive.
+    """
+    self.archive.close()
+    return self.flush()
+
+
+  def write(self, data):
+    """ Collects bytes that the tarfile module has written to the archive.
+
+    Args:
+      data: A str with the bytes that were written.
+    """
+    self.pieces.append(data)
+
+
+  def flush(self):
+    """ Hands back the bytes of the archive written since the last flush.
+
+    Returns:
+      A str with the bytes that were written.
+    """
+    data = ''.join(self.pieces)
+    self.pieces = []
+    return data
@@ -0,0 +1,758 @@
+#!/usr/bin/env python
+""" tiered_storage.py provides a single class, TieredStorage, that puts a tier
+of fast local disk in front of another *Storage object, so that uploads finish
+at local disk speed and reach cloud storage in the background. """
+
+
+# General-purpose Python library imports
+import collections
+import hashlib
+import heapq
+import json
+import mimetypes
+import os
+import Queue
+import shutil
+import threading
+import time
+import uuid
+
+
+# Magik library imports
+from magik.custom_exceptions import BadConfigurationException
+from magik.hash_ring import HashRing
+from magik.instrumentation import Instrumentation
+from magik.retry_policy import RetryPolicy
+from magik.wrapping_storage import WrappingStorage
+
+
+class TieredStorage(WrappingStorage):
+  """ TieredStorage writes each uploaded file to a directory on the local disk
+  (the hot tier) and returns right away, and a pool of background threads
+  then flushes it to the wrapped *Storage object (the cold tier). Until a file
+  is flushed it's only on the local disk, so a JSON sidecar next to it records
+  what it is, and files that weren't flushed when magik stopped are flushed
+  once it starts again with the same directory.
+
+  Reads, lookups and listings see local files first, and fall back to the
+  cold tier. Flushed files stay on the local disk until they take up more
+  than max_bytes, and are then evicted least recently read first. Files that
+  haven't been flushed can't be evicted, so writers wait (for up to
+  WRITE_TIMEOUT seconds) for flushes instead of pushing the unflushed bytes
+  past max_bytes. A file whose flush keeps failing is given up on after
+  MAX_FLUSH_ATTEMPTS tries, and stays in the hot tier (without holding up
+  writers) until it's written again, deleted, or magik starts again.
+
+  Deletes and copies go to the cold tier right away, after dropping any local
+  copy and waiting for a flush of the same key to finish, so that a deleted
+  file is never flushed back. Only one TieredStorage should use a directory at
+  a time, which for_storage makes sure of within a process.
+
+  Each set of credentials for the cold tier gets its own TieredStorage and its
+  own directory, since files in the hot tier are served without asking the
+  cold tier, and flushed with the credentials of the caller that created the
+  TieredStorage.
+  """
+
+
+  # The directory on the local filesystem where the hot tier is kept by
+  # default. Each cold tier (and set of credentials for it) gets its own
+  # directory inside it.
+  DEFAULT_DIRECTORY = os.path.expanduser('~/.magik/tiers')
+
+
+  # The most bytes of flushed files the hot tier keeps by default.
+  DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+  # The number of threads that flush files to the cold tier.
+  NUM_FLUSH_THREADS = 4
+
+
+  # The number of seconds we wait before trying again to flush a file whose
+  # flush failed (after its RetryPolicy gave up).
+  FLUSH_RETRY_INTERVAL = 30
+
+
+  # The number of times we try to flush a file (each time with its
+  # RetryPolicy) before giving up on it until magik starts again.
+  MAX_FLUSH_ATTEMPTS = 10
+
+
+  # The number of seconds a write waits for flushes to make room for it in
+  # the hot tier before it fails.
+  WRITE_TIMEOUT = 300
+
+
+  # The number of locks that keys are spread across, to keep deletes and
+  # copies of a key from racing with a flush of it.
+  NUM_KEY_LOCKS = 64
+
+
+  # The number of bytes we copy at a time into the hot tier.
+  COPY_CHUNK_SIZE = 1024 * 1024
+
+
+  # The TieredStorage for each directory and set of credentials for the cold
+  # tier, keyed by (directory, credentials id).
+  tiers = {}
+
+
+  # A lock that protects the dict of tiers.
+  tiers_lock = threading.Lock()
+
+
+  def __init__(self, storage, directory=None, max_bytes=None):
+    """ Creates a new TieredStorage, and starts flushing the files that an
+    earlier one left in its directory.
+
+    Args:
+      storage: The *Storage object that files are flushed to.
+      directory: A str naming the directory that the hot tier is kept in.
+        Defaults to DEFAULT_DIRECTORY.
+      max_bytes: An int with the most bytes of flushed files to keep in the
+        hot tier. Defaults to DEFAULT_MAX_BYTES.
+    Raises:
+      BadConfigurationException: If max_bytes isn't a positive int.
+    """
+    if max_bytes is None:
+      max_bytes = self.DEFAULT_MAX_BYTES
+    if not isinstance(max_bytes, (int, long)) or max_bytes <= 0:
+      raise BadConfigurationException('The size of the local tier must be ' \
+        'a positive number of bytes, not {0}'.format(max_bytes))
+    WrappingStorage.__init__(self, [storage])
+    self.storage = storage
+    self.directory = os.path.join(directory or self.DEFAULT_DIRECTORY,
+      hashlib.sha1(storage.get_credentials_id()).hexdigest())
+    self.max_bytes = max_bytes
+
+    # An OrderedDict that maps each (bucket, key) in the hot tier to its
+    # entry, from least to most recently read, and the bytes they take up.
+    self.entries = collections.OrderedDict()
+    self.used_bytes = 0
+    self.dirty_bytes = 0
+    self.num_dirty = 0
+    self.condition = threading.Condition()
+
+    # The buckets that the cold tier has told us exist, so that each write
+    # doesn't have to ask it again.
+    self.known_buckets = set()
+
+    self.key_locks = [threading.Lock() for _ in range(self.NUM_KEY_LOCKS)]
+    self.flush_queue = Queue.Queue()
+    self.retry_policy = RetryPolicy()
+
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    self.load()
+    for _ in range(self.NUM_FLUSH_THREADS):
+      flusher = threading.Thread(target=self.flush_files)
+      flusher.daemon = True
+      flusher.start()
+
+
+  @classmethod
+  def for_storage(cls, storage, directory=None, max_bytes=None):
+    """ Returns the TieredStorage for a cold tier and directory, creating it
+    if needed.
+
+    Args:
+      storage: The *Storage object that files are flushed to. Only *Storage
+        objects with the same credentials (see BaseStorage.get_credentials_id)
+        share a TieredStorage.
+      directory: A str naming the directory that the hot tier is kept in.
+      max_bytes: An int with the most bytes of flushed files to keep, which
+        is only used if the TieredStorage has to be created.
+    Returns:
+      A TieredStorage.
+    """
+    with cls.tiers_lock:
+      key = (directory or cls.DEFAULT_DIRECTORY, storage.get_credentials_id())
+      if key not in cls.tiers:
+        cls.tiers[key] = cls(storage, directory, max_bytes)
+      return cls.tiers[key]
+
+
+  def load(self):
+    """ Reads the entries of the files in the hot tier from their sidecars,
+    queues those that weren't flushed yet, and removes anything left over
+    from writes that didn't finish.
+    """
+    names = sorted(os.listdir(self.directory))
+    entries = {}
+    for name in names:
+      if not name.endswith('.json'):
+        continue
+      try:
+        with open(os.path.join(self.directory, name)) as file_handle:
+          entry = json.load(file_handle)
+      except ValueError:
+        continue
+      entry['bucket'] = entry['bucket'].encode('utf-8')
+      entry['key'] = entry['key'].encode('utf-8')
+      entry['name'] = entry['name'].encode('utf-8')
+      if entry['name'] not in names:
+        continue
+      # Sidecars sort by version, so later ones are for newer writes.
+      entries[(entry['bucket'], entry['key'])] = entry
+
+    live_names = set()
+    for entry in sorted(entries.values(), key=lambda entry: entry['version']):
+      self.entries[(entry['bucket'], entry['key'])] = entry
+      self.used_bytes += entry['size']
+      if entry['dirty']:
+        self.dirty_bytes += entry['size']
+        self.num_dirty += 1
+        self.flush_queue.put((entry['bucket'], entry['key']))
+      live_names.update([entry['name'], entry['name'] + '.json'])
+    for name in names:
+      if name not in live_names:
+        os.remove(os.path.join(self.directory, name))
+
+
+  def get_path(self, entry):
+    """ Finds the local file that holds a file in the hot tier.
+
+    Args:
+      entry: A dict with the file's entry.
+    Returns:
+      A str with the path of the local file.
+    """
+    return os.path.join(self.directory, entry['name'])
+
+
+  def get_key_lock(self, bucket_name, key_name):
+    """ Finds the lock that keeps deletes and copies of a key from racing with
+    a flush of it.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      A threading.Lock.
+    """
+    return self.key_locks[self.get_key_lock_index(bucket_name, key_name)]
+
+
+  def get_key_lock_index(self, bucket_name, key_name):
+    """ Finds which of the key locks a key uses (see get_key_lock).
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      An int with the index of the key's lock.
+    """
+    # Key names may be unicode, which str.format can't take.
+    return HashRing.hash('/%s/%s' % (bucket_name, key_name)) % \
+      self.NUM_KEY_LOCKS
+
+
+  def write_sidecar(self, entry):
+    """ Records a file's entry next to it, replacing the old record in one
+    step so that a crash never leaves half of one behind.
+
+    Args:
+      entry: A dict with the file's entry.
+    """
+    sidecar = self.get_path(entry) + '.json'
+    with open(sidecar + '.tmp', 'w') as file_handle:
+      json.dump(entry, file_handle)
+    os.rename(sidecar + '.tmp', sidecar)
+
+
+  def remove_files(self, entry):
+    """ Removes a file and its sidecar from the hot tier, if they're still
+    there.
+
+    Args:
+      entry: A dict with the file's entry.
+    """
+    for path in [self.get_path(entry) + '.json', self.get_path(entry)]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+
+  def store(self, bucket_name, key_name, size, write, content_encoding=None):
+    """ Writes a file into the hot tier, and queues it to be flushed.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file goes in.
+      key_name: A str with the name of the file's key.
+      size: An int with the number of bytes the file is expected to have.
+      write: A function that takes an open local file, writes the file's
+        contents to it, and returns their hex-encoded MD5.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    Raises:
+      IOError: If flushes didn't make room for the file within WRITE_TIMEOUT
+        seconds.
+    """
+    # Wait until flushes make room for the file, unless nothing is waiting
+    # to be flushed (so that a file larger than the tier still goes through).
+    deadline = time.time() + self.WRITE_TIMEOUT
+    with self.condition:
+      while self.dirty_bytes > 0 and self.dirty_bytes + size > self.max_bytes:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          raise IOError('timed out waiting for room in the local tier, ' \
+            'since {0} bytes are still being flushed'.format(
+            self.dirty_bytes))
+        self.condition.wait(remaining)
+      self.dirty_bytes += size
+
+    version = '{0:020d}-{1}'.format(int(time.time() * 1000000),
+      uuid.uuid4().hex[:12])
+    entry = {
+      'bucket' : bucket_name,
+      'key' : key_name,
+      'name' : '{0:016x}-{1}'.format(HashRing.hash('/%s/%s' % (bucket_name,
+        key_name)), version),
+      'version' : version,
+      'content_type' : mimetypes.guess_type(key_name)[0] or \
+        'application/octet-stream',
+      'content_encoding' : content_encoding,
+      'last_modified' : time.time(),
+      'dirty' : True
+    }
+    try:
+      with open(self.get_path(entry), 'wb') as file_handle:
+        entry['md5'] = write(file_handle)
+      entry['size'] = os.path.getsize(self.get_path(entry))
+      self.write_sidecar(entry)
+    except Exception:
+      self.remove_files(entry)
+      with self.condition:
+        self.dirty_bytes -= size
+        self.condition.notify_all()
+      raise
+
+    with self.condition:
+      old_entry = self.entries.pop((bucket_name, key_name), None)
+      self.entries[(bucket_name, key_name)] = entry
+      self.used_bytes += entry['size']
+      self.dirty_bytes += entry['size'] - size
+      self.num_dirty += 1
+      if old_entry is not None:
+        self.forget(old_entry)
+      self.condition.notify_all()
+    if old_entry is not None:
+      self.remove_files(old_entry)
+    self.flush_queue.put((bucket_name, key_name))
+    self.evict()
+
+
+  def forget(self, entry):
+    """ Stops counting a file that was taken out of the hot tier. The caller
+    must hold self.condition.
+
+    Args:
+      entry: A dict with the file's entry.
+    """
+    self.used_bytes -= entry['size']
+    # Files we gave up flushing were already stopped being counted as dirty.
+    if entry['dirty'] and not entry.get('abandoned'):
+      self.dirty_bytes -= entry['size']
+      self.num_dirty -= 1
+
+
+  def remove_entry(self, bucket_name, key_name):
+    """ Takes a file out of the hot tier, whether or not it was flushed.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    Returns:
+      The dict with the file's entry, or None if it wasn't in the hot tier.
+    """
+    with self.condition:
+      entry = self.entries.pop((bucket_name, key_name), None)
+      if entry is not None:
+        self.forget(entry)
+        self.condition.notify_all()
+    if entry is not None:
+      self.remove_files(entry)
+    return entry
+
+
+  def evict(self):
+    """ Removes flushed files from the hot tier, least recently read first,
+    until it's no larger than max_bytes (or only unflushed files are left).
+    """
+    evicted = []
+    with self.condition:
+      for key, entry in self.entries.items():
+        if self.used_bytes <= self.max_bytes:
+          break
+        if entry['dirty']:
+          continue
+        del self.entries[key]
+        self.forget(entry)
+        evicted.append(entry)
+    for entry in evicted:
+      self.remove_files(entry)
+
+
+  def flush_files(self):
+    """ Flushes the files in the flush queue, one at a time, forever. """
+    while True:
+      bucket_name, key_name = self.flush_queue.get()
+      self.flush_file(bucket_name, key_name)
+
+
+  def flush_file(self, bucket_name, key_name):
+    """ Uploads a file in the hot tier to the cold tier, if it hasn't been
+    flushed yet, and marks it as flushed.
+
+    A flush that fails (after the RetryPolicy gives up on it) is tried again
+    FLUSH_RETRY_INTERVAL seconds later, since the file isn't anywhere else,
+    until it has failed MAX_FLUSH_ATTEMPTS times. The file is then given up
+    on: it stays in the hot tier, but no longer counts against the room that
+    writers wait for, and isn't tried again until magik starts again.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+    """
+    with self.get_key_lock(bucket_name, key_name):
+      with self.condition:
+        entry = self.entries.get((bucket_name, key_name))
+      if entry is None or not entry['dirty']:
+        return
+
+      try:
+        self.retry_policy.call(lambda: self.storage.upload_file(
+          self.get_path(entry), bucket_name, key_name,
+          entry['content_encoding']), self.storage.is_retryable_error)
+        failure_reason = None
+      except Exception as exception:
+        failure_reason = self.storage.describe_error(exception)
+
+      with self.condition:
+        # If the file was written again or deleted while we were flushing it,
+        # this version no longer matters.
+        current_entry = self.entries.get((bucket_name, key_name))
+        if current_entry is None or \
+          current_entry['version'] != entry['version']:
+          return
+        if failure_reason is None:
+          flushed_entry = dict(entry, dirty=False)
+          flushed_entry.pop('flush_attempts', None)
+          self.write_sidecar(flushed_entry)
+          self.entries[(bucket_name, key_name)] = flushed_entry
+          self.dirty_bytes -= entry['size']
+          self.num_dirty -= 1
+          self.condition.notify_all()
+        else:
+          # Attempts are only counted in memory, so that a restart (e.g.,
+          # after the cold tier's configuration is fixed) tries again.
+          attempts = current_entry.get('flush_attempts', 0) + 1
+          current_entry['flush_attempts'] = attempts
+          abandoned = attempts >= self.MAX_FLUSH_ATTEMPTS
+          if abandoned:
+            current_entry['abandoned'] = True
+            self.dirty_bytes -= entry['size']
+            self.num_dirty -= 1
+            self.condition.notify_all()
+
+    if failure_reason is None:
+      self.evict()
+      return
+
+    Instrumentation.emit('tier_flush_failed', {
+      'bucket' : bucket_name,
+      'key' : key_name,
+      'failure_reason' : failure_reason,
+      'attempts' : attempts,
+      'abandoned' : abandoned
+    })
+    if abandoned:
+      return
+    retry = threading.Timer(self.FLUSH_RETRY_INTERVAL, self.flush_queue.put,
+      [(bucket_name, key_name)])
+    retry.daemon = True
+    retry.start()
+
+
+  def wait_for_flush(self, timeout=None):
+    """ Waits until every file in the hot tier has been flushed (or given up
+    on, as flush_file describes).
+
+    Args:
+      timeout: A float with the most seconds to wait, or None to wait for as
+        long as it takes.
+    Returns:
+      True if no file is waiting to be flushed, and False if we gave up
+        waiting.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with self.condition:
+      while self.num_dirty > 0:
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          return False
+        self.condition.wait(remaining)
+    return True
+
+
+  def read_local(self, bucket_name, key_name, read):
+    """ Reads a file from the hot tier, if it's there, and marks it as the
+    most recently read.
+
+    Args:
+      bucket_name: A str with the name of the bucket the file is in.
+      key_name: A str with the name of the file's key.
+      read: A function that takes the file's entry and reads its local file.
+    Returns:
+      A tuple with True and whatever read returned, or with False and None if
+        the file isn't in the hot tier.
+    Raises:
+      Exception: Whatever read raised, unless the file was evicted or written
+        again while we were reading it.
+    """
+    while True:
+      with self.condition:
+        entry = self.entries.pop((bucket_name, key_name), None)
+        if entry is None:
+          return False, None
+        self.entries[(bucket_name, key_name)] = entry
+      try:
+        return True, read(entry)
+      except (IOError, OSError):
+        with self.condition:
+          current_entry = self.entries.get((bucket_name, key_name))
+        if current_entry is not None and \
+          current_entry['version'] == entry['version']:
+          raise
+
+
+  def write_chunks(self, chunks, file_handle):
+    """ Writes chunks of a file to a local file.
+
+    Args:
+      chunks: An iterator of strs, whose concatenation is the file.
+      file_handle: The open local file to write to.
+    Returns:
+      A str with the hex-encoded MD5 of the file.
+    """
+    md5 = hashlib.md5()
+    for chunk in chunks:
+      md5.update(chunk)
+      file_handle.write(chunk)
+    return md5.hexdigest()
+
+
+  def copy_file(self, source, file_handle):
+    """ Copies a local file into another local file.
+
+    Args:
+      source: A str with the path of the file to copy.
+      file_handle: The open local file to copy to.
+    Returns:
+      A str with the hex-encoded MD5 of the file.
+    """
+    with open(source, 'rb') as source_handle:
+      return self.write_chunks(iter(lambda: source_handle.read(
+        self.COPY_CHUNK_SIZE), ''), file_handle)
+
+
+  def get_backend_id(self):
+    """ Identifies the cold tier's platform and account, since every file ends
+    up there. """
+    return self.storage.get_backend_id()
+
+
+  def does_bucket_exist(self, bucket_name):
+    """ Asks the cold tier if a bucket exists, unless it has already said so.
+
+    Buckets are remembered for as long as the TieredStorage lives, since every
+    upload checks its bucket first, and writes are meant to finish at local
+    disk speed. A bucket that is deleted behind our back shows up as failed
+    flushes instead.
+    """
+    with self.condition:
+      if bucket_name in self.known_buckets:
+        return True
+    exists = self.storage.does_bucket_exist(bucket_name)
+    if exists:
+      with self.condition:
+        self.known_buckets.add(bucket_name)
+    return exists
+
+
+  def create_bucket(self, bucket_name):
+    """ Asks the cold tier to create a bucket, and remembers that it exists.
+    """
+    self.storage.create_bucket(bucket_name)
+    with self.condition:
+      self.known_buckets.add(bucket_name)
+
+
+  def list_keys(self, bucket_name, prefix=''):
+    """ Lists the keys in a bucket that start with the given prefix, merging
+    files that haven't been flushed yet into the cold tier's listing.
+
+    Args:
+      bucket_name: A str with the name of the bucket to list.
+      prefix: A str that each key name returned must start with.
+    Yields:
+      A dict for each key found, in the format that BaseStorage.list_keys
+        describes, from the hot tier if the key is there.
+    """
+    with self.condition:
+      local_keys = sorted((key_name, 0, self.describe_entry(entry))
+        for (entry_bucket_name, key_name), entry in self.entries.items()
+        if entry_bucket_name == bucket_name and key_name.startswith(prefix)
+        and entry['dirty'])
+
+    def list_cold_tier():
+      for key_info in self.storage.list_keys(bucket_name, prefix):
+        yield key_info['key'], 1, key_info
+
+    last_key_name = None
+    for key_name, _, key_info in heapq.merge(local_keys, list_cold_tier()):
+      if key_name != last_key_name:
+        yield key_info
+      last_key_name = key_name
+
+
+  def describe_entry(self, entry):
+    """ Describes a file in the hot tier the way BaseStorage.get_metadata
+    does.
+
+    Args:
+      entry: A dict with the file's entry.
+    Returns:
+      A dict in the format that BaseStorage.get_metadata describes.
+    """
+    return {
+      'key' : entry['key'],
+      'size' : entry['size'],
+      'etag' : entry['md5'],
+      'md5' : entry['md5'],
+      'content_type' : entry['content_type'],
+      'content_encoding' : entry['content_encoding'],
+      'last_modified' : entry['last_modified']
+    }
+
+
+  def does_key_exist(self, bucket_name, key_name):
+    """ Checks if a file is in the hot tier or the cold tier. """
+    with self.condition:
+      if (bucket_name, key_name) in self.entries:
+        return True
+    return self.storage.does_key_exist(bucket_name, key_name)
+
+
+  def get_metadata(self, bucket_name, key_name):
+    """ Looks up a file in the hot tier, and then in the cold tier, as
+    BaseStorage.get_metadata describes. """
+    with self.condition:
+      entry = self.entries.get((bucket_name, key_name))
+    if entry is not None:
+      return self.describe_entry(entry)
+    return self.storage.get_metadata(bucket_name, key_name)
+
+
+  def download_file(self, destination, bucket_name, key_name):
+    """ Copies a file from the hot tier, or downloads it from the cold tier
+    if it isn't there, as BaseStorage.download_file describes. """
+    found, _ = self.read_local(bucket_name, key_name, lambda entry:
+      shutil.copyfile(self.get_path(entry), destination))
+    if not found:
+      self.storage.download_file(destination, bucket_name, key_name)
+
+
+  def download_range(self, bucket_name, key_name, start, end):
+    """ Reads part of a file from the hot tier, or downloads it from the cold
+    tier if it isn't there, as BaseStorage.download_range describes. """
+    def read(entry):
+      with open(self.get_path(entry), 'rb') as file_handle:
+        file_handle.seek(start)
+        return file_handle.read(end - start + 1)
+
+    found, contents = self.read_local(bucket_name, key_name, read)
+    if found:
+      return contents
+    return self.storage.download_range(bucket_name, key_name, start, end)
+
+
+  def upload_file(self, source, bucket_name, key_name, content_encoding=None):
+    """ Copies a file into the hot tier, to be flushed to the cold tier in the
+    background, as BaseStorage.upload_file describes. """
+    self.store(bucket_name, key_name, os.path.getsize(source), lambda
+      file_handle: self.copy_file(source, file_handle), content_encoding)
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Writes a stream into the hot tier, to be flushed to the cold tier in
+    the background, as BaseStorage.upload_stream describes. """
+    self.store(bucket_name, key_name, size, lambda file_handle:
+      self.write_chunks(chunks, file_handle), content_encoding)
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file within the hot tier if it's there, and within the cold
+    tier otherwise, as BaseStorage.copy_key describes. """
+    found, _ = self.read_local(source_bucket_name, source_key_name, lambda
+      entry: self.store(bucket_name, key_name, entry['size'], lambda
+      file_handle: self.copy_file(self.get_path(entry), file_handle),
+      entry['content_encoding']))
+    if found:
+      return
+
+    with self.get_key_lock(bucket_name, key_name):
+      self.remove_entry(bucket_name, key_name)
+      self.storage.copy_key(source_bucket_name, source_key_name, bucket_name,
+        key_name, size, content_encoding)
+
+
+  def delete_file(self, bucket_name, key_name):
+    """ Deletes a file from the hot tier and the cold tier, as
+    BaseStorage.delete_file describes.
+
+    A file that hadn't been flushed yet may not be in the cold tier at all,
+    so the cold tier failing to delete it only counts if it still has it.
+    """
+    with self.get_key_lock(bucket_name, key_name):
+      entry = self.remove_entry(bucket_name, key_name)
+      try:
+        self.storage.delete_file(bucket_name, key_name)
+      except Exception:
+        if entry is None or \
+          self.storage.get_metadata(bucket_name, key_name) is not None:
+          raise
+
+
+  def delete_keys(self, bucket_name, key_names):
+    """ Deletes several files from the hot tier and the cold tier.
+
+    Args:
+      bucket_name: A str with the name of the bucket the files are in.
+      key_names: A list of strs with the names of the keys to delete.
+    Returns:
+      A dict that maps the name of each key that couldn't be deleted to a str
+        explaining why. As in delete_file, the cold tier failing to delete a
+        file that was in the hot tier only counts if it still has it.
+    """
+    # Take every key's lock, in order, so that we can't deadlock with another
+    # caller doing the same.
+    key_locks = [self.key_locks[index] for index in sorted(set(
+      self.get_key_lock_index(bucket_name, key_name)
+      for key_name in key_names))]
+    for key_lock in key_locks:
+      key_lock.acquire()
+    try:
+      removed = set(key_name for key_name in key_names
+        if self.remove_entry(bucket_name, key_name) is not None)
+      failures = self.storage.delete_keys(bucket_name, key_names)
+      return dict((key_name, reason) for key_name, reason in
+        failures.items() if key_name not in removed or
+        self.storage.get_metadata(bucket_name, key_name) is not None)
+    finally:
+      for key_lock in reversed(key_locks):
+        key_lock.release()
@@ -9,11 +9,13 @@ import re
 
 
 # Third-party libraries
+import boto.exception
 import boto.s3.connection
 import boto.s3.key
 
 
 # WalrusStorage-specific imports
+from magik.base_storage import BaseStorage
 from magik.s3_storage import S3Storage
 from magik.custom_exceptions import BadConfigurationException
 
@@ -22,19 +24,26 @@ class WalrusStorage(S3Storage):
   """ WalrusStorage provides callers with an interface to Eucalyptus Walrus. """
 
 
+  # Walrus doesn't support S3's multi-object delete, so we delete keys one at
+  # a time (in parallel) instead.
+  DELETE_BATCH_SIZE = 1
+
+
   def __init__(self, parameters):
     """ Creates a new WalrusStorage object, with the AWS_ACCESS_KEY,
     AWS_SECRET_KEY, and S3_URL that the user has specified.
 
     Args:
       parameters: A dict that contains the credentials necessary to authenticate
-        with Walrus.
+        with Walrus, and optionally a 'timeout' (see BaseStorage.get_timeout).
     Raises:
       BadConfigurationException: If AWS_ACCESS_KEY or AWS_SECRET_KEY is not
-        specified, or if S3_URL is not a URL (e.g., of the form
-        http://1.2.3.4:8773/services/Walrus).
+        specified, if S3_URL is not a URL (e.g., of the form
+        http://1.2.3.4:8773/services/Walrus), or if the timeout isn't a
+        positive number.
     """
     self.setup_s3_credentials(parameters)
+    self.timeout = self.get_timeout(parameters)
 
     if 'S3_URL' not in parameters:
       raise BadConfigurationException("S3_URL needs to be specified")
@@ -58,9 +67,10 @@ class WalrusStorage(S3Storage):
     """ Uses boto to connect to Walrus.
 
     Returns:
-      A boto.s3.Connection, which represents a connection to Walrus.
+      A boto.s3.Connection, which represents a connection to Walrus, whose
+        HTTP connections time out after self.timeout seconds.
     """
-    return boto.s3.connection.S3Connection(
+    connection = boto.s3.connection.S3Connection(
       aws_access_key_id=self.aws_access_key,
       aws_secret_access_key=self.aws_secret_key,
       is_secure=False,
@@ -68,3 +78,91 @@ class WalrusStorage(S3Storage):
       port=8773,
       calling_format=boto.s3.connection.OrdinaryCallingFormat(),
       path="/services/Walrus")
+    connection.http_connection_kwargs['timeout'] = self.timeout
+    return connection
+
+
+  def get_backend_id(self):
+    """ Identifies the Walrus deployment and account that this object talks
+    to.
+
+    Returns:
+      A str that identifies the storage platform and account.
+    """
+    return 'walrus:{0}:{1}'.format(self.s3_url, self.aws_access_key)
+
+
+  def upload_file_resumable(self, source, bucket_name, key_name,
+    transfer_state, content_encoding=None):
+    """ Uploads a file from the local filesystem to Walrus in one go.
+
+    Walrus doesn't support multipart uploads, so unlike S3Storage, we can't
+    resume an upload of a single file that was cut short (although batches of
+    uploads still skip the files that were already uploaded).
+
+    Args:
+      source: A str containing the name of the file on the local filesystem that
+        should be uploaded to Walrus.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      transfer_state: A TransferState for this upload, which is unused.
+      content_encoding: A str with the Content-Encoding to store the file
+        with (e.g., 'gzip'), or None if it isn't encoded.
+    """
+    self.upload_file(source, bucket_name, key_name, content_encoding)
+
+
+  def copy_key(self, source_bucket_name, source_key_name, bucket_name,
+    key_name, size, content_encoding=None):
+    """ Copies a file to a new key within Walrus, via a single PUT-Copy
+    request.
+
+    Walrus doesn't support multipart copies, and older Walrus deployments
+    don't support copies at all, in which case we fall back to streaming the
+    file from its old key to its new one.
+
+    Args:
+      source_bucket_name: A str containing the name of the bucket that the
+        file should be copied from.
+      source_key_name: A str containing the name of the key that the file
+        should be copied from.
+      bucket_name: A str containing the name of the bucket that the file should
+        be copied to.
+      key_name: A str containing the name of the key that the file should be
+        copied to.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding the file is stored
+        with, or None if it isn't encoded.
+    """
+    bucket = self.connection.get_bucket(bucket_name, validate=False)
+    try:
+      bucket.copy_key(key_name, source_bucket_name, source_key_name)
+    except boto.exception.S3ResponseError as exception:
+      if exception.status != 501:
+        raise
+      BaseStorage.copy_key(self, source_bucket_name, source_key_name,
+        bucket_name, key_name, size, content_encoding)
+
+
+  def upload_stream(self, chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    """ Uploads a file to Walrus from a stream of chunks.
+
+    Walrus supports neither multipart uploads nor chunked transfer encoding,
+    so the chunks have to be staged in a temporary file and uploaded in one
+    go.
+
+    Args:
+      chunks: An iterator of strs whose concatenation is the file to upload.
+      bucket_name: A str containing the name of the bucket that the file should
+        be placed in.
+      key_name: A str containing the name of the key that the file should be
+        placed in.
+      size: An int with the size of the file, in bytes.
+      content_encoding: A str with the Content-Encoding to store the file
+        with, or None if it isn't encoded.
+    """
+    BaseStorage.upload_stream(self, chunks, bucket_name, key_name, size,
+      content_encoding)
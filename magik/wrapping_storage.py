@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+""" wrapping_storage.py provides a single class, WrappingStorage, that the
+*Storage objects which store files in other *Storage objects (rather than
+talking to a storage platform themselves) are built on. """
+
+
+# Magik library imports
+from magik.base_storage import BaseStorage
+
+
+class WrappingStorage(BaseStorage):
+  """ WrappingStorage answers the questions that only a storage platform can
+  (which errors are worth retrying or mean we're being throttled, how large
+  streamed chunks should be, and how many keys a bulk delete can take) by
+  asking the *Storage objects it wraps, so that subclasses (e.g.,
+  ShardedStorage or ReplicatedStorage) only implement the operations they
+  change.
+
+  Subclasses don't call BaseStorage.__init__, since they have no connection of
+  their own to set up.
+  """
+
+
+  def __init__(self, storages):
+    """ Creates a new WrappingStorage.
+
+    Args:
+      storages: A non-empty list of the *Storage objects that files are stored
+        in.
+    """
+    self.wrapped_storages = list(storages)
+    self.DELETE_BATCH_SIZE = min(storage.DELETE_BATCH_SIZE
+      for storage in self.wrapped_storages)
+
+
+  def get_credentials_id(self):
+    """ Identifies this object's layout along with the accounts and
+    credentials of every wrapped *Storage object, as
+    BaseStorage.get_credentials_id describes. """
+    return self.hash_credentials(*[storage.get_credentials_id()
+      for storage in self.wrapped_storages])
+
+
+  def get_stream_chunk_size(self, size):
+    """ Asks the wrapped *Storage objects how large streamed chunks should be,
+    and picks the largest, so that chunks are never too small for any of
+    them. """
+    return max(storage.get_stream_chunk_size(size)
+      for storage in self.wrapped_storages)
+
+
+  def is_retryable_error(self, exception):
+    """ Asks each wrapped *Storage object if an error is worth retrying. """
+    return any(storage.is_retryable_error(exception)
+      for storage in self.wrapped_storages)
+
+
+  def is_throttling_error(self, exception):
+    """ Asks each wrapped *Storage object if an error means it was throttled.
+    """
+    return any(storage.is_throttling_error(exception)
+      for storage in self.wrapped_storages)
+
+
+  def describe_error(self, exception):
+    """ Asks the first wrapped *Storage object to explain an error. """
+    return self.wrapped_storages[0].describe_error(exception)
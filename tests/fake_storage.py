@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+""" fake_storage.py provides make_fake_storage, an in-memory stand-in for a
+cloud *Storage object, for the tests of the *Storage objects that wrap
+others. """
+
+
+# General-purpose Python library imports
+import hashlib
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+def make_fake_storage(backend_id, objects, before_call=None, chunk_size=4,
+  credentials_id=None):
+  """ Builds a flexmock that acts like a *Storage object for one account, and
+  keeps its files in memory.
+
+  Args:
+    backend_id: A str with the id that the fake identifies itself with (e.g.,
+      's3:access').
+    objects: A dict that the fake keeps its files in, mapping each (bucket,
+      key) to the file's contents, which tests can read and change directly.
+    before_call: A function that is called with the name and arguments of
+      each operation before the fake runs it (e.g., to make it fail or hang),
+      or None.
+    chunk_size: An int with the size that streamed chunks should be.
+    credentials_id: A str with the fake's credentials id, which defaults to
+      one made from the backend id.
+  Returns:
+    A flexmock with the primitives of a *Storage object. Metadata and
+      listings include the 'backend_id' that answered.
+  """
+  # The Content-Encoding that each file was stored with, if any.
+  encodings = {}
+
+  def operation(name, function):
+    def run(*args, **kwargs):
+      if before_call is not None:
+        before_call(name, *args)
+      return function(*args, **kwargs)
+    storage.should_receive(name).replace_with(run)
+
+  def describe(bucket_name, key_name):
+    metadata = {
+      'key' : key_name,
+      'size' : len(objects[(bucket_name, key_name)]),
+      'md5' : hashlib.md5(objects[(bucket_name, key_name)]).hexdigest(),
+      'backend_id' : backend_id
+    }
+    if encodings.get((bucket_name, key_name)):
+      metadata['content_encoding'] = encodings[(bucket_name, key_name)]
+    return metadata
+
+  def list_keys(bucket_name, prefix=''):
+    return [describe(object_bucket_name, key_name) for (object_bucket_name,
+      key_name) in sorted(objects) if object_bucket_name == bucket_name and
+      key_name.startswith(prefix)]
+
+  def get_metadata(bucket_name, key_name):
+    if (bucket_name, key_name) not in objects:
+      return None
+    return describe(bucket_name, key_name)
+
+  def download_file(destination, bucket_name, key_name):
+    with open(destination, 'w') as file_handle:
+      file_handle.write(objects[(bucket_name, key_name)])
+
+  def iter_key_chunks(bucket_name, key_name, size, chunk_size, start=0):
+    contents = objects[(bucket_name, key_name)]
+    return [contents[offset:offset + chunk_size]
+      for offset in range(start, len(contents), chunk_size)]
+
+  def upload_file(source, bucket_name, key_name, content_encoding=None):
+    with open(source) as file_handle:
+      objects[(bucket_name, key_name)] = file_handle.read()
+    encodings[(bucket_name, key_name)] = content_encoding
+
+  def upload_stream(chunks, bucket_name, key_name, size,
+    content_encoding=None):
+    objects[(bucket_name, key_name)] = ''.join(chunks)
+    encodings[(bucket_name, key_name)] = content_encoding
+
+  def copy_key(source_bucket_name, source_key_name, bucket_name, key_name,
+    size, content_encoding=None):
+    objects[(bucket_name, key_name)] = objects[(source_bucket_name,
+      source_key_name)]
+    encodings[(bucket_name, key_name)] = encodings.get((source_bucket_name,
+      source_key_name))
+
+  def delete_file(bucket_name, key_name):
+    del objects[(bucket_name, key_name)]
+    encodings.pop((bucket_name, key_name), None)
+
+  def delete_keys(bucket_name, key_names):
+    failures = {}
+    for key_name in key_names:
+      if objects.pop((bucket_name, key_name), None) is None:
+        failures[key_name] = 'not found'
+      encodings.pop((bucket_name, key_name), None)
+    return failures
+
+  storage = flexmock(name=backend_id, DELETE_BATCH_SIZE=1000)
+  storage.should_receive('get_backend_id').and_return(backend_id)
+  storage.should_receive('get_credentials_id').and_return(credentials_id or
+    backend_id + ':secret')
+  storage.should_receive('get_stream_chunk_size').and_return(chunk_size)
+  storage.should_receive('is_retryable_error').and_return(False)
+  storage.should_receive('is_throttling_error').and_return(False)
+  storage.should_receive('describe_error').replace_with(str)
+  operation('does_bucket_exist', lambda bucket_name: True)
+  operation('create_bucket', lambda bucket_name: None)
+  operation('list_keys', list_keys)
+  operation('get_metadata', get_metadata)
+  operation('does_key_exist', lambda bucket_name, key_name:
+    get_metadata(bucket_name, key_name) is not None)
+  operation('download_file', download_file)
+  operation('download_range', lambda bucket_name, key_name, start, end:
+    objects[(bucket_name, key_name)][start:end + 1])
+  operation('iter_key_chunks', iter_key_chunks)
+  operation('upload_file', upload_file)
+  operation('upload_stream', upload_stream)
+  operation('copy_key', copy_key)
+  operation('delete_file', delete_file)
+  operation('delete_keys', delete_keys)
+  return storage
@@ -5,11 +5,14 @@
 
 # General-purpose Python library imports
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 
 # Third-party libraries
+import azure
 import azure.storage
 from flexmock import flexmock
 
@@ -17,7 +20,13 @@ from flexmock import flexmock
 # S3 storage import, the library that we're testing here
 lib = os.path.dirname(__file__) + os.sep + ".."
 sys.path.append(lib)
+from magik.base_storage import BaseStorage
+from magik.checkpoint import Checkpoint
+from magik.concurrency_controller import ConcurrencyController
 from magik.custom_exceptions import BadConfigurationException
+from magik.manifest_index import ManifestIndex
+from magik.rate_limiter import RateLimiter
+from magik.retry_policy import RetryPolicy
 from magik.storage_factory import StorageFactory
 
 
@@ -26,7 +35,11 @@ class TestAzureStorage(unittest.TestCase):
 
   def setUp(self):
     # Set up a mock for when we interact with S3
-    self.fake_azure = flexmock(name='fake_azure')
+    # The Azure SDK opens an HTTP connection per request.
+    self.fake_http_connection = flexmock(name='fake_http_connection',
+      timeout=None)
+    self.fake_azure = flexmock(name='fake_azure', _httpclient=flexmock(
+      get_connection=lambda request: self.fake_http_connection))
     flexmock(azure.storage)
     azure.storage.should_receive('BlobService').with_args('access', 'secret') \
       .and_return(self.fake_azure)
@@ -38,6 +51,11 @@ class TestAzureStorage(unittest.TestCase):
     })
 
 
+  def tearDown(self):
+    BaseStorage.manifest_index = None
+    RateLimiter.limiters = {}
+
+
   def test_azure_storage_creation_without_necessary_parameters(self):
     # Trying to create an AzureStorage without the account name should fail.
     self.assertRaises(BadConfigurationException, StorageFactory.get_storage, {
@@ -62,6 +80,12 @@ class TestAzureStorage(unittest.TestCase):
     self.assertEquals("secret", azure.azure_account_key)
 
 
+  def test_connections_time_out(self):
+    self.assertEquals(self.fake_http_connection,
+      self.azure.connection._httpclient.get_connection('request'))
+    self.assertEquals(60, self.fake_http_connection.timeout)
+
+
   def test_upload_one_file_and_create_bucket(self):
     file_one_info = {
       'source' : '/baz/boo/fbar1.tgz',
@@ -258,3 +282,286 @@ class TestAzureStorage(unittest.TestCase):
     actual = self.azure.delete_files(delete_info)
     for delete_result in actual:
       self.assertEquals(True, delete_result['success'])
+
+
+  def test_copy_waits_for_pending_copy_blob(self):
+    self.fake_azure.should_receive('get_container_metadata').with_args(
+      'mybucket')
+    self.fake_azure.should_receive('get_blob_properties').with_args(
+      'mybucket', 'files/a b.txt').and_return({
+        'content-length' : '10', 'etag' : '0x1',
+        'last-modified' : 'Mon, 18 Mar 2013 22:43:05 GMT'})
+
+    # Presume that Azure finishes the copy after we ask about it once.
+    self.fake_azure.should_receive('make_blob_url').with_args('mybucket',
+      'files/a%20b.txt').and_return('url')
+    self.fake_azure.should_receive('copy_blob').with_args('mybucket',
+      'copies/a b.txt', 'url').and_return({'x-ms-copy-status' : 'pending'})
+    self.fake_azure.should_receive('get_blob_properties').with_args(
+      'mybucket', 'copies/a b.txt').and_return(
+      {'x-ms-copy-status' : 'success'}).once()
+    self.azure.COPY_POLL_INTERVAL = 0
+
+    actual = self.azure.copy_files([{'source' : '/mybucket/files/a b.txt',
+      'destination' : '/mybucket/copies/a b.txt'}])
+    self.assertEquals(True, actual[0]['success'])
+
+
+  def test_copy_quotes_unicode_key_names(self):
+    self.fake_azure.should_receive('make_blob_url').with_args('mybucket',
+      'caf%C3%A9.txt').and_return('url').once()
+    self.fake_azure.should_receive('copy_blob').with_args('mybucket',
+      'copy.txt', 'url').and_return({'x-ms-copy-status' : 'success'})
+    self.azure.copy_key('mybucket', u'caf\xe9.txt', 'mybucket', 'copy.txt',
+      10)
+
+
+  def test_copy_aborts_copy_blob_that_takes_too_long(self):
+    self.fake_azure.should_receive('make_blob_url').and_return('url')
+    self.fake_azure.should_receive('copy_blob').with_args('mybucket',
+      'copy.txt', 'url').and_return({'x-ms-copy-status' : 'pending',
+      'x-ms-copy-id' : 'abc'})
+    self.fake_azure.should_receive('get_blob_properties').with_args(
+      'mybucket', 'copy.txt').and_return({'x-ms-copy-status' : 'pending'})
+    self.fake_azure.should_receive('abort_copy_blob').with_args('mybucket',
+      'copy.txt', 'abc').once()
+    self.fake_azure.should_receive('delete_blob').with_args('mybucket',
+      'copy.txt').once()
+    self.azure.COPY_POLL_INTERVAL = 0
+    self.azure.COPY_TIMEOUT = 0.01
+
+    self.assertRaises(azure.WindowsAzureError, self.azure.copy_key,
+      'mybucket', 'a.txt', 'mybucket', 'copy.txt', 10)
+
+
+  def test_upload_stream_puts_one_block_per_chunk(self):
+    self.azure.BLOCK_SIZE = 4
+    self.fake_azure.should_receive('put_block').with_args('mybucket', 'a.txt',
+      '0123', '0000000000').once()
+    self.fake_azure.should_receive('put_block').with_args('mybucket', 'a.txt',
+      '45', '0000000001').once()
+    self.fake_azure.should_receive('put_block_list').with_args('mybucket',
+      'a.txt', ['0000000000', '0000000001']).once()
+
+    self.azure.upload_stream(iter(['0123', '45']), 'mybucket', 'a.txt', 6)
+
+
+  def test_list_keys_pages_through_results(self):
+    # Presume that the container's listing comes back in two pages.
+    first_blob = flexmock(name='files/fbar1.tgz', properties=flexmock(
+      content_length='10', etag='0x1', content_md5='kAFQmDzST7DWlj99KOF/cg==',
+      last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+    second_blob = flexmock(name='files/fbar2.tgz', properties=flexmock(
+      content_length='20', etag='0x2', content_md5='',
+      last_modified='Mon, 18 Mar 2013 22:43:06 GMT'))
+
+    self.fake_azure.should_receive('list_blobs').with_args('mybucket',
+      prefix='files/', marker=None, maxresults=5000).and_return(
+      flexmock(blobs=[first_blob], next_marker='page2'))
+    self.fake_azure.should_receive('list_blobs').with_args('mybucket',
+      prefix='files/', marker='page2', maxresults=5000).and_return(
+      flexmock(blobs=[second_blob], next_marker=''))
+
+    actual = list(self.azure.list_keys('mybucket', 'files/'))
+    self.assertEquals(['files/fbar1.tgz', 'files/fbar2.tgz'],
+      [key_info['key'] for key_info in actual])
+    self.assertEquals(10, actual[0]['size'])
+    self.assertEquals('900150983cd24fb0d6963f7d28e17f72', actual[0]['md5'])
+    self.assertEquals(1363646585.0, actual[0]['last_modified'])
+    self.assertEquals(None, actual[1]['md5'])
+
+
+  def test_delete_prefix_deletes_each_blob(self):
+    # Presume that the container has two blobs under the prefix.
+    self.fake_azure.should_receive('list_blobs').with_args('mybucket',
+      prefix='logs/', marker=None, maxresults=5000).and_return(
+      flexmock(blobs=[
+        flexmock(name='logs/1', properties=flexmock(content_length='10',
+          etag='0x1', content_md5='',
+          last_modified='Mon, 18 Mar 2013 22:43:05 GMT')),
+        flexmock(name='logs/2', properties=flexmock(content_length='10',
+          etag='0x2', content_md5='',
+          last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+      ], next_marker=''))
+
+    # Azure can't delete blobs in bulk, so each one is deleted on its own.
+    self.fake_azure.should_receive('delete_blob').with_args('mybucket',
+      'logs/1').once()
+    self.fake_azure.should_receive('delete_blob').with_args('mybucket',
+      'logs/2').and_raise(azure.WindowsAzureMissingResourceError(
+      'Not Found')).once()
+
+    actual = dict((result['source'], result) for result in
+      self.azure.iter_delete_prefix('/mybucket/logs/'))
+    self.assertEquals(True, actual['/mybucket/logs/1']['success'])
+    self.assertEquals(False, actual['/mybucket/logs/2']['success'])
+    self.assertEquals('WindowsAzureMissingResourceError: Not Found',
+      actual['/mybucket/logs/2']['failure_reason'])
+
+
+  def test_delete_prefix_retries_throttled_deletes(self):
+    self.fake_azure.should_receive('list_blobs').with_args('mybucket',
+      prefix='logs/', marker=None, maxresults=5000).and_return(
+      flexmock(blobs=[flexmock(name='logs/1', properties=flexmock(
+        content_length='10', etag='0x1', content_md5='',
+        last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))], next_marker=''))
+
+    # Azure is busy the first time, so the delete is retried, and the
+    # bucket's ConcurrencyController backs off.
+    self.fake_azure.should_receive('delete_blob').with_args('mybucket',
+      'logs/1').and_raise(azure.WindowsAzureError('ServerBusy')) \
+      .and_return(None).twice()
+
+    try:
+      actual = list(self.azure.iter_delete_prefix('/mybucket/logs/',
+        retry_policy=RetryPolicy(base_delay=0), adaptive=True))
+      self.assertEquals([True], [result['success'] for result in actual])
+      self.assertTrue(ConcurrencyController.for_bucket(
+        self.azure.get_backend_id(), 'mybucket').limit <
+        ConcurrencyController.INITIAL_LIMIT)
+    finally:
+      ConcurrencyController.controllers = {}
+
+
+  def test_sync_download_only_downloads_missing_files(self):
+    # Use an in-memory manifest index, so that we don't write to the home dir.
+    BaseStorage.manifest_index = ManifestIndex(':memory:')
+
+    # Presume that we already have one of the two blobs locally.
+    local_dir = tempfile.mkdtemp()
+    with open(os.path.join(local_dir, 'have.txt'), 'w') as file_handle:
+      file_handle.write('abc')
+    os.utime(os.path.join(local_dir, 'have.txt'), (1363646585, 1363646585))
+
+    self.fake_azure.should_receive('get_container_metadata').with_args(
+      'mybucket')
+    self.fake_azure.should_receive('list_blobs').and_return(flexmock(blobs=[
+      flexmock(name='logs/have.txt', properties=flexmock(content_length='3',
+        etag='0x1', content_md5='',
+        last_modified='Mon, 18 Mar 2013 22:43:05 GMT')),
+      flexmock(name=u'logs/sub/n\xe9ed.txt', properties=flexmock(
+        content_length='4', etag='0x2', content_md5='',
+        last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+    ], next_marker=''))
+
+    # Only the missing blob should be downloaded, even though its name isn't
+    # ASCII.
+    self.fake_azure.should_receive('get_blob_metadata').with_args('mybucket',
+      'logs/sub/n\xc3\xa9ed.txt')
+    self.fake_azure.should_receive('get_blob').with_args('mybucket',
+      'logs/sub/n\xc3\xa9ed.txt').and_return('need').once()
+
+    actual = self.azure.sync_download('/mybucket/logs', local_dir)
+    need_path = os.path.join(local_dir, 'sub', 'n\xc3\xa9ed.txt')
+    self.assertEquals([need_path], [item['destination'] for item in actual])
+    self.assertEquals(True, actual[0]['success'])
+    self.assertEquals(1363646585, int(os.path.getmtime(need_path)))
+    shutil.rmtree(local_dir)
+
+
+  def test_resumable_download_only_fetches_missing_ranges(self):
+    # Keep checkpoints out of the home dir, and use tiny chunks.
+    checkpoint_dir = tempfile.mkdtemp()
+    flexmock(Checkpoint).should_receive('for_job').replace_with(
+      lambda directive, backend_id, items: Checkpoint(os.path.join(
+        checkpoint_dir, 'job.journal')))
+    self.azure.DOWNLOAD_CHUNK_SIZE = 4
+
+    # Presume that a previous run downloaded the first four bytes.
+    local_dir = tempfile.mkdtemp()
+    destination = os.path.join(local_dir, 'big.txt')
+    with open(destination + '.magik-partial', 'w') as file_handle:
+      file_handle.write('0123')
+    transfer_state = Checkpoint(os.path.join(checkpoint_dir, 'job.journal')) \
+      .get_transfer_state(0)
+    transfer_state.set('etag', '0x1')
+    transfer_state.set('offset', 4)
+
+    self.fake_azure.should_receive('get_container_metadata').with_args(
+      'mybucket')
+    self.fake_azure.should_receive('get_blob_metadata').with_args('mybucket',
+      'big.txt')
+    self.fake_azure.should_receive('get_blob_properties').with_args(
+      'mybucket', 'big.txt').and_return({'content-length' : '10',
+      'etag' : '0x1', 'last-modified' : 'Mon, 18 Mar 2013 22:43:05 GMT'})
+    self.fake_azure.should_receive('get_blob').with_args('mybucket', 'big.txt',
+      x_ms_range='bytes=0-3').never()
+    self.fake_azure.should_receive('get_blob').with_args('mybucket', 'big.txt',
+      x_ms_range='bytes=4-7').and_return('4567').once()
+    self.fake_azure.should_receive('get_blob').with_args('mybucket', 'big.txt',
+      x_ms_range='bytes=8-9').and_return('89').once()
+
+    actual = self.azure.download_files([{
+      'source' : '/mybucket/big.txt',
+      'destination' : destination
+    }], resumable=True)
+    self.assertEquals(True, actual[0]['success'])
+    with open(destination, 'r') as file_handle:
+      self.assertEquals('0123456789', file_handle.read())
+    shutil.rmtree(local_dir)
+    shutil.rmtree(checkpoint_dir)
+
+
+  def test_limited_download_is_throttled_a_range_at_a_time(self):
+    RateLimiter.set_limit(1024, backend_id='azure:access')
+    self.azure.THROTTLED_RANGE_SIZE = 4
+
+    # Each range should only be requested once the limiter lets it through.
+    calls = []
+    flexmock(self.azure).should_receive('throttle').replace_with(
+      lambda num_bytes: calls.append(num_bytes))
+    self.fake_azure.should_receive('get_blob_properties').with_args(
+      'mybucket', 'big.txt').and_return({'content-length' : '10'})
+    self.fake_azure.should_receive('get_blob').replace_with(
+      lambda container_name, key_name, x_ms_range: calls.append(x_ms_range)
+      or '0123456789'[int(x_ms_range[6:].split('-')[0]):
+      int(x_ms_range.split('-')[1]) + 1])
+
+    local_dir = tempfile.mkdtemp()
+    destination = os.path.join(local_dir, 'big.txt')
+    self.azure.download_file(destination, 'mybucket', 'big.txt')
+    with open(destination, 'r') as file_handle:
+      self.assertEquals('0123456789', file_handle.read())
+    self.assertEquals([4, 'bytes=0-3', 4, 'bytes=4-7', 2, 'bytes=8-9'],
+      calls)
+
+    del calls[:]
+    self.assertEquals('2345', self.azure.download_range('mybucket',
+      'big.txt', 2, 5))
+    self.assertEquals([4, 'bytes=2-5'], calls)
+    shutil.rmtree(local_dir)
+
+
+  def test_resumable_download_of_file_deleted_midway_fails(self):
+    # Keep checkpoints out of the home dir, and remember the one we open.
+    checkpoint_dir = tempfile.mkdtemp()
+    checkpoints = []
+    def open_checkpoint(directive, backend_id, items):
+      checkpoints.append(Checkpoint(os.path.join(checkpoint_dir,
+        'job.journal')))
+      return checkpoints[-1]
+    flexmock(Checkpoint).should_receive('for_job').replace_with(
+      open_checkpoint)
+
+    # Presume that the file is deleted after we check that it exists, but
+    # before we look up its size.
+    self.fake_azure.should_receive('get_container_metadata').with_args(
+      'mybucket')
+    self.fake_azure.should_receive('get_blob_metadata').with_args('mybucket',
+      'big.txt')
+    self.fake_azure.should_receive('get_blob_properties').with_args(
+      'mybucket', 'big.txt').and_raise(azure.WindowsAzureMissingResourceError,
+      '')
+    self.fake_azure.should_receive('get_blob').never()
+
+    actual = self.azure.download_files([{
+      'source' : '/mybucket/big.txt',
+      'destination' : '/baz/boo/big.txt'
+    }], resumable=True)
+    self.assertEquals(False, actual[0]['success'])
+    self.assertEquals('source not found', actual[0]['failure_reason'])
+
+    # The batch didn't finish, so its checkpoint stays around, but closed.
+    self.assertEquals(['job.journal'], os.listdir(checkpoint_dir))
+    self.assertEquals(True, checkpoints[0].file_handle.closed)
+    shutil.rmtree(checkpoint_dir)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+""" Tests for lib/batch_manifest.py. """
+
+
+# General-purpose Python library imports
+import os
+import StringIO
+import sys
+import unittest
+
+
+# BatchManifest import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.batch_manifest import BatchManifest
+from magik.custom_exceptions import BadConfigurationException
+
+
+class TestBatchManifest(unittest.TestCase):
+
+
+  def read(self, contents, fields=None):
+    return list(BatchManifest.read(StringIO.StringIO(contents), fields))
+
+
+  def test_read_json_lines(self):
+    self.assertEquals([
+      {'source' : '/baz/boo.txt', 'destination' : '/mybucket/boo.txt'},
+      {'source' : '/baz/foo.txt', 'destination' : '/mybucket/foo.txt'}
+    ], self.read('{"source": "/baz/boo.txt", "destination": ' +
+      '"/mybucket/boo.txt"}\n\n{"source": "/baz/foo.txt", "destination": ' +
+      '"/mybucket/foo.txt", "size": 10}\n'))
+
+
+  def test_read_csv_with_and_without_header(self):
+    expected = [
+      {'source' : '/baz/boo.txt', 'destination' : '/mybucket/boo.txt'},
+      {'source' : '/baz/a, b.txt', 'destination' : '/mybucket/a, b.txt'}
+    ]
+    rows = '/baz/boo.txt,/mybucket/boo.txt\n' + \
+      '"/baz/a, b.txt","/mybucket/a, b.txt"\n'
+    self.assertEquals(expected, self.read(rows))
+    self.assertEquals(expected, self.read('source,destination\n' + rows))
+
+
+  def test_read_only_requires_given_fields(self):
+    self.assertEquals([{'source' : '/mybucket/boo.txt'}],
+      self.read('/mybucket/boo.txt\n', fields=['source']))
+    self.assertRaises(BadConfigurationException, self.read,
+      '/mybucket/boo.txt\n')
+
+
+  def test_read_rejects_bad_json(self):
+    manifest = BatchManifest.read(StringIO.StringIO(
+      '/baz/boo.txt,/mybucket/boo.txt\n{"source": \n'))
+    self.assertEquals('/baz/boo.txt', next(manifest)['source'])
+    self.assertRaises(BadConfigurationException, next, manifest)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Tests for lib/batch_scheduler.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import unittest
+
+
+# BatchScheduler import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.batch_scheduler import BatchScheduler
+
+
+class TestBatchScheduler(unittest.TestCase):
+
+
+  def setUp(self):
+    self.large = BatchScheduler.LARGE_OBJECT_SIZE
+
+
+  def test_small_items_are_grouped_by_bucket(self):
+    sizes = [10, 20, 30, 40]
+    buckets = ['b', 'a', 'b', 'a']
+    self.assertEquals([1, 3, 0, 2],
+      BatchScheduler.order_by_size(sizes, buckets))
+
+
+  def test_large_items_go_longest_first(self):
+    sizes = [self.large, 3 * self.large, 2 * self.large]
+    buckets = ['a', 'a', 'a']
+    self.assertEquals([1, 2, 0], BatchScheduler.order_by_size(sizes, buckets))
+
+
+  def test_small_items_are_spread_between_large_ones(self):
+    sizes = [1, 2 * self.large, 2, 3, self.large, 4]
+    buckets = ['a'] * 6
+    self.assertEquals([1, 0, 2, 4, 3, 5],
+      BatchScheduler.order_by_size(sizes, buckets))
+
+
+  def test_every_item_is_scheduled_once(self):
+    sizes = [self.large * (index % 3) + index for index in range(50)]
+    buckets = [str(index % 4) for index in range(50)]
+    self.assertEquals(range(50),
+      sorted(BatchScheduler.order_by_size(sizes, buckets)))
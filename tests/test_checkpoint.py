@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+""" Tests for lib/checkpoint.py. """
+
+
+# General-purpose Python library imports
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+# Checkpoint import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.checkpoint import Checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+
+
+  def setUp(self):
+    self.checkpoint_dir = tempfile.mkdtemp()
+    self.items = [
+      {'source' : '/baz/boo/fbar1.tgz', 'destination' : '/mybucket/fbar1.tgz'},
+      {'source' : '/baz/boo/fbar2.tgz', 'destination' : '/mybucket/fbar2.tgz'}
+    ]
+
+
+  def tearDown(self):
+    shutil.rmtree(self.checkpoint_dir)
+
+
+  def test_same_job_finds_same_checkpoint(self):
+    first = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    second = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    other = Checkpoint.for_job('download_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    self.assertEquals(first.location, second.location)
+    self.assertNotEquals(first.location, other.location)
+
+
+  def test_progress_survives_reopening(self):
+    checkpoint = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    checkpoint.mark_item_done(0)
+    transfer_state = checkpoint.get_transfer_state(1)
+    transfer_state.set('upload_id', 'abc')
+    transfer_state.add('parts', 1)
+    transfer_state.add('parts', 2)
+
+    # Simulate magik dying in the middle of writing a journal entry.
+    checkpoint.file_handle.write('{"item": 1, "add"')
+    checkpoint.file_handle.flush()
+
+    reopened = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    self.assertEquals(True, reopened.is_item_done(0))
+    self.assertEquals(False, reopened.is_item_done(1))
+    self.assertEquals('abc', reopened.get_transfer_state(1).get('upload_id'))
+    self.assertEquals([1, 2], reopened.get_transfer_state(1).get('parts'))
+
+
+  def test_clear_forgets_transfer_state_and_tracker_files(self):
+    checkpoint = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    transfer_state = checkpoint.get_transfer_state(0)
+    transfer_state.set('upload_id', 'abc')
+    open(transfer_state.get_tracker_file('upload'), 'w').close()
+
+    transfer_state.clear()
+    self.assertEquals(None, transfer_state.get('upload_id'))
+    self.assertEquals(False,
+      os.path.exists(transfer_state.get_tracker_file('upload')))
+
+
+  def test_remove_deletes_journal(self):
+    checkpoint = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    checkpoint.mark_item_done(0)
+    checkpoint.remove()
+    self.assertEquals([], os.listdir(self.checkpoint_dir))
+
+
+  def test_close_keeps_journal(self):
+    checkpoint = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    checkpoint.mark_item_done(0)
+    checkpoint.close()
+
+    reopened = Checkpoint.for_job('upload_files', 's3:access', self.items,
+      self.checkpoint_dir)
+    self.assertEquals(True, reopened.is_item_done(0))
+    reopened.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+""" Tests for lib/chunk_reader.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import unittest
+
+
+# ChunkReader import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.chunk_reader import ChunkReader
+
+
+class TestChunkReader(unittest.TestCase):
+
+
+  def test_reads_across_chunk_boundaries(self):
+    reader = ChunkReader(['abc', '', 'defg', 'h'])
+    self.assertEquals('ab', reader.read(2))
+    self.assertEquals('cdef', reader.read(4))
+    self.assertEquals('gh', reader.read())
+    self.assertEquals('', reader.read(1))
+
+
+  def test_only_reads_chunks_as_needed(self):
+    chunks = iter(['abc', 'def'])
+    reader = ChunkReader(chunks)
+    self.assertEquals('a', reader.read(1))
+    self.assertEquals('def', next(chunks))
+
+
+  def test_is_not_seekable(self):
+    self.assertRaises(IOError, ChunkReader([]).tell)
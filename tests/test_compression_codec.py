@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+""" Tests for lib/compression_codec.py. """
+
+
+# General-purpose Python library imports
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+# CompressionCodec import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.compression_codec import CompressionCodec
+from magik.custom_exceptions import BadConfigurationException
+
+
+class TestCompressionCodec(unittest.TestCase):
+
+
+  def test_chunks_round_trip_through_gzip(self):
+    data = '{"level": "info", "message": "hello"}\n' * 1000
+    compressed = ''.join(CompressionCodec.compress_chunks(
+      [data[:100], data[100:]], 'gzip'))
+    self.assertTrue(len(compressed) < len(data) / 10)
+    self.assertEquals(data, ''.join(CompressionCodec.decompress_chunks(
+      [compressed[:10], compressed[10:]], 'gzip')))
+
+
+  def test_compressed_md5_matches_compressed_file(self):
+    local_dir = tempfile.mkdtemp()
+    source = os.path.join(local_dir, 'a.log')
+    destination = os.path.join(local_dir, 'a.log.gz')
+    with open(source, 'w') as file_handle:
+      file_handle.write('abc' * 1000)
+
+    CompressionCodec.compress_file(source, destination, 'gzip')
+    with open(destination, 'rb') as file_handle:
+      expected = hashlib.md5(file_handle.read()).hexdigest()
+    # Compressing the same file again should give the same bytes.
+    self.assertEquals(expected, CompressionCodec.compute_md5(source, 'gzip'))
+    shutil.rmtree(local_dir)
+
+
+  def test_already_compressed_types_are_skipped(self):
+    self.assertTrue(CompressionCodec.should_compress('logs/a.log'))
+    self.assertTrue(CompressionCodec.should_compress('data.json'))
+    self.assertTrue(CompressionCodec.should_compress('icon.svg'))
+    self.assertTrue(CompressionCodec.should_compress('no-extension'))
+    self.assertFalse(CompressionCodec.should_compress('photo.jpg'))
+    self.assertFalse(CompressionCodec.should_compress('backup.tar.gz'))
+    self.assertFalse(CompressionCodec.should_compress('archive.zip'))
+
+
+  def test_unknown_encodings_are_refused(self):
+    self.assertRaises(BadConfigurationException,
+      CompressionCodec.check_encoding, 'brotli')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+""" Tests for lib/concurrency_controller.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import time
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# ConcurrencyController import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.concurrency_controller import ConcurrencyController
+from magik.instrumentation import Instrumentation
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+
+  def setUp(self):
+    # Use a clock that advances by one second each time it is read, so that
+    # throughput measurements don't depend on how fast the tests run.
+    self.clock = [1000.0]
+    def tick():
+      self.clock[0] += 1
+      return self.clock[0]
+    flexmock(time).should_receive('time').replace_with(tick)
+
+    self.events = []
+    self.hook = lambda event, data: self.events.append((event, data))
+    Instrumentation.add_hook(self.hook)
+
+
+  def tearDown(self):
+    Instrumentation.remove_hook(self.hook)
+    ConcurrencyController.controllers = {}
+
+
+  def finish_operations(self, controller, count, latency=0.1, throttled=False):
+    for _ in range(count):
+      controller.acquire()
+      controller.release(latency, throttled)
+
+
+  def test_limit_grows_by_one_per_good_window(self):
+    controller = ConcurrencyController(initial_limit=4)
+    self.finish_operations(controller, 4)
+    self.assertEquals(5, int(controller.limit))
+    self.finish_operations(controller, 5)
+    self.assertEquals(6, int(controller.limit))
+
+
+  def test_limit_stops_growing_when_latency_rises(self):
+    controller = ConcurrencyController(initial_limit=4)
+    self.finish_operations(controller, 4, latency=0.1)
+    self.finish_operations(controller, 5, latency=1.0)
+    self.assertEquals(5, int(controller.limit))
+
+
+  def test_limit_halves_once_per_window_when_throttled(self):
+    controller = ConcurrencyController(initial_limit=16)
+    self.finish_operations(controller, 3, throttled=True)
+    self.assertEquals(8, int(controller.limit))
+
+    # The window that saw the throttling doesn't grow the limit.
+    self.finish_operations(controller, 8)
+    self.assertEquals(8, int(controller.limit))
+
+
+  def test_limit_stays_within_bounds(self):
+    controller = ConcurrencyController(initial_limit=2, min_limit=1,
+      max_limit=3)
+    for _ in range(5):
+      self.finish_operations(controller, 1, throttled=True)
+      self.finish_operations(controller, 3)
+    self.assertTrue(1 <= controller.limit <= 3)
+
+    self.finish_operations(controller, 30)
+    self.assertEquals(3, int(controller.limit))
+
+
+  def test_run_reports_throttling_errors(self):
+    controller = ConcurrencyController(initial_limit=8)
+
+    def throttled():
+      raise IOError('slow down')
+    self.assertRaises(IOError, controller.run, throttled,
+      lambda exception: True)
+    self.assertEquals(4, int(controller.limit))
+    self.assertEquals(0, controller.in_flight)
+    self.assertEquals('done', controller.run(lambda: 'done',
+      lambda exception: True))
+
+
+  def test_controllers_are_shared_per_bucket(self):
+    controller = ConcurrencyController.for_bucket('s3:access', 'mybucket')
+    self.assertTrue(controller is ConcurrencyController.for_bucket(
+      's3:access', 'mybucket'))
+    self.assertFalse(controller is ConcurrencyController.for_bucket(
+      's3:access', 'otherbucket'))
+
+
+  def test_changes_are_reported_to_hooks(self):
+    controller = ConcurrencyController('s3:access', 'mybucket',
+      initial_limit=2)
+    self.finish_operations(controller, 2)
+    self.assertEquals('concurrency', self.events[-1][0])
+    self.assertEquals('mybucket', self.events[-1][1]['bucket'])
+    self.assertEquals(3, self.events[-1][1]['limit'])
+    self.assertTrue(self.events[-1][1]['throughput'] > 0)
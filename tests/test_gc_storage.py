@@ -27,7 +27,7 @@ class TestGCStorage(unittest.TestCase):
 
   def setUp(self):
     # Set up a mock for when we interact with S3
-    self.fake_gcs = flexmock(name='fake_gcs')
+    self.fake_gcs = flexmock(name='fake_gcs', http_connection_kwargs={})
     flexmock(boto.gs.connection)
     boto.gs.connection.should_receive('GSConnection').with_args(
       gs_access_key_id='access', gs_secret_access_key='secret') \
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+""" Tests for lib/hash_cache.py. """
+
+
+# General-purpose Python library imports
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+# HashCache import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.hash_cache import HashCache
+
+
+class TestHashCache(unittest.TestCase):
+
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.location = os.path.join(self.cache_dir, 'hashes', 'cache.db')
+
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+
+  def test_get_returns_stored_md5_if_file_unchanged(self):
+    cache = HashCache(self.location)
+    self.assertEquals(None, cache.get('/baz/boo.txt', 10, 100.0))
+
+    cache.put('/baz/boo.txt', 10, 100.0, 'abc')
+    self.assertEquals('abc', cache.get('/baz/boo.txt', 10, 100.0))
+
+
+  def test_get_misses_if_size_or_mtime_changed(self):
+    cache = HashCache(self.location)
+    cache.put('/baz/boo.txt', 10, 100.0, 'abc')
+    self.assertEquals(None, cache.get('/baz/boo.txt', 11, 100.0))
+    self.assertEquals(None, cache.get('/baz/boo.txt', 10, 101.0))
+
+
+  def test_flushed_entries_survive_reopening(self):
+    cache = HashCache(self.location)
+    cache.put('/baz/boo.txt', 10, 100.0, 'abc')
+    cache.flush()
+
+    self.assertEquals('abc', HashCache(self.location).get('/baz/boo.txt', 10,
+      100.0))
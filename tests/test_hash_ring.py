@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+""" Tests for lib/hash_ring.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import unittest
+
+
+# HashRing import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.hash_ring import HashRing
+
+
+class TestHashRing(unittest.TestCase):
+
+
+  def setUp(self):
+    self.key_names = ['key{0}'.format(index) for index in range(3000)]
+
+
+  def test_keys_are_spread_evenly_across_nodes(self):
+    ring = HashRing(['a', 'b', 'c'])
+    counts = {}
+    for key_name in self.key_names:
+      node = ring.get_node(key_name)
+      counts[node] = counts.get(node, 0) + 1
+    self.assertEquals(set(['a', 'b', 'c']), set(counts))
+    self.assertTrue(all(600 < count < 1400 for count in counts.values()))
+
+
+  def test_adding_a_node_only_moves_keys_to_it(self):
+    old_ring = HashRing(['a', 'b', 'c'])
+    new_ring = HashRing(['a', 'b', 'c', 'd'])
+    moved = [key_name for key_name in self.key_names
+      if old_ring.get_node(key_name) != new_ring.get_node(key_name)]
+    self.assertTrue(all(new_ring.get_node(key_name) == 'd'
+      for key_name in moved))
+    self.assertTrue(400 < len(moved) < 1100)
+
+
+  def test_nodes_are_listed_in_ring_order(self):
+    ring = HashRing(['a', 'b', 'c'])
+    nodes = ring.get_nodes('mykey')
+    self.assertEquals(['a', 'b', 'c'], sorted(nodes))
+    self.assertEquals(ring.get_node('mykey'), nodes[0])
+    self.assertEquals(nodes[:2], ring.get_nodes('mykey', 2))
+
+    # Removing the owner hands its keys to the next node on the ring.
+    smaller_ring = HashRing([node for node in ['a', 'b', 'c']
+      if node != nodes[0]])
+    self.assertEquals(nodes[1], smaller_ring.get_node('mykey'))
+
+
+  def test_unicode_keys_hash_like_their_utf8(self):
+    ring = HashRing([u'caf\xe9', 'b', 'c'])
+    self.assertEquals(ring.get_nodes('caf\xc3\xa9/a'),
+      ring.get_nodes(u'caf\xe9/a'))
+    self.assertEquals(HashRing.hash('caf\xc3\xa9'), HashRing.hash(u'caf\xe9'))
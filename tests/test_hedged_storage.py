@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Tests for lib/hedged_storage.py. """
+
+
+# General-purpose Python library imports
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# HedgedStorage import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.custom_exceptions import BadConfigurationException
+from magik.hedged_storage import HedgedStorage
+from magik.hedger import Hedger
+
+
+class TestHedgedStorage(unittest.TestCase):
+
+
+  def setUp(self):
+    # The first call to each read hangs until the test is done, like a
+    # request that landed on a slow server, and the rest answer right away.
+    self.release = threading.Event()
+    self.calls = []
+    def read(name, answer):
+      def attempt(*args):
+        self.calls.append(name)
+        if self.calls.count(name) == 1:
+          self.release.wait()
+        return answer(*args)
+      return attempt
+    def download_file(destination, bucket_name, key_name):
+      with open(destination, 'w') as file_handle:
+        file_handle.write('contents')
+
+    self.storage = flexmock(name='fake_storage', DELETE_BATCH_SIZE=1000)
+    self.storage.should_receive('get_backend_id').and_return('s3:access')
+    self.storage.should_receive('get_metadata').replace_with(read(
+      'get_metadata', lambda bucket_name, key_name: {'key' : key_name}))
+    self.storage.should_receive('download_file').replace_with(read(
+      'download_file', download_file))
+    Hedger.for_operation('s3:access', 'get_metadata').initial_delay = 0.01
+    Hedger.for_operation('s3:access', 'download_file').initial_delay = 0.01
+    self.directory = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    self.release.set()
+    shutil.rmtree(self.directory)
+    Hedger.hedgers = {}
+
+
+  def test_slow_reads_are_sent_again(self):
+    hedged = HedgedStorage(self.storage)
+    self.assertEquals({'key' : 'a.txt'}, hedged.get_metadata('mybucket',
+      'a.txt'))
+    self.assertEquals(['get_metadata'] * 2, self.calls)
+
+    destination = os.path.join(self.directory, 'a.txt')
+    hedged.download_file(destination, 'mybucket', 'a.txt')
+    with open(destination) as file_handle:
+      self.assertEquals('contents', file_handle.read())
+    self.assertEquals(['a.txt'], os.listdir(self.directory))
+
+
+  def test_writes_are_only_sent_once(self):
+    self.storage.should_receive('delete_file').with_args('mybucket',
+      'a.txt').once()
+    HedgedStorage(self.storage).delete_file('mybucket', 'a.txt')
+
+
+  def test_number_of_duplicates_must_be_positive(self):
+    self.assertEquals(3, HedgedStorage(self.storage, '3').num_duplicates)
+    self.assertRaises(BadConfigurationException, HedgedStorage, self.storage,
+      0)
+    self.assertRaises(BadConfigurationException, HedgedStorage, self.storage,
+      'lots')
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+""" Tests for lib/hedger.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import threading
+import unittest
+
+
+# Hedger import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.hedger import Hedger
+
+
+class TestHedger(unittest.TestCase):
+
+
+  def setUp(self):
+    self.hedger = Hedger(initial_delay=0.01)
+    # Lets slow attempts finish once the test is done with them.
+    self.release = threading.Event()
+
+
+  def tearDown(self):
+    self.release.set()
+    Hedger.hedgers = {}
+
+
+  def slow(self, result):
+    def attempt():
+      self.release.wait()
+      return result
+    return attempt
+
+
+  def test_slow_attempts_are_hedged(self):
+    discarded = []
+    finished = threading.Event()
+    def discard(result):
+      discarded.append(result)
+      finished.set()
+
+    self.assertEquals('fast', self.hedger.call([self.slow('slow'),
+      lambda: 'fast'], discard=discard))
+
+    # The slow attempt's answer is cleaned up once it finally arrives.
+    self.release.set()
+    finished.wait(5)
+    self.assertEquals(['slow'], discarded)
+
+
+  def test_failed_attempts_fail_over_right_away(self):
+    self.hedger.initial_delay = 60
+    def fail():
+      raise IOError('replica down')
+    self.assertEquals('second', self.hedger.call([fail, lambda: 'second']))
+    self.assertRaises(IOError, self.hedger.call, [fail, fail])
+
+
+  def test_rejected_answers_are_only_used_as_a_last_resort(self):
+    def fail():
+      raise IOError('replica down')
+    accept = lambda result: result is not None
+    self.assertEquals('found', self.hedger.call([lambda: None,
+      lambda: 'found'], accept=accept))
+    self.assertEquals(None, self.hedger.call([fail, lambda: None],
+      accept=accept))
+
+
+  def test_delay_follows_recent_latencies(self):
+    self.assertEquals(0.01, self.hedger.get_delay())
+    for index in range(100):
+      self.hedger.record(index / 100.0)
+    self.assertEquals(0.94, self.hedger.get_delay())
+
+
+  def test_hedgers_are_shared_per_operation(self):
+    self.assertTrue(Hedger.for_operation('s3:a', 'get_metadata') is
+      Hedger.for_operation('s3:a', 'get_metadata'))
+    self.assertFalse(Hedger.for_operation('s3:a', 'get_metadata') is
+      Hedger.for_operation('s3:a', 'download_range'))
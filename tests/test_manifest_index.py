@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+""" Tests for lib/manifest_index.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import time
+import unittest
+
+
+# ManifestIndex import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.manifest_index import ManifestIndex
+
+
+class TestManifestIndex(unittest.TestCase):
+
+
+  def setUp(self):
+    self.index = ManifestIndex(':memory:')
+
+
+  def make_key_info(self, key, size=10):
+    return {
+      'key' : key,
+      'size' : size,
+      'etag' : 'abc',
+      'md5' : 'abc',
+      'last_modified' : 100.0
+    }
+
+
+  def test_listing_covers_longer_prefixes_only(self):
+    self.assertEquals(False, self.index.has_listing('s3:a', 'bucket', 'logs/'))
+
+    self.index.replace_listing('s3:a', 'bucket', 'logs/', [])
+    self.assertEquals(True, self.index.has_listing('s3:a', 'bucket', 'logs/'))
+    self.assertEquals(True, self.index.has_listing('s3:a', 'bucket',
+      'logs/2013/'))
+    self.assertEquals(False, self.index.has_listing('s3:a', 'bucket', ''))
+    self.assertEquals(False, self.index.has_listing('s3:b', 'bucket', 'logs/'))
+
+
+  def test_listing_expires_after_max_age(self):
+    self.index.replace_listing('s3:a', 'bucket', '', [])
+    self.index.connection.execute('UPDATE listings SET listed_at = ?',
+      (time.time() - 60,))
+    self.assertEquals(True, self.index.has_listing('s3:a', 'bucket', '', 120))
+    self.assertEquals(False, self.index.has_listing('s3:a', 'bucket', '', 30))
+
+
+  def test_get_keys_only_returns_keys_under_prefix(self):
+    self.index.replace_listing('s3:a', 'bucket', '', [
+      self.make_key_info('logs/a'), self.make_key_info('logs/b'),
+      self.make_key_info('logsbackup/a'), self.make_key_info('other')])
+    self.assertEquals(['logs/a', 'logs/b'],
+      sorted(self.index.get_keys('s3:a', 'bucket', 'logs/').keys()))
+    self.assertEquals(4, len(self.index.get_keys('s3:a', 'bucket', '')))
+
+
+  def test_relisting_replaces_old_keys(self):
+    self.index.replace_listing('s3:a', 'bucket', 'logs/', [
+      self.make_key_info('logs/a'), self.make_key_info('logs/b')])
+    self.index.replace_listing('s3:a', 'bucket', 'logs/', [
+      self.make_key_info('logs/c')])
+    self.assertEquals(['logs/c'],
+      self.index.get_keys('s3:a', 'bucket', 'logs/').keys())
+
+
+  def test_put_and_remove_update_keys(self):
+    self.index.put('s3:a', 'bucket', self.make_key_info('logs/a', size=5))
+    self.index.put('s3:a', 'bucket', self.make_key_info('logs/b'))
+    self.index.remove('s3:a', 'bucket', 'logs/b')
+
+    actual = self.index.get_keys('s3:a', 'bucket', 'logs/')
+    self.assertEquals(['logs/a'], actual.keys())
+    self.assertEquals(5, actual['logs/a']['size'])
+
+
+  def test_non_ascii_keys_are_kept_as_unicode(self):
+    # Keys are found whether their names are given as UTF-8 or as unicode.
+    self.index.replace_listing('s3:a', 'bucket', 'caf\xc3\xa9/', [
+      self.make_key_info('caf\xc3\xa9/a'), self.make_key_info(u'caf\xe9/b')])
+    self.index.put('s3:a', 'bucket', self.make_key_info(u'caf\xe9z/c'))
+    self.assertTrue(self.index.has_listing('s3:a', 'bucket', u'caf\xe9/'))
+    self.assertEquals([u'caf\xe9/a', u'caf\xe9/b'], sorted(self.index.get_keys(
+      's3:a', 'bucket', 'caf\xc3\xa9/').keys()))
+
+    self.index.remove('s3:a', 'bucket', 'caf\xc3\xa9/a')
+    self.assertEquals([u'caf\xe9/b'], self.index.get_keys('s3:a', 'bucket',
+      u'caf\xe9/').keys())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Tests for lib/metadata_cache.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import time
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# MetadataCache import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.metadata_cache import MetadataCache
+
+
+class TestMetadataCache(unittest.TestCase):
+
+
+  def test_entries_expire_after_ttl(self):
+    flexmock(time).should_receive('time').and_return(100.0).and_return(
+      105.0).and_return(111.0)
+    cache = MetadataCache(ttl=10)
+    cache.put('s3:access', 'mybucket', 'a.txt', {'size' : 10})
+    self.assertEquals((True, {'size' : 10}),
+      cache.get('s3:access', 'mybucket', 'a.txt'))
+    self.assertEquals((False, None),
+      cache.get('s3:access', 'mybucket', 'a.txt'))
+
+
+  def test_missing_files_are_cached_too(self):
+    cache = MetadataCache()
+    cache.put('s3:access', 'mybucket', 'a.txt', None)
+    self.assertEquals((True, None),
+      cache.get('s3:access', 'mybucket', 'a.txt'))
+    self.assertEquals((False, None),
+      cache.get('azure:access', 'mybucket', 'a.txt'))
+
+    cache.invalidate('s3:access', 'mybucket', 'a.txt')
+    self.assertEquals((False, None),
+      cache.get('s3:access', 'mybucket', 'a.txt'))
+
+
+  def test_oldest_entries_are_dropped_when_full(self):
+    cache = MetadataCache(max_entries=2)
+    for key in ['a', 'b', 'c']:
+      cache.put('s3:access', 'mybucket', key, {'key' : key})
+    self.assertEquals(False, cache.get('s3:access', 'mybucket', 'a')[0])
+    self.assertEquals(True, cache.get('s3:access', 'mybucket', 'c')[0])
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+""" Tests for lib/pack_store.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# PackStore import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.pack_store import PackStore
+
+
+class TestPackStore(unittest.TestCase):
+
+
+  def setUp(self):
+    # Keep the objects in our fake bucket in memory, and remember the ranged
+    # GETs made against packs.
+    self.objects = {}
+    self.pack_reads = []
+    def list_keys(bucket_name, prefix=''):
+      for key_name in sorted(self.objects):
+        if key_name.startswith(prefix):
+          yield {'key' : key_name, 'size' : len(self.objects[key_name])}
+    def download_range(bucket_name, key_name, start, end):
+      if key_name.endswith('.pack'):
+        self.pack_reads.append((key_name, start, end))
+      return self.objects[key_name][start:end + 1]
+    def upload_stream(chunks, bucket_name, key_name, size):
+      self.objects[key_name] = ''.join(chunks)
+    def delete_keys(bucket_name, key_names):
+      for key_name in key_names:
+        del self.objects[key_name]
+      return {}
+
+    self.storage = flexmock(name='fake_storage', DELETE_BATCH_SIZE=1000)
+    self.storage.should_receive('get_backend_id').and_return('fake:access')
+    self.storage.should_receive('get_credentials_id').and_return(
+      'fake:access:secret')
+    self.storage.should_receive('get_stream_chunk_size').and_return(4)
+    self.storage.should_receive('list_keys').replace_with(list_keys)
+    self.storage.should_receive('download_range').replace_with(download_range)
+    self.storage.should_receive('upload_stream').replace_with(upload_stream)
+    self.storage.should_receive('delete_keys').replace_with(delete_keys)
+
+
+  def tearDown(self):
+    PackStore.stores = {}
+
+
+  def old_name(self, number):
+    # A pack name that sorts before any that new_name makes up now.
+    return '{0:020d}'.format(number)
+
+
+  def test_files_are_read_back_with_ranged_gets(self):
+    pack_store = PackStore(self.storage, 'mybucket')
+    pack_store.write_pack([{'key' : 'a.txt', 'contents' : 'hello'},
+      {'key' : 'b/c.txt', 'contents' : 'world!'},
+      {'key' : 'empty.txt', 'contents' : ''}])
+    self.assertEquals(2, len(self.objects))
+
+    # Another process only sees the files once it reads the index.
+    other_store = PackStore(self.storage, 'mybucket')
+    self.assertEquals('world!', other_store.read('b/c.txt'))
+    self.assertEquals('', other_store.read('empty.txt'))
+    self.assertEquals(None, other_store.read('missing.txt'))
+    self.assertEquals([5], [start for _, start, _ in self.pack_reads])
+    self.assertEquals(['b/c.txt'], [entry['key'] for entry in
+      other_store.list_entries('b/')])
+
+
+  def test_newer_packs_and_deletions_override_older_ones(self):
+    pack_store = PackStore(self.storage, 'mybucket')
+    pack_store.write_pack([{'key' : 'a.txt', 'contents' : 'old'},
+      {'key' : 'b.txt', 'contents' : 'bye'}], name=self.old_name(1))
+    pack_store.write_pack([{'key' : 'a.txt', 'contents' : 'new'}],
+      name=self.old_name(2))
+    self.assertEquals(['b.txt'], pack_store.write_deletions(['b.txt',
+      'missing.txt']))
+
+    other_store = PackStore(self.storage, 'mybucket')
+    self.assertEquals('new', other_store.read('a.txt'))
+    self.assertEquals(None, other_store.read('b.txt'))
+
+
+  def test_non_ascii_keys_are_found_by_fresh_stores(self):
+    # Paths are parsed into UTF-8 strs, but indexes are read back as unicode.
+    pack_store = PackStore(self.storage, 'mybucket')
+    pack_store.write_pack([{'key' : 'caf\xc3\xa9.txt', 'contents' : 'hello'},
+      {'key' : u'na\xefve.txt', 'contents' : 'world'}])
+    self.assertEquals('hello', pack_store.read(u'caf\xe9.txt'))
+
+    other_store = PackStore(self.storage, 'mybucket')
+    self.assertEquals(('hello', 'world'), (other_store.read('caf\xc3\xa9.txt'),
+      other_store.read('na\xc3\xafve.txt')))
+    self.assertEquals([u'caf\xe9.txt', u'na\xefve.txt'],
+      [entry['key'] for entry in other_store.list_entries()])
+    self.assertEquals([u'caf\xe9.txt'], [entry['key'] for entry in
+      other_store.list_entries('caf\xc3\xa9')])
+
+    self.assertEquals(['caf\xc3\xa9.txt'], other_store.write_deletions(
+      ['caf\xc3\xa9.txt']))
+    self.assertEquals(None, PackStore(self.storage, 'mybucket').read(
+      u'caf\xe9.txt'))
+
+
+  def test_nearby_files_are_fetched_together(self):
+    pack_store = PackStore(self.storage, 'mybucket')
+    pack_store.SPAN_GAP = 2
+    entries = [
+      {'pack' : 'p1', 'offset' : 0, 'length' : 3},
+      {'pack' : 'p1', 'offset' : 5, 'length' : 3},
+      {'pack' : 'p1', 'offset' : 100, 'length' : 3},
+      {'pack' : 'p2', 'offset' : 8, 'length' : 3}
+    ]
+    spans = pack_store.plan_reads([(entry, index) for index, entry in
+      reversed(list(enumerate(entries)))])
+    self.assertEquals([('p1', 0, 7, [0, 1]), ('p1', 100, 102, [2]),
+      ('p2', 8, 10, [3])], [(span['pack'], span['start'], span['end'],
+      [value for _, value in span['parts']]) for span in spans])
+
+
+  def test_compaction_keeps_only_live_files(self):
+    pack_store = PackStore(self.storage, 'mybucket')
+    pack_store.write_pack([{'key' : 'a.txt', 'contents' : 'a' * 10},
+      {'key' : 'b.txt', 'contents' : 'b' * 10}], name=self.old_name(1))
+    pack_store.write_pack([{'key' : 'c.txt', 'contents' : 'c' * 10}],
+      name=self.old_name(2))
+    self.objects[PackStore.PACK_DIRECTORY + self.old_name(3) + '.pack'] = \
+      'abandoned'
+    pack_store.write_deletions(['b.txt'])
+
+    # Not enough of the packs is wasted to be worth compacting yet.
+    self.assertEquals(False, pack_store.compact(min_waste=0.5)['compacted'])
+
+    stats = pack_store.compact(min_waste=0.1)
+    self.assertEquals((3, 20, 19, True, 1), (stats['packs'],
+      stats['live_bytes'], stats['dead_bytes'], stats['compacted'],
+      stats['packs_written']))
+    self.assertEquals(['-compacted-0000.index', '-compacted-0000.pack'],
+      sorted(key_name[key_name.index('-compacted'):] for key_name in
+      self.objects))
+
+    other_store = PackStore(self.storage, 'mybucket')
+    self.assertEquals(('a' * 10, None, 'c' * 10), (other_store.read('a.txt'),
+      other_store.read('b.txt'), other_store.read('c.txt')))
+
+
+  def test_stores_are_shared_per_bucket(self):
+    self.assertTrue(PackStore.for_bucket(self.storage, 'mybucket') is
+      PackStore.for_bucket(self.storage, 'mybucket'))
+    self.assertFalse(PackStore.for_bucket(self.storage, 'mybucket') is
+      PackStore.for_bucket(self.storage, 'otherbucket'))
+
+
+  def test_stores_are_not_shared_with_other_credentials(self):
+    guesser = flexmock(name='guesser')
+    guesser.should_receive('get_backend_id').and_return('fake:access')
+    guesser.should_receive('get_credentials_id').and_return(
+      'fake:access:guess')
+
+    pack_store = PackStore.for_bucket(self.storage, 'mybucket')
+    guessed_store = PackStore.for_bucket(guesser, 'mybucket')
+    self.assertFalse(pack_store is guessed_store)
+    self.assertTrue(guessed_store.storage is guesser)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+""" Tests for lib/progress_reporter.py. """
+
+
+# General-purpose Python library imports
+import os
+import StringIO
+import sys
+import time
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# ProgressReporter import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.progress_reporter import ProgressReporter
+
+
+class TestProgressReporter(unittest.TestCase):
+
+
+  def test_reports_counts_and_throughput(self):
+    flexmock(time).should_receive('time').and_return(100.0).and_return(
+      101.0).and_return(101.1).and_return(101.2).and_return(104.0)
+
+    stream = StringIO.StringIO()
+    progress = ProgressReporter(stream, verb='deleted')
+    progress.update({'success' : True})
+    progress.update({'success' : False, 'failure_reason' : 'boom'})
+    progress.update({'success' : True, 'skipped' : True})
+    progress.finish()
+
+    # The later updates came too soon after the first to be reported.
+    self.assertEquals('\r1 deleted, 0 skipped, 0 failed (1.0 files/s)' +
+      '\r1 deleted, 1 skipped, 1 failed (0.8 files/s)\n', stream.getvalue())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+""" Tests for lib/rate_limiter.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import time
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# RateLimiter import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.rate_limiter import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+
+
+  def setUp(self):
+    # Use a fake clock that only moves forward when we sleep.
+    self.clock = [1000.0]
+    self.sleeps = []
+    def sleep(seconds):
+      self.sleeps.append(seconds)
+      self.clock[0] += seconds
+    flexmock(time).should_receive('time').replace_with(lambda: self.clock[0])
+    flexmock(time).should_receive('sleep').replace_with(sleep)
+
+
+  def tearDown(self):
+    RateLimiter.limiters = {}
+
+
+  def test_throttle_keeps_average_rate(self):
+    RateLimiter.set_limit(100 * 1024)
+
+    # The first second's worth of bytes goes through as a burst, and the rest
+    # has to wait.
+    RateLimiter.throttle('s3:access', 100 * 1024)
+    self.assertEquals(1000.0, self.clock[0])
+    RateLimiter.throttle('s3:access', 300 * 1024)
+    self.assertAlmostEquals(1003.0, self.clock[0])
+
+
+  def test_throttle_does_nothing_without_limits(self):
+    self.assertFalse(RateLimiter.is_limited('s3:access'))
+    RateLimiter.throttle('s3:access', 1024 * 1024 * 1024)
+    self.assertEquals([], self.sleeps)
+
+
+  def test_backend_limits_only_apply_to_that_backend(self):
+    RateLimiter.set_limit(1024, backend_id='s3:access')
+    self.assertTrue(RateLimiter.is_limited('s3:access'))
+    self.assertFalse(RateLimiter.is_limited('azure:name'))
+
+    # Both the global and backend limits apply, so the stricter one wins.
+    RateLimiter.set_limit(1024 * 1024)
+    self.assertEquals(2, len(RateLimiter.get_limiters('s3:access')))
+    RateLimiter.throttle('s3:access', 3 * 1024)
+    self.assertAlmostEquals(1002.0, self.clock[0])
+
+    RateLimiter.set_limit(None, backend_id='s3:access')
+    self.assertEquals(1, len(RateLimiter.get_limiters('s3:access')))
+
+
+  def test_reservations_are_handed_out_in_turn(self):
+    limiter = RateLimiter(1024, burst=0)
+
+    # Each reservation gets the next free slot, so a stream that asks for a
+    # chunk right after another stream waits for that stream's chunk only.
+    self.assertAlmostEquals(1.0, limiter.reserve(1024))
+    self.assertAlmostEquals(2.0, limiter.reserve(1024))
+    self.assertAlmostEquals(2.5, limiter.reserve(512))
+
+
+  def test_parse_rate(self):
+    self.assertEquals(1000, RateLimiter.parse_rate('1000'))
+    self.assertEquals(512 * 1024, RateLimiter.parse_rate('512k'))
+    self.assertEquals(int(1.5 * 1024 * 1024), RateLimiter.parse_rate('1.5M'))
+    self.assertRaises(ValueError, RateLimiter.parse_rate, 'fast')
+
+
+  def test_parse_backend_rate(self):
+    self.assertEquals(('s3:access', 10 * 1024 * 1024),
+      RateLimiter.parse_backend_rate('s3:access=10M'))
+    self.assertEquals(('walrus:http://host/?a=b:access', 512 * 1024),
+      RateLimiter.parse_backend_rate('walrus:http://host/?a=b:access=512K'))
+    self.assertRaises(ValueError, RateLimiter.parse_backend_rate, '10M')
+    self.assertRaises(ValueError, RateLimiter.parse_backend_rate, '=10M')
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+""" Tests for lib/replicated_storage.py. """
+
+
+# General-purpose Python library imports
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+
+# ReplicatedStorage import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.custom_exceptions import BadConfigurationException
+from magik.hedger import Hedger
+from magik.replicated_storage import ReplicatedStorage
+
+
+# The in-memory replicas that files are copied to in these tests
+from fake_storage import make_fake_storage
+
+
+class TestReplicatedStorage(unittest.TestCase):
+
+
+  def setUp(self):
+    # Keep the objects in each fake replica in memory, keyed by the replica's
+    # id and then by (bucket, key). Replicas in self.down fail every call.
+    self.objects = {}
+    self.down = set()
+    self.directory = tempfile.mkdtemp()
+    # Lets slow replicas finish once the test is done with them.
+    self.release = threading.Event()
+
+
+  def tearDown(self):
+    self.release.set()
+    shutil.rmtree(self.directory)
+    Hedger.hedgers = {}
+
+
+  def make_storage(self, backend_id, slow=False):
+    def before_call(operation, *args):
+      if slow:
+        self.release.wait()
+      if backend_id in self.down:
+        raise IOError('{0} is down'.format(backend_id))
+    return make_fake_storage(backend_id, self.objects.setdefault(backend_id,
+      {}), before_call)
+
+
+  def upload(self, replicated, key_name, contents):
+    source = os.path.join(self.directory, 'source')
+    with open(source, 'w') as file_handle:
+      file_handle.write(contents)
+    replicated.upload_file(source, 'mybucket', key_name)
+
+
+  def test_writes_reach_every_replica_and_need_a_quorum(self):
+    replicated = ReplicatedStorage([self.make_storage('s3:a'),
+      self.make_storage('azure:b'), self.make_storage('gcs:c')],
+      write_quorum='2')
+    self.upload(replicated, 'a.txt', 'hello')
+    self.assertEquals(3, len([objects for objects in self.objects.values()
+      if objects.get(('mybucket', 'a.txt')) == 'hello']))
+
+    # One replica being down is fine for new files, but two aren't.
+    self.down.add('s3:a')
+    self.upload(replicated, 'b.txt', 'world')
+    self.down.add('gcs:c')
+    self.assertRaises(IOError, self.upload, replicated, 'c.txt', 'lost')
+
+
+  def test_old_copies_are_never_left_behind(self):
+    replicated = ReplicatedStorage([self.make_storage('s3:a'),
+      self.make_storage('azure:b'), self.make_storage('gcs:c')],
+      write_quorum=2)
+    self.upload(replicated, 'a.txt', 'old')
+    self.down.add('gcs:c')
+    self.upload(replicated, 'b.txt', 'new')
+
+    # A replica that's down may have a copy of a.txt, so it can't be
+    # overwritten or deleted without it.
+    self.assertRaises(IOError, self.upload, replicated, 'a.txt', 'newer')
+    self.assertRaises(IOError, replicated.delete_file, 'mybucket', 'a.txt')
+    self.assertEquals(['a.txt'], replicated.delete_keys('mybucket',
+      ['a.txt']).keys())
+    self.assertEquals('old', self.objects['gcs:c'][('mybucket', 'a.txt')])
+
+    # A replica that missed a write doesn't need to take overwrites or
+    # deletes of the file.
+    self.down = set()
+    self.down.add('gcs:c')
+    self.assertRaises(IOError, self.upload, replicated, 'b.txt', 'newer')
+    self.down = set()
+    self.upload(replicated, 'a.txt', 'newer')
+    replicated.delete_file('mybucket', 'b.txt')
+    self.assertEquals({}, replicated.delete_keys('mybucket', ['a.txt']))
+    self.assertEquals([{}, {}, {}], self.objects.values())
+
+    # Files that no replica has can't be deleted.
+    self.assertRaises(KeyError, replicated.delete_file, 'mybucket', 'a.txt')
+    self.assertEquals({'a.txt' : 'not found'}, replicated.delete_keys(
+      'mybucket', ['a.txt']))
+
+
+  def test_reads_skip_replicas_that_are_down_or_missed_a_write(self):
+    replicated = ReplicatedStorage([self.make_storage('s3:a'),
+      self.make_storage('azure:b'), self.make_storage('gcs:c')],
+      write_quorum=2)
+    self.down.add('s3:a')
+    self.upload(replicated, 'a.txt', 'hello')
+    self.assertEquals('azure:b', replicated.get_metadata('mybucket',
+      'a.txt')['backend_id'])
+
+    self.down = set()
+    self.assertEquals('azure:b', replicated.get_metadata('mybucket',
+      'a.txt')['backend_id'])
+    self.assertEquals(None, replicated.get_metadata('mybucket', 'missing'))
+    self.assertEquals(['a.txt'], [key_info['key'] for key_info in
+      replicated.list_keys('mybucket')])
+
+    destination = os.path.join(self.directory, 'a.txt')
+    replicated.download_file(destination, 'mybucket', 'a.txt')
+    with open(destination) as file_handle:
+      self.assertEquals('hello', file_handle.read())
+    self.assertEquals(['a.txt', 'source'], sorted(os.listdir(self.directory)))
+
+
+  def test_slow_replicas_are_hedged(self):
+    replicated = ReplicatedStorage([self.make_storage('s3:a', slow=True),
+      self.make_storage('azure:b')])
+    self.objects['s3:a'][('mybucket', 'a.txt')] = 'hello'
+    self.objects['azure:b'][('mybucket', 'a.txt')] = 'hello'
+    Hedger.for_operation(replicated.get_backend_id(),
+      'get_metadata').initial_delay = 0.01
+    self.assertEquals('azure:b', replicated.get_metadata('mybucket',
+      'a.txt')['backend_id'])
+
+
+  def test_write_quorum_must_be_reachable(self):
+    storages = [self.make_storage('s3:a'), self.make_storage('azure:b')]
+    self.assertEquals(2, ReplicatedStorage(storages).write_quorum)
+    self.assertRaises(BadConfigurationException, ReplicatedStorage, storages,
+      write_quorum=3)
+    self.assertRaises(BadConfigurationException, ReplicatedStorage, storages,
+      write_quorum='none')
+    self.assertRaises(BadConfigurationException, ReplicatedStorage,
+      storages + [self.make_storage('s3:a')])
@@ -4,26 +4,38 @@
 
 
 # General-purpose Python library imports
+import base64
+import json
 import os
+import StringIO
 import sys
+import tarfile
 import unittest
 import uuid
 
 
 # Third-party libraries
 from flexmock import flexmock
+import webapp2
 
 
 # RESTServer import, the library that we're testing here
 lib = os.path.dirname(__file__) + os.sep + ".."
 sys.path.append(lib)
 from magik.rest_server import RESTServer
+from magik.rest_server import StaticFileHandler
+from magik.static_file_cache import StaticFileCache
 from magik.storage_factory import StorageFactory
+from magik.tar_stream import TarStream
 
 
 class TestRESTServer(unittest.TestCase):
 
 
+  def tearDown(self):
+    StaticFileCache.files = {}
+
+
   def test_get_route_with_s3_credentials(self):
     # Allow the user to store data in Amazon S3 if they specify all the
     # correct credentials.
@@ -45,6 +57,21 @@ class TestRESTServer(unittest.TestCase):
       .and_return('')
     server.request.should_receive('get').with_args('AZURE_ACCOUNT_KEY') \
       .and_return('')
+    server.request.should_receive('get').with_args('shard_prefixes') \
+      .and_return('')
+    server.request.should_receive('get').with_args('shard_buckets') \
+      .and_return('')
+    server.request.should_receive('get').with_args('shard_bucket_suffix') \
+      .and_return('')
+    server.request.should_receive('get').with_args('stripes').and_return('')
+    server.request.should_receive('get').with_args('replicas').and_return('')
+    server.request.should_receive('get').with_args('write_quorum') \
+      .and_return('')
+    server.request.should_receive('get').with_args('timeout').and_return('')
+    server.request.should_receive('get').with_args('hedge_reads') \
+      .and_return('')
+    server.request.should_receive('get').with_args('archive').and_return('')
+    server.request.should_receive('get').with_args('packed').and_return('')
 
     # Mock out writing the file contents that were sent over.
     flexmock(uuid)
@@ -60,6 +87,11 @@ class TestRESTServer(unittest.TestCase):
 
     # Mock out interacting with S3.
     fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').with_args('/baz/gbaz.txt') \
+      .and_return(('baz', 'gbaz.txt'))
+    fake_storage.should_receive('get_cached_metadata').with_args('baz', 'gbaz.txt') \
+      .and_return({'size' : 13, 'etag' : 'abc', 'content_type' : None,
+      'last_modified' : 1363646585.0})
     fake_storage.should_receive('download_files').with_args([{
       'source' : '/baz/gbaz.txt',
       'destination' : '/tmp/magik-temp-123'
@@ -68,11 +100,12 @@ class TestRESTServer(unittest.TestCase):
     }])
 
     flexmock(StorageFactory)
-    StorageFactory.should_receive('get_storage').with_args(dict).and_return(
-      fake_storage)
+    StorageFactory.should_receive('get_pooled_storage').with_args(dict) \
+      .and_return(fake_storage)
 
     # Mock out writing the response.
-    server.response = flexmock()
+    server.request.headers = {}
+    server.response = flexmock(headers={})
     server.response.should_receive('write').and_return()
 
     # Finally, mock out removing the tempfile we created.
@@ -80,6 +113,151 @@ class TestRESTServer(unittest.TestCase):
     os.should_receive('remove').with_args('/tmp/magik-temp-123')
 
     self.assertEquals(None, server.get('/baz/gbaz.txt'))
+    self.assertEquals('"abc"', server.response.headers['ETag'])
+    self.assertEquals('Mon, 18 Mar 2013 22:43:05 GMT',
+      server.response.headers['Last-Modified'])
+
+
+  def get_object(self, headers):
+    # Presume that the object exists and is ten bytes long.
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').and_return(('baz', 'gbaz.txt'))
+    fake_storage.should_receive('get_cached_metadata').and_return({'size' : 10,
+      'etag' : 'abc', 'content_type' : 'text/plain',
+      'last_modified' : 1363646585.0})
+    fake_storage.should_receive('download_range').replace_with(
+      lambda bucket_name, key_name, start, end: '0123456789'[start:end + 1])
+    fake_storage.should_receive('download_files').never()
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/gbaz.txt?name=s3',
+      headers=headers)
+    server.response = webapp2.Response()
+    server.get('/baz/gbaz.txt')
+    return server.response
+
+
+  def test_get_route_serves_byte_ranges(self):
+    response = self.get_object({'Range' : 'bytes=2-4'})
+    self.assertEquals(206, response.status_int)
+    self.assertEquals('234', response.body)
+    self.assertEquals('bytes 2-4/10', response.headers['Content-Range'])
+    self.assertEquals('3', response.headers['Content-Length'])
+    self.assertEquals('text/plain', response.content_type)
+
+    self.assertEquals('789', self.get_object({'Range' : 'bytes=7-'}).body)
+    self.assertEquals('89', self.get_object({'Range' : 'bytes=-2'}).body)
+    self.assertEquals('89', self.get_object({'Range' : 'bytes=8-20'}).body)
+
+    response = self.get_object({'Range' : 'bytes=10-'})
+    self.assertEquals(416, response.status_int)
+    self.assertEquals('bytes */10', response.headers['Content-Range'])
+
+
+  def test_head_route_sends_headers_without_body(self):
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/gbaz.txt?name=s3',
+      method='HEAD')
+    server.response = webapp2.Response()
+
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').and_return(('baz', 'gbaz.txt'))
+    fake_storage.should_receive('get_cached_metadata').with_args('baz',
+      'gbaz.txt').and_return({'size' : 10, 'etag' : 'abc',
+      'content_type' : 'text/plain', 'last_modified' : 1363646585.0})
+    fake_storage.should_receive('download_range').never()
+    fake_storage.should_receive('download_files').never()
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server.head('/baz/gbaz.txt')
+    self.assertEquals(200, server.response.status_int)
+    self.assertEquals('10', server.response.headers['Content-Length'])
+    self.assertEquals('"abc"', server.response.headers['ETag'])
+    self.assertEquals('text/plain', server.response.content_type)
+
+
+  def test_get_route_answers_revalidation_with_304(self):
+    self.assertEquals(304, self.get_object({
+      'If-None-Match' : '"abc"'}).status_int)
+    self.assertEquals(304, self.get_object({
+      'If-Modified-Since' : 'Mon, 18 Mar 2013 22:43:05 GMT'}).status_int)
+
+    # A stale If-Range means the client needs the whole file.
+    fake_file = flexmock(name='fake_file')
+    fake_file.should_receive('read').and_return('0123456789')
+    fake_builtins = flexmock(sys.modules['__builtin__'])
+    fake_builtins.should_call('open')
+    fake_builtins.should_receive('open').with_args(str, 'r').and_return(
+      fake_file)
+    flexmock(os).should_receive('remove')
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').and_return(('baz', 'gbaz.txt'))
+    fake_storage.should_receive('get_cached_metadata').and_return({'size' : 10,
+      'etag' : 'abc', 'content_type' : None, 'last_modified' : 1363646585.0})
+    fake_storage.should_receive('download_range').never()
+    fake_storage.should_receive('download_files').and_return([{
+      'success' : True}]).once()
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/gbaz.txt?name=s3',
+      headers={'Range' : 'bytes=2-4', 'If-Range' : '"old"'})
+    server.response = webapp2.Response()
+    server.get('/baz/gbaz.txt')
+    self.assertEquals(200, server.response.status_int)
+    self.assertEquals('0123456789', server.response.body)
+
+
+  def get_compressed_object(self, headers):
+    # Presume that the object was stored gzipped.
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').and_return(('baz', 'gbaz.txt'))
+    fake_storage.should_receive('get_cached_metadata').and_return({'size' : 10,
+      'etag' : 'abc', 'content_type' : 'text/plain',
+      'content_encoding' : 'gzip', 'last_modified' : 1363646585.0})
+    fake_storage.should_receive('download_range').replace_with(
+      lambda bucket_name, key_name, start, end: 'gzippedgz!'[start:end + 1])
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/gbaz.txt?name=s3',
+      headers=headers)
+    server.response = webapp2.Response()
+    return server, fake_storage
+
+
+  def test_get_route_sends_compressed_files_as_stored(self):
+    server, fake_storage = self.get_compressed_object({
+      'Accept-Encoding' : 'gzip, deflate', 'Range' : 'bytes=0-6'})
+    fake_storage.should_receive('download_files').never()
+    server.get('/baz/gbaz.txt')
+    self.assertEquals(206, server.response.status_int)
+    self.assertEquals('gzipped', server.response.body)
+    self.assertEquals('gzip', server.response.headers['Content-Encoding'])
+    self.assertEquals('Accept-Encoding', server.response.headers['Vary'])
+    self.assertEquals('"abc"', server.response.headers['ETag'])
+
+
+  def test_get_route_decompresses_for_clients_without_gzip(self):
+    server, fake_storage = self.get_compressed_object({
+      'Accept-Encoding' : 'gzip;q=0, identity', 'Range' : 'bytes=0-6'})
+    fake_storage.should_receive('download_range').never()
+    fake_storage.should_receive('download_files').with_args(list,
+      decompress=True).and_return([{'success' : False}]).once()
+    server.get('/baz/gbaz.txt')
+    self.assertEquals(200, server.response.status_int)
+    self.assertFalse('Content-Encoding' in server.response.headers)
+    self.assertEquals('W/"abc"', server.response.headers['ETag'])
+    self.assertEquals('none', server.response.headers['Accept-Ranges'])
 
 
   def test_put_route_without_body(self):
@@ -112,6 +290,20 @@ class TestRESTServer(unittest.TestCase):
       .and_return('')
     server.request.should_receive('get').with_args('AZURE_ACCOUNT_KEY') \
       .and_return('')
+    server.request.should_receive('get').with_args('shard_prefixes') \
+      .and_return('')
+    server.request.should_receive('get').with_args('shard_buckets') \
+      .and_return('')
+    server.request.should_receive('get').with_args('shard_bucket_suffix') \
+      .and_return('')
+    server.request.should_receive('get').with_args('stripes').and_return('')
+    server.request.should_receive('get').with_args('replicas').and_return('')
+    server.request.should_receive('get').with_args('write_quorum') \
+      .and_return('')
+    server.request.should_receive('get').with_args('timeout').and_return('')
+    server.request.should_receive('get').with_args('hedge_reads') \
+      .and_return('')
+    server.request.should_receive('get').with_args('compress').and_return('')
 
     # Mock out writing the file contents that were sent over.
     flexmock(uuid)
@@ -133,8 +325,8 @@ class TestRESTServer(unittest.TestCase):
     }])
 
     flexmock(StorageFactory)
-    StorageFactory.should_receive('get_storage').with_args(dict).and_return(
-      fake_storage)
+    StorageFactory.should_receive('get_pooled_storage').with_args(dict) \
+      .and_return(fake_storage)
 
     # Mock out writing the response.
     server.response = flexmock()
@@ -145,3 +337,278 @@ class TestRESTServer(unittest.TestCase):
     os.should_receive('remove').with_args('/tmp/magik-temp-123')
 
     self.assertEquals(None, server.put('/baz/gbaz.txt'))
+
+
+  def test_copy_route_uses_destination_header(self):
+    server = RESTServer()
+    server.request = flexmock(headers={
+      'Destination' : 'http://127.0.0.1:8080/baz/copy%20of%20gbaz.txt'})
+    server.request.should_receive('get').and_return('')
+
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('copy_files').with_args([{
+      'source' : '/baz/gbaz.txt',
+      'destination' : '/baz/copy of gbaz.txt'
+    }]).and_return([{'success' : True}]).once()
+
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').with_args(dict) \
+      .and_return(fake_storage)
+
+    server.response = flexmock()
+    server.response.should_receive('write').with_args([{'success' : True}]) \
+      .once()
+
+    self.assertEquals(None, server.copy('/baz/gbaz.txt'))
+
+
+  def post_batch(self, body, content_type, operations):
+    # Run each operation as though it succeeded, downloading 'contents'.
+    fake_storage = flexmock(name='fake_storage')
+    def run_operations(items):
+      for item in items:
+        operations.append(dict(item))
+        item['success'] = True
+        if item.get('op') == 'download':
+          item['contents'] = 'contents'
+        yield item
+    fake_storage.should_receive('iter_run_operations').replace_with(
+      run_operations)
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage).once()
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/_batch?name=s3', POST=body)
+    server.request.content_type = content_type
+    server.response = webapp2.Response()
+    server.post('/_batch')
+    return [json.loads(line) for line in server.response.body.splitlines()]
+
+
+  def test_batch_route_runs_json_operations(self):
+    operations = []
+    actual = self.post_batch('\n'.join([
+      json.dumps({'op' : 'upload', 'destination' : '/baz/a.txt',
+        'body' : base64.b64encode('hello')}),
+      json.dumps({'op' : 'download', 'source' : '/baz/b.txt'}),
+      '',
+      'not json'
+    ]), 'application/x-ndjson', operations)
+
+    self.assertEquals([
+      {'op' : 'upload', 'destination' : '/baz/a.txt', 'contents' : 'hello'},
+      {'op' : 'download', 'source' : '/baz/b.txt'},
+      {'line' : 4}
+    ], operations)
+    # Uploaded contents aren't echoed back, but downloaded ones are.
+    self.assertEquals([
+      {'op' : 'upload', 'destination' : '/baz/a.txt', 'success' : True},
+      {'op' : 'download', 'source' : '/baz/b.txt', 'success' : True,
+        'body' : base64.b64encode('contents')},
+      {'line' : 4, 'success' : True}
+    ], actual)
+
+
+  def test_batch_route_uploads_files_in_tar(self):
+    body = StringIO.StringIO()
+    archive = tarfile.open(fileobj=body, mode='w:gz',
+      format=tarfile.PAX_FORMAT)
+    for name, contents in [('baz/a.txt', 'hello'), ('baz/b/c.txt', 'world')]:
+      info = tarfile.TarInfo(name)
+      info.size = len(contents)
+      archive.addfile(info, StringIO.StringIO(contents))
+    # Files from an archive we sent keep the encoding they were stored with.
+    info = tarfile.TarInfo('baz/d.txt')
+    info.size = 2
+    info.pax_headers = {TarStream.CONTENT_ENCODING_HEADER : u'gzip'}
+    archive.addfile(info, StringIO.StringIO('\x1f\x8b'))
+    archive.close()
+
+    operations = []
+    self.post_batch(body.getvalue(), 'application/x-tar', operations)
+    self.assertEquals([
+      {'op' : 'upload', 'destination' : '/baz/a.txt', 'contents' : 'hello',
+        'content_encoding' : None},
+      {'op' : 'upload', 'destination' : '/baz/b/c.txt', 'contents' : 'world',
+        'content_encoding' : None},
+      {'op' : 'upload', 'destination' : '/baz/d.txt', 'contents' : '\x1f\x8b',
+        'content_encoding' : 'gzip'}
+    ], operations)
+
+
+  def test_get_route_streams_prefix_as_archive(self):
+    def failing_chunks():
+      yield 'abc'
+      raise IOError('connection reset')
+
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').with_args('/baz/logs') \
+      .and_return(('baz', 'logs'))
+    fake_storage.should_receive('does_bucket_exist').with_args('baz') \
+      .and_return(True)
+    fake_storage.should_receive('iter_download_prefix').with_args('/baz/logs') \
+      .and_return(iter([
+        {'source' : '/baz/logs/a.txt', 'success' : True, 'size' : 5,
+          'chunks' : iter(['hel', 'lo']), 'content_encoding' : None,
+          'last_modified' : 1363646585.0},
+        {'source' : '/baz/logs/b.txt', 'success' : False,
+          'failure_reason' : 'source not found'},
+        {'source' : '/baz/logs/c.txt.gz', 'success' : True, 'size' : 4,
+          'chunks' : iter(['\x1f\x8b..']), 'content_encoding' : 'gzip',
+          'last_modified' : 1363646585.0},
+        {'source' : '/baz/logs/d.txt', 'success' : True, 'size' : 6,
+          'chunks' : failing_chunks(), 'content_encoding' : None,
+          'last_modified' : 1363646585.0}
+      ]))
+    fake_storage.should_receive('get_cached_metadata').never()
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/logs?name=s3&archive=tar.gz')
+    server.response = webapp2.Response()
+    server.get('/baz/logs')
+    self.assertEquals('application/gzip', server.response.content_type)
+    self.assertEquals('attachment; filename="logs.tar.gz"',
+      server.response.headers['Content-Disposition'])
+
+    archive = tarfile.open(fileobj=StringIO.StringIO(server.response.body),
+      mode='r:gz')
+    self.assertEquals(['baz/logs/a.txt', 'baz/logs/c.txt.gz',
+      'baz/logs/d.txt', 'magik-errors.json'], archive.getnames())
+    self.assertEquals('hello', archive.extractfile('baz/logs/a.txt').read())
+    # Compressed files are archived as they're stored, and marked as such.
+    member = archive.getmember('baz/logs/c.txt.gz')
+    self.assertEquals('\x1f\x8b..', archive.extractfile(member).read())
+    self.assertEquals('gzip',
+      member.pax_headers[TarStream.CONTENT_ENCODING_HEADER])
+    # Files that fail part of the way through are padded, and listed.
+    self.assertEquals('abc\0\0\0',
+      archive.extractfile('baz/logs/d.txt').read())
+    self.assertEquals([
+      {'source' : '/baz/logs/b.txt', 'failure_reason' : 'source not found'},
+      {'source' : '/baz/logs/d.txt', 'failure_reason' : 'connection reset'}
+    ], [json.loads(line) for line in
+      archive.extractfile('magik-errors.json').read().splitlines()])
+
+
+  def test_get_route_reads_packed_files_from_their_pack(self):
+    fake_pack_store = flexmock(name='fake_pack_store')
+    fake_pack_store.should_receive('get_entry').with_args('a.txt').and_return(
+      {'pack' : '.magik-packs/1.pack', 'offset' : 5, 'length' : 5,
+      'md5' : 'abc', 'last_modified' : 1363646585.0})
+    fake_pack_store.should_receive('read').with_args('a.txt').and_return(
+      'hello')
+    fake_pack_store.should_receive('get_entry').with_args('b.txt') \
+      .and_return(None)
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('parse_path').replace_with(
+      lambda path: tuple(path.split('/', 2)[1:]))
+    fake_storage.should_receive('get_pack_store').with_args('baz') \
+      .and_return(fake_pack_store)
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/a.txt?name=s3&packed=1')
+    server.response = webapp2.Response()
+    server.get('/baz/a.txt')
+    self.assertEquals(('hello', '"abc"'), (server.response.body,
+      server.response.headers['ETag']))
+
+    server.request = webapp2.Request.blank('/baz/b.txt?name=s3&packed=1')
+    server.response = webapp2.Response()
+    server.get('/baz/b.txt')
+    self.assertEquals(404, server.response.status_int)
+
+
+  def test_batch_route_can_upload_into_packs(self):
+    fake_storage = flexmock(name='fake_storage')
+    fake_storage.should_receive('get_operation_bucket').replace_with(
+      lambda item: item.get('destination', '').split('/')[1] or None)
+    def upload_packed(items):
+      for item in items:
+        item.pop('contents')
+        item['success'] = True
+        yield item
+    fake_storage.should_receive('iter_upload_packed').replace_with(
+      upload_packed)
+    fake_storage.should_receive('iter_run_operations').never()
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_pooled_storage').and_return(
+      fake_storage)
+
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/_batch?name=s3&packed=1',
+      POST='\n'.join([
+        json.dumps({'op' : 'upload', 'destination' : '/baz/a.txt',
+          'body' : base64.b64encode('hello')}),
+        json.dumps({'op' : 'delete', 'source' : '/baz/b.txt'})
+      ]))
+    server.request.content_type = 'application/x-ndjson'
+    server.response = webapp2.Response()
+    server.post('/_batch')
+    self.assertEquals([
+      {'op' : 'upload', 'destination' : '/baz/a.txt', 'success' : True},
+      {'op' : 'delete', 'source' : '/baz/b.txt', 'success' : False,
+        'failure_reason' : 'only uploads can be packed'}
+    ], [json.loads(line) for line in server.response.body.splitlines()])
+
+
+  def test_post_route_only_serves_batches(self):
+    server = RESTServer()
+    server.request = webapp2.Request.blank('/baz/gbaz.txt?name=s3', POST='')
+    server.response = webapp2.Response()
+    server.post('/baz/gbaz.txt')
+    self.assertEquals(405, server.response.status_int)
+
+
+  def get_static_file(self, path, headers=None):
+    handler = StaticFileHandler()
+    handler.request = webapp2.Request.blank('/static/' + path,
+      headers=headers or {})
+    handler.response = webapp2.Response()
+    handler.get(path)
+    return handler.response
+
+
+  def test_static_files_are_gzipped_with_caching_headers(self):
+    response = self.get_static_file('css/bootstrap.css',
+      {'Accept-Encoding' : 'gzip, deflate'})
+    self.assertEquals(200, response.status_int)
+    self.assertEquals('gzip', response.headers['Content-Encoding'])
+    self.assertEquals('public, max-age=3600',
+      response.headers['Cache-Control'])
+    self.assertTrue(response.headers['ETag'].startswith('"'))
+
+    # Clients that don't accept gzip get the file as-is.
+    response = self.get_static_file('css/bootstrap.css')
+    self.assertEquals(None, response.headers.get('Content-Encoding'))
+    with open(os.path.join(StaticFileHandler.STATIC_DIRECTORY, 'css',
+      'bootstrap.css')) as file_handle:
+      self.assertEquals(file_handle.read(), response.body)
+
+
+  def test_static_files_answer_revalidation_with_304(self):
+    response = self.get_static_file('css/app.css')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    self.assertEquals(304, self.get_static_file('css/app.css',
+      {'If-None-Match' : 'W/"other", ' + etag}).status_int)
+    self.assertEquals(304, self.get_static_file('css/app.css',
+      {'If-Modified-Since' : last_modified}).status_int)
+    self.assertEquals(200, self.get_static_file('css/app.css',
+      {'If-None-Match' : '"other"', 'If-Modified-Since' : last_modified}) \
+      .status_int)
+
+
+  def test_static_files_cant_escape_static_directory(self):
+    self.assertEquals(403, self.get_static_file('../README.md').status_int)
+    self.assertEquals(403, self.get_static_file('css/../../LICENSE')
+      .status_int)
+    self.assertEquals(403, self.get_static_file('css').status_int)
+    self.assertEquals(404, self.get_static_file('css/missing.css').status_int)
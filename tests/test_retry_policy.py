@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+""" Tests for lib/retry_policy.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import time
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# RetryPolicy import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.retry_policy import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+
+  def setUp(self):
+    # Don't actually wait between retries.
+    flexmock(time).should_receive('sleep')
+    self.attempts = 0
+
+
+  def fail_then_succeed(self, failures):
+    """ Returns a function that raises an IOError the first 'failures' times
+    it is called, and returns 'done' after that. """
+    def function():
+      self.attempts += 1
+      if self.attempts <= failures:
+        raise IOError('try again')
+      return 'done'
+    return function
+
+
+  def test_call_retries_retryable_errors(self):
+    policy = RetryPolicy()
+    self.assertEquals('done', policy.call(self.fail_then_succeed(2),
+      lambda exception: True))
+    self.assertEquals(3, self.attempts)
+
+
+  def test_call_doesnt_retry_other_errors(self):
+    policy = RetryPolicy()
+    self.assertRaises(IOError, policy.call, self.fail_then_succeed(2),
+      lambda exception: False)
+    self.assertEquals(1, self.attempts)
+
+
+  def test_call_gives_up_after_max_attempts(self):
+    policy = RetryPolicy(max_attempts=3)
+    self.assertRaises(IOError, policy.call, self.fail_then_succeed(5),
+      lambda exception: True)
+    self.assertEquals(3, self.attempts)
+
+
+  def test_call_gives_up_when_budget_runs_out(self):
+    # The budget is shared by every call made with the same policy.
+    policy = RetryPolicy(retry_budget=3)
+    self.assertEquals('done', policy.call(self.fail_then_succeed(2),
+      lambda exception: True))
+
+    self.attempts = 0
+    self.assertRaises(IOError, policy.call, self.fail_then_succeed(2),
+      lambda exception: True)
+    self.assertEquals(2, self.attempts)
+
+
+  def test_budget_grows_with_batch_size(self):
+    self.assertEquals(RetryPolicy.MIN_RETRY_BUDGET,
+      RetryPolicy.for_batch(0).retries_left)
+    self.assertEquals(RetryPolicy.MIN_RETRY_BUDGET + 100,
+      RetryPolicy.for_batch(1000).retries_left)
+
+
+  def test_stream_budget_grows_with_each_item(self):
+    policy = RetryPolicy.for_stream()
+    policy.add_items(100)
+    self.assertEquals(RetryPolicy.MIN_RETRY_BUDGET + 10, policy.retries_left)
+
+    # Policies without a per-item budget don't grow.
+    policy = RetryPolicy(retry_budget=3)
+    policy.add_items(100)
+    self.assertEquals(3, policy.retries_left)
+
+
+  def test_delay_is_capped_and_jittered(self):
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt in range(1, 10):
+      delay = policy.get_delay(attempt)
+      self.assertTrue(0 <= delay <= min(5.0, 2 ** (attempt - 1)))
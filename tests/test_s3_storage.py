@@ -5,20 +5,35 @@
 
 # General-purpose Python library imports
 import os
+import shutil
 import sys
+import tempfile
 import unittest
+import zlib
 
 
 # Third-party libraries
+import boto.exception
 import boto.s3.connection
 import boto.s3.key
+import boto.s3.multipart
 from flexmock import flexmock
 
 
 # S3 storage import, the library that we're testing here
 lib = os.path.dirname(__file__) + os.sep + ".."
 sys.path.append(lib)
+from magik.base_storage import BaseStorage
+from magik.checkpoint import Checkpoint
+from magik.compression_codec import CompressionCodec
+from magik.concurrency_controller import ConcurrencyController
 from magik.custom_exceptions import BadConfigurationException
+from magik.hash_cache import HashCache
+from magik.manifest_index import ManifestIndex
+from magik.metadata_cache import MetadataCache
+from magik.pack_store import PackStore
+from magik.rate_limiter import RateLimiter
+from magik.retry_policy import RetryPolicy
 from magik.storage_factory import StorageFactory
 
 
@@ -27,7 +42,7 @@ class TestS3Storage(unittest.TestCase):
 
   def setUp(self):
     # Set up a mock for when we interact with S3
-    self.fake_s3 = flexmock(name='fake_s3')
+    self.fake_s3 = flexmock(name='fake_s3', http_connection_kwargs={})
     flexmock(boto.s3.connection)
     boto.s3.connection.should_receive('S3Connection').with_args(
       aws_access_key_id='access', aws_secret_access_key='secret') \
@@ -40,6 +55,14 @@ class TestS3Storage(unittest.TestCase):
     })
 
 
+  def tearDown(self):
+    BaseStorage.manifest_index = None
+    BaseStorage.metadata_cache = MetadataCache()
+    ConcurrencyController.controllers = {}
+    PackStore.stores = {}
+    RateLimiter.limiters = {}
+
+
   def test_s3_storage_creation_without_necessary_parameters(self):
     # Trying to create a S3Storage without the AWS_ACCESS_KEY should fail.
     self.assertRaises(BadConfigurationException, StorageFactory.get_storage, {
@@ -64,6 +87,16 @@ class TestS3Storage(unittest.TestCase):
     self.assertEquals("secret", s3.aws_secret_key)
 
 
+  def test_connections_time_out(self):
+    self.assertEquals(60, self.fake_s3.http_connection_kwargs['timeout'])
+    StorageFactory.get_storage({'name' : 's3', 'AWS_ACCESS_KEY' : 'access',
+      'AWS_SECRET_KEY' : 'secret', 'timeout' : '2.5'})
+    self.assertEquals(2.5, self.fake_s3.http_connection_kwargs['timeout'])
+    self.assertRaises(BadConfigurationException, StorageFactory.get_storage,
+      {'name' : 's3', 'AWS_ACCESS_KEY' : 'access', 'AWS_SECRET_KEY' :
+      'secret', 'timeout' : '-1'})
+
+
   def test_upload_one_file_and_create_bucket(self):
     file_one_info = {
       'source' : '/baz/boo/fbar1.tgz',
@@ -151,6 +184,45 @@ class TestS3Storage(unittest.TestCase):
       self.assertEquals(True, upload_result['success'])
 
 
+  def test_upload_scheduled_by_size_keeps_result_order(self):
+    # Presume that we have one small and one large file to upload.
+    flexmock(os.path)
+    os.path.should_call('exists')
+    os.path.should_receive('exists').with_args('/baz/small.tgz') \
+      .and_return(True)
+    os.path.should_receive('exists').with_args('/baz/large.tgz') \
+      .and_return(True)
+    os.path.should_call('getsize')
+    os.path.should_receive('getsize').with_args('/baz/small.tgz') \
+      .and_return(10)
+    os.path.should_receive('getsize').with_args('/baz/large.tgz') \
+      .and_return(100 * 1024 * 1024)
+
+    # And presume that our bucket exists.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+
+    # The large file should be uploaded first.
+    uploaded = []
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('set_contents_from_filename').replace_with(
+      lambda source: uploaded.append(source))
+
+    actual = self.s3.upload_files([
+      {'source' : '/baz/small.tgz', 'destination' : '/mybucket/small.tgz'},
+      {'source' : '/baz/large.tgz', 'destination' : '/mybucket/large.tgz'}
+    ], num_threads=1, schedule_by_size=True)
+    self.assertEquals(['/baz/large.tgz', '/baz/small.tgz'], uploaded)
+    self.assertEquals(['/baz/small.tgz', '/baz/large.tgz'],
+      [item['source'] for item in actual])
+    for upload_result in actual:
+      self.assertEquals(True, upload_result['success'])
+
+
   def test_download_one_file_that_doesnt_exist(self):
     # Set up mocks for the first file.
     file_one_info = {
@@ -254,3 +326,827 @@ class TestS3Storage(unittest.TestCase):
     actual = self.s3.delete_files(delete_info)
     for delete_result in actual:
       self.assertEquals(True, delete_result['success'])
+
+
+  def test_move_files_copies_within_s3(self):
+    # Presume that both buckets exist, and that the destination bucket is
+    # the one we copy into.
+    fake_source_bucket = flexmock(name='source_bucket')
+    fake_bucket = flexmock(name='dest_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_source_bucket)
+    self.fake_s3.should_receive('lookup').with_args('otherbucket').and_return(
+      fake_bucket)
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_source_bucket)
+    self.fake_s3.should_receive('get_bucket').with_args('otherbucket',
+      validate=False).and_return(fake_bucket)
+
+    # Presume that the first file is small and the second is missing.
+    fake_source_bucket.should_receive('get_key').with_args('files/a.txt') \
+      .and_return(flexmock(etag='"abc"', size=10, content_type='text/plain',
+      content_encoding=None, last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+    fake_source_bucket.should_receive('get_key').with_args('files/b.txt') \
+      .and_return(None)
+
+    # The small file should be copied by S3 itself, and then deleted.
+    fake_bucket.should_receive('copy_key').with_args('copies/a.txt',
+      'mybucket', 'files/a.txt').once()
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_source_bucket) \
+      .and_return(fake_key)
+    fake_key.should_receive('delete').once()
+
+    actual = self.s3.move_files([
+      {'source' : '/mybucket/files/a.txt',
+        'destination' : '/otherbucket/copies/a.txt'},
+      {'source' : '/mybucket/files/b.txt',
+        'destination' : '/otherbucket/copies/b.txt'}
+    ])
+    self.assertEquals(True, actual[0]['success'])
+    self.assertEquals(False, actual[1]['success'])
+    self.assertEquals('source not found', actual[1]['failure_reason'])
+
+
+  def test_copy_large_file_in_parts(self):
+    self.s3.MULTIPART_COPY_THRESHOLD = 100
+    self.s3.MULTIPART_COPY_CHUNK_SIZE = 40
+
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('big.tgz').and_return(
+      flexmock(etag='"abc-2"', size=100, content_type=None,
+      content_encoding='gzip', last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+
+    # The file should be copied in three parts, without copying it whole, and
+    # keep its Content-Encoding.
+    fake_bucket.should_receive('copy_key').never()
+    fake_upload = flexmock(name='fake_upload')
+    fake_bucket.should_receive('initiate_multipart_upload').with_args(
+      'big-copy.tgz', headers={'Content-Encoding' : 'gzip'}).and_return(
+      fake_upload)
+    fake_upload.should_receive('copy_part_from_key').with_args('mybucket',
+      'big.tgz', 1, 0, 39).once()
+    fake_upload.should_receive('copy_part_from_key').with_args('mybucket',
+      'big.tgz', 2, 40, 79).once()
+    fake_upload.should_receive('copy_part_from_key').with_args('mybucket',
+      'big.tgz', 3, 80, 99).once()
+    fake_upload.should_receive('complete_upload').once()
+
+    actual = self.s3.copy_files([{'source' : '/mybucket/big.tgz',
+      'destination' : '/mybucket/big-copy.tgz'}])
+    self.assertEquals(True, actual[0]['success'])
+
+
+  def test_transfer_streams_ranges_into_multipart_upload(self):
+    # Copy between two S3 accounts that share the same fake connection.
+    destination = StorageFactory.get_storage({
+      "name" : "s3",
+      "AWS_ACCESS_KEY" : "access",
+      "AWS_SECRET_KEY" : "secret"
+    })
+    destination.STREAM_CHUNK_SIZE = 4
+
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('lookup').and_return(fake_bucket)
+    self.fake_s3.should_receive('get_bucket').and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('files/a.txt').and_return(
+      flexmock(etag='"abc"', size=10, content_type=None, content_encoding=None,
+      last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+
+    # The file should be downloaded in ranges as large as the parts that the
+    # destination uploads.
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    for start, end, contents in [(0, 3, '0123'), (4, 7, '4567'),
+      (8, 9, '89')]:
+      fake_key.should_receive('get_contents_as_string').with_args(headers={
+        'Range' : 'bytes={0}-{1}'.format(start, end)}).and_return(contents)
+
+    uploaded_parts = []
+    fake_upload = flexmock(name='fake_upload')
+    fake_bucket.should_receive('initiate_multipart_upload').with_args(
+      'copies/a.txt').and_return(fake_upload)
+    fake_upload.should_receive('upload_part_from_file').replace_with(
+      lambda file_handle, part_num, size: uploaded_parts.append(
+      (part_num, file_handle.read(), size)))
+    fake_upload.should_receive('complete_upload').once()
+
+    actual = self.s3.transfer_files(destination, [{
+      'source' : '/mybucket/files/a.txt',
+      'destination' : '/otherbucket/copies/a.txt'
+    }])
+    self.assertEquals(True, actual[0]['success'])
+    self.assertEquals([(1, '0123', 4), (2, '4567', 4), (3, '89', 2)],
+      uploaded_parts)
+
+
+  def test_transfer_cancels_upload_when_download_fails(self):
+    self.s3.STREAM_CHUNK_SIZE = 4
+
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('lookup').and_return(fake_bucket)
+    self.fake_s3.should_receive('get_bucket').and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('a.txt').and_return(
+      flexmock(etag='"abc"', size=10, content_type=None, content_encoding=None,
+      last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    fake_key.should_receive('get_contents_as_string').and_raise(
+      boto.exception.S3ResponseError(403, 'Forbidden'))
+
+    fake_upload = flexmock(name='fake_upload')
+    fake_bucket.should_receive('initiate_multipart_upload').and_return(
+      fake_upload)
+    fake_upload.should_receive('complete_upload').never()
+    fake_upload.should_receive('cancel_upload').once()
+
+    actual = self.s3.transfer_files(self.s3, [{'source' : '/mybucket/a.txt',
+      'destination' : '/mybucket/b.txt'}])
+    self.assertEquals(False, actual[0]['success'])
+    self.assertTrue(actual[0]['failure_reason'].startswith(
+      'S3ResponseError: '))
+
+
+  def test_cached_metadata_is_forgotten_after_delete(self):
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('lookup').and_return(fake_bucket)
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+
+    # Only one HEAD should happen before the file is deleted.
+    fake_bucket.should_receive('get_key').with_args('a.txt').and_return(
+      flexmock(etag='"abc"', size=10, content_type=None, content_encoding=None,
+      last_modified='Mon, 18 Mar 2013 22:43:05 GMT')).and_return(None) \
+      .times(2)
+    self.assertEquals(10, self.s3.get_cached_metadata('mybucket',
+      'a.txt')['size'])
+    self.assertEquals(10, self.s3.get_cached_metadata('mybucket',
+      'a.txt')['size'])
+
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    fake_key.should_receive('exists').and_return(True)
+    fake_key.should_receive('delete').once()
+    self.s3.delete_files([{'source' : '/mybucket/a.txt'}])
+
+    self.assertEquals(None, self.s3.get_cached_metadata('mybucket', 'a.txt'))
+
+
+  def test_cached_metadata_is_not_shared_with_other_credentials(self):
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('a.txt').and_return(
+      flexmock(etag='"abc"', size=10, content_type=None, content_encoding=None,
+      last_modified='Mon, 18 Mar 2013 22:43:05 GMT')).once()
+    self.assertEquals(10, self.s3.get_cached_metadata('mybucket',
+      'a.txt')['size'])
+
+    # Someone who knows our access key but not our secret key has to ask S3,
+    # which turns them away.
+    wrong_s3 = flexmock(name='wrong_s3', http_connection_kwargs={})
+    boto.s3.connection.should_receive('S3Connection').with_args(
+      aws_access_key_id='access', aws_secret_access_key='guess') \
+      .and_return(wrong_s3)
+    wrong_s3.should_receive('get_bucket').and_raise(
+      boto.exception.S3ResponseError(403, 'Forbidden'))
+    guesser = StorageFactory.get_storage({'name' : 's3',
+      'AWS_ACCESS_KEY' : 'access', 'AWS_SECRET_KEY' : 'guess'})
+    self.assertEquals(self.s3.get_backend_id(), guesser.get_backend_id())
+    self.assertNotEquals(self.s3.get_credentials_id(),
+      guesser.get_credentials_id())
+    self.assertRaises(boto.exception.S3ResponseError,
+      guesser.get_cached_metadata, 'mybucket', 'a.txt')
+
+
+  def test_iter_run_operations_mixes_uploads_downloads_and_deletes(self):
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('lookup').and_return(fake_bucket)
+    self.fake_s3.should_receive('get_bucket').and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('a.txt').and_return(
+      flexmock(etag='"abc"', size=5, content_type=None, content_encoding=None,
+      last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+    fake_bucket.should_receive('get_key').with_args('missing.txt') \
+      .and_return(None)
+
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    fake_key.should_receive('set_contents_from_string').with_args('hello') \
+      .once()
+    fake_key.should_receive('get_contents_as_string').with_args(headers={
+      'Range' : 'bytes=0-4'}).and_return('world')
+    fake_key.should_receive('exists').and_return(True)
+    fake_key.should_receive('delete').once()
+
+    actual = sorted(self.s3.iter_run_operations(iter([
+      {'op' : 'upload', 'destination' : '/mybucket/b.txt',
+        'contents' : 'hello'},
+      {'op' : 'download', 'source' : '/mybucket/a.txt'},
+      {'op' : 'download', 'source' : '/mybucket/missing.txt'},
+      {'op' : 'delete', 'source' : '/mybucket/c.txt'},
+      {'op' : 'rename', 'source' : '/mybucket/c.txt'}
+    ]), num_threads=2), key=lambda item: item['op'] + item.get('source', ''))
+    self.assertEquals(['delete', 'download', 'download', 'rename', 'upload'],
+      [item['op'] for item in actual])
+    self.assertEquals(True, actual[0]['success'])
+    self.assertEquals((True, 'world'), (actual[1]['success'],
+      actual[1]['contents']))
+    self.assertEquals((False, 'source not found'), (actual[2]['success'],
+      actual[2]['failure_reason']))
+    self.assertEquals((False, 'invalid operation'), (actual[3]['success'],
+      actual[3]['failure_reason']))
+    self.assertEquals(True, actual[4]['success'])
+
+
+  def test_download_retries_throttled_requests(self):
+    # Presume that our bucket exists.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('exists').and_return(True)
+
+    # Presume that S3 throttles us the first time we ask for the file, and
+    # hands it over the second time.
+    slow_down = boto.exception.S3ResponseError(503, 'Slow Down')
+    slow_down.error_code = 'SlowDown'
+    fake_key.should_receive('get_contents_to_filename').with_args(
+      '/baz/boo/fbar1.tgz').and_raise(slow_down).and_return(None).twice()
+
+    actual = self.s3.download_files([{
+      'source' : '/mybucket/files/fbar1.tgz',
+      'destination' : '/baz/boo/fbar1.tgz'
+    }], retry_policy=RetryPolicy(base_delay=0))
+    self.assertEquals(True, actual[0]['success'])
+
+
+  def test_adaptive_download_backs_off_when_throttled(self):
+    # Presume that our bucket exists.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('exists').and_return(True)
+
+    # Presume that S3 throttles us once before handing over the file.
+    slow_down = boto.exception.S3ResponseError(503, 'Slow Down')
+    fake_key.should_receive('get_contents_to_filename').with_args(
+      '/baz/boo/fbar1.tgz').and_raise(slow_down).and_return(None).twice()
+
+    actual = self.s3.download_files([{
+      'source' : '/mybucket/files/fbar1.tgz',
+      'destination' : '/baz/boo/fbar1.tgz'
+    }], retry_policy=RetryPolicy(base_delay=0), adaptive=True)
+    self.assertEquals(True, actual[0]['success'])
+
+    # The bucket's controller should have halved its limit.
+    controller = ConcurrencyController.for_bucket('s3:access', 'mybucket')
+    self.assertEquals(ConcurrencyController.INITIAL_LIMIT / 2,
+      int(controller.limit))
+
+
+  def test_download_is_throttled_when_rate_is_limited(self):
+    RateLimiter.set_limit(1024 * 1024)
+
+    # Presume that our bucket and file exist.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('exists').and_return(True)
+
+    # boto should tell us about each chunk it receives, and we should wait for
+    # the rate limiter after each one.
+    def get_contents_to_filename(destination, cb, num_cb):
+      self.assertEquals(-1, num_cb)
+      cb(8192, 16384)
+      cb(16384, 16384)
+    fake_key.should_receive('get_contents_to_filename').replace_with(
+      get_contents_to_filename)
+    flexmock(RateLimiter).should_receive('throttle').with_args('s3:access',
+      8192).twice()
+
+    actual = self.s3.download_files([{
+      'source' : '/mybucket/files/fbar1.tgz',
+      'destination' : '/baz/boo/fbar1.tgz'
+    }])
+    self.assertEquals(True, actual[0]['success'])
+
+
+  def test_download_doesnt_retry_permanent_errors(self):
+    # Presume that our bucket exists.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('exists').and_return(True)
+
+    # Presume that we aren't allowed to read the first file, but can read the
+    # second one.
+    fake_key.should_receive('get_contents_to_filename').with_args(
+      '/baz/boo/fbar1.tgz').and_raise(
+      boto.exception.S3ResponseError(403, 'Forbidden')).once()
+    fake_key.should_receive('get_contents_to_filename').with_args(
+      '/baz/boo/fbar2.tgz').once()
+
+    actual = self.s3.download_files([
+      {'source' : '/mybucket/files/fbar1.tgz',
+       'destination' : '/baz/boo/fbar1.tgz'},
+      {'source' : '/mybucket/files/fbar2.tgz',
+       'destination' : '/baz/boo/fbar2.tgz'}
+    ], retry_policy=RetryPolicy(base_delay=0))
+    self.assertEquals(False, actual[0]['success'])
+    self.assertTrue(actual[0]['failure_reason'].startswith(
+      'S3ResponseError: S3ResponseError: 403 Forbidden'))
+    self.assertEquals(True, actual[1]['success'])
+
+
+  def test_iter_delete_files_reads_input_lazily(self):
+    # Presume that our bucket and files exist.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('exists').and_return(True)
+    fake_key.should_receive('delete')
+
+    # Keep track of how far the input has been read.
+    taken = []
+    def files_to_delete():
+      for index in range(20):
+        taken.append(index)
+        yield {'source' : '/mybucket/files/{0}.tgz'.format(index)}
+
+    results = self.s3.iter_delete_files(files_to_delete(), num_threads=2,
+      max_in_flight=4)
+    first_result = next(results)
+    self.assertEquals(True, first_result['success'])
+    self.assertTrue(len(taken) <= 5)
+
+    rest = list(results)
+    self.assertEquals(19, len(rest))
+    self.assertEquals(range(20), taken)
+    for delete_result in rest:
+      self.assertEquals(True, delete_result['success'])
+
+
+  def test_iter_upload_files_reports_failures(self):
+    # Presume that one local file exists, and one doesn't.
+    flexmock(os.path)
+    os.path.should_call('exists')
+    os.path.should_receive('exists').with_args('/baz/boo/fbar1.tgz') \
+      .and_return(True)
+    os.path.should_receive('exists').with_args('/baz/boo/fbar2.tgz') \
+      .and_return(False)
+
+    # And presume that our bucket exists.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('set_contents_from_filename') \
+      .with_args('/baz/boo/fbar1.tgz').once()
+
+    results = list(self.s3.iter_upload_files(iter([
+      {'source' : '/baz/boo/fbar1.tgz',
+       'destination' : '/mybucket/files/fbar1.tgz'},
+      {'source' : '/baz/boo/fbar2.tgz',
+       'destination' : '/mybucket/files/fbar2.tgz'}
+    ])))
+    by_source = dict((result['source'], result) for result in results)
+    self.assertEquals(True, by_source['/baz/boo/fbar1.tgz']['success'])
+    self.assertEquals(False, by_source['/baz/boo/fbar2.tgz']['success'])
+    self.assertEquals('file not found',
+      by_source['/baz/boo/fbar2.tgz']['failure_reason'])
+
+
+  def test_list_keys(self):
+    # Presume that our bucket exists and has two keys in it, one of which was
+    # uploaded in multiple parts.
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    fake_bucket.should_receive('list').with_args(prefix='files/').and_return([
+      flexmock(name='files/fbar1.tgz', size=10, etag='"abc"',
+        last_modified='2013-03-18T22:43:05.000Z'),
+      flexmock(name='files/fbar2.tgz', size=20, etag='"def-2"',
+        last_modified='2013-03-18T22:43:06.000Z')
+    ])
+
+    actual = list(self.s3.list_keys('mybucket', 'files/'))
+    self.assertEquals(2, len(actual))
+    self.assertEquals('files/fbar1.tgz', actual[0]['key'])
+    self.assertEquals(10, actual[0]['size'])
+    self.assertEquals('abc', actual[0]['md5'])
+    self.assertEquals(1363646585.0, actual[0]['last_modified'])
+    self.assertEquals(None, actual[1]['md5'])
+
+
+  def test_download_prefix_streams_files_as_stored(self):
+    compressed = ''.join(CompressionCodec.compress_chunks(['bar' * 100],
+      'gzip'))
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_s3.should_receive('lookup').and_return(fake_bucket)
+    self.fake_s3.should_receive('get_bucket').and_return(fake_bucket)
+    fake_bucket.should_receive('list').with_args(prefix='files/').and_return([
+      flexmock(name='files/a.txt', size=150, etag='"abc"',
+        last_modified='2013-03-18T22:43:05.000Z'),
+      flexmock(name=u'files/b\xe9.txt', size=0, etag='"def"',
+        last_modified='2013-03-18T22:43:06.000Z'),
+      flexmock(name='files/c.txt', size=len(compressed), etag='"ghi"',
+        last_modified='2013-03-18T22:43:07.000Z')
+    ])
+    # Listings don't say how files are encoded, so each file is looked up.
+    for key_name, size, content_encoding in [('files/a.txt', 150, None),
+      (u'files/b\xe9.txt', 0, None),
+      ('files/c.txt', len(compressed), 'gzip')]:
+      fake_bucket.should_receive('get_key').with_args(key_name).and_return(
+        flexmock(etag='"abc"', size=size, content_type=None,
+        content_encoding=content_encoding,
+        last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+
+    # Only the first chunk of each file is fetched before it's handed back.
+    self.s3.PREFIX_CHUNK_SIZE = 100
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    fake_key.should_receive('get_contents_as_string').with_args(headers={
+      'Range' : 'bytes=0-99'}).and_return('foo' * 33 + 'f').once()
+    fake_key.should_receive('get_contents_as_string').with_args(headers={
+      'Range' : 'bytes=100-149'}).and_return('oo' + 'foo' * 16).once()
+    fake_key.should_receive('get_contents_as_string').with_args(headers={
+      'Range' : 'bytes=0-{0}'.format(len(compressed) - 1)}).and_return(
+      compressed).once()
+
+    actual = sorted(self.s3.iter_download_prefix('/mybucket/files/'),
+      key=lambda item: item['source'])
+    self.assertEquals([
+      ('/mybucket/files/a.txt', 150, 'foo' * 50, None, 1363646585.0),
+      ('/mybucket/files/b\xc3\xa9.txt', 0, '', None, 1363646586.0),
+      ('/mybucket/files/c.txt', len(compressed), compressed, 'gzip',
+        1363646587.0)],
+      [(item['source'], item['size'], ''.join(item['chunks']),
+      item['content_encoding'], item['last_modified']) for item in actual])
+
+
+  def test_packed_files_are_moved_in_few_requests(self):
+    # Keep the bucket's objects in memory, and count the requests for them.
+    objects = {}
+    requests = []
+    def upload_stream(chunks, bucket_name, key_name, size):
+      requests.append(('PUT', key_name))
+      objects[key_name] = ''.join(chunks)
+    def download_range(bucket_name, key_name, start, end):
+      requests.append(('GET', key_name))
+      return objects[key_name][start:end + 1]
+    def list_keys(bucket_name, prefix=''):
+      return [{'key' : key_name, 'size' : len(objects[key_name])}
+        for key_name in sorted(objects) if key_name.startswith(prefix)]
+    flexmock(self.s3)
+    self.s3.should_receive('check_buckets').and_return({'mybucket' : None})
+    self.s3.should_receive('upload_stream').replace_with(upload_stream)
+    self.s3.should_receive('download_range').replace_with(download_range)
+    self.s3.should_receive('list_keys').replace_with(list_keys)
+
+    directory = tempfile.mkdtemp()
+    try:
+      for name, contents in [('a.txt', 'hello'), ('b.txt', 'world')]:
+        with open(os.path.join(directory, name), 'w') as file_handle:
+          file_handle.write(contents)
+
+      actual = list(self.s3.iter_upload_packed(iter([{
+        'source' : os.path.join(directory, name),
+        'destination' : '/mybucket/files/' + name
+      } for name in ['a.txt', 'b.txt', 'missing.txt']]), num_threads=2))
+      self.assertEquals([True, True, False], [item['success'] for item in
+        sorted(actual, key=lambda item: item['destination'])])
+      # Both files go into one pack, which is written along with its index.
+      self.assertEquals(['PUT', 'PUT'], [method for method, _ in requests])
+
+      del requests[:]
+      PackStore.stores = {}
+      actual = list(self.s3.iter_download_packed(iter([{
+        'source' : '/mybucket/files/' + name,
+        'destination' : os.path.join(directory, name + '.copy')
+      } for name in ['a.txt', 'b.txt', 'missing.txt']])))
+      self.assertEquals([True, True, False], [item['success'] for item in
+        sorted(actual, key=lambda item: item['source'])])
+      with open(os.path.join(directory, 'b.txt.copy')) as file_handle:
+        self.assertEquals('world', file_handle.read())
+      # One GET reads the index, and another reads both files from the pack.
+      self.assertEquals(['GET', 'GET'], [method for method, _ in requests])
+
+      self.assertEquals([True, False], [item['success'] for item in
+        self.s3.delete_files_packed([{'source' : '/mybucket/files/a.txt'},
+        {'source' : '/mybucket/files/missing.txt'}])])
+      self.assertEquals(['files/b.txt'], [entry['key'] for entry in
+        self.s3.get_pack_store('mybucket').list_entries()])
+    finally:
+      shutil.rmtree(directory)
+
+
+  def test_delete_prefix_uses_multi_object_delete(self):
+    # Presume that our bucket has three keys under the prefix, and that we
+    # delete two at a time.
+    self.s3.DELETE_BATCH_SIZE = 2
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    fake_bucket.should_receive('list').with_args(prefix='logs/').and_return([
+      flexmock(name='logs/1', size=10, etag='"abc"',
+        last_modified='2013-03-18T22:43:05.000Z'),
+      flexmock(name='logs/2', size=10, etag='"abc"',
+        last_modified='2013-03-18T22:43:05.000Z'),
+      flexmock(name=u'logs/caf\xe9', size=10, etag='"abc"',
+        last_modified='2013-03-18T22:43:05.000Z')
+    ])
+
+    # And presume that S3 refuses to delete one of them.
+    fake_bucket.should_receive('delete_keys').with_args(['logs/1', 'logs/2'],
+      quiet=True).and_return(flexmock(errors=[
+      flexmock(key='logs/2', code='AccessDenied', message='Access Denied')
+    ])).once()
+    fake_bucket.should_receive('delete_keys').with_args([u'logs/caf\xe9'],
+      quiet=True).and_return(flexmock(errors=[])).once()
+
+    actual = dict((result['source'], result) for result in
+      self.s3.iter_delete_prefix('/mybucket/logs/'))
+    self.assertEquals(True, actual['/mybucket/logs/1']['success'])
+    self.assertEquals(False, actual['/mybucket/logs/2']['success'])
+    self.assertEquals('AccessDenied: Access Denied',
+      actual['/mybucket/logs/2']['failure_reason'])
+    self.assertEquals(True, actual['/mybucket/logs/caf\xc3\xa9']['success'])
+
+
+  def test_sync_upload_only_uploads_changed_files(self):
+    # Use an in-memory manifest index, so that we don't write to the home dir.
+    BaseStorage.manifest_index = ManifestIndex(':memory:')
+
+    # Make a local directory with one unchanged file, one file whose size has
+    # changed, and one file that hasn't been uploaded yet.
+    local_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(local_dir, 'sub'))
+    for name, contents in [('same.txt', 'same'), ('changed.txt', 'new stuff'),
+      ('sub/new.txt', 'new')]:
+      with open(os.path.join(local_dir, name), 'w') as file_handle:
+        file_handle.write(contents)
+
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    fake_bucket.should_receive('list').with_args(prefix='builds/').and_return([
+      flexmock(name='builds/same.txt', size=4, etag='"abc"',
+        last_modified='2030-01-01T00:00:00.000Z'),
+      flexmock(name='builds/changed.txt', size=3, etag='"def"',
+        last_modified='2030-01-01T00:00:00.000Z')
+    ])
+
+    # Only the changed and new files should be uploaded.
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('set_contents_from_filename').with_args(
+      os.path.join(local_dir, 'changed.txt')).once()
+    fake_key.should_receive('set_contents_from_filename').with_args(
+      os.path.join(local_dir, 'sub/new.txt')).once()
+
+    # Each uploaded file is looked up afterwards, so that the manifest index
+    # has S3's timestamp and MD5 for it.
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('builds/changed.txt') \
+      .and_return(flexmock(size=9, etag='"ghi"', content_type='text/plain',
+        content_encoding=None, last_modified='Tue, 01 Jan 2030 00:00:00 GMT'))
+    fake_bucket.should_receive('get_key').with_args('builds/sub/new.txt') \
+      .and_return(flexmock(size=3, etag='"jkl"', content_type='text/plain',
+        content_encoding=None, last_modified='Tue, 01 Jan 2030 00:00:00 GMT'))
+
+    actual = self.s3.sync_upload(local_dir, '/mybucket/builds')
+    self.assertEquals(['/mybucket/builds/changed.txt',
+      '/mybucket/builds/sub/new.txt'],
+      sorted(item['destination'] for item in actual))
+    for upload_result in actual:
+      self.assertEquals(True, upload_result['success'])
+    recorded = BaseStorage.manifest_index.get_keys(self.s3.get_backend_id(),
+      'mybucket', 'builds/')['builds/changed.txt']
+    self.assertEquals(('ghi', 1893456000), (recorded['md5'],
+      int(recorded['last_modified'])))
+
+    # Syncing again shouldn't list the bucket or upload anything, since the
+    # manifest index knows about the files we just uploaded.
+    fake_bucket.should_receive('list').never()
+    self.assertEquals([], self.s3.sync_upload(local_dir, '/mybucket/builds'))
+    shutil.rmtree(local_dir)
+
+
+  def test_upload_skips_files_with_same_md5(self):
+    # Use an in-memory hash cache, so that we don't write to the home dir.
+    BaseStorage.hash_cache = HashCache(':memory:')
+
+    local_dir = tempfile.mkdtemp()
+    for name in ['same.txt', 'different.txt']:
+      with open(os.path.join(local_dir, name), 'w') as file_handle:
+        file_handle.write('abc')
+
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+
+    # Presume that one remote file has the same MD5 as the local one, and the
+    # other one doesn't.
+    fake_bucket.should_receive('get_key').with_args('same.txt').and_return(
+      flexmock(size=3, etag='"900150983cd24fb0d6963f7d28e17f72"',
+        content_type='text/plain', content_encoding=None,
+        last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+    fake_bucket.should_receive('get_key').with_args('different.txt') \
+      .and_return(flexmock(size=3, etag='"def"', content_type='text/plain',
+        content_encoding=None, last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+
+    # Only the file with a different MD5 should get uploaded.
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').with_args(fake_bucket).and_return(
+      fake_key)
+    fake_key.should_receive('set_contents_from_filename').with_args(
+      os.path.join(local_dir, 'different.txt')).once()
+
+    actual = self.s3.upload_files([
+      {
+        'source' : os.path.join(local_dir, 'same.txt'),
+        'destination' : '/mybucket/same.txt'
+      },
+      {
+        'source' : os.path.join(local_dir, 'different.txt'),
+        'destination' : '/mybucket/different.txt'
+      }
+    ], skip_unchanged=True)
+    shutil.rmtree(local_dir)
+
+    self.assertEquals([True, True], [item['success'] for item in actual])
+    self.assertEquals([True, False], [item['skipped'] for item in actual])
+
+
+  def test_upload_compresses_files_that_arent_compressed(self):
+    local_dir = tempfile.mkdtemp()
+    for name in ['log.txt', 'photo.jpg']:
+      with open(os.path.join(local_dir, name), 'w') as file_handle:
+        file_handle.write('abc' * 1000)
+
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+
+    uploads = {}
+    def upload(source, **kwargs):
+      with open(source, 'rb') as file_handle:
+        uploads[os.path.splitext(source)[1]] = (source, file_handle.read(),
+          kwargs.get('headers'))
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    fake_key.should_receive('set_contents_from_filename').replace_with(upload)
+
+    actual = self.s3.upload_files([
+      {
+        'source' : os.path.join(local_dir, 'log.txt'),
+        'destination' : '/mybucket/log.txt'
+      },
+      {
+        'source' : os.path.join(local_dir, 'photo.jpg'),
+        'destination' : '/mybucket/photo.jpg'
+      }
+    ], compression='gzip')
+    shutil.rmtree(local_dir)
+
+    self.assertEquals([True, True], [item['success'] for item in actual])
+    self.assertEquals(['gzip', None], [item.get('content_encoding')
+      for item in actual])
+
+    # The log should be uploaded gzipped from a temporary file that is then
+    # cleaned up, and the photo should be uploaded as it is.
+    source, contents, headers = uploads['.txt']
+    self.assertFalse(os.path.exists(source))
+    self.assertEquals({'Content-Encoding' : 'gzip'}, headers)
+    self.assertEquals('abc' * 1000, zlib.decompress(contents,
+      16 + zlib.MAX_WBITS))
+    self.assertEquals(('abc' * 1000, None), uploads['.jpg'][1:])
+
+
+  def test_download_decompresses_compressed_files(self):
+    local_dir = tempfile.mkdtemp()
+    destination = os.path.join(local_dir, 'log.txt')
+
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+    self.fake_s3.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+    fake_bucket.should_receive('get_key').with_args('log.txt').and_return(
+      flexmock(size=20, etag='"abc"', content_type='text/plain',
+        content_encoding='gzip', last_modified='Mon, 18 Mar 2013 22:43:05 GMT'))
+
+    def download(path, **kwargs):
+      with open(path, 'wb') as file_handle:
+        file_handle.write(''.join(CompressionCodec.compress_chunks(
+          ['abc' * 1000], 'gzip')))
+    fake_key = flexmock(name='fake_key')
+    flexmock(boto.s3.key)
+    boto.s3.key.should_receive('Key').and_return(fake_key)
+    fake_key.should_receive('get_contents_to_filename').replace_with(download)
+
+    actual = self.s3.download_files([{'source' : '/mybucket/log.txt',
+      'destination' : destination}], decompress=True)
+    self.assertEquals(True, actual[0]['success'])
+    self.assertEquals('gzip', actual[0]['content_encoding'])
+    with open(destination, 'r') as file_handle:
+      self.assertEquals('abc' * 1000, file_handle.read())
+    self.assertEquals(['log.txt'], os.listdir(local_dir))
+    shutil.rmtree(local_dir)
+
+
+  def test_resumable_upload_only_sends_missing_parts(self):
+    # Keep checkpoints out of the home dir, and use tiny parts.
+    checkpoint_dir = tempfile.mkdtemp()
+    flexmock(Checkpoint).should_receive('for_job').replace_with(
+      lambda directive, backend_id, items: Checkpoint(os.path.join(
+        checkpoint_dir, 'job.journal')))
+    self.s3.MULTIPART_THRESHOLD = 8
+    self.s3.MULTIPART_CHUNK_SIZE = 4
+
+    local_dir = tempfile.mkdtemp()
+    source = os.path.join(local_dir, 'big.txt')
+    with open(source, 'w') as file_handle:
+      file_handle.write('0123456789')
+
+    # Presume that a previous run started a multipart upload and uploaded the
+    # first of its three parts before dying.
+    file_stat = os.stat(source)
+    transfer_state = Checkpoint(os.path.join(checkpoint_dir, 'job.journal')) \
+      .get_transfer_state(0)
+    transfer_state.set('source', [file_stat.st_size, file_stat.st_mtime])
+    transfer_state.set('upload_id', 'upload123')
+    transfer_state.add('parts', 1)
+
+    fake_bucket = flexmock(name='name_bucket')
+    self.fake_s3.should_receive('lookup').with_args('mybucket').and_return(
+      fake_bucket)
+
+    # The upload should be resumed, not restarted.
+    fake_upload = flexmock(name='fake_upload')
+    flexmock(boto.s3.multipart)
+    boto.s3.multipart.should_receive('MultiPartUpload').with_args(
+      fake_bucket).and_return(fake_upload)
+    fake_bucket.should_receive('initiate_multipart_upload').never()
+    fake_upload.should_receive('upload_part_from_file').with_args(object, 1,
+      size=4).never()
+    fake_upload.should_receive('upload_part_from_file').with_args(object, 2,
+      size=4).once()
+    fake_upload.should_receive('upload_part_from_file').with_args(object, 3,
+      size=2).once()
+    fake_upload.should_receive('complete_upload').once()
+
+    actual = self.s3.upload_files([{
+      'source' : source,
+      'destination' : '/mybucket/big.txt'
+    }], resumable=True)
+    self.assertEquals(True, actual[0]['success'])
+    self.assertEquals('upload123', fake_upload.id)
+
+    # Since the batch finished, its checkpoint should be gone.
+    self.assertEquals([], os.listdir(checkpoint_dir))
+    shutil.rmtree(local_dir)
+    shutil.rmtree(checkpoint_dir)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+""" Tests for lib/sharded_storage.py. """
+
+
+# General-purpose Python library imports
+import hashlib
+import os
+import sys
+import unittest
+
+
+# ShardedStorage import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.custom_exceptions import BadConfigurationException
+from magik.retry_policy import RetryPolicy
+from magik.sharded_storage import ShardedStorage
+
+
+# The in-memory storage platform that ShardedStorage wraps in these tests
+from fake_storage import make_fake_storage
+
+
+class TestShardedStorage(unittest.TestCase):
+
+
+  def setUp(self):
+    # Keep the objects in our fake storage platform in memory, keyed by
+    # (bucket, key), and note the bucket of each multi-object delete.
+    self.objects = {}
+    self.deletions = []
+    def before_call(operation, *args):
+      if operation == 'delete_keys':
+        self.deletions.append(args[0])
+    self.storage = make_fake_storage('s3:access', self.objects, before_call)
+
+
+  def upload(self, sharded, key_names):
+    for key_name in key_names:
+      sharded.upload_stream(iter([key_name]), 'mybucket', key_name,
+        len(key_name))
+
+
+  def test_sequential_keys_are_spread_across_prefixes(self):
+    sharded = ShardedStorage(self.storage, num_prefixes=16)
+    key_names = ['logs/{0:06d}.txt'.format(index) for index in range(100)]
+    self.upload(sharded, key_names)
+
+    prefixes = set(key_name.split('/')[0] for _, key_name in self.objects)
+    self.assertTrue(len(prefixes) > 8)
+    self.assertTrue(all(len(prefix) == 1 for prefix in prefixes))
+
+    # The keys are mapped back to their own names, in order.
+    self.assertEquals(key_names, [key_info['key'] for key_info in
+      sharded.list_keys('mybucket', 'logs/')])
+    self.assertEquals('logs/000007.txt', sharded.get_metadata('mybucket',
+      'logs/000007.txt')['key'])
+    self.assertEquals(None, sharded.get_metadata('mybucket', 'missing.txt'))
+
+
+  def test_keys_can_be_spread_across_buckets(self):
+    sharded = ShardedStorage(self.storage, num_prefixes=1, num_buckets=3)
+    key_names = ['{0}.txt'.format(index) for index in range(30)]
+    self.upload(sharded, key_names)
+    self.assertEquals(set(['mybucket', 'mybucket-shard-1',
+      'mybucket-shard-2']), set(bucket_name for bucket_name, _ in
+      self.objects))
+    self.assertEquals(set(key_names), set(key_name for _, key_name in
+      self.objects))
+
+    self.assertEquals({}, sharded.delete_keys('mybucket', key_names[:10]))
+    self.assertEquals(20, len(list(sharded.list_keys('mybucket'))))
+    # Each bucket only gets one multi-object delete.
+    self.assertEquals(len(self.deletions), len(set(self.deletions)))
+
+
+  def test_unicode_keys_go_to_the_same_shard_as_their_utf8(self):
+    sharded = ShardedStorage(self.storage, num_prefixes=16, num_buckets=3)
+    bucket_name, key_name = sharded.get_shard('mybucket', u'caf\xe9.txt')
+    self.assertEquals((bucket_name, key_name.encode('utf-8')),
+      sharded.get_shard('mybucket', 'caf\xc3\xa9.txt'))
+    self.assertTrue(key_name.endswith(u'/caf\xe9.txt'))
+
+    # Keys stay where the MD5 of their name has always put them.
+    digest = hashlib.md5('a.txt').hexdigest()
+    self.assertEquals((sharded.get_shard_buckets('mybucket')[int(
+      digest[8:16], 16) % 3], '{0:x}/a.txt'.format(int(digest[:8], 16) % 16)),
+      sharded.get_shard('mybucket', 'a.txt'))
+
+
+  def test_keys_written_around_the_shards_are_not_listed(self):
+    sharded = ShardedStorage(self.storage, num_prefixes=16)
+    self.upload(sharded, ['a.txt'])
+    self.objects[('mybucket', '0/b.txt')] = 'stray'
+    self.assertEquals(['a.txt'], [key_info['key'] for key_info in
+      sharded.list_keys('mybucket')])
+
+
+  def test_shard_buckets_must_belong_to_their_bucket(self):
+    existing = set(['mybucket'])
+    self.storage.should_receive('does_bucket_exist').replace_with(
+      lambda bucket_name: bucket_name in existing)
+    self.storage.should_receive('create_bucket').replace_with(existing.add)
+    sharded = ShardedStorage(self.storage, num_prefixes=1, num_buckets=3)
+    self.assertFalse(sharded.does_bucket_exist('mybucket'))
+    sharded.create_bucket('mybucket')
+    self.assertEquals(['mybucket', 'mybucket', None], [self.objects.get(
+      (bucket_name, ShardedStorage.OWNER_KEY)) for bucket_name in
+      ['mybucket-shard-1', 'mybucket-shard-2', 'mybucket']])
+    # The marks don't show up as keys.
+    self.upload(sharded, ['a.txt'])
+    self.assertEquals(['a.txt'], [key_info['key'] for key_info in
+      sharded.list_keys('mybucket')])
+    self.assertTrue(ShardedStorage(self.storage, num_prefixes=1,
+      num_buckets=3).does_bucket_exist('mybucket'))
+
+    # A bucket that happens to have a shard bucket's name is left alone.
+    existing.update(['other', 'other-shard-1'])
+    sharded = ShardedStorage(self.storage, num_prefixes=1, num_buckets=2)
+    self.assertRaises(BadConfigurationException, sharded.does_bucket_exist,
+      'other')
+    self.assertRaises(BadConfigurationException, sharded.create_bucket,
+      'other')
+    self.assertEquals({'other' : 'The bucket other-shard-1 already exists, ' \
+      'but not as a shard of other, so its keys can\'t be sharded into it. ' \
+      'Pick another shard bucket suffix.'}, sharded.check_buckets(
+      set(['other']), RetryPolicy(), create_missing=True))
+
+
+  def test_shard_counts_must_be_positive_ints(self):
+    self.assertRaises(BadConfigurationException, ShardedStorage,
+      self.storage, num_prefixes='0')
+    self.assertRaises(BadConfigurationException, ShardedStorage,
+      self.storage, num_buckets='lots')
+    sharded = ShardedStorage(self.storage, '256', '')
+    self.assertEquals((256, 1, 2), (sharded.num_prefixes, sharded.num_buckets,
+      sharded.prefix_width))
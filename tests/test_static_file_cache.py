@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+""" Tests for lib/static_file_cache.py. """
+
+
+# General-purpose Python library imports
+import gzip
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+
+# StaticFileCache import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.static_file_cache import StaticFileCache
+
+
+class TestStaticFileCache(unittest.TestCase):
+
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    StaticFileCache.files = {}
+
+
+  def write(self, name, contents, mtime):
+    path = os.path.join(self.directory, name)
+    with open(path, 'w') as file_handle:
+      file_handle.write(contents)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+  def test_text_files_get_gzipped_copy(self):
+    path = self.write('app.css', 'body { color: red; }\n' * 100, 1363646585)
+    entry = StaticFileCache.get(path)
+    self.assertEquals('text/css', entry['content_type'])
+    self.assertEquals('Mon, 18 Mar 2013 22:43:05 GMT', entry['last_modified'])
+    self.assertEquals(entry['contents'], gzip.GzipFile(
+      fileobj=StringIO.StringIO(entry['gzipped'])).read())
+    self.assertTrue(len(entry['gzipped']) < len(entry['contents']))
+
+
+  def test_images_are_not_gzipped(self):
+    path = self.write('logo.png', 'a' * 1000, 1363646585)
+    self.assertEquals(None, StaticFileCache.get(path)['gzipped'])
+
+
+  def test_changed_files_are_read_again(self):
+    path = self.write('app.js', 'one', 1363646585)
+    first = StaticFileCache.get(path)
+    self.assertTrue(first is StaticFileCache.get(path))
+
+    self.write('app.js', 'two', 1363646590)
+    second = StaticFileCache.get(path)
+    self.assertEquals('two', second['contents'])
+    self.assertNotEquals(first['etag'], second['etag'])
+
+
+  def test_missing_files(self):
+    self.assertEquals(None, StaticFileCache.get(os.path.join(self.directory,
+      'missing.css')))
@@ -4,8 +4,11 @@
 
 
 # General-purpose Python library imports
+import collections
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 
@@ -17,12 +20,22 @@ from flexmock import flexmock
 lib = os.path.dirname(__file__) + os.sep + ".."
 sys.path.append(lib)
 from magik.custom_exceptions import BadConfigurationException
+from magik.s3_storage import S3Storage
+from magik.hedged_storage import HedgedStorage
+from magik.replicated_storage import ReplicatedStorage
+from magik.sharded_storage import ShardedStorage
 from magik.storage_factory import StorageFactory
+from magik.striped_storage import StripedStorage
+from magik.tiered_storage import TieredStorage
 
 
 class TestStorageFactory(unittest.TestCase):
 
 
+  def tearDown(self):
+    StorageFactory.pool = collections.OrderedDict()
+
+
   def test_no_storage_specified(self):
     self.assertRaises(BadConfigurationException, StorageFactory.get_storage, {})
 
@@ -31,3 +44,119 @@ class TestStorageFactory(unittest.TestCase):
     self.assertRaises(NotImplementedError, StorageFactory.get_storage, {
       "name" : "not a supported storage system"
     })
+
+
+  def test_shard_counts_wrap_storage_in_sharded_storage(self):
+    flexmock(S3Storage).should_receive('create_s3_connection').and_return(
+      flexmock(name='fake_s3', http_connection_kwargs={}))
+    storage = StorageFactory.get_storage({'name' : 's3',
+      'AWS_ACCESS_KEY' : 'access', 'AWS_SECRET_KEY' : 'secret',
+      'shard_prefixes' : '64', 'shard_buckets' : None})
+    self.assertTrue(isinstance(storage, ShardedStorage))
+    self.assertTrue(isinstance(storage.storage, S3Storage))
+    self.assertEquals('sharded-64-1:s3:access', storage.get_backend_id())
+
+    storage = StorageFactory.get_storage({'name' : 's3',
+      'AWS_ACCESS_KEY' : 'access', 'AWS_SECRET_KEY' : 'secret',
+      'shard_buckets' : '2', 'shard_bucket_suffix' : '.part'})
+    self.assertEquals(['logs', 'logs.part1'], storage.get_shard_buckets(
+      'logs'))
+    self.assertEquals('sharded-16-2.part:s3:access', storage.get_backend_id())
+
+
+  def test_stripes_make_a_striped_storage(self):
+    flexmock(S3Storage).should_receive('create_s3_connection').and_return(
+      flexmock(name='fake_s3', http_connection_kwargs={}))
+    storage = StorageFactory.get_storage({'name' : '', 'shard_prefixes' : '4',
+      'stripes' : '[{"name": "s3", "AWS_ACCESS_KEY": "a", ' \
+      '"AWS_SECRET_KEY": "secret"}, {"name": "s3", "AWS_ACCESS_KEY": "b", ' \
+      '"AWS_SECRET_KEY": "secret"}]'})
+    self.assertTrue(isinstance(storage, StripedStorage))
+    self.assertEquals('striped:sharded-4-1:s3:a,sharded-4-1:s3:b',
+      storage.get_backend_id())
+
+    # Stripes are placed on the ring by their names, if they have them.
+    storage = StorageFactory.get_storage({'stripes' : [{'name' : 's3',
+      'AWS_ACCESS_KEY' : 'a', 'AWS_SECRET_KEY' : 'secret', 'stripe_name' :
+      'one'}, {'name' : 's3', 'AWS_ACCESS_KEY' : 'b', 'AWS_SECRET_KEY' :
+      'secret'}]})
+    self.assertEquals(['one', 's3:b'], sorted(storage.storages))
+
+    self.assertRaises(BadConfigurationException, StorageFactory.get_storage,
+      {'stripes' : 'not json'})
+    self.assertRaises(BadConfigurationException, StorageFactory.get_storage,
+      {'stripes' : '{"name": "s3"}'})
+
+
+  def test_replicas_make_a_replicated_storage(self):
+    flexmock(S3Storage).should_receive('create_s3_connection').and_return(
+      flexmock(name='fake_s3', http_connection_kwargs={}))
+    replicas = [{'name' : 's3', 'AWS_ACCESS_KEY' : 'a', 'AWS_SECRET_KEY' :
+      'secret'}, {'name' : 's3', 'AWS_ACCESS_KEY' : 'b', 'AWS_SECRET_KEY' :
+      'secret'}]
+    storage = StorageFactory.get_storage({'replicas' : replicas,
+      'write_quorum' : 1})
+    self.assertTrue(isinstance(storage, ReplicatedStorage))
+    self.assertEquals('replicated-1:s3:a,s3:b', storage.get_backend_id())
+
+    self.assertRaises(BadConfigurationException, StorageFactory.get_storage,
+      {'replicas' : replicas, 'stripes' : replicas})
+
+
+  def test_hedge_reads_wraps_storage_in_hedged_storage(self):
+    flexmock(S3Storage).should_receive('create_s3_connection').and_return(
+      flexmock(name='fake_s3', http_connection_kwargs={}))
+    storage = StorageFactory.get_storage({'name' : 's3',
+      'AWS_ACCESS_KEY' : 'access', 'AWS_SECRET_KEY' : 'secret',
+      'timeout' : '5', 'hedge_reads' : '2'})
+    self.assertTrue(isinstance(storage, HedgedStorage))
+    self.assertEquals((2, 5.0), (storage.num_duplicates,
+      storage.storage.timeout))
+
+
+  def test_tier_directory_puts_a_tiered_storage_in_front(self):
+    flexmock(S3Storage).should_receive('create_s3_connection').and_return(
+      flexmock(name='fake_s3', http_connection_kwargs={}))
+    directory = tempfile.mkdtemp()
+    StorageFactory.set_tier(directory, 1024)
+    stripes = [{'name' : 's3', 'AWS_ACCESS_KEY' : 'a', 'AWS_SECRET_KEY' :
+      'secret'}, {'name' : 's3', 'AWS_ACCESS_KEY' : 'b', 'AWS_SECRET_KEY' :
+      'secret'}]
+    try:
+      storage = StorageFactory.get_storage({'stripes' : stripes})
+
+      # Only the whole storage gets a tier, not each of its stripes, and
+      # storages for the same account share it.
+      self.assertTrue(isinstance(storage, TieredStorage))
+      self.assertTrue(isinstance(storage.storage, StripedStorage))
+      self.assertEquals(1024, storage.max_bytes)
+      self.assertEquals(storage, StorageFactory.get_storage({'stripes' :
+        stripes}))
+    finally:
+      StorageFactory.set_tier(None)
+      TieredStorage.tiers = {}
+      shutil.rmtree(directory)
+
+
+  def test_pooled_storage_is_reused_for_same_parameters(self):
+    flexmock(StorageFactory)
+    StorageFactory.should_receive('get_storage').replace_with(
+      lambda parameters: flexmock(name=parameters['AWS_ACCESS_KEY']))
+    StorageFactory.MAX_POOLED_STORAGES = 2
+    try:
+      first = StorageFactory.get_pooled_storage({'name' : 's3',
+        'AWS_ACCESS_KEY' : 'a', 'S3_URL' : ''})
+      # Parameters that weren't given shouldn't matter.
+      self.assertEquals(first, StorageFactory.get_pooled_storage({
+        'name' : 's3', 'AWS_ACCESS_KEY' : 'a'}))
+      self.assertNotEquals(first, StorageFactory.get_pooled_storage({
+        'name' : 's3', 'AWS_ACCESS_KEY' : 'b'}))
+
+      # Using the first storage again should make the second one the one that
+      # gets dropped when the pool overflows.
+      StorageFactory.get_pooled_storage({'name' : 's3', 'AWS_ACCESS_KEY' : 'a'})
+      StorageFactory.get_pooled_storage({'name' : 's3', 'AWS_ACCESS_KEY' : 'c'})
+      self.assertEquals([(('AWS_ACCESS_KEY', 'a'), ('name', 's3')),
+        (('AWS_ACCESS_KEY', 'c'), ('name', 's3'))], StorageFactory.pool.keys())
+    finally:
+      StorageFactory.MAX_POOLED_STORAGES = 100
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+""" Tests for lib/striped_storage.py. """
+
+
+# General-purpose Python library imports
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+# StripedStorage import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.custom_exceptions import BadConfigurationException
+from magik.striped_storage import StripedStorage
+
+
+# The in-memory backends that files are striped across in these tests
+from fake_storage import make_fake_storage
+
+
+class TestStripedStorage(unittest.TestCase):
+
+
+  def setUp(self):
+    # Keep the objects in each fake backend in memory, keyed by the backend's
+    # id and then by (bucket, key).
+    self.objects = {}
+
+
+  def make_storage(self, backend_id):
+    return make_fake_storage(backend_id, self.objects.setdefault(backend_id,
+      {}))
+
+
+  def upload(self, striped, key_names):
+    for key_name in key_names:
+      striped.upload_stream(iter([key_name * 3]), 'mybucket', key_name,
+        len(key_name) * 3)
+
+
+  def test_files_are_spread_across_backends(self):
+    striped = StripedStorage([self.make_storage('s3:a'),
+      self.make_storage('s3:b'), self.make_storage('gcs:c')])
+    key_names = ['{0:04d}.txt'.format(index) for index in range(60)]
+    self.upload(striped, key_names)
+
+    # Each file is in exactly its owner, and every backend gets some.
+    for backend_id, objects in self.objects.items():
+      self.assertTrue(len(objects) > 5)
+      for _, key_name in objects:
+        self.assertEquals(backend_id, striped.get_owner_id('mybucket',
+          key_name))
+
+    self.assertEquals(key_names, [key_info['key'] for key_info in
+      striped.list_keys('mybucket')])
+    self.assertEquals(24, striped.get_metadata('mybucket', '0007.txt')['size'])
+    self.assertEquals(None, striped.get_metadata('mybucket', 'missing.txt'))
+
+
+  def test_files_are_found_and_rebalanced_after_adding_a_backend(self):
+    old_storages = [self.make_storage('s3:a'), self.make_storage('s3:b')]
+    key_names = ['{0:04d}.txt'.format(index) for index in range(60)]
+    self.upload(StripedStorage(old_storages), key_names)
+
+    striped = StripedStorage(old_storages + [self.make_storage('s3:c')])
+    misplaced = [key_name for key_name in key_names
+      if striped.get_owner_id('mybucket', key_name) == 's3:c']
+    self.assertTrue(misplaced)
+
+    # Files that haven't moved yet are still found, and listed once.
+    self.assertEquals(24, striped.get_metadata('mybucket',
+      misplaced[0])['size'])
+    self.assertTrue(striped.locate('mybucket', misplaced[0]) in old_storages)
+    self.assertEquals(key_names, [key_info['key'] for key_info in
+      striped.list_keys('mybucket')])
+
+    results = list(striped.iter_rebalance('mybucket', num_threads=2))
+    self.assertEquals(sorted(misplaced), sorted(striped.parse_path(
+      result['source'])[1] for result in results))
+    self.assertTrue(all(result['success'] and result['to'] == 's3:c'
+      for result in results))
+    self.assertEquals(sorted(misplaced), sorted(key_name for _, key_name in
+      self.objects['s3:c']))
+    self.assertEquals(misplaced[0] * 3, self.objects['s3:c'][('mybucket',
+      misplaced[0])])
+    self.assertEquals(60, sum(len(objects) for objects in
+      self.objects.values()))
+
+    # Nothing is left to move.
+    self.assertEquals([], list(striped.iter_rebalance('mybucket')))
+
+
+  def test_deletes_reach_copies_that_have_not_been_rebalanced(self):
+    old_storages = [self.make_storage('s3:a'), self.make_storage('s3:b')]
+    key_names = ['{0:04d}.txt'.format(index) for index in range(30)]
+    self.upload(StripedStorage(old_storages), key_names)
+    striped = StripedStorage(old_storages + [self.make_storage('s3:c')])
+
+    self.assertEquals({'missing.txt' : 'not found'}, striped.delete_keys(
+      'mybucket', key_names + ['missing.txt']))
+    self.assertEquals(0, sum(len(objects) for objects in
+      self.objects.values()))
+
+
+  def test_deletes_only_go_to_backends_that_have_the_file(self):
+    deletes = []
+    def make_storage(backend_id):
+      def before_call(operation, *args):
+        if operation.startswith('delete'):
+          deletes.append((backend_id, operation))
+      return make_fake_storage(backend_id, self.objects.setdefault(backend_id,
+        {}), before_call)
+    striped = StripedStorage([make_storage('s3:a'), make_storage('s3:b'),
+      make_storage('s3:c')])
+    key_names = ['{0:04d}.txt'.format(index) for index in range(10)]
+    for key_name in key_names:
+      self.objects['s3:a'][('mybucket', key_name)] = 'old'
+    owned = [key_name for key_name in key_names
+      if striped.get_owner_id('mybucket', key_name) == 's3:a'][0]
+    misplaced = [key_name for key_name in key_names
+      if striped.get_owner_id('mybucket', key_name) != 's3:a'][0]
+
+    striped.delete_file('mybucket', owned)
+    self.assertEquals([('s3:a', 'delete_file')], deletes)
+
+    # The owner doesn't have the file yet, so find leads to the old backend.
+    del deletes[:]
+    striped.delete_file('mybucket', misplaced)
+    self.assertEquals([(striped.get_owner_id('mybucket', misplaced),
+      'delete_file'), ('s3:a', 'delete_file')], deletes)
+
+    del deletes[:]
+    self.assertEquals({'missing.txt' : 'not found'}, striped.delete_keys(
+      'mybucket', [key_name for key_name in key_names if key_name not in
+      [owned, misplaced]] + ['missing.txt']))
+    self.assertEquals(0, sum(len(objects) for objects in
+      self.objects.values()))
+    # One batch per owner, and then one for the copies left in the old backend.
+    self.assertEquals([(backend_id, 'delete_keys') for backend_id in
+      ['s3:a', 's3:b', 's3:c', 's3:a']], deletes)
+
+
+  def test_delete_failures_from_backends_with_the_file_are_reported(self):
+    old_storage = self.make_storage('s3:a')
+    striped = StripedStorage([old_storage, self.make_storage('s3:b')])
+    misplaced = [key_name for key_name in ['{0:04d}.txt'.format(index)
+      for index in range(10)] if striped.get_owner_id('mybucket',
+      key_name) == 's3:b'][:2]
+    for key_name in misplaced:
+      self.objects['s3:a'][('mybucket', key_name)] = 'old'
+
+    def fail(*args):
+      raise IOError('access denied')
+    old_storage.should_receive('delete_file').replace_with(fail)
+    old_storage.should_receive('delete_keys').replace_with(
+      lambda bucket_name, key_names: dict((key_name, 'access denied')
+      for key_name in key_names))
+    self.assertRaises(IOError, striped.delete_file, 'mybucket', misplaced[0])
+    self.assertEquals({misplaced[1] : 'access denied'}, striped.delete_keys(
+      'mybucket', misplaced[1:]))
+    self.assertEquals(2, len(self.objects['s3:a']))
+
+
+  def test_named_backends_keep_their_files_when_keys_are_rotated(self):
+    striped = StripedStorage([self.make_storage('s3:a'),
+      self.make_storage('s3:b')], ['one', 'two'])
+    key_names = ['{0:04d}.txt'.format(index) for index in range(20)]
+    self.upload(striped, key_names)
+
+    rotated = StripedStorage([self.make_storage('s3:a'),
+      make_fake_storage('s3:rotated', self.objects['s3:b'])], ['one', 'two'])
+    self.assertEquals([striped.get_owner_id('mybucket', key_name) for
+      key_name in key_names], [rotated.get_owner_id('mybucket', key_name)
+      for key_name in key_names])
+    self.assertEquals([], list(rotated.iter_rebalance('mybucket')))
+    self.assertEquals('striped:s3:a,s3:rotated', rotated.get_backend_id())
+
+
+  def test_backends_must_be_distinct(self):
+    self.assertRaises(BadConfigurationException, StripedStorage, [])
+    self.assertRaises(BadConfigurationException, StripedStorage,
+      [self.make_storage('s3:a'), self.make_storage('s3:a')])
+    self.assertRaises(BadConfigurationException, StripedStorage,
+      [self.make_storage('s3:a'), self.make_storage('s3:b')], ['one', 'one'])
+    self.assertRaises(BadConfigurationException, StripedStorage,
+      [self.make_storage('s3:a'), self.make_storage('s3:b')], ['one'])
+
+
+  def test_compressed_files_keep_their_encoding_when_streamed(self):
+    local_dir = tempfile.mkdtemp()
+    source = os.path.join(local_dir, 'log.txt')
+    with open(source, 'w') as file_handle:
+      file_handle.write('abc' * 1000)
+
+    # Upload a compressed file, then stream it to another account, within
+    # it, and to a backend added after it was written.
+    striped = StripedStorage([self.make_storage('s3:a')])
+    self.assertEquals(True, striped.upload_files([{'source' : source,
+      'destination' : '/mybucket/log.txt'}], compression='gzip')[0]['success'])
+    other_storages = [self.make_storage('s3:b'), self.make_storage('gcs:c')]
+    other = StripedStorage(other_storages)
+    self.assertEquals(True, striped.transfer_files(other, [{
+      'source' : '/mybucket/log.txt', 'destination' : '/mybucket/log.txt'
+    }])[0]['success'])
+    grown = StripedStorage(other_storages + [self.make_storage('s3:d')])
+    key_name = [key_name for key_name in ['{0}.txt'.format(index)
+      for index in range(100)] if other.get_owner_id('mybucket', key_name) !=
+      other.get_owner_id('mybucket', 'log.txt') and
+      grown.get_owner_id('mybucket', key_name) == 's3:d'][0]
+    self.assertEquals(True, other.copy_files([{
+      'source' : '/mybucket/log.txt',
+      'destination' : '/mybucket/' + key_name
+    }])[0]['success'])
+    results = list(grown.iter_rebalance('mybucket'))
+    self.assertTrue(results)
+    self.assertTrue(all(result['success'] for result in results))
+
+    # Every copy should still decompress to the original file.
+    for path in ['/mybucket/log.txt', '/mybucket/' + key_name]:
+      self.assertEquals('gzip', grown.get_metadata(*grown.parse_path(path))[
+        'content_encoding'])
+      destination = os.path.join(local_dir, 'copy.txt')
+      actual = grown.download_files([{'source' : path,
+        'destination' : destination}], decompress=True)
+      self.assertEquals('gzip', actual[0]['content_encoding'])
+      with open(destination, 'r') as file_handle:
+        self.assertEquals('abc' * 1000, file_handle.read())
+    shutil.rmtree(local_dir)
+
+
+  def test_unicode_key_names_are_rebalanced(self):
+    # Listings hand back key names as unicode.
+    old_storage = self.make_storage('s3:a')
+    striped = StripedStorage([old_storage, self.make_storage('s3:b')])
+    key_name = [key_name for key_name in [u'caf\xe9-{0}.txt'.format(index)
+      for index in range(100)] if striped.get_owner_id('mybucket',
+      key_name) == 's3:b'][0]
+    self.objects['s3:a'][('mybucket', key_name)] = 'hello'
+
+    results = list(striped.iter_rebalance('mybucket'))
+    self.assertEquals([('/mybucket/' + key_name.encode('utf-8'), True)],
+      [(result['source'], result['success']) for result in results])
+    self.assertEquals({}, self.objects['s3:a'])
+    self.assertEquals(['hello'], self.objects['s3:b'].values())
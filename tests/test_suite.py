@@ -7,14 +7,44 @@ import unittest
 
 # imports for all tests
 from test_azure_storage import TestAzureStorage
+from test_batch_manifest import TestBatchManifest
+from test_batch_scheduler import TestBatchScheduler
+from test_checkpoint import TestCheckpoint
+from test_chunk_reader import TestChunkReader
+from test_compression_codec import TestCompressionCodec
+from test_concurrency_controller import TestConcurrencyController
 from test_gc_storage import TestGCStorage
+from test_hash_cache import TestHashCache
+from test_hash_ring import TestHashRing
+from test_hedged_storage import TestHedgedStorage
+from test_hedger import TestHedger
+from test_manifest_index import TestManifestIndex
+from test_metadata_cache import TestMetadataCache
+from test_pack_store import TestPackStore
+from test_progress_reporter import TestProgressReporter
+from test_rate_limiter import TestRateLimiter
+from test_replicated_storage import TestReplicatedStorage
 from test_rest_server import TestRESTServer
+from test_retry_policy import TestRetryPolicy
 from test_s3_storage import TestS3Storage
+from test_sharded_storage import TestShardedStorage
+from test_static_file_cache import TestStaticFileCache
 from test_storage_factory import TestStorageFactory
+from test_striped_storage import TestStripedStorage
+from test_tar_stream import TestTarStream
+from test_tiered_storage import TestTieredStorage
 from test_walrus_storage import TestWalrusStorage
-
-test_cases = [TestAzureStorage, TestGCStorage, TestRESTServer, TestS3Storage,
-  TestStorageFactory, TestWalrusStorage]
+from test_wrapping_storage import TestWrappingStorage
+
+test_cases = [TestAzureStorage, TestBatchManifest, TestBatchScheduler,
+  TestCheckpoint, TestChunkReader, TestCompressionCodec,
+  TestConcurrencyController, TestGCStorage, TestHashCache, TestHashRing,
+  TestHedgedStorage, TestHedger, TestManifestIndex, TestMetadataCache,
+  TestPackStore, TestProgressReporter, TestRateLimiter,
+  TestReplicatedStorage, TestRESTServer, TestRetryPolicy, TestS3Storage,
+  TestShardedStorage, TestStaticFileCache, TestStorageFactory,
+  TestStripedStorage, TestTarStream, TestTieredStorage, TestWalrusStorage,
+  TestWrappingStorage]
 
 test_case_names = []
 for cls in test_cases:
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+""" Tests for lib/tar_stream.py. """
+
+
+# General-purpose Python library imports
+import os
+import StringIO
+import sys
+import tarfile
+import unittest
+
+
+# TarStream import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.tar_stream import TarStream
+
+
+class TestTarStream(unittest.TestCase):
+
+
+  def build_archive(self, compress):
+    tar_stream = TarStream(compress)
+    pieces = [tar_stream.add('baz/a.txt', 'a' * 20000, 1363646585),
+      tar_stream.add('baz/b/c.txt', 'hello')]
+    pieces.append(tar_stream.close())
+    return pieces
+
+
+  def test_archive_is_handed_back_as_files_are_added(self):
+    pieces = self.build_archive(compress=False)
+    # The first file is big enough that some of it is ready straight away.
+    self.assertTrue(len(pieces[0]) > 0)
+
+    archive = tarfile.open(fileobj=StringIO.StringIO(''.join(pieces)))
+    self.assertEquals([('baz/a.txt', 20000), ('baz/b/c.txt', 5)],
+      [(member.name, member.size) for member in archive])
+    self.assertEquals(1363646585, archive.getmember('baz/a.txt').mtime)
+    self.assertEquals('hello', archive.extractfile('baz/b/c.txt').read())
+
+
+  def test_archive_can_be_gzipped(self):
+    data = ''.join(self.build_archive(compress=True))
+    self.assertEquals('\x1f\x8b', data[:2])
+    archive = tarfile.open(fileobj=StringIO.StringIO(data), mode='r:gz')
+    self.assertEquals(['baz/a.txt', 'baz/b/c.txt'], archive.getnames())
+
+
+  def test_non_ascii_names_are_stored_as_utf8(self):
+    tar_stream = TarStream()
+    data = tar_stream.add(u'baz/caf\xe9.txt', 'a') + tar_stream.add(
+      'baz/na\xc3\xafve.txt', 'b') + tar_stream.close()
+    archive = tarfile.open(fileobj=StringIO.StringIO(data))
+    self.assertEquals(['baz/caf\xc3\xa9.txt', 'baz/na\xc3\xafve.txt'],
+      archive.getnames())
+
+
+  def test_streamed_files_are_handed_back_a_chunk_at_a_time(self):
+    tar_stream = TarStream()
+    pieces = list(tar_stream.add_stream('baz/a.txt', 30000,
+      iter(['a' * 10000] * 3), 1363646585, content_encoding='gzip'))
+    # The header goes out before any of the chunks have been read.
+    self.assertEquals(5, len(pieces))
+    data = ''.join(pieces) + tar_stream.add('baz/b.txt', 'hello') + \
+      tar_stream.close()
+
+    archive = tarfile.open(fileobj=StringIO.StringIO(data))
+    member = archive.getmember('baz/a.txt')
+    self.assertEquals(30000, member.size)
+    self.assertEquals(1363646585, member.mtime)
+    self.assertEquals('gzip',
+      member.pax_headers[TarStream.CONTENT_ENCODING_HEADER])
+    self.assertEquals('a' * 30000, archive.extractfile(member).read())
+    self.assertEquals('hello', archive.extractfile('baz/b.txt').read())
+
+
+  def test_streamed_files_that_fail_are_padded(self):
+    def chunks():
+      yield 'abc'
+      raise IOError('connection reset')
+
+    tar_stream = TarStream()
+    pieces = []
+    try:
+      for data in tar_stream.add_stream('baz/a.txt', 10, chunks()):
+        pieces.append(data)
+      self.fail('the failed read should have been raised')
+    except IOError as exception:
+      self.assertEquals('connection reset', str(exception))
+    pieces.append(tar_stream.add('baz/b.txt', 'hello'))
+    pieces.append(tar_stream.close())
+
+    archive = tarfile.open(fileobj=StringIO.StringIO(''.join(pieces)))
+    self.assertEquals('abc' + '\0' * 7,
+      archive.extractfile('baz/a.txt').read())
+    self.assertEquals('hello', archive.extractfile('baz/b.txt').read())
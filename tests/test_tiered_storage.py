@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+""" Tests for lib/tiered_storage.py. """
+
+
+# General-purpose Python library imports
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+
+# TieredStorage import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.custom_exceptions import BadConfigurationException
+from magik.tiered_storage import TieredStorage
+
+
+# The in-memory cold tier that files are flushed to in these tests
+from fake_storage import make_fake_storage
+
+
+class TestTieredStorage(unittest.TestCase):
+
+
+  def setUp(self):
+    # Uploads to the cold tier hang until the test releases them, so that we
+    # can look at files that haven't been flushed yet.
+    self.release = threading.Event()
+    self.started = threading.Event()
+    self.directory = tempfile.mkdtemp()
+    self.tiers = []
+
+
+  def tearDown(self):
+    self.release.set()
+    for tier in self.tiers:
+      tier.wait_for_flush(timeout=5)
+    TieredStorage.tiers = {}
+    shutil.rmtree(self.directory)
+
+
+  def make_storage(self, objects):
+    def before_call(operation, *args):
+      if operation == 'upload_file':
+        self.started.set()
+        self.release.wait()
+    return make_fake_storage('s3:access', objects, before_call)
+
+
+  def make_tier(self, objects, max_bytes=None):
+    tier = TieredStorage(self.make_storage(objects), self.directory,
+      max_bytes)
+    self.tiers.append(tier)
+    return tier
+
+
+  def test_writes_are_acknowledged_before_they_are_flushed(self):
+    objects = {('mybucket', 'b.txt') : 'cold'}
+    tier = self.make_tier(objects)
+    tier.upload_stream(iter(['hot ', 'file']), 'mybucket', 'a.txt', 8)
+
+    # The file is read from the hot tier until it reaches the cold tier.
+    self.assertFalse(('mybucket', 'a.txt') in objects)
+    metadata = tier.get_metadata('mybucket', 'a.txt')
+    self.assertEquals(8, metadata['size'])
+    # Like S3Storage, the ETag is the bare MD5, which callers quote.
+    self.assertEquals(hashlib.md5('hot file').hexdigest(), metadata['etag'])
+    self.assertEquals('file', tier.download_range('mybucket', 'a.txt', 4, 7))
+    self.assertEquals('cold', tier.download_range('mybucket', 'b.txt', 0, 3))
+    self.assertEquals(['a.txt', 'b.txt'], [key_info['key'] for key_info in
+      tier.list_keys('mybucket')])
+    self.assertFalse(tier.wait_for_flush(timeout=0.01))
+
+    self.release.set()
+    self.assertTrue(tier.wait_for_flush(timeout=5))
+    self.assertEquals('hot file', objects[('mybucket', 'a.txt')])
+
+
+  def test_only_flushed_files_are_evicted(self):
+    objects = {}
+    tier = self.make_tier(objects, max_bytes=10)
+    self.release.set()
+    tier.upload_stream(iter(['aaaa']), 'mybucket', 'a.txt', 4)
+    tier.upload_stream(iter(['bbbb']), 'mybucket', 'b.txt', 4)
+    self.assertTrue(tier.wait_for_flush(timeout=5))
+
+    # Reading a makes b the least recently read, so b is evicted to make
+    # room for c, and c stays until it's flushed.
+    self.assertEquals('aaaa', tier.download_range('mybucket', 'a.txt', 0, 3))
+    self.release.clear()
+    self.started.clear()
+    tier.upload_stream(iter(['cccc']), 'mybucket', 'c.txt', 4)
+    self.started.wait()
+    self.assertEquals([('mybucket', 'a.txt'), ('mybucket', 'c.txt')],
+      tier.entries.keys())
+    self.assertEquals(4, len(os.listdir(tier.directory)))
+    self.assertEquals('bbbb', tier.download_range('mybucket', 'b.txt', 0, 3))
+
+
+  def test_unflushed_files_are_flushed_after_a_restart(self):
+    # The first TieredStorage never gets to flush, as if magik had stopped,
+    # so that it doesn't race the new one for the same files.
+    stopped = threading.Event()
+    def before_call(operation, *args):
+      if operation == 'upload_file':
+        stopped.wait()
+    tier = TieredStorage(make_fake_storage('s3:access', {}, before_call),
+      self.directory)
+    tier.upload_stream(iter(['old']), 'mybucket', 'a.txt', 3)
+    tier.upload_stream(iter(['new']), 'mybucket', 'a.txt', 3)
+
+    # A new TieredStorage for the same directory picks up the newest write.
+    objects = {}
+    restarted = self.make_tier(objects)
+    self.assertEquals(2, len(os.listdir(restarted.directory)))
+    self.release.set()
+    self.assertTrue(restarted.wait_for_flush(timeout=5))
+    self.assertEquals('new', objects[('mybucket', 'a.txt')])
+
+
+  def test_deletes_wait_for_flushes_so_files_are_not_resurrected(self):
+    objects = {}
+    tier = self.make_tier(objects)
+    tier.upload_stream(iter(['aaaa']), 'mybucket', 'a.txt', 4)
+    self.started.wait()
+
+    release_timer = threading.Timer(0.1, self.release.set)
+    release_timer.start()
+    tier.delete_file('mybucket', 'a.txt')
+    self.assertEquals({}, objects)
+    self.assertEquals(None, tier.get_metadata('mybucket', 'a.txt'))
+    self.assertEquals([], os.listdir(tier.directory))
+
+
+  def test_unicode_key_names_are_stored_and_flushed(self):
+    objects = {}
+    tier = self.make_tier(objects)
+    tier.upload_stream(iter(['hot']), 'mybucket', u'caf\xe9.txt', 3)
+    self.assertEquals('hot', tier.download_range('mybucket', u'caf\xe9.txt',
+      0, 2))
+
+    self.release.set()
+    self.assertTrue(tier.wait_for_flush(timeout=5))
+    self.assertEquals('hot', objects[('mybucket', u'caf\xe9.txt')])
+
+
+  def test_buckets_are_only_looked_up_once(self):
+    calls = []
+    def before_call(operation, *args):
+      calls.append(operation)
+    tier = TieredStorage(make_fake_storage('s3:access', {}, before_call),
+      self.directory)
+    self.tiers.append(tier)
+    self.assertTrue(tier.does_bucket_exist('mybucket'))
+    self.assertTrue(tier.does_bucket_exist('mybucket'))
+    tier.create_bucket('otherbucket')
+    self.assertTrue(tier.does_bucket_exist('otherbucket'))
+    self.assertEquals(['does_bucket_exist', 'create_bucket'], calls)
+
+
+  def test_writes_time_out_if_flushes_do_not_make_room(self):
+    tier = self.make_tier({}, max_bytes=4)
+    tier.WRITE_TIMEOUT = 0.05
+    tier.upload_stream(iter(['aaaa']), 'mybucket', 'a.txt', 4)
+    self.assertRaises(IOError, tier.upload_stream, iter(['bbbb']),
+      'mybucket', 'b.txt', 4)
+    # The failed write doesn't keep its room.
+    self.assertEquals(None, tier.get_metadata('mybucket', 'b.txt'))
+    self.assertEquals(4, tier.dirty_bytes)
+
+
+  def test_flushes_that_keep_failing_are_given_up_on(self):
+    attempts = []
+    def before_call(operation, *args):
+      if operation == 'upload_file':
+        attempts.append(args[2])
+        raise IOError('access denied')
+    objects = {}
+    tier = TieredStorage(make_fake_storage('s3:access', objects, before_call),
+      self.directory, 4)
+    tier.FLUSH_RETRY_INTERVAL = 0.01
+    tier.MAX_FLUSH_ATTEMPTS = 3
+    self.tiers.append(tier)
+    tier.upload_stream(iter(['aaaa']), 'mybucket', 'a.txt', 4)
+
+    # The file stays readable, but no longer holds up writers.
+    self.assertTrue(tier.wait_for_flush(timeout=5))
+    self.assertEquals(['a.txt'] * 3, attempts)
+    self.assertEquals({}, objects)
+    self.assertEquals('aaaa', tier.download_range('mybucket', 'a.txt', 0, 3))
+    tier.WRITE_TIMEOUT = 0.05
+    tier.delete_file('mybucket', 'a.txt')
+    self.assertEquals((0, 0, 0), (tier.used_bytes, tier.dirty_bytes,
+      tier.num_dirty))
+
+
+  def test_tiers_are_not_shared_with_other_credentials(self):
+    objects = {}
+    tier = TieredStorage.for_storage(self.make_storage(objects),
+      self.directory)
+    self.tiers.append(tier)
+    tier.upload_stream(iter(['aaaa']), 'mybucket', 'a.txt', 4)
+    self.assertTrue(tier is TieredStorage.for_storage(self.make_storage(
+      objects), self.directory))
+
+    # A caller with the same account but the wrong secret neither sees the
+    # files in the hot tier nor gets them flushed with someone else's secret.
+    guesser = make_fake_storage('s3:access', {}, credentials_id='s3:guess')
+    guessed_tier = TieredStorage.for_storage(guesser, self.directory)
+    self.tiers.append(guessed_tier)
+    self.assertFalse(tier is guessed_tier)
+    self.assertTrue(guessed_tier.storage is guesser)
+    self.assertNotEquals(tier.directory, guessed_tier.directory)
+    self.assertEquals(None, guessed_tier.get_metadata('mybucket', 'a.txt'))
+
+
+  def test_tier_size_must_be_positive(self):
+    self.assertRaises(BadConfigurationException, TieredStorage,
+      self.make_storage({}), self.directory, 0)
+    self.assertRaises(BadConfigurationException, TieredStorage,
+      self.make_storage({}), self.directory, '1G')
@@ -10,6 +10,7 @@ import unittest
 
 
 # Third-party libraries
+import boto.exception
 import boto.s3.connection
 import boto.s3.key
 from flexmock import flexmock
@@ -27,7 +28,8 @@ class TestWalrusStorage(unittest.TestCase):
 
   def setUp(self):
     # Set up a mock for when we interact with Walrus
-    self.fake_walrus = flexmock(name='fake_walrus')
+    self.fake_walrus = flexmock(name='fake_walrus',
+      http_connection_kwargs={})
     flexmock(boto.s3.connection)
     boto.s3.connection.should_receive('S3Connection').and_return(
       self.fake_walrus)
@@ -63,7 +65,8 @@ class TestWalrusStorage(unittest.TestCase):
 
     # If S3_URL is a URL, that should be fine.
     flexmock(boto.s3.connection)
-    boto.s3.connection.should_receive('S3Connection')
+    boto.s3.connection.should_receive('S3Connection').and_return(
+      flexmock(http_connection_kwargs={}))
     another_walrus = StorageFactory.get_storage({
       "name" : "walrus",
       "AWS_ACCESS_KEY" : "access",
@@ -267,3 +270,28 @@ class TestWalrusStorage(unittest.TestCase):
     actual = self.walrus.delete_files(delete_info)
     for delete_result in actual:
       self.assertEquals(True, delete_result['success'])
+
+
+  def test_copy_falls_back_to_streaming_without_put_copy(self):
+    # Presume that this Walrus deployment doesn't support PUT-Copy.
+    fake_bucket = flexmock(name='fake_bucket')
+    self.fake_walrus.should_receive('get_bucket').with_args('mybucket',
+      validate=False).and_return(fake_bucket)
+    fake_bucket.should_receive('copy_key').with_args('b.txt', 'mybucket',
+      'a.txt').and_raise(boto.exception.S3ResponseError(501,
+      'Not Implemented'))
+
+    # The file should be streamed to its new key, rather than being staged
+    # in a file of its own.
+    walrus = flexmock(self.walrus)
+    walrus.should_receive('download_file').never()
+    walrus.should_receive('iter_key_chunks').with_args('mybucket', 'a.txt',
+      3, walrus.STREAM_CHUNK_SIZE).and_return(iter(['abc']))
+    # It should keep its Content-Encoding, too.
+    walrus.should_receive('upload_stream').replace_with(
+      lambda chunks, bucket_name, key_name, size, content_encoding:
+      self.assertEquals(('abc', 'mybucket', 'b.txt', 3, 'gzip'),
+      (''.join(chunks), bucket_name, key_name, size,
+      content_encoding))).once()
+
+    self.walrus.copy_key('mybucket', 'a.txt', 'mybucket', 'b.txt', 3, 'gzip')
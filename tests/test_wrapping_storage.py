@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+""" Tests for lib/wrapping_storage.py. """
+
+
+# General-purpose Python library imports
+import os
+import sys
+import unittest
+
+
+# Third-party libraries
+from flexmock import flexmock
+
+
+# WrappingStorage import, the library that we're testing here
+lib = os.path.dirname(__file__) + os.sep + ".."
+sys.path.append(lib)
+from magik.wrapping_storage import WrappingStorage
+
+
+class TestWrappingStorage(unittest.TestCase):
+
+
+  def test_platform_questions_go_to_the_wrapped_storages(self):
+    s3 = flexmock(name='s3', DELETE_BATCH_SIZE=1000)
+    s3.should_receive('get_stream_chunk_size').and_return(5 * 1024 * 1024)
+    s3.should_receive('is_retryable_error').and_return(False)
+    s3.should_receive('is_throttling_error').and_return(False)
+    s3.should_receive('describe_error').and_return('S3ResponseError: 500')
+    azure = flexmock(name='azure', DELETE_BATCH_SIZE=1)
+    azure.should_receive('get_stream_chunk_size').and_return(4 * 1024 * 1024)
+    azure.should_receive('is_retryable_error').and_return(True)
+    azure.should_receive('is_throttling_error').and_return(True)
+
+    wrapper = WrappingStorage([s3, azure])
+    self.assertEquals(1, wrapper.DELETE_BATCH_SIZE)
+    self.assertEquals(5 * 1024 * 1024, wrapper.get_stream_chunk_size(100))
+    self.assertTrue(wrapper.is_retryable_error(IOError()))
+    self.assertTrue(wrapper.is_throttling_error(IOError()))
+    self.assertEquals('S3ResponseError: 500', wrapper.describe_error(
+      IOError()))